@@ -0,0 +1,413 @@
+"""
+Async deployment entry point for the campaign review app.
+
+A thin ASGI layer around the Flask app, for ASGI servers such as uvicorn or hypercorn:
+
+    uvicorn asgi:application --workers 1 --port 5000
+
+- Flask views (and their SQLite work) run on a bounded thread pool (ASGI_THREADS, default 8).
+- Request bodies are handed to the view as they arrive, through a bounded queue: the event
+  loop receives at most a few messages ahead of what the view has read, so /upload stays a
+  stream. Bodies over the route's limit (MAX_CONTENT_LENGTH, or MAX_UPLOAD_JSON_BYTES for
+  the streaming endpoints) are answered with 413 as soon as the limit is crossed.
+- Responses are streamed back chunk by chunk, so CSV exports are not buffered in memory.
+- With DISPATCH_SCHEDULER off, send_to_n8n is split: leads are prepared on the pool, the
+  webhook POST is awaited on the event loop (WEBHOOK_CONCURRENCY in flight at most, default
+  100), and the result is recorded on the pool. A slow webhook therefore costs a socket, not
+  a worker thread. With the scheduler on (the default) the view only queues the send.
+- Operation progress streams (/api/operations/<id>/events) are served on the event loop by
+  polling the in-process tracker, so watching a long job doesn't hold a worker thread either.
+
+Only the standard library is used; the sync mode (`python test_upload.py`) is unchanged.
+"""
+import asyncio
+import io
+import os
+import re
+import ssl
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from werkzeug.exceptions import ClientDisconnected, HTTPException, RequestEntityTooLarge
+
+import test_upload
+
+SEND_TO_N8N_PATH = re.compile(r'/send_to_n8n/(\d+)')
+OPERATION_EVENTS_PATH = re.compile(r'/api/operations/([A-Za-z0-9_-]{8,64})/events')
+STREAMED_BODY_PATHS = {'/upload', '/api/delivery_events'}  # views that raise their own limit
+UPLOAD_PART_PATH = re.compile(r'/api/uploads/[0-9a-f]{32}/parts/\d+')
+SSE_POLL_SECONDS = 0.25
+BODY_QUEUE_MESSAGES = 8     # request body messages received ahead of the view
+RESPONSE_QUEUE_CHUNKS = 8   # response chunks produced ahead of the client
+
+
+class WebhookError(Exception):
+    pass
+
+
+async def post_json(url, body, timeout, headers=None):
+    """Minimal HTTP/1.1 POST over asyncio streams. Returns (status, response body)."""
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context() if secure else None),
+        timeout)
+    try:
+        headers = dict({'Content-Type': 'application/json'}, **(headers or {}))
+        head = (
+            f"POST {path} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            + ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+            + f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode('latin-1')
+        writer.write(head + body)
+        await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            raise WebhookError(f"Malformed response from webhook: {status_line[:100]!r}")
+        # Connection: close, so the body runs to EOF
+        response_body = await asyncio.wait_for(reader.read(), timeout)
+        return status, response_body.partition(b'\r\n\r\n')[2]
+    finally:
+        writer.close()
+
+
+class RequestBody(io.RawIOBase):
+    """
+    wsgi.input fed from the ASGI receive channel. The event loop side (pump) puts body
+    chunks on a bounded asyncio.Queue; the view reads them on its pool thread. Going over
+    `limit` bytes, or the client leaving, raises in the reader instead of ending the body.
+    """
+
+    def __init__(self, loop, limit):
+        self.loop = loop
+        self.limit = limit
+        self.queue = asyncio.Queue(BODY_QUEUE_MESSAGES)
+        self.buffer = bytearray()
+        self.received = 0
+        self.eof = False
+        self.error = None
+        self.too_large = False
+
+    async def pump(self, receive):
+        """Runs on the event loop until the body is complete, too large or the client is gone"""
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                await self.queue.put(ClientDisconnected())
+                return
+            chunk = message.get('body', b'')
+            self.received += len(chunk)
+            if self.received > self.limit:
+                self.too_large = True
+                await self.queue.put(RequestEntityTooLarge())
+                return
+            if chunk:
+                await self.queue.put(chunk)
+            if not message.get('more_body'):
+                await self.queue.put(b'')
+                return
+
+    def _fill(self):
+        """Pool side: wait for the next chunk; False at the end of the body"""
+        if self.error is not None:
+            raise self.error
+        if self.eof:
+            return False
+        item = asyncio.run_coroutine_threadsafe(self.queue.get(), self.loop).result()
+        if isinstance(item, Exception):
+            self.error = item
+            raise item
+        self.eof = not item
+        self.buffer += item
+        return not self.eof
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        if not self.buffer:
+            self._fill()
+        count = min(len(target), len(self.buffer))
+        target[:count] = self.buffer[:count]
+        del self.buffer[:count]
+        return count
+
+    def readline(self, size=-1):
+        while b'\n' not in self.buffer and (size < 0 or len(self.buffer) < size) and self._fill():
+            pass
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        if size >= 0:
+            end = min(end, size)
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return line
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope; `body` is the wsgi.input stream (ends with the body)"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsyncCampaignApp:
+    def __init__(self, flask_app, threads=8, webhook_concurrency=100):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='campaign-review')
+        self.webhook_slots = asyncio.Semaphore(webhook_concurrency)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise RuntimeError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        match = OPERATION_EVENTS_PATH.fullmatch(scope['path'])
+        if match and scope['method'] == 'GET':
+            await self._stream_operation(scope, match.group(1), send)
+            return
+
+        limit = self._body_limit(scope['path'])
+        declared = dict(scope.get('headers', [])).get(b'content-length')
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            await self._send_too_large(send)
+            return
+
+        loop = asyncio.get_running_loop()
+        body = RequestBody(loop, limit)
+        match = SEND_TO_N8N_PATH.fullmatch(scope['path'])
+        if match and scope['method'] == 'POST' and not self.flask_app.config['DISPATCH_SCHEDULER']:
+            # The body (a small form) is read twice here, so it is received whole first
+            raw = await self._receive_all(receive, limit)
+            if raw is None:
+                await self._send_too_large(send)
+                return
+            environ = build_environ(scope, io.BytesIO(raw))
+            dispatch = await loop.run_in_executor(self.executor, self._prepare_dispatch,
+                                                  dict(environ, **{'wsgi.input': io.BytesIO(raw)}),
+                                                  int(match.group(1)))
+            if dispatch is not None:
+                dispatch['operation'].progress('sending', rows=dispatch['lead_count'])
+                dispatch['error'] = await self._deliver(dispatch)
+                environ['campaign_review.dispatch'] = dispatch
+            pump = None
+        else:
+            environ = build_environ(scope, body)
+            pump = asyncio.ensure_future(body.pump(receive))
+
+        chunks = asyncio.Queue(RESPONSE_QUEUE_CHUNKS)
+        abandoned = threading.Event()
+        worker = loop.run_in_executor(self.executor, self._call_wsgi, environ, loop, chunks, abandoned)
+        try:
+            await self._send_response(send, chunks, body)
+        finally:
+            abandoned.set()
+            while not chunks.empty():
+                chunks.get_nowait()  # unblock a producer waiting for room
+            await worker
+            if pump is not None:
+                pump.cancel()
+
+    async def _receive_all(self, receive, limit):
+        """Whole body, or None when it is over `limit` (a disconnect ends it early)"""
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return bytes(body)
+            body += message.get('body', b'')
+            if len(body) > limit:
+                return None
+            if not message.get('more_body'):
+                return bytes(body)
+
+    def _body_limit(self, path):
+        config = self.flask_app.config
+        if path in STREAMED_BODY_PATHS:
+            return max(config['MAX_CONTENT_LENGTH'], config['MAX_UPLOAD_JSON_BYTES'])
+        if UPLOAD_PART_PATH.fullmatch(path):
+            return max(config['MAX_CONTENT_LENGTH'], config['UPLOAD_PART_SIZE'])
+        return config['MAX_CONTENT_LENGTH']
+
+    async def _send_too_large(self, send):
+        await send({'type': 'http.response.start', 'status': 413,
+                    'headers': [(b'content-type', b'application/json'), (b'connection', b'close')]})
+        await send({'type': 'http.response.body',
+                    'body': b'{"status": "error", "message": "Request body too large"}'})
+
+    async def _send_response(self, send, chunks, body):
+        """Relay what _call_wsgi produces: ('start', status, headers), ('body', bytes)..., ('end',)"""
+        while True:
+            item = await chunks.get()
+            if item[0] == 'start':
+                if body.too_large and item[1] != 413:
+                    await self._send_too_large(send)  # the view swallowed the error; don't trust its answer
+                    return
+                await send({'type': 'http.response.start', 'status': item[1], 'headers': item[2]})
+            elif item[0] == 'body':
+                await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+            else:
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+
+    def _prepare_dispatch(self, environ, campaign_id):
+        """Runs on the pool. None means 'let the view handle it' (e.g. campaign not approved)."""
+        with self.flask_app.request_context(environ):
+            try:
+                dispatch, _ = test_upload.prepare_campaign_dispatch(campaign_id)
+            except HTTPException:
+                return None  # e.g. unknown tenant: the view answers with the proper error
+            if dispatch is None:
+                return None
+            self._encode(dispatch)
+            return dispatch
+
+    def _encode(self, dispatch):
+        """Body and headers in the webhook's current encoding (runs on the pool: it is CPU work)"""
+        url = self.flask_app.config['N8N_WEBHOOK_URL']
+        dispatch['encoding'] = test_upload.webhook_encoding(url)
+        dispatch['body'], dispatch['headers'] = test_upload.encode_webhook_payload(
+            dispatch['payload'], *dispatch['encoding'], dispatch['unsubscribe_url_template'])
+        test_upload.metrics.inc('webhook_request_bytes_total', tuple(zip(('format', 'encoding'), dispatch['encoding'])),
+                                len(dispatch['body']))
+
+    async def _stream_operation(self, scope, operation_id, send):
+        """Server-Sent Events for one operation, same format as the Flask view"""
+        try:
+            after = int(dict(scope.get('headers', [])).get(b'last-event-id', b'0'))
+        except ValueError:
+            after = 0
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': b'retry: 2000\n\n', 'more_body': True})
+        waited = idle = 0.0
+        while True:
+            events, finished = test_upload.operation_tracker.snapshot(operation_id, after)
+            if events is None and waited >= test_upload.SSE_START_WAIT_SECONDS:
+                events, finished = [(0, 'failed', {'message': 'Unknown or expired operation'})], True
+            if events:
+                after = events[-1][0]
+                chunk = ''.join(test_upload.format_sse(*item) for item in events)
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+                idle = 0.0
+            elif idle >= test_upload.SSE_KEEPALIVE_SECONDS:
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                idle = 0.0
+            if finished and events is not None:
+                break
+            await asyncio.sleep(SSE_POLL_SECONDS)
+            waited += SSE_POLL_SECONDS
+            idle += SSE_POLL_SECONDS
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _deliver(self, dispatch):
+        url = self.flask_app.config['N8N_WEBHOOK_URL']
+        timeout = self.flask_app.config['WEBHOOK_TIMEOUT']
+        started = time.perf_counter()
+        try:
+            async with self.webhook_slots:
+                status, _ = await post_json(url, dispatch['body'], timeout, dispatch['headers'])
+            if status == 415 and test_upload.fall_back_to_plain(url, *dispatch['encoding']):
+                await asyncio.get_running_loop().run_in_executor(self.executor, self._encode, dispatch)
+                async with self.webhook_slots:
+                    status, _ = await post_json(url, dispatch['body'], timeout, dispatch['headers'])
+            if status >= 400:
+                raise WebhookError(f"{status} Error from webhook {url}")
+        except (OSError, asyncio.TimeoutError, WebhookError) as e:
+            test_upload.metrics.observe('webhook_request_duration_seconds', (('outcome', 'error'),),
+                                        time.perf_counter() - started)
+            return str(e) or e.__class__.__name__
+        test_upload.metrics.observe('webhook_request_duration_seconds', (('outcome', 'success'),),
+                                    time.perf_counter() - started)
+        return None
+
+    def _call_wsgi(self, environ, loop, chunks, abandoned):
+        """Runs on the pool; puts the response on `chunks` as it is produced (waits while it is full)"""
+
+        def put(item):
+            if not abandoned.is_set():
+                asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started.append(True)
+            put(('start', int(status.split(' ', 1)[0]),
+                 [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]))
+
+        try:
+            result = self.flask_app.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if abandoned.is_set():
+                        break  # client gone: stop producing (closes stream_with_context generators)
+                    if chunk:
+                        put(('body', chunk))
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception:
+            test_upload.logger.exception("asgi_request_failed path=%s", environ.get('PATH_INFO'))
+            if not started:
+                put(('start', 500, [(b'content-type', b'text/plain')]))
+        finally:
+            put(('end',))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = AsyncCampaignApp(
+    test_upload.create_app(),
+    threads=int(os.environ.get('ASGI_THREADS', 8)),
+    webhook_concurrency=int(os.environ.get('WEBHOOK_CONCURRENCY', 100)),
+)
@@ -0,0 +1,141 @@
+"""
+Chunked upload benchmark.
+
+Writes a CSV of --leads synthetic leads, sends it through the resumable upload API in parts of
+--part-size bytes (every --fail-every-th part is first sent corrupted, then re-sent after
+reading the upload status, as a client resuming after a failure would), completes it and
+reports upload throughput, import rows/s and peak RSS. For files that still fit in one
+request, the same file is also posted to /upload_csv for comparison.
+
+    python benchmarks/chunked_upload.py --leads 200000 --part-size 4194304
+"""
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_benchmarks import peak_rss_mb, reset_peak_rss  # noqa: E402
+from synthetic_data import make_person  # noqa: E402
+
+CSV_HEADER = ['first_name', 'last_name', 'email', 'company', 'domain', 'score', 'label', 'description']
+
+
+def write_csv(path, count, seed):
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for i in range(count):
+            person = make_person(rng, i)
+            writer.writerow([person.get(field, rng.randint(1, 10)) for field in CSV_HEADER])
+    return os.path.getsize(path)
+
+
+def put_part(client, upload_id, part_number, data, corrupt=False):
+    body = data[:-1] + b'#' if corrupt else data
+    return client.put(f"/api/uploads/{upload_id}/parts/{part_number}", data=body,
+                      headers={'X-Part-SHA256': hashlib.sha256(data).hexdigest()})
+
+
+def chunked_upload(client, path, size, fail_every):
+    response = client.post('/api/uploads', json={'filename': os.path.basename(path), 'size': size,
+                                                 'campaign_name': f"Chunked benchmark {time.time()}"})
+    upload = response.get_json()
+    upload_id, part_size = upload['upload_id'], upload['part_size']
+    failed = 0
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        for part_number in range(1, len(upload['missing_parts']) + 1):
+            data = f.read(part_size)
+            corrupt = fail_every and part_number % fail_every == 0
+            if put_part(client, upload_id, part_number, data, corrupt).status_code != 200:
+                failed += 1
+    # Resume: ask which parts are missing and send only those
+    missing = client.get(f"/api/uploads/{upload_id}").get_json()['missing_parts']
+    with open(path, 'rb') as f:
+        for part_number in missing:
+            f.seek((part_number - 1) * part_size)
+            put_part(client, upload_id, part_number, f.read(part_size))
+    upload_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    response = client.post(f"/api/uploads/{upload_id}/complete")
+    return response, upload_seconds, time.perf_counter() - started, failed, len(missing)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable chunked upload throughput and memory")
+    parser.add_argument('--leads', type=int, default=200000)
+    parser.add_argument('--part-size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--fail-every', type=int, default=5, help="Corrupt every Nth part once (0: never)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write results as JSON")
+    args = parser.parse_args()
+
+    import test_upload
+    workdir = tempfile.mkdtemp(prefix='campaign-chunked-')
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = test_upload.create_app(
+            DB_PATH=os.path.join(workdir, 'chunked.db'), UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+            PURGE_IN_BACKGROUND=False, DELIVERY_ROLLUP_INTERVAL_SECONDS=0, UPLOAD_PART_SIZE=args.part_size)
+    client = app.test_client()
+    path = os.path.join(workdir, 'leads.csv')
+    size = write_csv(path, args.leads, args.seed)
+    print(f"{args.leads} leads, {size / 1e6:.1f} MB, parts of {args.part_size / 1e6:.1f} MB")
+
+    reset_peak_rss()
+    response, upload_s, import_s, failed, resent = chunked_upload(client, path, size, args.fail_every)
+    result = response.get_json()
+    results = {
+        'leads': args.leads, 'bytes': size, 'part_size': args.part_size,
+        'chunked': {
+            'status': response.status_code,
+            'leads_added': result.get('leads_added'),
+            'parts_failed': failed, 'parts_resent': resent,
+            'upload_mb_per_s': round(size / 1e6 / upload_s, 1),
+            'import_seconds': round(import_s, 2),
+            'import_rows_per_s': round(args.leads / import_s),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        },
+    }
+    row = results['chunked']
+    print(f"chunked     status {row['status']}  leads {row['leads_added']}  parts failed/resent {failed}/{resent}  "
+          f"upload {row['upload_mb_per_s']} MB/s  import {row['import_seconds']}s ({row['import_rows_per_s']} rows/s)  "
+          f"peak RSS {row['peak_rss_mb']} MB")
+
+    if size <= app.config['MAX_CONTENT_LENGTH']:
+        with open(path, 'rb') as f:
+            data = f.read()
+        reset_peak_rss()
+        started = time.perf_counter()
+        response = client.post('/upload_csv', data={'csv_file': (io.BytesIO(data), 'leads.csv'),
+                                                    'campaign_name': 'Single request benchmark'},
+                               content_type='multipart/form-data')
+        elapsed = time.perf_counter() - started
+        results['upload_csv'] = {'status': response.status_code, 'seconds': round(elapsed, 2),
+                                 'rows_per_s': round(args.leads / elapsed), 'peak_rss_mb': round(peak_rss_mb(), 1)}
+        row = results['upload_csv']
+        print(f"upload_csv  status {row['status']}  {row['seconds']}s ({row['rows_per_s']} rows/s)  "
+              f"peak RSS {row['peak_rss_mb']} MB")
+    else:
+        print(f"upload_csv  skipped: file exceeds MAX_CONTENT_LENGTH ({app.config['MAX_CONTENT_LENGTH']} bytes)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
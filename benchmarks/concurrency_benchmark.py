@@ -0,0 +1,187 @@
+"""
+Concurrency benchmark: sync (thread-per-request) vs async (asgi.py) deployment.
+
+Both modes run in-process against the same synthetic database and a local webhook
+stub with a fixed delay. Sync mode models a threaded WSGI worker: a request holds one
+of --threads threads for its whole life, including the webhook wait and the time a
+slow client spends trickling its body. Async mode drives asgi.application directly
+with the same thread pool size, so only the prepare/record steps occupy threads.
+
+    python benchmarks/concurrency_benchmark.py --concurrency 8,32,128 --webhook-delay 0.2
+    python benchmarks/concurrency_benchmark.py --scenario upload --upload-trickle 0.5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_benchmarks import percentile  # noqa: E402
+from synthetic_data import generate_database, make_person  # noqa: E402
+from webhook_stub import start_stub  # noqa: E402
+
+UPLOAD_CHUNKS = 10
+
+
+def make_request(scenario, campaign_ids, upload_size, index):
+    """(method, path, body bytes, content type) for the index-th request"""
+    if scenario == 'send':
+        return 'POST', f"/send_to_n8n/{campaign_ids[index % len(campaign_ids)]}", b'', 'application/x-www-form-urlencoded'
+    rng = random.Random(index)
+    leads = [make_person(rng, 20_000_000 + index * upload_size + i) for i in range(upload_size)]
+    body = json.dumps({'campaign_name': f"Concurrency {index}", 'leads': leads}).encode('utf-8')
+    return 'POST', '/upload', body, 'application/json'
+
+
+def summarize(latencies, wall, errors):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1),
+    }
+
+
+def run_sync(app, requests_list, concurrency, threads, trickle):
+    """Thread-per-request: at most `threads` requests in progress, the rest queue"""
+    local = threading.local()
+
+    def handle(request_spec, submitted):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client(use_cookies=False)
+        method, path, body, content_type = request_spec
+        if trickle:
+            time.sleep(trickle)  # the worker thread is blocked reading a slow client's body
+        response = local.client.open(path, method=method, data=body, content_type=content_type)
+        return time.perf_counter() - submitted, response.status_code
+
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        # Closed loop: `concurrency` clients, each waiting for its previous response
+        pending = list(requests_list)
+        in_flight = set()
+        while pending or in_flight:
+            while pending and len(in_flight) < concurrency:
+                in_flight.add(pool.submit(handle, pending.pop(), time.perf_counter()))
+            done = next(iter(f for f in list(in_flight) if f.done()), None)
+            if done is None:
+                time.sleep(0.001)
+                continue
+            in_flight.discard(done)
+            latency, status = done.result()
+            latencies.append(latency)
+            errors += status >= 400
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def run_async(asgi_app, requests_list, concurrency, trickle):
+    async def one(request_spec, slots, latencies, counters):
+        method, path, body, content_type = request_spec
+        async with slots:
+            submitted = time.perf_counter()
+            chunk = max(1, len(body) // UPLOAD_CHUNKS)
+            parts = [body[i:i + chunk] for i in range(0, len(body), chunk)] or [b'']
+
+            async def receive():
+                if trickle and len(parts) > 0:
+                    await asyncio.sleep(trickle / UPLOAD_CHUNKS if len(body) > 0 else trickle)
+                data = parts.pop(0) if parts else b''
+                return {'type': 'http.request', 'body': data, 'more_body': bool(parts)}
+
+            status = {}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status['code'] = message['status']
+
+            scope = {
+                'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+                'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+                'headers': [(b'host', b'localhost'), (b'content-type', content_type.encode())],
+                'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+            }
+            await asgi_app(scope, receive, send)
+            latencies.append(time.perf_counter() - submitted)
+            counters['errors'] += status.get('code', 500) >= 400
+
+    async def main():
+        slots = asyncio.Semaphore(concurrency)
+        latencies, counters = [], {'errors': 0}
+        started = time.perf_counter()
+        await asyncio.gather(*(one(r, slots, latencies, counters) for r in requests_list))
+        return summarize(latencies, time.perf_counter() - started, counters['errors'])
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and async deployment modes under concurrency")
+    parser.add_argument('--scenario', choices=['send', 'upload'], default='send')
+    parser.add_argument('--concurrency', default='8,32,128', help="Comma-separated client counts")
+    parser.add_argument('--requests', type=int, default=0, help="Requests per level (default: 2x concurrency, min 32)")
+    parser.add_argument('--threads', type=int, default=8, help="Worker threads in both modes")
+    parser.add_argument('--webhook-delay', type=float, default=0.2)
+    parser.add_argument('--upload-size', type=int, default=100)
+    parser.add_argument('--upload-trickle', type=float, default=0.0, help="Seconds a client takes to send its body")
+    parser.add_argument('--campaigns', type=int, default=10)
+    parser.add_argument('--leads-per-campaign', type=int, default=100)
+    parser.add_argument('--output', help="Write results as JSON")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='campaign-concurrency-'), 'bench.db')
+    generate_database(db_path, campaigns=args.campaigns, leads_per_campaign=args.leads_per_campaign,
+                      sent_rate=1.0, merged_rate=0.0)
+
+    import test_upload
+    # Measures how long requests wait on the webhook, so sends are posted from the view, not queued
+    test_upload.create_app(DB_PATH=db_path, DISPATCH_SCHEDULER=False)
+    import asgi
+    server, webhook_url, webhook_stats = start_stub(delay=args.webhook_delay)
+    test_upload.app.config['N8N_WEBHOOK_URL'] = webhook_url
+
+    conn = sqlite3.connect(db_path)
+    campaign_ids = [r[0] for r in conn.execute("SELECT id FROM campaigns WHERE status = 'approved'")]
+    conn.close()
+
+    results = {'scenario': args.scenario, 'threads': args.threads, 'webhook_delay': args.webhook_delay,
+               'upload_trickle': args.upload_trickle, 'levels': []}
+    print(f"{'mode':<6} {'clients':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'errors':>6}")
+    for concurrency in [int(c) for c in args.concurrency.split(',') if c.strip()]:
+        total = args.requests or max(32, concurrency * 2)
+        requests_list = [make_request(args.scenario, campaign_ids, args.upload_size, i) for i in range(total)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            sync_stats = run_sync(test_upload.app, list(requests_list), concurrency, args.threads, args.upload_trickle)
+            asgi_app = asgi.AsyncCampaignApp(test_upload.app, threads=args.threads)
+            async_stats = run_async(asgi_app, list(requests_list), concurrency, args.upload_trickle)
+            asgi_app.executor.shutdown()
+        for mode, stats in (('sync', sync_stats), ('async', async_stats)):
+            print(f"{mode:<6} {concurrency:>7} {stats['throughput_rps']:>8} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['errors']:>6}")
+            results['levels'].append(dict(stats, mode=mode, concurrency=concurrency))
+
+    results['webhook'] = webhook_stats.as_dict()
+    server.shutdown()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
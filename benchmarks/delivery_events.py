@@ -0,0 +1,129 @@
+"""
+Delivery callback benchmark.
+
+Uploads one campaign of --leads leads, then posts --events synthetic delivery events for them
+to /api/delivery_events in batches of --batch (as n8n would report them). The rollup thread
+runs with a long interval, so ingest is measured on its own. Reports ingest throughput per
+body format (json, ndjson, gzip'd json), then the time one rollup pass needs to fold
+everything into lead_delivery_status and campaign_delivery_stats, and the latency of the
+dashboard reads that use the rollups.
+
+    python benchmarks/delivery_events.py --leads 20000 --events 200000 --batch 5000
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_benchmarks import percentile  # noqa: E402
+from synthetic_data import make_person  # noqa: E402
+
+# Rough shape of real callbacks: most leads are delivered, some open, few click or bounce
+EVENT_WEIGHTS = {'delivered': 50, 'opened': 30, 'clicked': 10, 'bounced': 6, 'failed': 3, 'complained': 1}
+
+
+def make_events(lead_ids, count, seed):
+    rng = random.Random(seed)
+    kinds, weights = list(EVENT_WEIGHTS), list(EVENT_WEIGHTS.values())
+    now = time.time()
+    return [{'lead_id': rng.choice(lead_ids), 'event': kind, 'event_id': f"evt-{seed}-{i}",
+             'occurred_at': now - rng.random() * 86400}
+            for i, kind in enumerate(rng.choices(kinds, weights, k=count))]
+
+
+def encode(batch, body_format):
+    if body_format == 'ndjson':
+        return '\n'.join(json.dumps(event) for event in batch).encode('utf-8'), 'application/x-ndjson', {}
+    body = json.dumps({'events': batch}).encode('utf-8')
+    if body_format == 'json+gzip':
+        return gzip.compress(body, compresslevel=6), 'application/json', {'Content-Encoding': 'gzip'}
+    return body, 'application/json', {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delivery callback ingest and rollup throughput")
+    parser.add_argument('--leads', type=int, default=20000)
+    parser.add_argument('--events', type=int, default=200000, help="Events per body format")
+    parser.add_argument('--batch', type=int, default=5000, help="Events per POST")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write results as JSON")
+    args = parser.parse_args()
+
+    import test_upload
+    workdir = tempfile.mkdtemp(prefix='campaign-delivery-')
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = test_upload.create_app(
+            DB_PATH=os.path.join(workdir, 'delivery.db'), UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+            PURGE_IN_BACKGROUND=False, DELIVERY_ROLLUP_INTERVAL_SECONDS=3600)
+    client = app.test_client()
+
+    rng = random.Random(args.seed)
+    leads = [make_person(rng, i) for i in range(args.leads)]
+    response = client.post('/upload', data=json.dumps({'campaign_name': 'Delivery benchmark', 'leads': leads}),
+                           content_type='application/json')
+    campaign_id = response.get_json()['campaign_id']
+    conn = test_upload.connection_pool.acquire(app.config['DB_PATH'])
+    lead_ids = [row[0] for row in conn.execute("SELECT id FROM campaign_leads WHERE campaign_id = ?", (campaign_id,))]
+
+    results = {'leads': args.leads, 'events': args.events, 'batch': args.batch, 'ingest': {}}
+    print(f"{'format':<10} {'events/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'accepted':>9}")
+    for n, body_format in enumerate(('json', 'ndjson', 'json+gzip')):
+        events = make_events(lead_ids, args.events, args.seed + n)
+        latencies, accepted = [], 0
+        started = time.perf_counter()
+        for i in range(0, len(events), args.batch):
+            body, content_type, headers = encode(events[i:i + args.batch], body_format)
+            request_started = time.perf_counter()
+            response = client.post('/api/delivery_events', data=body, content_type=content_type, headers=headers)
+            latencies.append(time.perf_counter() - request_started)
+            accepted += response.get_json()['accepted']
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        results['ingest'][body_format] = row = {
+            'events_per_second': round(len(events) / elapsed),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'accepted': accepted,
+        }
+        print(f"{body_format:<10} {row['events_per_second']:>10} {row['p50_ms']:>8} {row['p95_ms']:>8} {accepted:>9}")
+
+    started = time.perf_counter()
+    rolled_up = test_upload.delivery_rollup.run_once()
+    elapsed = time.perf_counter() - started
+    results['rollup'] = {'events': rolled_up, 'seconds': round(elapsed, 2),
+                         'events_per_second': round(rolled_up / elapsed) if elapsed else None}
+    print(f"rollup: {rolled_up} events in {elapsed:.2f}s ({results['rollup']['events_per_second']} events/s)")
+
+    reads = {}
+    for name, path in (('summary', f"/api/campaign/{campaign_id}/delivery"),
+                       ('bounced_leads', f"/api/campaign/{campaign_id}/delivery/leads?status=bounced&limit=100")):
+        latencies = []
+        for _ in range(50):
+            started = time.perf_counter()
+            client.get(path)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        reads[name] = round(percentile(latencies, 50) * 1000, 2)
+        print(f"{name:<14} p50 {reads[name]} ms")
+    results['read_p50_ms'] = reads
+    results['summary'] = client.get(f"/api/campaign/{campaign_id}/delivery").get_json()
+    test_upload.connection_pool.release(app.config['DB_PATH'], conn)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
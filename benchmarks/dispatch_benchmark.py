@@ -0,0 +1,146 @@
+"""
+Dispatch benchmark: sending several approved campaigns at once to a rate-limited webhook.
+
+One large campaign and a few small ones are uploaded, approved and sent at the same moment
+to the local webhook stub running with --max-rps / --max-leads-per-second (429 + Retry-After
+above capacity). "direct" mode posts each campaign in one request from the view
+(DISPATCH_SCHEDULER=0); "scheduled" mode queues them on the dispatch scheduler, which is
+deliberately configured faster than the stub so its adaptive backoff has to find the limit.
+Reports campaigns sent/failed, 429s seen and when the small campaigns finished.
+
+    python benchmarks/dispatch_benchmark.py --large 20000 --small 5 --small-size 200
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_benchmarks import percentile  # noqa: E402
+from synthetic_data import make_person  # noqa: E402
+from webhook_stub import start_stub  # noqa: E402
+
+
+def create_campaigns(client, mode, sizes, seed):
+    """Upload and approve one campaign per size; returns their ids in the same order"""
+    rng = random.Random(seed)
+    ids = []
+    base = 60_000_000 + seed * 1_000_000
+    for n, size in enumerate(sizes):
+        leads = [make_person(rng, base + n * 100_000 + i) for i in range(size)]
+        response = client.post('/upload', data=json.dumps({'campaign_name': f"Dispatch {mode} #{n}", 'leads': leads}),
+                               content_type='application/json')
+        campaign_id = response.get_json()['campaign_id']
+        client.post(f"/approve/{campaign_id}")
+        ids.append(campaign_id)
+        base += size
+    return ids
+
+
+def processing_statuses(test_upload, campaign_ids):
+    conn = test_upload.connection_pool.acquire(test_upload.app.config['DB_PATH'])
+    try:
+        placeholders = ','.join('?' * len(campaign_ids))
+        return dict(conn.execute(f"SELECT id, processing_status FROM campaigns WHERE id IN ({placeholders})",
+                                 campaign_ids).fetchall())
+    finally:
+        test_upload.connection_pool.release(test_upload.app.config['DB_PATH'], conn)
+
+
+def run(test_upload, mode, campaign_ids, timeout):
+    """Send every campaign at once; returns {campaign_id: (status, seconds until sent/failed)}"""
+    test_upload.app.config['DISPATCH_SCHEDULER'] = mode == 'scheduled'
+    finished = {}
+    started = time.perf_counter()
+
+    def send(campaign_id):
+        test_upload.app.test_client().post(f"/send_to_n8n/{campaign_id}")
+
+    threads = [threading.Thread(target=send, args=(campaign_id,)) for campaign_id in campaign_ids]
+    for thread in threads:
+        thread.start()
+    while len(finished) < len(campaign_ids) and time.perf_counter() - started < timeout:
+        for campaign_id, status in processing_statuses(test_upload, campaign_ids).items():
+            if status in ('sent', 'failed') and campaign_id not in finished:
+                finished[campaign_id] = (status, time.perf_counter() - started)
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+    return {campaign_id: finished.get(campaign_id, ('unfinished', None)) for campaign_id in campaign_ids}
+
+
+def summarize(outcomes, campaign_ids, webhook_before, webhook_after):
+    small = sorted(t for cid, (_, t) in outcomes.items() if cid != campaign_ids[0] and t is not None)
+    large = outcomes[campaign_ids[0]][1]
+    return {
+        'sent': sum(status == 'sent' for status, _ in outcomes.values()),
+        'failed': sum(status == 'failed' for status, _ in outcomes.values()),
+        'unfinished': sum(status == 'unfinished' for status, _ in outcomes.values()),
+        'webhook_requests': webhook_after['requests'] - webhook_before['requests'],
+        'throttled_429': webhook_after['throttled'] - webhook_before['throttled'],
+        'leads_delivered': webhook_after['leads_received'] - webhook_before['leads_received'],
+        'small_p50_s': round(percentile(small, 50), 2) if small else None,
+        'small_max_s': round(small[-1], 2) if small else None,
+        'large_s': round(large, 2) if large is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send campaigns at once to a rate-limited webhook, with and without the scheduler")
+    parser.add_argument('--large', type=int, default=20000, help="Leads in the large campaign")
+    parser.add_argument('--small', type=int, default=5, help="Number of small campaigns")
+    parser.add_argument('--small-size', type=int, default=200)
+    parser.add_argument('--stub-rps', type=float, default=4, help="Webhook stub capacity, requests per second")
+    parser.add_argument('--stub-leads-per-second', type=float, default=2000, help="Webhook stub capacity, leads per second")
+    parser.add_argument('--dispatch-rps', type=float, default=8, help="Scheduler requests/s (above the stub to exercise backoff)")
+    parser.add_argument('--dispatch-leads-per-second', type=float, default=4000)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--timeout', type=float, default=300, help="Give up waiting after this many seconds per mode")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write results as JSON")
+    args = parser.parse_args()
+
+    import test_upload
+    workdir = tempfile.mkdtemp(prefix='campaign-dispatch-')
+    server, webhook_url, webhook_stats = start_stub(max_rps=args.stub_rps, max_leads_per_second=args.stub_leads_per_second)
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = test_upload.create_app(
+            DB_PATH=os.path.join(workdir, 'dispatch.db'), UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+            PURGE_IN_BACKGROUND=False, N8N_WEBHOOK_URL=webhook_url, DISPATCH_CHUNK_SIZE=args.chunk_size,
+            DISPATCH_REQUESTS_PER_SECOND=args.dispatch_rps, DISPATCH_LEADS_PER_SECOND=args.dispatch_leads_per_second)
+    client = app.test_client()
+    sizes = [args.large] + [args.small_size] * args.small
+
+    results = {'sizes': sizes, 'stub_rps': args.stub_rps, 'stub_leads_per_second': args.stub_leads_per_second,
+               'modes': {}}
+    print(f"{'mode':<10} {'sent':>4} {'failed':>6} {'429s':>5} {'requests':>8} {'small p50 s':>11} "
+          f"{'small max s':>11} {'large s':>8}")
+    for n, mode in enumerate(('direct', 'scheduled')):
+        campaign_ids = create_campaigns(client, mode, sizes, args.seed + n)
+        time.sleep(1.5)  # let the stub's buckets refill between modes
+        before = webhook_stats.as_dict()
+        outcomes = run(test_upload, mode, campaign_ids, args.timeout)
+        results['modes'][mode] = stats = summarize(outcomes, campaign_ids, before, webhook_stats.as_dict())
+        print(f"{mode:<10} {stats['sent']:>4} {stats['failed']:>6} {stats['throttled_429']:>5} "
+              f"{stats['webhook_requests']:>8} {str(stats['small_p50_s']):>11} {str(stats['small_max_s']):>11} "
+              f"{str(stats['large_s']):>8}")
+    results['destinations'] = test_upload.dispatch_scheduler.snapshot()['destinations']
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
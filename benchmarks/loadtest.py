@@ -0,0 +1,395 @@
+"""
+Closed-loop load generator for a running campaign review instance.
+
+Each worker thread repeatedly picks an action from a weighted traffic mix,
+waits for the response and (optionally) thinks before the next one. The run
+steps through increasing concurrency levels and reports throughput, error
+rates (SQLite lock errors separately) and tail latency per level.
+
+Start the app with the webhook pointed at the stub this tool launches:
+
+    N8N_WEBHOOK_URL=http://127.0.0.1:5678/webhook/stub python test_upload.py
+    python benchmarks/loadtest.py --base-url http://127.0.0.1:5000 --concurrency 1,4,16,32 --duration 30
+
+Requests can be recorded as JSON lines and replayed later with their original timing:
+
+    python benchmarks/loadtest.py --record traffic.jsonl ...
+    python benchmarks/loadtest.py --replay traffic.jsonl --speed 2
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_data import make_person  # noqa: E402
+from webhook_stub import start_stub  # noqa: E402
+
+DEFAULT_MIX = 'upload=2,list=30,detail=25,bulk_toggle=10,merge=2,send=3,unsubscribe=25,preview=3'
+
+
+class Fixtures:
+    """Campaigns, lead ids and unsubscribe tokens discovered through the HTTP API"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.campaign_ids = []
+        self.approved_ids = []
+        self.lead_ids = defaultdict(list)
+        self.unsubscribe_paths = []
+
+    def add_campaign(self, session, base_url, campaign_id, approve):
+        response = session.get(f"{base_url}/api/campaign/{campaign_id}/unsubscribe_urls", timeout=30)
+        response.raise_for_status()
+        urls = response.json()['unsubscribe_urls']
+        if approve:
+            session.post(f"{base_url}/approve/{campaign_id}", allow_redirects=False, timeout=30)
+        with self.lock:
+            self.campaign_ids.append(campaign_id)
+            if approve:
+                self.approved_ids.append(campaign_id)
+            self.lead_ids[campaign_id] = [u['lead_id'] for u in urls]
+            self.unsubscribe_paths.extend('/unsubscribe/' + u['unsubscribe_url'].rsplit('/', 1)[1] for u in urls)
+
+
+def upload_payload(rng, size):
+    base = rng.randrange(10 ** 9)
+    return {
+        'campaign_name': f"Load test {base}",
+        'campaign_description': 'loadtest',
+        'leads': [make_person(rng, base + i) for i in range(size)],
+    }
+
+
+def seed_fixtures(session, base_url, rng, campaigns, size):
+    fixtures = Fixtures()
+    for i in range(campaigns):
+        response = session.post(f"{base_url}/upload", json=upload_payload(rng, size), timeout=120)
+        response.raise_for_status()
+        fixtures.add_campaign(session, base_url, response.json()['campaign_id'], approve=i % 2 == 0)
+    return fixtures
+
+
+# --- ACTIONS: each returns (method, path, kwargs) for one request ---
+
+def action_upload(rng, fx, args):
+    return 'POST', '/upload', {'json': upload_payload(rng, args.upload_size)}
+
+
+def action_list(rng, fx, args):
+    return 'GET', rng.choice(['/campaigns', '/merge_campaigns_page']), {}
+
+
+def action_detail(rng, fx, args):
+    return 'GET', f"/campaign/{rng.choice(fx.campaign_ids)}", {}
+
+
+def action_bulk_toggle(rng, fx, args):
+    campaign_id = rng.choice(fx.campaign_ids)
+    leads = fx.lead_ids[campaign_id]
+    selected = rng.sample(leads, min(len(leads), 25))
+    return 'POST', f"/bulk_toggle_leads/{campaign_id}/{rng.choice([0, 1])}", {'data': {'lead_ids': selected}}
+
+
+def action_merge(rng, fx, args):
+    ids = rng.sample(fx.campaign_ids, 2)
+    return 'POST', '/merge_campaigns', {'data': {
+        'campaign_ids[]': ids,
+        'merged_campaign_name': f"Load merge {ids[0]}+{ids[1]}",
+    }}
+
+
+def action_preview(rng, fx, args):
+    return 'POST', '/api/merge_preview', {'json': {'campaign_ids': rng.sample(fx.campaign_ids, 2)}}
+
+
+def action_send(rng, fx, args):
+    return 'POST', f"/send_to_n8n/{rng.choice(fx.approved_ids or fx.campaign_ids)}", {}
+
+
+def action_unsubscribe(rng, fx, args):
+    # Unsubscribe clicks arrive in bursts right after a send
+    path = rng.choice(fx.unsubscribe_paths)
+    return 'POST', path.replace('/unsubscribe/', '/confirm_unsubscribe/'), {}
+
+
+ACTIONS = {
+    'upload': action_upload,
+    'list': action_list,
+    'detail': action_detail,
+    'bulk_toggle': action_bulk_toggle,
+    'merge': action_merge,
+    'preview': action_preview,
+    'send': action_send,
+    'unsubscribe': action_unsubscribe,
+}
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ACTIONS:
+            raise SystemExit(f"Unknown action in mix: {name} (available: {', '.join(ACTIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def response_error_code(response):
+    """The app's machine-readable error code ({"error": "database_locked"}), if the body is JSON"""
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    return body.get('error') if isinstance(body, dict) else None
+
+
+def server_lock_errors(session, base_url):
+    """Sum of the app's sqlite_lock_errors_total counter, or None if /metrics is unreachable"""
+    try:
+        response = session.get(f"{base_url}/metrics", timeout=10)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+    return sum(float(line.rsplit(' ', 1)[1]) for line in response.text.splitlines()
+               if line.startswith('sqlite_lock_errors_total'))
+
+
+def classify(response, error):
+    """
+    Bucket a result: ok, sqlite_locked, server_error, client_error or connection_error.
+    Lock timeouts are the app's 503 responses with {"error": "database_locked"}.
+    """
+    if error is not None:
+        return 'connection_error'
+    if response.status_code == 503 and response_error_code(response) == 'database_locked':
+        return 'sqlite_locked'
+    if response.status_code >= 500:
+        return 'server_error'
+    if response.status_code >= 400:
+        return 'client_error'
+    return 'ok'
+
+
+class Recorder:
+    """Appends issued requests as JSON lines for later replay"""
+
+    def __init__(self, path):
+        self.file = open(path, 'a') if path else None
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counter = 0
+
+    def write(self, action, method, path, kwargs, outcome, latency):
+        if self.file is None:
+            return
+        with self.lock:
+            self.counter += 1
+            self.file.write(json.dumps({
+                'request_id': self.counter,
+                'offset_s': round(time.time() - self.started, 4),
+                'action': action,
+                'method': method,
+                'path': path,
+                'json': kwargs.get('json'),
+                'form': kwargs.get('data'),
+                'outcome': outcome,
+                'latency_ms': round(latency * 1000, 2),
+            }) + '\n')
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+class LevelStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.outcomes = defaultdict(int)
+        self.per_action = defaultdict(list)
+
+    def add(self, action, latency, outcome):
+        with self.lock:
+            self.latencies.append(latency)
+            self.outcomes[outcome] += 1
+            self.per_action[action].append(latency)
+
+    def summary(self, wall):
+        def pct(values, p):
+            if not values:
+                return None
+            values = sorted(values)
+            return round(values[min(len(values) - 1, int(len(values) * p / 100))] * 1000, 2)
+
+        total = len(self.latencies)
+        errors = total - self.outcomes.get('ok', 0)
+        return {
+            'requests': total,
+            'throughput_rps': round(total / wall, 2) if wall else None,
+            'error_rate': round(errors / total, 4) if total else 0,
+            'outcomes': dict(self.outcomes),
+            'p50_ms': pct(self.latencies, 50),
+            'p95_ms': pct(self.latencies, 95),
+            'p99_ms': pct(self.latencies, 99),
+            'max_ms': round(max(self.latencies) * 1000, 2) if self.latencies else None,
+            'per_action_p95_ms': {name: pct(values, 95) for name, values in sorted(self.per_action.items())},
+        }
+
+
+def issue(session, base_url, method, path, kwargs, timeout):
+    started = time.perf_counter()
+    response, error = None, None
+    try:
+        response = session.request(method, base_url + path, allow_redirects=False, timeout=timeout, **kwargs)
+    except requests.RequestException as e:
+        error = e
+    return response, error, time.perf_counter() - started
+
+
+def run_level(args, fixtures, mix, concurrency, recorder):
+    stats = LevelStats()
+    deadline = time.perf_counter() + args.duration
+    names = list(mix)
+    weights = [mix[n] for n in names]
+
+    def worker(worker_id):
+        rng = random.Random(args.seed * 1000 + concurrency * 100 + worker_id)
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            action = rng.choices(names, weights)[0]
+            method, path, kwargs = ACTIONS[action](rng, fixtures, args)
+            bursts = rng.randint(3, 10) if action == 'unsubscribe' else 1
+            for _ in range(bursts):
+                response, error, latency = issue(session, args.base_url, method, path, kwargs, args.timeout)
+                outcome = classify(response, error)
+                stats.add(action, latency, outcome)
+                recorder.write(action, method, path, kwargs, outcome, latency)
+                if action == 'unsubscribe':
+                    method, path, kwargs = action_unsubscribe(rng, fixtures, args)
+            if args.think_time:
+                time.sleep(rng.expovariate(1 / args.think_time))
+
+    metrics_session = requests.Session()
+    locks_before = server_lock_errors(metrics_session, args.base_url)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    summary = stats.summary(time.perf_counter() - started)
+    locks_after = server_lock_errors(metrics_session, args.base_url)
+    # Cross-check against the server's own count: catches lock errors surfaced some other way
+    if locks_before is not None and locks_after is not None:
+        summary['server_lock_errors'] = int(locks_after - locks_before)
+    return summary
+
+
+def replay(args):
+    """Re-issue recorded requests with their original relative timing (divided by --speed)"""
+    with open(args.replay) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    stats = LevelStats()
+    local = threading.local()
+    semaphore = threading.Semaphore(max(int(n) for n in args.concurrency.split(',')))
+    started = time.perf_counter()
+
+    def send(entry):
+        with semaphore:
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            kwargs = {}
+            if entry.get('json') is not None:
+                kwargs['json'] = entry['json']
+            if entry.get('form') is not None:
+                kwargs['data'] = entry['form']
+            response, error, latency = issue(local.session, args.base_url, entry['method'], entry['path'], kwargs, args.timeout)
+            stats.add(entry.get('action', entry['path']), latency, classify(response, error))
+
+    threads = []
+    for entry in entries:
+        delay = entry.get('offset_s', 0) / args.speed - (time.perf_counter() - started)
+        if delay > 0:
+            time.sleep(delay)
+        t = threading.Thread(target=send, args=(entry,), daemon=True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return stats.summary(time.perf_counter() - started)
+
+
+def print_level(label, summary):
+    outcomes = summary['outcomes']
+    print(f"{label:>12} {summary['requests']:>8} {summary['throughput_rps']:>9} "
+          f"{summary['error_rate'] * 100:>7.2f}% {outcomes.get('sqlite_locked', 0):>7} "
+          f"{summary['p50_ms']:>9} {summary['p95_ms']:>9} {summary['p99_ms']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Closed-loop load test against a running instance")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated worker counts, run in order")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds per concurrency level")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="action=weight pairs")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Mean seconds between a worker's requests")
+    parser.add_argument('--upload-size', type=int, default=200)
+    parser.add_argument('--seed-campaigns', type=int, default=6)
+    parser.add_argument('--seed-size', type=int, default=300)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--stub-port', type=int, default=5678, help="Port for the local n8n webhook stub (0 = disabled)")
+    parser.add_argument('--stub-delay', type=float, default=0.05)
+    parser.add_argument('--record', help="Append issued requests to this JSON lines file")
+    parser.add_argument('--replay', help="Replay a recorded JSON lines file instead of generating traffic")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed multiplier")
+    parser.add_argument('--output', help="Write the summary as JSON")
+    args = parser.parse_args()
+
+    server = None
+    if args.stub_port:
+        server, url, _ = start_stub(port=args.stub_port, delay=args.stub_delay)
+        print(f"ℹ️ n8n webhook stub on {url} (start the app with N8N_WEBHOOK_URL={url})")
+
+    header = f"{'level':>12} {'requests':>8} {'req/s':>9} {'errors':>8} {'locked':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    results = {'base_url': args.base_url, 'levels': {}}
+    try:
+        if args.replay:
+            summary = replay(args)
+            print(header)
+            print_level('replay', summary)
+            results['levels']['replay'] = summary
+        else:
+            rng = random.Random(args.seed)
+            fixtures = seed_fixtures(requests.Session(), args.base_url, rng, args.seed_campaigns, args.seed_size)
+            mix = parse_mix(args.mix)
+            recorder = Recorder(args.record)
+            print(header)
+            try:
+                for concurrency in [int(n) for n in args.concurrency.split(',')]:
+                    summary = run_level(args, fixtures, mix, concurrency, recorder)
+                    print_level(f"c={concurrency}", summary)
+                    results['levels'][str(concurrency)] = summary
+            finally:
+                recorder.close()
+    finally:
+        if server:
+            server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
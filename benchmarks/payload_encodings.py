@@ -0,0 +1,105 @@
+"""
+Webhook payload encoding benchmark.
+
+Builds a send_to_n8n payload of --leads synthetic leads (same fields as a real dispatch) and,
+for every format (json, ndjson, columnar) with and without gzip, reports the body size, the
+time to encode it in the app and the time the receiving side needs to decode it back to the
+original json shape (webhook_stub.decode_payload). Each decoded payload is checked against
+the original.
+
+    python benchmarks/payload_encodings.py --leads 5000 --repeat 5
+"""
+import argparse
+import json
+import os
+import random
+import secrets
+import sys
+import time
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_data import SOURCES, make_person  # noqa: E402
+from webhook_stub import decode_payload  # noqa: E402
+
+BASE_URL = 'https://campaigns.example.com'
+
+
+def make_payload(count, seed):
+    rng = random.Random(seed)
+    leads = []
+    for i in range(count):
+        person = make_person(rng, i)
+        token = secrets.token_urlsafe(32)
+        leads.append({
+            "lead_id": 100000 + i,
+            "first_name": person['first_name'],
+            "last_name": person['last_name'],
+            "email": person['email'],
+            "company": person['company'],
+            "domain": person['domain'],
+            "score": rng.randint(1, 10),
+            "label": person['label'],
+            "description": person['description'],
+            "source": rng.choice(SOURCES),
+            "unsubscribe_url": f"{BASE_URL}/unsubscribe/{token}",
+            "unsubscribe_token": token,
+        })
+    return {"campaign_id": 1, "total_leads": count, "processing_mode": "process all leads (no exclusions)", "leads": leads}
+
+
+def best_of(repeat, func):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare webhook payload formats by size, encode and decode time")
+    parser.add_argument('--leads', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5, help="Timings are the best of this many runs")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write results as JSON")
+    args = parser.parse_args()
+
+    import test_upload
+    payload = make_payload(args.leads, args.seed)
+    template = f"{BASE_URL}/unsubscribe/{{token}}"
+
+    results = {'leads': args.leads, 'formats': []}
+    baseline = None
+    print(f"{'format':<10} {'encoding':<9} {'bytes':>10} {'vs json':>8} {'encode ms':>10} {'decode ms':>10} {'ok':>3}")
+    for payload_format in ('json', 'ndjson', 'columnar'):
+        for content_encoding in ('identity', 'gzip'):
+            encode_s, (body, headers) = best_of(args.repeat, lambda: test_upload.encode_webhook_payload(
+                payload, payload_format, content_encoding, template))
+            decode_s, decoded = best_of(args.repeat, lambda: decode_payload(body, headers))
+            baseline = baseline or len(body)
+            row = {
+                'format': payload_format,
+                'content_encoding': content_encoding,
+                'bytes': len(body),
+                'ratio_vs_json': round(len(body) / baseline, 3),
+                'encode_ms': round(encode_s * 1000, 2),
+                'decode_ms': round(decode_s * 1000, 2),
+                'round_trip_ok': decoded == payload,
+            }
+            results['formats'].append(row)
+            print(f"{payload_format:<10} {content_encoding:<9} {row['bytes']:>10} {row['ratio_vs_json']:>8} "
+                  f"{row['encode_ms']:>10} {row['decode_ms']:>10} {'✓' if row['round_trip_ok'] else '✗':>3}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+    sys.exit(0 if all(row['round_trip_ok'] for row in results['formats']) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""
+Scenario benchmarks for the campaign review app.
+
+Generates a synthetic database, drives each route through the Flask test client
+and writes p50/p95 latency, throughput and peak RSS per scenario to JSON, so runs
+can be compared across commits.
+
+    python benchmarks/run_benchmarks.py --campaigns 30 --leads-per-campaign 1000 --output bench_results.json
+    python benchmarks/run_benchmarks.py --compare bench_results.json --output new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_data import generate_database, make_person  # noqa: E402
+from webhook_stub import start_stub  # noqa: E402
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+# --- SCENARIOS: each performs one request and returns the response ---
+
+@scenario('upload_csv')
+def bench_upload_csv(ctx):
+    return ctx.client.post('/upload_csv', data={
+        'csv_file': (io.BytesIO(ctx.csv_bytes), 'leads.csv'),
+        'campaign_name': f"Bench CSV {ctx.rng.random()}",
+        'campaign_description': 'benchmark',
+    }, content_type='multipart/form-data')
+
+
+@scenario('upload_json')
+def bench_upload_json(ctx):
+    payload = dict(ctx.upload_payload, campaign_name=f"Bench API {ctx.rng.random()}")
+    return ctx.client.post('/upload', json=payload)
+
+
+@scenario('merge_campaigns')
+def bench_merge_campaigns(ctx):
+    ids = ctx.rng.sample(ctx.campaign_ids, 2)
+    return ctx.client.post('/merge_campaigns', data={
+        'campaign_ids[]': [str(i) for i in ids],
+        'merged_campaign_name': f"Bench Merge {ids[0]}+{ids[1]}",
+        'merged_campaign_description': 'benchmark',
+    })
+
+
+@scenario('merge_preview')
+def bench_merge_preview(ctx):
+    ids = ctx.rng.sample(ctx.campaign_ids, min(3, len(ctx.campaign_ids)))
+    return ctx.client.post('/api/merge_preview', json={'campaign_ids': ids})
+
+
+@scenario('send_to_n8n')
+def bench_send_to_n8n(ctx):
+    # The suite runs with DISPATCH_SCHEDULER off, so the webhook POST happens inside the request
+    # (dispatch_benchmark.py covers the scheduler)
+    sent = ctx.webhook_stats.requests
+    response = ctx.client.post(f"/send_to_n8n/{ctx.rng.choice(ctx.approved_ids)}")
+    assert ctx.webhook_stats.requests == sent + 1, "send_to_n8n did not reach the webhook"
+    return response
+
+
+@scenario('campaign_detail')
+def bench_campaign_detail(ctx):
+    return ctx.client.get(f"/campaign/{ctx.rng.choice(ctx.campaign_ids)}")
+
+
+@scenario('export_campaign')
+def bench_export_campaign(ctx):
+    response = ctx.client.get(f"/export_campaign/{ctx.rng.choice(ctx.campaign_ids)}")
+    response.get_data()  # the body is streamed: rows are only queried and encoded while it is read
+    response.close()
+    return response
+
+
+@scenario('check_duplicates')
+def bench_check_duplicates(ctx):
+    return ctx.client.post('/api/check_duplicates', json={'emails': ctx.rng.sample(ctx.emails, min(100, len(ctx.emails)))})
+
+
+@scenario('compare_leads')
+def bench_compare_leads(ctx):
+    current = ctx.rng.choice(ctx.approved_ids)
+    processed = ctx.rng.choice(ctx.sent_ids or ctx.campaign_ids)
+    return ctx.client.get(f"/api/compare_leads/{current}/{processed}")
+
+
+@scenario('search')
+def bench_search(ctx):
+    email = ctx.rng.choice(ctx.emails)
+    return ctx.client.get('/api/search', query_string={'q': email.split('@')[0][:6]})
+
+
+@scenario('toggle_lead_status')
+def bench_toggle_lead_status(ctx):
+    lead_id, campaign_id = ctx.rng.choice(ctx.memberships)
+    return ctx.client.post(f"/toggle_lead_status/{lead_id}/{campaign_id}")
+
+
+@scenario('bulk_toggle_leads')
+def bench_bulk_toggle_leads(ctx):
+    campaign_id = ctx.rng.choice(list(ctx.campaign_leads))
+    lead_ids = ctx.campaign_leads[campaign_id]
+    # Flip to the opposite of the last state so every call changes rows
+    status = ctx.bulk_status[campaign_id] = 1 - ctx.bulk_status.get(campaign_id, 1)
+    response = ctx.client.post(f"/bulk_toggle_leads/{campaign_id}/{status}", data={'lead_ids': [str(i) for i in lead_ids]})
+    changed = ctx.conn.execute(f"""
+        SELECT COUNT(*) FROM campaign_leads WHERE is_active = ? AND id IN ({','.join('?' for _ in lead_ids)})
+    """, [status] + lead_ids).fetchone()[0]
+    assert changed == len(lead_ids), f"bulk_toggle_leads changed {changed} of {len(lead_ids)} leads"
+    return response
+
+
+# --- HARNESS ---
+
+class Context:
+    """Shared state for scenarios: test client, RNG and sample ids/emails from the dataset"""
+
+    def __init__(self, client, db_path, upload_size, seed, webhook_stats=None):
+        self.client = client
+        self.webhook_stats = webhook_stats
+        self.rng = random.Random(seed)
+        conn = sqlite3.connect(db_path)
+        self.campaign_ids = [r[0] for r in conn.execute("SELECT id FROM campaigns ORDER BY id")]
+        self.approved_ids = [r[0] for r in conn.execute("SELECT id FROM campaigns WHERE status = 'approved'")] or self.campaign_ids[:1]
+        self.sent_ids = [r[0] for r in conn.execute("SELECT id FROM campaigns WHERE processing_status = 'sent'")]
+        self.emails = [r[0] for r in conn.execute("SELECT email FROM leads ORDER BY RANDOM() LIMIT 5000")]
+        self.memberships = conn.execute("SELECT id, campaign_id FROM campaign_leads ORDER BY RANDOM() LIMIT 5000").fetchall()
+        # Up to 200 leads of each campaign that has any, for the bulk scenarios
+        self.campaign_leads = {}
+        for lead_id, campaign_id in conn.execute("""
+            SELECT id, campaign_id FROM (
+                SELECT id, campaign_id, ROW_NUMBER() OVER (PARTITION BY campaign_id ORDER BY id) AS n FROM campaign_leads
+            ) WHERE n <= 200
+        """):
+            self.campaign_leads.setdefault(campaign_id, []).append(lead_id)
+        self.bulk_status = {}
+        conn.close()
+        self.conn = sqlite3.connect(db_path)  # for checking what the write scenarios changed
+        if not self.approved_ids or not self.campaign_leads:
+            raise SystemExit("Dataset has no campaigns")
+
+        people = [make_person(self.rng, 10_000_000 + i) for i in range(upload_size)]
+        self.upload_payload = {'campaign_description': 'benchmark', 'leads': people}
+        out = io.StringIO()
+        out.write('first_name,last_name,email,company,domain,label,description,score\n')
+        for p in people:
+            out.write(f"{p['first_name']},{p['last_name']},{p['email']},{p['company']},{p['domain']},{p['label']},\"{p['description']}\",5\n")
+        self.csv_bytes = out.getvalue().encode('utf-8')
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak-RSS watermark (Linux); returns False where unsupported"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS; process lifetime peak
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def run_scenario(func, ctx, iterations, warmup):
+    for _ in range(warmup):
+        func(ctx)
+    reset_peak_rss()
+    timings = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        response = func(ctx)
+        timings.append(time.perf_counter() - t0)
+        if response.status_code >= 400:
+            errors += 1
+    wall = time.perf_counter() - started
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'throughput_rps': round(iterations / wall, 2) if wall else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline):
+    print(f"\n{'scenario':<20} {'p50 ms':>10} {'Δ p50':>8} {'p95 ms':>10} {'Δ p95':>8}")
+    for name, current in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            print(f"{name:<20} {current['p50_ms']:>10} {'new':>8} {current['p95_ms']:>10} {'new':>8}")
+            continue
+        deltas = []
+        for key in ('p50_ms', 'p95_ms'):
+            deltas.append(f"{(current[key] - before[key]) / before[key] * 100:+.0f}%" if before[key] else 'n/a')
+        print(f"{name:<20} {current['p50_ms']:>10} {deltas[0]:>8} {current['p95_ms']:>10} {deltas[1]:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run route benchmarks against a synthetic database")
+    parser.add_argument('--campaigns', type=int, default=20)
+    parser.add_argument('--leads-per-campaign', type=int, default=500)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--unsubscribe-rate', type=float, default=0.02)
+    parser.add_argument('--upload-size', type=int, default=500, help="Leads per upload_csv / upload_json request")
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated subset to run")
+    parser.add_argument('--db', help="Use (and keep) this database file instead of a temporary one")
+    parser.add_argument('--webhook-delay', type=float, default=0.0, help="Seconds the webhook stub sleeps per request")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="Previous results JSON to diff against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='campaign-bench-')
+    db_path = args.db or os.path.join(workdir, 'bench.db')
+    dataset = generate_database(
+        db_path,
+        campaigns=args.campaigns,
+        leads_per_campaign=args.leads_per_campaign,
+        duplicate_rate=args.duplicate_rate,
+        unsubscribe_rate=args.unsubscribe_rate,
+        seed=args.seed,
+    )
+
+    import test_upload
+    # No purger thread: its archival pass would move old sent campaigns' leads out of
+    # campaign_leads while the scenarios run. Archive once up front instead, so the dataset
+    # starts in the state a long-running deployment is in.
+    test_upload.create_app(DB_PATH=db_path, PURGE_IN_BACKGROUND=False, DISPATCH_SCHEDULER=False)
+    with test_upload.app.app_context():
+        test_upload.campaign_purger.archive_once()
+    server, webhook_url, webhook_stats = start_stub(delay=args.webhook_delay)
+    test_upload.app.config['N8N_WEBHOOK_URL'] = webhook_url
+    # No cookies: flash messages from redirects would otherwise pile up in the session
+    client = test_upload.app.test_client(use_cookies=False)
+    ctx = Context(client, db_path, args.upload_size, args.seed, webhook_stats)
+
+    results = {
+        'meta': {
+            'git_commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'dataset': dataset,
+            'upload_size': args.upload_size,
+            'iterations': args.iterations,
+        },
+        'scenarios': {},
+    }
+
+    for name in [n.strip() for n in args.scenarios.split(',') if n.strip()]:
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario: {name} (available: {', '.join(SCENARIOS)})")
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = run_scenario(SCENARIOS[name], ctx, args.iterations, args.warmup)
+        results['scenarios'][name] = stats
+        print(f"{name:<20} p50={stats['p50_ms']:>9.2f}ms p95={stats['p95_ms']:>9.2f}ms "
+              f"{stats['throughput_rps']:>8.1f} req/s rss={stats['peak_rss_mb']:.0f}MB errors={stats['errors']}")
+
+    results['meta']['webhook'] = webhook_stats.as_dict()
+    server.shutdown()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Write-scaling benchmark for tenant sharding.
+
+Concurrent writers each post /upload requests. In "single" mode every writer targets the
+default database (one writer lock); in "sharded" mode each writer is its own tenant with its
+own shard file. Reports uploads/s and leads/s for each writer count.
+
+    python benchmarks/shard_benchmark.py --writers 1,2,4,8 --uploads 20 --upload-size 500
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_benchmarks import percentile  # noqa: E402
+from synthetic_data import generate_database, make_person  # noqa: E402
+
+
+def make_payloads(writer, uploads, upload_size, seed):
+    rng = random.Random(seed + writer)
+    base = 30_000_000 + writer * uploads * upload_size
+    return [
+        json.dumps({
+            'campaign_name': f"Shard bench w{writer} #{n}",
+            'leads': [make_person(rng, base + n * upload_size + i) for i in range(upload_size)],
+        }).encode('utf-8')
+        for n in range(uploads)
+    ]
+
+
+def run(app, payloads_per_writer, tenants):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def writer(index):
+        client = app.test_client(use_cookies=False)
+        headers = {'X-Tenant-ID': tenants[index]} if tenants[index] else {}
+        for body in payloads_per_writer[index]:
+            started = time.perf_counter()
+            response = client.post('/upload', data=body, content_type='application/json', headers=headers)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(len(payloads_per_writer))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'uploads': len(latencies),
+        'errors': len(errors),
+        'wall_s': round(wall, 3),
+        'uploads_per_s': round(len(latencies) / wall, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare upload throughput on one database vs one shard per writer")
+    parser.add_argument('--writers', default='1,2,4,8', help="Comma-separated concurrent writer counts")
+    parser.add_argument('--uploads', type=int, default=10, help="Uploads per writer")
+    parser.add_argument('--upload-size', type=int, default=500)
+    parser.add_argument('--campaigns', type=int, default=10, help="Campaigns in each starting database")
+    parser.add_argument('--leads-per-campaign', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write results as JSON")
+    args = parser.parse_args()
+
+    writer_counts = [int(w) for w in args.writers.split(',') if w.strip()]
+    workdir = tempfile.mkdtemp(prefix='campaign-shards-')
+    db_path = os.path.join(workdir, 'bench.db')
+    generate_database(db_path, campaigns=args.campaigns, leads_per_campaign=args.leads_per_campaign, seed=args.seed)
+
+    import test_upload
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = test_upload.create_app(DB_PATH=db_path, CATALOG_DB_PATH=os.path.join(workdir, 'catalog.db'),
+                                     SHARD_DIR=os.path.join(workdir, 'shards'), PURGE_IN_BACKGROUND=False,
+                                     ARCHIVE_AFTER_DAYS=0)
+        tenants = [f"bench{i}" for i in range(max(writer_counts))]
+        for i, tenant in enumerate(tenants):
+            path, _ = test_upload.shard_catalog.register(tenant)
+            generate_database(path, campaigns=args.campaigns, leads_per_campaign=args.leads_per_campaign,
+                              seed=args.seed + i + 1)
+
+    results = {'upload_size': args.upload_size, 'uploads_per_writer': args.uploads, 'levels': []}
+    print(f"{'mode':<8} {'writers':>7} {'uploads/s':>10} {'leads/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'errors':>6}")
+    for writers in writer_counts:
+        payloads = [make_payloads(w, args.uploads, args.upload_size, args.seed + writers * 100) for w in range(writers)]
+        for mode, shard_tenants in (('single', [None] * writers), ('sharded', tenants[:writers])):
+            # Distinct names per mode so idempotency keys don't turn the second run into replays
+            renamed = [[body.replace(b'Shard bench', mode.encode()) for body in bodies] for bodies in payloads]
+            stats = run(app, renamed, shard_tenants)
+            stats.update(mode=mode, writers=writers, leads_per_s=round(stats['uploads_per_s'] * args.upload_size))
+            results['levels'].append(stats)
+            print(f"{mode:<8} {writers:>7} {stats['uploads_per_s']:>10} {stats['leads_per_s']:>10} "
+                  f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['errors']:>6}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Cold-start benchmark.
+
+Starts fresh interpreters and times, per run: importing the app module, create_app()
+(settings, logging, migration check) and the first request. Runs against a database whose
+migrations are already applied (the common worker restart) and against one that is not.
+
+    python benchmarks/startup_benchmark.py --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_benchmarks import percentile  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Executed in a child interpreter; prints one JSON line with phase timings in seconds
+CHILD = r"""
+import contextlib, io, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+import test_upload
+imported = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    app = test_upload.create_app(DB_PATH={db!r}, UPLOAD_FOLDER={uploads!r}, LOG_LEVEL='WARNING')
+created = time.perf_counter()
+status = app.test_client().get('/campaigns').status_code
+first_request = time.perf_counter()
+print(json.dumps({{
+    'import_s': imported - started,
+    'create_app_s': created - imported,
+    'first_request_s': first_request - created,
+    'total_s': first_request - started,
+    'status': status,
+    'modules': len(sys.modules),
+    'requests_loaded': 'requests' in sys.modules,
+}}))
+"""
+
+
+def run_child(db_path, uploads):
+    code = CHILD.format(root=REPO_ROOT, db=db_path, uploads=uploads)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=REPO_ROOT, env=dict(os.environ, LOG_LEVEL='WARNING'))
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def summarize(samples):
+    summary = {}
+    for key in ('import_s', 'create_app_s', 'first_request_s', 'total_s'):
+        values = sorted(s[key] for s in samples)
+        summary[key.replace('_s', '_ms')] = {
+            'p50': round(percentile(values, 50) * 1000, 1),
+            'p95': round(percentile(values, 95) * 1000, 1),
+        }
+    summary['modules'] = samples[-1]['modules']
+    summary['requests_loaded'] = samples[-1]['requests_loaded']
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure interpreter-to-first-response startup time")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--db', default=os.path.join(REPO_ROOT, 'leads.db'),
+                        help="Database to copy for each run (left untouched)")
+    parser.add_argument('--output', help="Write results as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='campaign-startup-')
+    uploads = os.path.join(workdir, 'uploads')
+    migrated_db = os.path.join(workdir, 'migrated.db')
+    shutil.copy(args.db, migrated_db)
+    run_child(migrated_db, uploads)  # apply pending migrations once
+
+    results = {'runs': args.runs, 'python': sys.version.split()[0], 'cases': {}}
+    cases = {
+        'migrations_current': lambda i: migrated_db,
+        'migrations_pending': lambda i: shutil.copy(args.db, os.path.join(workdir, f"pending_{i}.db")),
+    }
+    for name, make_db in cases.items():
+        samples = [run_child(make_db(i), uploads) for i in range(args.runs)]
+        results['cases'][name] = summary = summarize(samples)
+        print(f"{name:<20} import={summary['import_ms']['p50']:>7.1f}ms create_app={summary['create_app_ms']['p50']:>7.1f}ms "
+              f"first_request={summary['first_request_ms']['p50']:>7.1f}ms total={summary['total_ms']['p50']:>7.1f}ms "
+              f"(p95 {summary['total_ms']['p95']:.1f}ms)")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
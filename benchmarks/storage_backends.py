@@ -0,0 +1,181 @@
+"""
+Storage backend conformance check and bulk-load benchmark.
+
+Runs the same sequence against SQLiteRepository (a fresh temporary database) and, when a DSN
+is given, PostgresRepository: campaign creation, bulk lead insert (COPY on PostgreSQL),
+contact reuse across campaigns, counts, streamed export, suppression lookups, dispatch
+selection, token updates and upload idempotency. Each step's result is compared with the
+expected value, then --leads rows are bulk-inserted and exported to time both paths.
+
+    python benchmarks/storage_backends.py --leads 50000
+    python benchmarks/storage_backends.py --postgres-dsn postgresql://localhost/campaigns_test
+
+The PostgreSQL database should be a scratch one: its tables are created if missing and
+the rows this script adds are left in place.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_data import make_person  # noqa: E402
+
+
+def make_leads(test_upload, rng, start, count):
+    leads = []
+    for i in range(count):
+        lead = test_upload.normalize_api_lead(make_person(rng, start + i))
+        if lead is not None:
+            leads.append(lead)
+    return leads
+
+
+def check(results, name, actual, expected):
+    ok = actual == expected
+    results.append({'check': name, 'ok': ok, 'actual': repr(actual)[:200], 'expected': repr(expected)[:200]})
+    if not ok:
+        print(f"  ✗ {name}: got {actual!r}, expected {expected!r}")
+
+
+def conformance(test_upload, repo, seed):
+    """Run the shared checks; returns a list of {"check", "ok", ...}"""
+    results = []
+    rng = random.Random(seed)
+    tag = f"{seed}-{time.time_ns()}"
+    leads = make_leads(test_upload, rng, 40_000_000 + seed * 1000, 50)
+
+    first = repo.create_campaign(f"Conformance A {tag}", 'storage check')
+    repo.insert_leads(first, leads[:30])
+    repo.rename_campaign(first, f"Conformance A {tag} (renamed)", 'storage check')
+    repo.commit()
+    check(results, 'campaign_created', repo.get_campaign(first)['name'], f"Conformance A {tag} (renamed)")
+    check(results, 'lead_counts', tuple(repo.lead_counts(first)), (30, 0, 30))
+
+    # Overlapping emails reuse contacts; a blank field on the existing contact is filled in
+    second = repo.create_campaign(f"Conformance B {tag}", '')
+    overlap = [dict(lead) for lead in leads[20:50]]
+    for lead in overlap:
+        lead['unsubscribe_token'] = test_upload.generate_unsubscribe_token()
+    overlap[-1]['unsubscribe_status'] = 'unsubscribed'
+    repo.insert_leads(second, overlap)
+    repo.commit()
+    check(results, 'lead_counts_second', tuple(repo.lead_counts(second)), (30, 0, 30))
+
+    exported = list(repo.iter_export_rows(first, 7))
+    check(results, 'export_rows', len(exported), 30)
+    check(results, 'export_order', [row[2] for row in exported], [lead['email'] for lead in leads[:30]])
+
+    keys = [lead['email'].lower() for lead in leads[18:22]] + ['nobody-here@example.invalid']
+    statuses = repo.contact_statuses(keys)
+    check(results, 'contact_statuses_known', sorted(statuses), sorted(keys[:4]))
+    unsubscribed_email = overlap[-1]['email']
+    check(results, 'unsubscribe_sticky',
+          [entry['email'] for entry in repo.find_unsubscribed_emails([unsubscribed_email.upper(), keys[0]])],
+          [unsubscribed_email])
+
+    all_rows = repo.dispatch_leads(second)
+    check(results, 'dispatch_excludes_unsubscribed', len(all_rows), 29)
+    ids = [row[0] for row in all_rows]
+    check(results, 'dispatch_include', [row[0] for row in repo.dispatch_leads(second, [str(i) for i in ids[:3]])], ids[:3])
+    check(results, 'dispatch_exclude', len(repo.dispatch_leads(second, None, [str(i) for i in ids[:3]])), 26)
+
+    repo.set_unsubscribe_tokens([(ids[0], f"tok-{tag}")])
+    repo.commit()
+    check(results, 'token_updated', repo.dispatch_leads(second, [str(ids[0])])[0][10], f"tok-{tag}")
+
+    repo.record_dispatch(second, sent=True)
+    repo.commit()
+    check(results, 'dispatch_recorded', repo.get_campaign(second)['processing_status'], 'sent')
+
+    key = f"key:conformance-{tag}"
+    check(results, 'idempotency_miss', repo.lookup_idempotent_upload(key), None)
+    check(results, 'idempotency_store', repo.store_idempotent_upload(key, first, {'campaign_id': first}), True)
+    repo.commit()
+    check(results, 'idempotency_conflict', repo.store_idempotent_upload(key, second, {'campaign_id': second}), False)
+    repo.rollback()
+    check(results, 'idempotency_hit', repo.lookup_idempotent_upload(key), {'campaign_id': first})
+
+    listed = {campaign['id']: campaign['profile_count'] for campaign in repo.list_available_campaigns()}
+    check(results, 'listing_counts', (listed.get(first), listed.get(second)), (30, 30))
+    return results
+
+
+def bulk_load(test_upload, repo, lead_count, batch_size, fetch_size, seed):
+    rng = random.Random(seed)
+    leads = make_leads(test_upload, rng, 50_000_000 + seed * lead_count, lead_count)
+    campaign_id = repo.create_campaign(f"Bulk load {time.time_ns()}", 'storage benchmark')
+    started = time.perf_counter()
+    for i in range(0, len(leads), batch_size):
+        repo.insert_leads(campaign_id, leads[i:i + batch_size])
+    repo.commit()
+    inserted = time.perf_counter() - started
+    started = time.perf_counter()
+    exported = sum(1 for _ in repo.iter_export_rows(campaign_id, fetch_size))
+    repo.commit()
+    export_s = time.perf_counter() - started
+    return {
+        'leads': len(leads),
+        'insert_s': round(inserted, 3),
+        'insert_leads_per_s': round(len(leads) / inserted) if inserted else None,
+        'export_rows': exported,
+        'export_s': round(export_s, 3),
+        'export_rows_per_s': round(exported / export_s) if export_s else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check both storage backends behave the same and time bulk loads")
+    parser.add_argument('--postgres-dsn', default=os.environ.get('POSTGRES_DSN', ''),
+                        help="Scratch PostgreSQL database (default: $POSTGRES_DSN; skipped when empty)")
+    parser.add_argument('--leads', type=int, default=20000, help="Leads in the bulk-load run")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--fetch-size', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write results as JSON")
+    args = parser.parse_args()
+
+    import test_upload
+    workdir = tempfile.mkdtemp(prefix='campaign-storage-')
+    db_path = os.path.join(workdir, 'storage.db')
+    with contextlib.redirect_stdout(io.StringIO()):
+        test_upload.create_app(DB_PATH=db_path, PURGE_IN_BACKGROUND=False)
+
+    backends = {'sqlite': lambda: test_upload.SQLiteRepository(sqlite3.connect(db_path))}
+    if args.postgres_dsn:
+        test_upload.init_postgres(args.postgres_dsn)
+        backends['postgres'] = lambda: test_upload.PostgresRepository(test_upload.postgres_pool.connect(args.postgres_dsn))
+    else:
+        print("ℹ️ No --postgres-dsn given: checking SQLite only")
+
+    results = {'leads': args.leads, 'batch_size': args.batch_size, 'backends': {}}
+    failed = False
+    for name, make_repo in backends.items():
+        repo = make_repo()
+        checks = conformance(test_upload, repo, args.seed)
+        passed = sum(c['ok'] for c in checks)
+        failed |= passed != len(checks)
+        load = bulk_load(test_upload, repo, args.leads, args.batch_size, args.fetch_size, args.seed)
+        repo.conn.close()
+        results['backends'][name] = {'checks': checks, 'bulk_load': load}
+        print(f"{name:<9} checks {passed}/{len(checks)}  insert {load['insert_leads_per_s']:>8} leads/s  "
+              f"export {load['export_rows_per_s']:>8} rows/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
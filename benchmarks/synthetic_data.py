@@ -0,0 +1,152 @@
+"""
+Synthetic lead database generator.
+
+Builds a leads database with the application's current schema (via init_db)
+and fills it with reproducible fake campaigns and leads.
+
+    python benchmarks/synthetic_data.py bench.db --campaigns 50 --leads-per-campaign 2000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import secrets
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIRST_NAMES = ['John', 'Jane', 'Alex', 'Maria', 'Wei', 'Priya', 'Omar', 'Sofia', 'Liam', 'Emma',
+               'Noah', 'Olivia', 'Lucas', 'Mia', 'Ethan', 'Ava', 'Mateo', 'Chloe', 'Arjun', 'Yuki']
+LAST_NAMES = ['Smith', 'Doe', 'Garcia', 'Chen', 'Patel', 'Kim', 'Nguyen', 'Muller', 'Rossi', 'Silva',
+              'Brown', 'Wilson', 'Khan', 'Lopez', 'Novak', 'Sato', 'Okafor', 'Larsen', 'Dubois', 'Cohen']
+COMPANIES = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Stark', 'Wayne', 'Wonka', 'Tyrell', 'Cyberdyne',
+             'Soylent', 'Vandelay', 'Aperture', 'Monarch', 'Oscorp', 'Massive', 'Gringotts', 'Pied Piper']
+TITLES = ['CEO', 'CTO', 'VP Sales', 'Head of Marketing', 'Engineer', 'Founder', 'Product Manager', 'Director']
+SOURCES = ['CSV Import', 'API Import', 'Manual', 'LinkedIn', 'Apollo']
+
+
+def make_person(rng, index):
+    first = rng.choice(FIRST_NAMES)
+    last = rng.choice(LAST_NAMES)
+    company = rng.choice(COMPANIES)
+    domain = f"{company.lower().replace(' ', '')}{index % 97}.com"
+    return {
+        'first_name': first,
+        'last_name': last,
+        'email': f"{first.lower()}.{last.lower()}{index}@{domain}",
+        'company': company,
+        'domain': domain,
+        'label': rng.choice(TITLES),
+        'description': f"{rng.choice(TITLES)} at {company}, interested in {rng.choice(['growth', 'automation', 'data', 'security'])}",
+    }
+
+
+def generate_database(path, campaigns=20, leads_per_campaign=500, duplicate_rate=0.1,
+                      unsubscribe_rate=0.02, merged_rate=0.2, sent_rate=0.3, seed=42):
+    """
+    Create (or overwrite) a database at `path` with synthetic data.
+    duplicate_rate is the share of leads that reuse an email already used elsewhere.
+    Returns a summary dict.
+    """
+    import test_upload
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        test_upload.init_db(path)
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    people = []
+    person_index = 0
+    total_leads = 0
+    now = datetime.now()
+
+    for campaign_number in range(campaigns):
+        is_merged = 1 if rng.random() < merged_rate else 0
+        sent = rng.random() < sent_rate
+        cursor.execute("""
+            INSERT INTO campaigns (name, description, status, created_at, is_merged,
+                                   processing_status, last_processed_at, process_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            f"Synthetic Campaign {campaign_number + 1}",
+            f"Generated with seed {seed}",
+            'approved' if sent or rng.random() < 0.3 else 'pending',
+            now - timedelta(days=campaigns - campaign_number),
+            is_merged,
+            'sent' if sent else 'not_sent',
+            now - timedelta(days=rng.randint(0, 400)) if sent else None,
+            1 if sent else 0,
+        ))
+        campaign_id = cursor.lastrowid
+
+        rows = []
+        for _ in range(leads_per_campaign):
+            if people and rng.random() < duplicate_rate:
+                person = rng.choice(people)
+            else:
+                person = make_person(rng, person_index)
+                person_index += 1
+                people.append(person)
+
+            unsubscribed = rng.random() < unsubscribe_rate
+            rows.append((
+                person['first_name'], person['last_name'], person['email'], person['domain'],
+                rng.randint(1, 10), person['company'], person['label'], person['description'],
+                rng.choice(SOURCES), campaign_id, 0 if unsubscribed else 1, now,
+                'unsubscribed' if unsubscribed else 'subscribed',
+                secrets.token_urlsafe(32), 'subscribed',
+            ))
+
+        cursor.executemany("""
+            INSERT INTO leads (first_name, last_name, email, domain, score, company, label, description,
+                               source, campaign_id, is_active, created_at, unsubscribe_status,
+                               unsubscribe_token, email_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        total_leads += len(rows)
+        conn.commit()
+
+    conn.close()
+    return {
+        'path': path,
+        'campaigns': campaigns,
+        'leads': total_leads,
+        'distinct_people': len(people),
+        'seed': seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic leads database")
+    parser.add_argument('path', help="Output SQLite file (overwritten)")
+    parser.add_argument('--campaigns', type=int, default=20)
+    parser.add_argument('--leads-per-campaign', type=int, default=500)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--unsubscribe-rate', type=float, default=0.02)
+    parser.add_argument('--merged-rate', type=float, default=0.2)
+    parser.add_argument('--sent-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    summary = generate_database(
+        args.path,
+        campaigns=args.campaigns,
+        leads_per_campaign=args.leads_per_campaign,
+        duplicate_rate=args.duplicate_rate,
+        unsubscribe_rate=args.unsubscribe_rate,
+        merged_rate=args.merged_rate,
+        sent_rate=args.sent_rate,
+        seed=args.seed,
+    )
+    print(f"✅ Generated {summary['leads']} leads in {summary['campaigns']} campaigns -> {summary['path']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Local stand-in for the n8n webhook.
+
+Accepts POSTs on any path, optionally sleeps and/or fails a share of requests,
+and keeps simple counters. With --max-rps / --max-leads-per-second it behaves like a
+rate-limited endpoint: requests over capacity get 429 with Retry-After. Run standalone or
+start in-process with start_stub().
+
+    python benchmarks/webhook_stub.py --port 5678 --delay 0.05
+    python benchmarks/webhook_stub.py --max-rps 4 --max-leads-per-second 1500
+"""
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class WebhookStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.throttled = 0
+        self.leads_received = 0
+        self.bytes_received = 0
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'failures': self.failures,
+                'throttled': self.throttled,
+                'leads_received': self.leads_received,
+                'bytes_received': self.bytes_received,
+            }
+
+
+class Capacity:
+    """Token buckets for requests/s and leads/s (one second of burst); None means unlimited"""
+
+    def __init__(self, max_rps=None, max_leads_per_second=None):
+        self.lock = threading.Lock()
+        self.limits = {'requests': max_rps, 'leads': max_leads_per_second}
+        self.tokens = {name: limit for name, limit in self.limits.items() if limit}
+        self.updated = time.monotonic()
+
+    def admit(self, leads):
+        """True if the request fits, else False (nothing is taken)"""
+        cost = {'requests': 1, 'leads': leads}
+        with self.lock:
+            now = time.monotonic()
+            for name in self.tokens:
+                self.tokens[name] = min(self.limits[name], self.tokens[name] + (now - self.updated) * self.limits[name])
+            self.updated = now
+            if any(self.tokens[name] < min(cost[name], self.limits[name]) for name in self.tokens):
+                return False
+            for name in self.tokens:
+                self.tokens[name] -= cost[name]
+            return True
+
+
+def decode_payload(body, headers):
+    """
+    Reference receiver for the app's webhook encodings: returns the payload in the original
+    json shape ({..., "leads": [{...}, ...]}) whatever X-Payload-Format / Content-Encoding was used.
+    """
+    if headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    payload_format = headers.get('X-Payload-Format', 'json')
+    if payload_format == 'json':
+        return json.loads(body)
+    if payload_format == 'ndjson':
+        lines = body.decode('utf-8').splitlines()
+        payload = json.loads(lines[0])
+        leads = [json.loads(line) for line in lines[1:] if line]
+    elif payload_format == 'columnar':
+        payload = json.loads(body)
+        columns = payload.pop('columns')
+        leads = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    else:
+        raise ValueError(f"Unknown payload format {payload_format!r}")
+    template = payload.pop('unsubscribe_url_template', None)
+    if template:
+        for lead in leads:
+            lead['unsubscribe_url'] = template.replace('{token}', lead['unsubscribe_token'])
+    for key in ('format', 'lead_count'):
+        payload.pop(key, None)
+    payload['leads'] = leads
+    return payload
+
+
+def count_leads(body, headers):
+    try:
+        leads = decode_payload(body, headers).get('leads')
+    except (ValueError, AttributeError, KeyError, OSError):
+        return 0
+    return len(leads) if isinstance(leads, list) else 0
+
+
+def make_handler(stats, delay=0.0, fail_rate=0.0, fail_status=503, capacity=None):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            leads = count_leads(body, self.headers)
+            if capacity is not None and not capacity.admit(leads):
+                with stats.lock:
+                    stats.requests += 1
+                    stats.throttled += 1
+                payload = json.dumps({'status': 'rate limited'}).encode()
+                self.send_response(429)
+                self.send_header('Retry-After', '1')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            if delay:
+                time.sleep(delay)
+
+            failed = fail_rate and random.random() < fail_rate
+            with stats.lock:
+                stats.requests += 1
+                stats.bytes_received += len(body)
+                if failed:
+                    stats.failures += 1
+                else:
+                    stats.leads_received += leads
+
+            status = fail_status if failed else 200
+            payload = json.dumps({'received': len(body), 'status': 'error' if failed else 'ok'}).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            payload = json.dumps(stats.as_dict()).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookHandler
+
+
+class StubServer(ThreadingHTTPServer):
+    # Concurrency benchmarks open hundreds of connections at once
+    request_queue_size = 1024
+
+
+def start_stub(host='127.0.0.1', port=0, delay=0.0, fail_rate=0.0, fail_status=503,
+               max_rps=None, max_leads_per_second=None):
+    """Start the stub on a background thread. Returns (server, url, stats)."""
+    stats = WebhookStats()
+    capacity = Capacity(max_rps, max_leads_per_second) if max_rps or max_leads_per_second else None
+    server = StubServer((host, port), make_handler(stats, delay, fail_rate, fail_status, capacity))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://{host}:{server.server_address[1]}/webhook/stub"
+    return server, url, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local n8n webhook stub")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5678)
+    parser.add_argument('--delay', type=float, default=0.0, help="Seconds to sleep per request")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Share of requests answered with --fail-status")
+    parser.add_argument('--fail-status', type=int, default=503)
+    parser.add_argument('--max-rps', type=float, help="Answer 429 above this many requests per second")
+    parser.add_argument('--max-leads-per-second', type=float, help="Answer 429 above this many leads per second")
+    args = parser.parse_args()
+
+    server, url, _ = start_stub(args.host, args.port, args.delay, args.fail_rate, args.fail_status,
+                                args.max_rps, args.max_leads_per_second)
+    print(f"✅ Webhook stub listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,2325 @@
-from flask import Flask, request, jsonify, render_template, g, redirect, url_for, flash
+from flask import Flask, request, jsonify, render_template, g, redirect, url_for, flash, session, has_request_context, abort
 import sqlite3
-import requests
-import csv
+import atexit
+import codecs
+import contextlib
 import io
+import json
+import hashlib
+import logging
+import math
+import mmap
+import random
+import re
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 import os
-from datetime import datetime
+import pickle
+import tempfile
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 import uuid
 import secrets
+import shutil
+import zlib
 
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-here'  # Change this to a random secret key
-DB_PATH = "leads.db"
+try:
+    import brotli  # Optional: enables "br" Content-Encoding when installed
+except ImportError:
+    brotli = None
+
+class Config:
+    """
+    Application settings. Each can be overridden by an environment variable of the same
+    name or by keyword arguments to create_app().
+    """
+    DB_PATH = os.environ.get('DB_PATH', 'leads.db')
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here')  # Change this to a random secret key
+
+    # File uploads
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB max file size
+    # /upload is parsed as a stream, so n8n callbacks may be much larger than form uploads
+    MAX_UPLOAD_JSON_BYTES = int(os.environ.get('MAX_UPLOAD_JSON_BYTES', 512 * 1024 * 1024))
+    UPLOAD_BATCH_SIZE = int(os.environ.get('UPLOAD_BATCH_SIZE', 500))
+    # Parsed leads are spooled until the body has been read (memory first, then a temp file in UPLOAD_FOLDER)
+    UPLOAD_SPOOL_MEMORY_BYTES = int(os.environ.get('UPLOAD_SPOOL_MEMORY_BYTES', 8 * 1024 * 1024))
+    # How long a repeated /upload (same Idempotency-Key, or same name + leads) returns the original campaign
+    IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+    # Resumable chunked uploads (see CHUNKED UPLOADS) for CSV files too large for one request:
+    # parts are kept under UPLOAD_FOLDER until the upload is completed or left idle for the TTL
+    # (also how long the staging campaign of an import that died is kept before it is purged)
+    UPLOAD_PART_SIZE = int(os.environ.get('UPLOAD_PART_SIZE', 8 * 1024 * 1024))
+    UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 4 * 1024 ** 3))
+    UPLOAD_SESSION_TTL_HOURS = float(os.environ.get('UPLOAD_SESSION_TTL_HOURS', 24))
+
+    # n8n webhook that receives approved campaigns (override for staging or local stubs)
+    N8N_WEBHOOK_URL = os.environ.get(
+        'N8N_WEBHOOK_URL',
+        "https://dory-logical-briefly.ngrok-free.app/webhook-test/f7ecb2fe-1f9c-4920-be0d-2cd6bbc93561"
+    )
+    WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', 60))
+
+    # Dispatch scheduler (see DISPATCH SCHEDULER): sends are queued and delivered in chunks of
+    # DISPATCH_CHUNK_SIZE leads, paced per destination by token buckets and slowed down on
+    # 429/5xx. DISPATCH_SCHEDULER=0 posts each campaign in one request from the view, as before.
+    DISPATCH_SCHEDULER = os.environ.get('DISPATCH_SCHEDULER', '1') == '1'
+    DISPATCH_CHUNK_SIZE = int(os.environ.get('DISPATCH_CHUNK_SIZE', 500))           # 0 = whole campaign per request
+    DISPATCH_REQUESTS_PER_SECOND = float(os.environ.get('DISPATCH_REQUESTS_PER_SECOND', 5))  # 0 = unlimited
+    DISPATCH_LEADS_PER_SECOND = float(os.environ.get('DISPATCH_LEADS_PER_SECOND', 1000))     # 0 = unlimited
+    DISPATCH_BURST_SECONDS = float(os.environ.get('DISPATCH_BURST_SECONDS', 1))     # bucket size, in seconds of rate
+    DISPATCH_MAX_IN_FLIGHT = int(os.environ.get('DISPATCH_MAX_IN_FLIGHT', 2))       # concurrent requests per destination
+    DISPATCH_WORKERS = int(os.environ.get('DISPATCH_WORKERS', 8))
+    DISPATCH_MAX_ATTEMPTS = int(os.environ.get('DISPATCH_MAX_ATTEMPTS', 6))         # per chunk, on 429/5xx/network errors
+    DISPATCH_BACKOFF_SECONDS = float(os.environ.get('DISPATCH_BACKOFF_SECONDS', 1))
+    DISPATCH_MAX_BACKOFF_SECONDS = float(os.environ.get('DISPATCH_MAX_BACKOFF_SECONDS', 60))
+    DISPATCH_MIN_RATE_FACTOR = float(os.environ.get('DISPATCH_MIN_RATE_FACTOR', 0.05))  # floor for the adaptive slowdown
+    DISPATCH_DEFAULT_PRIORITY = int(os.environ.get('DISPATCH_DEFAULT_PRIORITY', 5))  # 0 (first) .. 9 (last)
+    # Per-destination overrides, keyed by webhook URL: {"requests_per_second": .., "leads_per_second": ..}
+    DISPATCH_DESTINATION_LIMITS = {}
+    # Webhook body (see WEBHOOK PAYLOAD ENCODINGS): 'json' (default, unchanged), 'ndjson' or
+    # 'columnar'; WEBHOOK_CONTENT_ENCODING=gzip compresses it. Per-URL overrides as
+    # {"format": .., "content_encoding": ..}. A 415 reply falls back to plain json.
+    WEBHOOK_PAYLOAD_FORMAT = os.environ.get('WEBHOOK_PAYLOAD_FORMAT', 'json')
+    WEBHOOK_CONTENT_ENCODING = os.environ.get('WEBHOOK_CONTENT_ENCODING', 'identity')
+    WEBHOOK_DESTINATION_ENCODINGS = {}
+
+    # Delivery callbacks (see DELIVERY EVENTS): n8n POSTs per-lead events to /api/delivery_events;
+    # a background pass every DELIVERY_ROLLUP_INTERVAL_SECONDS (0: one batch on the ingesting
+    # shard after each ingest)
+    # folds them into per-lead and per-campaign rollups. Raw events are kept for the retention.
+    DELIVERY_EVENT_BATCH_SIZE = int(os.environ.get('DELIVERY_EVENT_BATCH_SIZE', 1000))    # rows per executemany
+    DELIVERY_ROLLUP_BATCH_SIZE = int(os.environ.get('DELIVERY_ROLLUP_BATCH_SIZE', 5000))  # events per transaction
+    DELIVERY_ROLLUP_INTERVAL_SECONDS = float(os.environ.get('DELIVERY_ROLLUP_INTERVAL_SECONDS', 10))
+    DELIVERY_EVENT_RETENTION_DAYS = int(os.environ.get('DELIVERY_EVENT_RETENTION_DAYS', 30))  # 0 keeps them forever
+
+    # Audit log (see AUDIT LOG): mutations are buffered in memory and written in batches.
+    # AUDIT_ACTOR_HEADER names a header set by a trusted auth proxy (e.g. X-Forwarded-User).
+    AUDIT_LOG_ENABLED = os.environ.get('AUDIT_LOG_ENABLED', '1') == '1'
+    AUDIT_FLUSH_INTERVAL_SECONDS = float(os.environ.get('AUDIT_FLUSH_INTERVAL_SECONDS', 0.5))
+    AUDIT_FLUSH_BATCH_SIZE = int(os.environ.get('AUDIT_FLUSH_BATCH_SIZE', 1000))   # flush early at this many events
+    AUDIT_MAX_BUFFERED = int(os.environ.get('AUDIT_MAX_BUFFERED', 100000))         # kept while flushes are failing
+    AUDIT_ACTOR_HEADER = os.environ.get('AUDIT_ACTOR_HEADER', '')
+
+    # Imports: rejected rows (invalid email, missing first name, ...) are kept as a CSV error report
+    IMPORT_REPORT_MAX_ROWS = int(os.environ.get('IMPORT_REPORT_MAX_ROWS', 10000))  # per import; all are counted
+    IMPORT_REPORT_TTL_DAYS = int(os.environ.get('IMPORT_REPORT_TTL_DAYS', 7))
+
+    # Deleted campaigns are hidden at once and purged by a background thread in small
+    # transactions, so unsubscribe clicks and uploads are not blocked behind one large delete
+    PURGE_IN_BACKGROUND = os.environ.get('PURGE_IN_BACKGROUND', '1') == '1'
+    PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 500))        # memberships per transaction
+    PURGE_PAUSE_SECONDS = float(os.environ.get('PURGE_PAUSE_SECONDS', 0.05))  # gap between batches for other writers
+    PURGE_INTERVAL_SECONDS = float(os.environ.get('PURGE_INTERVAL_SECONDS', 300))
+    VACUUM_PAGES_PER_STEP = int(os.environ.get('VACUUM_PAGES_PER_STEP', 1000))
+
+    # Multi-tenant sharding: with CATALOG_DB_PATH set, each registered tenant's data lives in its
+    # own SQLite file under SHARD_DIR (one writer lock per tenant). Requests pick a tenant with
+    # the X-Tenant-ID header or ?tenant=; without one they use DB_PATH as before.
+    CATALOG_DB_PATH = os.environ.get('CATALOG_DB_PATH', '')
+    SHARD_DIR = os.environ.get('SHARD_DIR', 'shards')
+    SHARD_POOL_SIZE = int(os.environ.get('SHARD_POOL_SIZE', 8))        # idle connections kept per shard
+    SHARD_FANOUT_THREADS = int(os.environ.get('SHARD_FANOUT_THREADS', 8))
+    SHARD_GLOBAL_SUPPRESSION = os.environ.get('SHARD_GLOBAL_SUPPRESSION', '0') == '1'  # unsubscribes apply across tenants
+
+    # Storage backend for the repository layer (see STORAGE BACKENDS): 'sqlite' (DB_PATH / shards)
+    # or 'postgres' (POSTGRES_DSN, shared by every app node). Needs psycopg 3 for postgres; a
+    # postgres node serves the upload, dispatch, export and unsubscribe routes only (POSTGRES_ENDPOINTS).
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sqlite')
+    POSTGRES_DSN = os.environ.get('POSTGRES_DSN', '')
+    POSTGRES_POOL_SIZE = int(os.environ.get('POSTGRES_POOL_SIZE', 8))   # idle connections kept per node
+    EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', 2000))  # rows per round trip when streaming exports
+
+    # Archival: sent campaigns untouched for ARCHIVE_AFTER_DAYS move to a cold SQLite store
+    # (default: <DB_PATH stem>_archive.db) and come back when opened. 0 disables archiving.
+    ARCHIVE_DB_PATH = os.environ.get('ARCHIVE_DB_PATH', '')
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+
+    # Duplicate detection: email canonicalization rules and fuzzy-match thresholds. The two
+    # folding rules are opt-in: contacts and the unsubscribe list key on LOWER(TRIM(email)),
+    # so with them on, upload dedup treats more addresses as one person than suppression does.
+    DEDUP_RULES = {
+        'strip_plus_tags': os.environ.get('DEDUP_STRIP_PLUS_TAGS', '0') == '1',  # john+news@acme.com -> john@acme.com
+        'fold_gmail_dots': os.environ.get('DEDUP_FOLD_GMAIL_DOTS', '0') == '1',  # j.o.h.n@googlemail.com -> john@gmail.com
+        'fuzzy_matching': True,       # name + company + domain similarity within blocks
+        'report_threshold': 0.80,     # fuzzy pairs at or above this are reported as clusters
+        'max_block_size': 500,        # larger blocks are skipped to keep comparisons near-linear
+        'max_comparisons': 200000,    # fuzzy pair budget per call; smallest blocks are scored first
+    }
+
+    # Instrumentation: metrics are cheap counters; SLOW_REQUEST_MS > 0 enables the slow-request log
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '0'))
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 
-# Configuration for file uploads
-UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'csv'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-# Create upload folder if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Routes are registered on this module-level app; create_app() configures it for serving
+app = Flask(__name__)
+app.config.from_object(Config)
+logger = logging.getLogger('campaign_review')
+
+def create_app(config=None, **overrides):
+    """
+    Configure the app for serving: settings, logging, upload folder and pending migrations.
+    Import-time work is kept to defining routes, so cold start is the Flask import plus one
+    PRAGMA user_version read. WSGI servers can load "test_upload:create_app()".
+    """
+    if config is not None:
+        app.config.from_object(config)
+    app.config.update(overrides)
+    logging.basicConfig(
+        level=app.config['LOG_LEVEL'].upper(),
+        format='%(asctime)s %(levelname)s %(name)s %(message)s'
+    )
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    for url in (None, *app.config['WEBHOOK_DESTINATION_ENCODINGS']):
+        webhook_encoding(url)  # fail at startup on a misspelt format
+    init_db()
+    if app.config['STORAGE_BACKEND'] == 'postgres':
+        if app.config['CATALOG_DB_PATH']:
+            raise RuntimeError("STORAGE_BACKEND=postgres keeps every tenant in one database; unset CATALOG_DB_PATH")
+        init_postgres(app.config['POSTGRES_DSN'])
+    for tenant, db_path in shard_catalog.all_shards().items():
+        if tenant != DEFAULT_TENANT:
+            init_db(db_path)
+    if app.config['PURGE_IN_BACKGROUND']:
+        campaign_purger.start()
+    if app.config['DELIVERY_ROLLUP_INTERVAL_SECONDS'] > 0:
+        delivery_rollup.start()
+    return app
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# --- INSTRUMENTATION: METRICS REGISTRY ---
+# Upper bounds (seconds) shared by all latency histograms
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+    __slots__ = ('bucket_counts', 'count', 'total')
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+
+class MetricsRegistry:
+    """Thread-safe in-process counters and histograms, rendered for /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram()
+            histogram.observe(value)
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {self.help.get(name, name)}")
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{self._format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {self.help.get(name, name)}")
+                    lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._format_labels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {histogram.total:.6f}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+metrics.help.update({
+    'http_request_duration_seconds': 'Request latency by endpoint, method and status',
+    'sql_statements_total': 'SQL statements executed (including trigger statements) by endpoint',
+    'sql_request_duration_seconds': 'Total time spent in SQL per request by endpoint',
+    'sql_rows_read_total': 'Rows fetched from SQLite by endpoint',
+    'sql_rows_written_total': 'Rows inserted, updated or deleted by endpoint',
+    'webhook_request_duration_seconds': 'Outbound webhook latency by outcome',
+    'webhook_request_bytes_total': 'Webhook request body bytes by payload format and content encoding',
+    'dispatch_chunks_total': 'Scheduled webhook requests by outcome (sent, retried, failed)',
+    'delivery_events_received_total': 'Delivery callback events by outcome (accepted, duplicate, rejected)',
+    'delivery_events_rolled_up_total': 'Delivery events folded into the per-lead and per-campaign rollups',
+    'audit_events_total': 'Audit log events recorded by action',
+    'audit_events_dropped_total': 'Audit log events dropped because the buffer was full while flushes failed',
+    'chunked_upload_parts_total': 'Chunked upload parts received by outcome (stored, checksum_mismatch)',
+    'chunked_upload_bytes_total': 'Bytes of chunked upload parts stored',
+    'audit_flush_duration_seconds': 'Time to write one batch of audit events to a shard',
+    'sqlite_lock_errors_total': 'Requests answered 503 database_locked after a SQLite lock timeout, by endpoint',
+})
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that accumulates SQL time and rows read into the current request's stats"""
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            _record_sql_time(time.perf_counter() - started)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            _record_sql_time(time.perf_counter() - started)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            _record_rows_read(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        _record_rows_read(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _record_rows_read(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        _record_rows_read(1)
+        return row
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+def _request_stats():
+    return g.get('sql_stats') if has_request_context() else None
+
+def _record_sql_time(elapsed):
+    stats = _request_stats()
+    if stats is not None:
+        stats['time'] += elapsed
+
+def _record_rows_read(count):
+    stats = _request_stats()
+    if stats is not None:
+        stats['rows_read'] += count
+
+def _trace_sql(statement):
+    """sqlite3 trace callback: called once per executed statement, trigger bodies included"""
+    stats = _request_stats()
+    if stats is not None:
+        stats['count'] += 1
+        if stats['statements'] is not None:
+            stats['statements'].append(statement[:500])
+
+# --- SHARDING: TENANT CATALOG, CONNECTION POOLS AND FAN-OUT ---
+DEFAULT_TENANT = 'default'
+TENANT_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    tenant TEXT PRIMARY KEY,
+    db_path TEXT NOT NULL UNIQUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+class ShardCatalog:
+    """Tenant -> shard file. The default tenant is DB_PATH; others are rows in the catalog DB."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cache = {}
+
+    @property
+    def enabled(self):
+        return bool(app.config.get('CATALOG_DB_PATH'))
+
+    def _connect(self):
+        conn = sqlite3.connect(app.config['CATALOG_DB_PATH'], timeout=30)
+        conn.executescript(CATALOG_SCHEMA)
+        return conn
+
+    def resolve(self, tenant):
+        """Shard path for a tenant, or None if it isn't registered"""
+        if tenant == DEFAULT_TENANT:
+            return app.config['DB_PATH']
+        if not self.enabled:
+            return None
+        path = self.cache.get(tenant)
+        if path is None:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT db_path FROM shards WHERE tenant = ?", (tenant,)).fetchone()
+            finally:
+                conn.close()
+            if row:
+                path = self.cache[tenant] = row[0]
+        return path
+
+    def all_shards(self):
+        """{tenant: path} for every shard, default first"""
+        shards = {DEFAULT_TENANT: app.config['DB_PATH']}
+        if self.enabled:
+            conn = self._connect()
+            try:
+                shards.update(conn.execute("SELECT tenant, db_path FROM shards ORDER BY tenant").fetchall())
+            finally:
+                conn.close()
+        return shards
+
+    def register(self, tenant):
+        """Create (and migrate) a shard for a new tenant; returns (path, created)"""
+        if not self.enabled:
+            raise ValueError("Sharding is disabled (CATALOG_DB_PATH is not set)")
+        if not TENANT_NAME.match(tenant) or tenant == DEFAULT_TENANT:
+            raise ValueError(f"Invalid tenant name: {tenant!r}")
+        with self.lock:
+            existing = self.resolve(tenant)
+            if existing:
+                return existing, False
+            os.makedirs(app.config['SHARD_DIR'], exist_ok=True)
+            path = os.path.join(app.config['SHARD_DIR'], f"{tenant}.db")
+            init_db(path)
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("INSERT INTO shards (tenant, db_path) VALUES (?, ?)", (tenant, path))
+            finally:
+                conn.close()
+            self.cache[tenant] = path
+            return path, True
+
+class ConnectionPool:
+    """Idle SQLite connections per shard file, reused across requests instead of reconnecting"""
+    size_setting = 'SHARD_POOL_SIZE'  # idle connections kept per key
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def acquire(self, db_path):
+        with self.lock:
+            stack = self.idle.get(db_path)
+            if stack:
+                return stack.pop()
+        return self.connect(db_path)
+
+    def connect(self, db_path):
+        if app.config.get('METRICS_ENABLED'):
+            conn = sqlite3.connect(db_path, factory=InstrumentedConnection, check_same_thread=False)
+            conn.set_trace_callback(_trace_sql)
+        else:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def reset(self, conn):
+        """Roll back anything the last user left open; False if the connection is unusable"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def release(self, db_path, conn):
+        if not self.reset(conn):
+            conn.close()
+            return
+        with self.lock:
+            stack = self.idle.setdefault(db_path, [])
+            if len(stack) < app.config[self.size_setting]:
+                stack.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for stack in idle.values():
+            for conn in stack:
+                conn.close()
+
+shard_catalog = ShardCatalog()
+connection_pool = ConnectionPool()
+_fanout_executor = None
+_fanout_lock = threading.Lock()
+
+def current_tenant():
+    """Tenant for this request: X-Tenant-ID header, then ?tenant= (remembered in the session for pages)"""
+    tenant = request.headers.get('X-Tenant-ID')
+    if tenant:
+        return tenant
+    tenant = request.args.get('tenant')
+    if tenant:
+        session['tenant'] = tenant
+        return tenant
+    return session.get('tenant', DEFAULT_TENANT)
+
+def build_unsubscribe_url(base_url, token):
+    """Unsubscribe links carry the tenant so they resolve to the right shard"""
+    tenant = g.get('tenant', DEFAULT_TENANT)
+    suffix = f"?tenant={tenant}" if tenant != DEFAULT_TENANT else ''
+    return f"{base_url}/unsubscribe/{token}{suffix}"
+
+def current_shard_path():
+    if not has_request_context():
+        return app.config['DB_PATH']
+    if 'shard_path' not in g:
+        g.tenant = current_tenant()
+        path = shard_catalog.resolve(g.tenant)
+        if path is None:
+            abort(404, description=f"Unknown tenant: {g.tenant}")
+        g.shard_path = path
+    return g.shard_path
+
+@app.before_request
+def route_to_shard():
+    current_shard_path()
+
+def fan_out(func):
+    """
+    Run func(cursor) against every shard in parallel, each on a pooled connection.
+    Returns {tenant: result}. With sharding disabled this is just the default shard.
+    """
+    global _fanout_executor
+    shards = shard_catalog.all_shards()
+
+    def run(item):
+        tenant, db_path = item
+        conn = connection_pool.acquire(db_path)
+        try:
+            return tenant, func(conn.cursor())
+        finally:
+            connection_pool.release(db_path, conn)
+
+    if len(shards) == 1:
+        return dict([run(next(iter(shards.items())))])
+    with _fanout_lock:
+        if _fanout_executor is None:
+            _fanout_executor = ThreadPoolExecutor(max_workers=app.config['SHARD_FANOUT_THREADS'],
+                                                  thread_name_prefix='shard-fanout')
+    return dict(_fanout_executor.map(run, shards.items()))
+
+@app.route('/api/tenants', methods=['GET', 'POST'])
+def tenants():
+    """List shards, or register a tenant ({"tenant": "acme"}) and create its shard"""
+    if request.method == 'GET':
+        return jsonify({"sharding": shard_catalog.enabled,
+                        "tenants": [{"tenant": t, "db_path": p} for t, p in shard_catalog.all_shards().items()]})
+    tenant = str((request.get_json(silent=True) or {}).get('tenant', '')).strip()
+    try:
+        path, created = shard_catalog.register(tenant)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if created:
+        logger.info("tenant_registered tenant=%s db_path=%s", tenant, path)
+    return jsonify({"status": "success", "tenant": tenant, "db_path": path, "created": created}), 201 if created else 200
+
 # --- DB CONNECTION ---
 def get_db():
     if not hasattr(g, '_database'):
-        g._database = sqlite3.connect(DB_PATH)
+        if app.config['STORAGE_BACKEND'] == 'postgres' and has_request_context():
+            # Every POSTGRES_ENDPOINTS route must stay on the repository: fail instead of splitting the data
+            raise RuntimeError(f"{request.endpoint} reached SQLite on a STORAGE_BACKEND=postgres node")
+        g._db_path = current_shard_path()
+        g._database = connection_pool.acquire(g._db_path)
+        # Pooled connections keep their lifetime total; metrics want this request's writes
+        g._db_changes_start = g._database.total_changes
     return g._database
 
+@app.before_request
+def start_request_metrics():
+    if not app.config.get('METRICS_ENABLED'):
+        return
+    g.request_started = time.perf_counter()
+    g.sql_stats = {
+        'count': 0,
+        'time': 0.0,
+        'rows_read': 0,
+        # Statement text is only kept when the slow-request log is on
+        'statements': [] if app.config.get('SLOW_REQUEST_MS') else None,
+    }
+
+@app.after_request
+def capture_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request_metrics(exception):
+    # Popped: a stream_with_context body tears the request down a second time when it ends
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = g.sql_stats
+    endpoint = request.endpoint or 'unmatched'
+    status = g.get('response_status', 500)
+
+    db = g.get('_database')
+    rows_written = db.total_changes - g.get('_db_changes_start', 0) if db is not None else 0
+
+    metrics.observe('http_request_duration_seconds',
+                    (('endpoint', endpoint), ('method', request.method), ('status', status)), elapsed)
+    labels = (('endpoint', endpoint),)
+    metrics.inc('sql_statements_total', labels, stats['count'])
+    metrics.observe('sql_request_duration_seconds', labels, stats['time'])
+    metrics.inc('sql_rows_read_total', labels, stats['rows_read'])
+    metrics.inc('sql_rows_written_total', labels, rows_written)
+
+    slow_ms = app.config.get('SLOW_REQUEST_MS')
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        logger.warning(
+            "slow_request endpoint=%s method=%s status=%s duration_ms=%.1f sql_count=%d sql_ms=%.1f rows_read=%d rows_written=%d sql=%r",
+            endpoint, request.method, status, elapsed * 1000, stats['count'], stats['time'] * 1000,
+            stats['rows_read'], rows_written, stats['statements']
+        )
+
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    g.pop('repository', None)
+    db = g.pop('_database', None)
     if db:
-        db.close()
+        connection_pool.release(g._db_path, db)
+    pg_connection = g.pop('_pg_connection', None)
+    if pg_connection:
+        postgres_pool.release(app.config['POSTGRES_DSN'], pg_connection)
+
+def detach_request_connections():
+    """
+    Hand the request's pooled connections over to a streamed response body. Flask tears the
+    request down as soon as the view returns, before the body is read, so the teardown must
+    not release a connection the generator is still reading from. Returns the release
+    function to pass to response.call_on_close.
+    """
+    g.pop('repository', None)
+    held = []
+    if '_database' in g:
+        held.append((connection_pool, g._db_path, g.pop('_database')))
+    if '_pg_connection' in g:
+        held.append((postgres_pool, app.config['POSTGRES_DSN'], g.pop('_pg_connection')))
+
+    def release():
+        for pool, key, conn in held:
+            pool.release(key, conn)
+    return release
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus-style metrics exposition"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def is_database_locked(error):
+    """True for SQLite busy/lock timeouts (retryable), as opposed to schema or syntax errors"""
+    message = str(error)
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+@app.errorhandler(sqlite3.OperationalError)
+def handle_database_locked(error):
+    """Lock timeouts answer 503 + {"error": "database_locked"} on every route so clients can retry"""
+    if not is_database_locked(error):
+        raise error
+    endpoint = request.endpoint or 'unmatched'
+    metrics.inc('sqlite_lock_errors_total', (('endpoint', endpoint),))
+    logger.warning("database_locked endpoint=%s error=%s", endpoint, error)
+    response = jsonify({"status": "error", "error": "database_locked", "message": str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+# --- STORAGE BACKENDS: REPOSITORY LAYER (SQLITE / POSTGRESQL) ---
+# Routes that app nodes share with n8n (upload, campaign list, stats, export, unsubscribe
+# checks, dispatch) read and write through a repository instead of raw sqlite3, so
+# STORAGE_BACKEND=postgres lets several nodes serve them from one database. Both
+# repositories expose the same methods and return plain tuples/dicts. The review pages
+# (merges, search, duplicate clusters, archival) still use get_db() directly, so a postgres
+# node only serves POSTGRES_ENDPOINTS.
+DISPATCH_COLUMNS = ('id', 'first_name', 'last_name', 'email', 'company', 'domain', 'score', 'label',
+                    'description', 'source', 'unsubscribe_token')
+EXPORT_COLUMNS = ('first_name', 'last_name', 'email', 'company', 'domain', 'score', 'label', 'description',
+                  'source', 'is_active')
+
+def _dispatch_query(placeholder, included_ids, excluded_ids):
+    """Active, subscribed leads of one campaign, optionally narrowed to/excluding lead ids"""
+    query = f"""
+        SELECT {', '.join(DISPATCH_COLUMNS)}
+        FROM leads
+        WHERE campaign_id = {placeholder}
+        AND is_active = 1
+        -- unsubscribe_status is per contact (any campaign's unsubscribe applies);
+        -- a manual resubscribe via toggle_email_status clears it
+        AND (email_status IS NULL OR email_status = 'subscribed')
+        AND (unsubscribe_status IS NULL OR unsubscribe_status = 'subscribed')
+    """
+    if included_ids:
+        query += f" AND id IN ({','.join(placeholder for _ in included_ids)})"
+    elif excluded_ids:
+        query += f" AND id NOT IN ({','.join(placeholder for _ in excluded_ids)})"
+    return query + " ORDER BY id"
+
+class SQLiteRepository:
+    """Repository over the current shard's SQLite connection (the contacts/campaign_leads schema)"""
+    backend = 'sqlite'
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    # Campaigns
+    def list_available_campaigns(self):
+        return list_available_campaigns(self.conn.cursor())
+
+    def get_campaign(self, campaign_id):
+        """{"id", "name", "status", "processing_status"} of a live campaign, or None"""
+        row = self.conn.execute("""
+            SELECT id, name, status, processing_status FROM campaigns WHERE id = ? AND deleted_at IS NULL
+        """, (campaign_id,)).fetchone()
+        return dict(zip(('id', 'name', 'status', 'processing_status'), row)) if row else None
+
+    def create_campaign(self, name, description, status='pending'):
+        cursor = self.conn.execute("""
+            INSERT INTO campaigns (name, description, status, created_at) VALUES (?, ?, ?, ?)
+        """, (name, description, status, datetime.now()))
+        return cursor.lastrowid
+
+    def rename_campaign(self, campaign_id, name, description):
+        self.conn.execute("UPDATE campaigns SET name = ?, description = ? WHERE id = ?",
+                          (name, description, campaign_id))
+
+    def create_staging_campaign(self, name, description):
+        """A campaign hidden like a deleted one (but skipped by the purger) until publish_staging_campaign"""
+        now = datetime.now()
+        return self.conn.execute("""
+            INSERT INTO campaigns (name, description, status, created_at, deleted_at) VALUES (?, ?, 'importing', ?, ?)
+        """, (name, description, now, now)).lastrowid
+
+    def publish_staging_campaign(self, campaign_id):
+        self.conn.execute("""
+            UPDATE campaigns SET status = 'pending', deleted_at = NULL WHERE id = ? AND status = 'importing'
+        """, (campaign_id,))
+
+    def discard_staging_campaign(self, campaign_id):
+        """Leave a staging campaign to the purger"""
+        self.conn.execute("UPDATE campaigns SET status = 'pending' WHERE id = ? AND status = 'importing'",
+                          (campaign_id,))
+
+    def record_dispatch(self, campaign_id, sent):
+        if sent:
+            self.conn.execute("""
+                UPDATE campaigns
+                SET processing_status = 'sent', last_processed_at = ?, process_count = COALESCE(process_count, 0) + 1
+                WHERE id = ?
+            """, (datetime.now(), campaign_id))
+        else:
+            self.conn.execute("UPDATE campaigns SET processing_status = 'failed' WHERE id = ?", (campaign_id,))
+
+    def mark_dispatch_queued(self, campaign_id):
+        self.conn.execute("UPDATE campaigns SET processing_status = 'queued' WHERE id = ?", (campaign_id,))
+
+    def ensure_hot(self, campaign_ids):
+        return ensure_campaigns_hot(campaign_ids)
+
+    def set_campaign_status(self, campaign_id, status):
+        self.conn.execute("UPDATE campaigns SET status = ? WHERE id = ?", (status, campaign_id))
+
+    def delete_campaign(self, campaign_id):
+        """Hide the campaign until the purger removes it; a retried upload of its leads creates it again"""
+        self.conn.execute("""
+            UPDATE campaigns SET deleted_at = ?, generation = COALESCE(generation, 0) + 1
+            WHERE id = ? AND deleted_at IS NULL
+        """, (datetime.now(), campaign_id))
+        self.conn.execute("DELETE FROM upload_idempotency WHERE campaign_id = ?", (campaign_id,))
+
+    # Leads
+    def insert_leads(self, campaign_id, leads):
+        """Insert normalized leads (see normalize_api_lead) as active members of the campaign"""
+        cursor = self.conn.cursor()
+        now = datetime.now()
+        cursor.executemany("""
+            INSERT INTO leads (campaign_id, first_name, last_name, email, domain, score, company, label,
+                               description, unsubscribe_token, unsubscribe_status, source, is_active, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+        """, [
+            (campaign_id, lead['first_name'], lead['last_name'], lead['email'], lead['domain'],
+             lead['score'], lead['company'], lead['label'], lead['description'],
+             lead['unsubscribe_token'], lead['unsubscribe_status'], lead['source'], now)
+            for lead in leads
+        ])
+        sketch_add_leads(cursor, campaign_id, [lead['email'] for lead in leads])
+        bump_campaign_generations(cursor, [campaign_id])
+
+    def lead_counts(self, campaign_id):
+        """(active, inactive, total) memberships of a campaign"""
+        return self.conn.execute("""
+            SELECT COALESCE(SUM(is_active = 1), 0), COALESCE(SUM(is_active = 0), 0), COUNT(*)
+            FROM campaign_leads WHERE campaign_id = ?
+        """, (campaign_id,)).fetchone()
+
+    def iter_export_rows(self, campaign_id, fetch_size):
+        """EXPORT_COLUMNS tuples in lead id order, fetched fetch_size at a time"""
+        cursor = self.conn.execute(f"""
+            SELECT {', '.join(EXPORT_COLUMNS)} FROM leads WHERE campaign_id = ? ORDER BY id
+        """, (campaign_id,))
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                return
+            yield from rows
+
+    # Suppression
+    def contact_statuses(self, email_keys):
+        """{email_key: (latest membership email_status, contact unsubscribe_status)} for known contacts"""
+        statuses = {}
+        email_keys = list(email_keys)
+        for i in range(0, len(email_keys), 500):
+            chunk = email_keys[i:i + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            # Latest membership's manual status (hot or archived) and the contact's external status
+            for email_key, email_status, unsubscribe_status in self.conn.execute(f"""
+                SELECT ct.email_key,
+                       (SELECT email_status FROM (
+                            SELECT id, email_status FROM campaign_leads WHERE contact_id = ct.id
+                            UNION ALL
+                            SELECT membership_id, email_status FROM archived_memberships WHERE contact_id = ct.id
+                        ) ORDER BY id DESC LIMIT 1) AS email_status,
+                       ct.unsubscribe_status
+                FROM contacts ct
+                WHERE ct.email_key IN ({placeholders})
+                AND (EXISTS (SELECT 1 FROM campaign_leads cl WHERE cl.contact_id = ct.id)
+                     OR EXISTS (SELECT 1 FROM archived_memberships am WHERE am.contact_id = ct.id))
+            """, chunk):
+                statuses[email_key] = (email_status, unsubscribe_status)
+        return statuses
+
+    def find_unsubscribed_emails(self, emails):
+        return find_unsubscribed_emails(self.conn.cursor(), emails)
+
+    # Dispatch
+    def dispatch_leads(self, campaign_id, included_ids=None, excluded_ids=None):
+        """DISPATCH_COLUMNS tuples for the leads to send"""
+        params = [campaign_id] + list(included_ids or excluded_ids or [])
+        return self.conn.execute(_dispatch_query('?', included_ids, excluded_ids), params).fetchall()
+
+    def set_unsubscribe_tokens(self, tokens):
+        """tokens: [(lead_id, token)]"""
+        self.conn.executemany("UPDATE leads SET unsubscribe_token = ? WHERE id = ?",
+                              [(token, lead_id) for lead_id, token in tokens])
+        for i in range(0, len(tokens), 500):
+            bump_lead_generations(self.conn.cursor(), [lead_id for lead_id, _ in tokens[i:i + 500]])
+
+    # Unsubscribe links
+    def lead_unsubscribe_token(self, lead_id):
+        """(unsubscribe_token,) of a membership, or None when there is no such lead"""
+        return self.conn.execute("SELECT unsubscribe_token FROM leads WHERE id = ?", (lead_id,)).fetchone()
+
+    def campaign_unsubscribe_leads(self, campaign_id):
+        """(id, email, first_name, last_name, unsubscribe_token) of the active, subscribed leads"""
+        return self.conn.execute("""
+            SELECT id, email, first_name, last_name, unsubscribe_token
+            FROM leads
+            WHERE campaign_id = ?
+            AND is_active = 1
+            AND (unsubscribe_status IS NULL OR unsubscribe_status = 'subscribed')
+            ORDER BY id
+        """, (campaign_id,)).fetchall()
+
+    def unsubscribe_link(self, token):
+        """
+        (lead_id, first_name, last_name, email, unsubscribe_status, contact_id, archived) for an
+        unsubscribe token, or None; links from archived campaigns resolve through the archive
+        """
+        row = self.conn.execute("""
+            SELECT id, first_name, last_name, email, unsubscribe_status, contact_id FROM leads WHERE unsubscribe_token = ?
+        """, (token,)).fetchone()
+        if row:
+            return row + (False,)
+        archived = find_archived_token(self.conn.cursor(), token)
+        return archived + (True,) if archived else None
+
+    def unsubscribe_lead(self, lead_id):
+        """Unsubscribe the lead's contact (every campaign) and deactivate this membership"""
+        self.conn.execute("UPDATE leads SET unsubscribe_status = 'unsubscribed', is_active = 0 WHERE id = ?",
+                          (lead_id,))
+        bump_lead_generations(self.conn.cursor(), [lead_id])
+
+    def unsubscribe_contact(self, contact_id):
+        """Unsubscribe a contact whose membership is archived; the contact status suppresses future sends"""
+        self.conn.execute("UPDATE contacts SET unsubscribe_status = 'unsubscribed' WHERE id = ?", (contact_id,))
+
+    # Import profiles
+    def import_profiles(self):
+        return load_import_profiles(self.conn.cursor())
+
+    def save_import_profile(self, name, profile):
+        store_import_profile(self.conn.cursor(), '?', name, profile)
+
+    def delete_import_profile(self, name):
+        return self.conn.execute("DELETE FROM import_profiles WHERE name = ?", (name,)).rowcount > 0
+
+    # Upload idempotency
+    def lookup_idempotent_upload(self, key):
+        return lookup_idempotent_upload(self.conn.cursor(), key)
+
+    def store_idempotent_upload(self, key, campaign_id, response_data):
+        return store_idempotent_upload(self.conn.cursor(), key, campaign_id, response_data)
+
+    # Import error reports
+    def store_import_rejections(self, report_id, rejections):
+        store_import_rejections(self.conn.cursor(), '?', report_id, rejections)
+
+    def import_rejections(self, report_id):
+        return load_import_rejections(self.conn.cursor(), '?', report_id)
+
+    # Delivery events
+    def insert_delivery_events(self, rows):
+        """rows: normalize_delivery_event tuples; returns how many were new (event_id not seen before)"""
+        return self.conn.executemany(f"""
+            INSERT OR IGNORE INTO delivery_events ({', '.join(DELIVERY_EVENT_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)
+        """, rows).rowcount
+
+    def roll_up_delivery_events(self, batch_size, max_batches=None):
+        """
+        Roll up everything pending (or at most max_batches transactions), batch_size events per
+        transaction; returns events rolled up
+        """
+        total = batches = 0
+        while max_batches is None or batches < max_batches:
+            batches += 1
+            self.conn.commit()
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                count = roll_up_delivery_batch(cursor, '?', batch_size)
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+            total += count
+            if count < batch_size:
+                break
+        return total
+
+    def prune_delivery_events(self, cutoff, batch_size):
+        return prune_delivery_events(self.conn.cursor(), '?', cutoff, batch_size)
+
+    def delivery_summary(self, campaign_id):
+        return delivery_summary(self.conn.cursor(), '?', campaign_id)
+
+    def lead_delivery_statuses(self, campaign_id, status=None, after_lead_id=0, limit=100):
+        return lead_delivery_statuses(self.conn.cursor(), '?', campaign_id, status, after_lead_id, limit)
+
+# Same tables as the SQLite schema after all migrations, minus the SQLite-only extras
+# (sketches, overlap index, FTS, archival). `leads` is a plain view: routes on the
+# repository write contacts and campaign_leads directly.
+POSTGRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_merged INTEGER DEFAULT 0,
+    last_processed_at TIMESTAMP,
+    process_count INTEGER DEFAULT 0,
+    processing_status TEXT DEFAULT 'not_sent',
+    generation INTEGER DEFAULT 0,
+    deleted_at TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS contacts (
+    id BIGSERIAL PRIMARY KEY,
+    email_key TEXT UNIQUE,
+    email TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    company TEXT,
+    domain TEXT,
+    label TEXT,
+    description TEXT,
+    unsubscribe_status TEXT DEFAULT 'subscribed',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS campaign_leads (
+    id BIGSERIAL PRIMARY KEY,
+    campaign_id BIGINT REFERENCES campaigns(id) ON DELETE CASCADE,
+    contact_id BIGINT NOT NULL REFERENCES contacts(id),
+    score INTEGER,
+    source TEXT,
+    is_active INTEGER DEFAULT 1,
+    email_status TEXT DEFAULT 'subscribed',
+    unsubscribe_token TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_campaign_leads_campaign ON campaign_leads(campaign_id);
+CREATE INDEX IF NOT EXISTS idx_campaign_leads_contact ON campaign_leads(contact_id);
+CREATE INDEX IF NOT EXISTS idx_campaign_leads_token ON campaign_leads(unsubscribe_token);
+CREATE TABLE IF NOT EXISTS upload_idempotency (
+    key TEXT PRIMARY KEY,
+    campaign_id BIGINT NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
+    response TEXT NOT NULL,
+    created_at DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_upload_idempotency_created ON upload_idempotency(created_at);
+CREATE TABLE IF NOT EXISTS import_rejections (
+    report_id TEXT NOT NULL,
+    row_number INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    row TEXT NOT NULL,
+    created_at DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_import_rejections_report ON import_rejections(report_id, row_number);
+CREATE INDEX IF NOT EXISTS idx_import_rejections_created ON import_rejections(created_at);
+CREATE TABLE IF NOT EXISTS app_state (
+    key TEXT PRIMARY KEY,
+    value BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO app_state (key, value) VALUES ('delivery_rollup_id', 0) ON CONFLICT (key) DO NOTHING;
+CREATE TABLE IF NOT EXISTS delivery_events (
+    id BIGSERIAL PRIMARY KEY,
+    lead_id BIGINT NOT NULL,
+    event TEXT NOT NULL,
+    occurred_at DOUBLE PRECISION NOT NULL,
+    received_at DOUBLE PRECISION NOT NULL,
+    event_key TEXT,
+    detail TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_delivery_events_key ON delivery_events(event_key) WHERE event_key IS NOT NULL;
+CREATE TABLE IF NOT EXISTS lead_delivery_status (
+    lead_id BIGINT PRIMARY KEY REFERENCES campaign_leads(id) ON DELETE CASCADE,
+    campaign_id BIGINT NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
+    flags INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    open_count INTEGER NOT NULL DEFAULT 0,
+    click_count INTEGER NOT NULL DEFAULT 0,
+    last_event_at DOUBLE PRECISION
+);
+CREATE INDEX IF NOT EXISTS idx_lead_delivery_campaign ON lead_delivery_status(campaign_id, status, lead_id);
+CREATE TABLE IF NOT EXISTS campaign_delivery_stats (
+    campaign_id BIGINT PRIMARY KEY REFERENCES campaigns(id) ON DELETE CASCADE,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    opened INTEGER NOT NULL DEFAULT 0,
+    clicked INTEGER NOT NULL DEFAULT 0,
+    bounced INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    complained INTEGER NOT NULL DEFAULT 0,
+    events INTEGER NOT NULL DEFAULT 0,
+    last_event_at DOUBLE PRECISION,
+    updated_at DOUBLE PRECISION
+);
+CREATE TABLE IF NOT EXISTS import_profiles (
+    name TEXT PRIMARY KEY,
+    definition TEXT NOT NULL,
+    updated_at DOUBLE PRECISION NOT NULL
+);
+CREATE OR REPLACE VIEW leads AS
+    SELECT cl.id AS id, ct.first_name AS first_name, ct.last_name AS last_name, ct.email AS email,
+           ct.domain AS domain, cl.score AS score, ct.company AS company, ct.label AS label,
+           ct.description AS description, cl.source AS source, cl.campaign_id AS campaign_id,
+           cl.is_active AS is_active, cl.created_at AS created_at,
+           ct.unsubscribe_status AS unsubscribe_status, cl.unsubscribe_token AS unsubscribe_token,
+           cl.email_status AS email_status, cl.contact_id AS contact_id
+    FROM campaign_leads cl
+    JOIN contacts ct ON ct.id = cl.contact_id;
+"""
+# Serializes schema setup when several nodes start at once (CREATE ... IF NOT EXISTS can race)
+POSTGRES_SCHEMA_LOCK_ID = 0x63616d70
+STAGING_COLUMNS = ('ord', 'email_key', 'email', 'first_name', 'last_name', 'company', 'domain', 'label',
+                   'description', 'unsubscribe_status', 'score', 'source', 'unsubscribe_token')
+
+def init_postgres(dsn):
+    """Create the PostgreSQL schema if needed (idempotent, safe with concurrent nodes)"""
+    conn = postgres_pool.connect(dsn)
+    try:
+        with conn.transaction():
+            conn.execute("SELECT pg_advisory_xact_lock(%s)", (POSTGRES_SCHEMA_LOCK_ID,))
+            conn.execute(POSTGRES_SCHEMA)
+    finally:
+        conn.close()
+
+class PostgresRepository:
+    """
+    Repository over a PostgreSQL connection (psycopg 3). Lead batches are loaded with COPY into
+    a temporary staging table and merged into contacts/campaign_leads with two set-based
+    statements; exports read through a server-side (named) cursor.
+    """
+    backend = 'postgres'
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    # Campaigns
+    def list_available_campaigns(self):
+        rows = self.conn.execute("""
+            SELECT c.id, c.name, c.status, c.description, COUNT(l.id) AS profile_count
+            FROM campaigns c
+            LEFT JOIN campaign_leads l ON c.id = l.campaign_id
+            WHERE (c.is_merged IS NULL OR c.is_merged = 0) AND c.deleted_at IS NULL
+            GROUP BY c.id
+            ORDER BY c.id DESC
+        """).fetchall()
+        return [{'id': row[0], 'name': row[1], 'status': row[2], 'description': row[3] or '',
+                 'profile_count': row[4] or 0} for row in rows]
+
+    def get_campaign(self, campaign_id):
+        row = self.conn.execute("""
+            SELECT id, name, status, processing_status FROM campaigns WHERE id = %s AND deleted_at IS NULL
+        """, (campaign_id,)).fetchone()
+        return dict(zip(('id', 'name', 'status', 'processing_status'), row)) if row else None
+
+    def create_campaign(self, name, description, status='pending'):
+        return self.conn.execute("""
+            INSERT INTO campaigns (name, description, status, created_at) VALUES (%s, %s, %s, %s) RETURNING id
+        """, (name, description, status, datetime.now())).fetchone()[0]
+
+    def rename_campaign(self, campaign_id, name, description):
+        self.conn.execute("UPDATE campaigns SET name = %s, description = %s WHERE id = %s",
+                          (name, description, campaign_id))
+
+    def create_staging_campaign(self, name, description):
+        now = datetime.now()
+        return self.conn.execute("""
+            INSERT INTO campaigns (name, description, status, created_at, deleted_at)
+            VALUES (%s, %s, 'importing', %s, %s) RETURNING id
+        """, (name, description, now, now)).fetchone()[0]
+
+    def publish_staging_campaign(self, campaign_id):
+        self.conn.execute("""
+            UPDATE campaigns SET status = 'pending', deleted_at = NULL WHERE id = %s AND status = 'importing'
+        """, (campaign_id,))
+
+    def discard_staging_campaign(self, campaign_id):
+        self.conn.execute("UPDATE campaigns SET status = 'pending' WHERE id = %s AND status = 'importing'",
+                          (campaign_id,))
+
+    def record_dispatch(self, campaign_id, sent):
+        if sent:
+            self.conn.execute("""
+                UPDATE campaigns
+                SET processing_status = 'sent', last_processed_at = %s, process_count = COALESCE(process_count, 0) + 1
+                WHERE id = %s
+            """, (datetime.now(), campaign_id))
+        else:
+            self.conn.execute("UPDATE campaigns SET processing_status = 'failed' WHERE id = %s", (campaign_id,))
+
+    def mark_dispatch_queued(self, campaign_id):
+        self.conn.execute("UPDATE campaigns SET processing_status = 'queued' WHERE id = %s", (campaign_id,))
+
+    def ensure_hot(self, campaign_ids):
+        return []  # no archival tier: everything stays in the one database
+
+    def set_campaign_status(self, campaign_id, status):
+        self.conn.execute("UPDATE campaigns SET status = %s WHERE id = %s", (status, campaign_id))
+
+    def delete_campaign(self, campaign_id):
+        self.conn.execute("UPDATE campaigns SET deleted_at = %s WHERE id = %s AND deleted_at IS NULL",
+                          (datetime.now(), campaign_id))
+        self.conn.execute("DELETE FROM upload_idempotency WHERE campaign_id = %s", (campaign_id,))
+
+    def purge_deleted_campaigns(self, abandoned_before, batch_size, pause):
+        """
+        CampaignPurger.purge_shard for PostgreSQL: memberships go batch_size rows per transaction,
+        then the campaign row. Returns the number of campaigns purged.
+        """
+        purged = 0
+        while True:
+            with self.conn.transaction():
+                row = self.conn.execute("""
+                    SELECT id FROM campaigns
+                    WHERE deleted_at IS NOT NULL AND (status != 'importing' OR deleted_at < %s)
+                    ORDER BY deleted_at LIMIT 1
+                """, (abandoned_before,)).fetchone()
+            if row is None:
+                return purged
+            campaign_id = row[0]
+            while True:
+                with self.conn.transaction():
+                    deleted = self.conn.execute("""
+                        DELETE FROM campaign_leads
+                        WHERE id IN (SELECT id FROM campaign_leads WHERE campaign_id = %s LIMIT %s)
+                    """, (campaign_id, batch_size)).rowcount
+                if deleted < batch_size:
+                    break
+                time.sleep(pause)
+            with self.conn.transaction():
+                self.conn.execute("DELETE FROM campaigns WHERE id = %s AND deleted_at IS NOT NULL", (campaign_id,))
+            logger.info("campaign_purged campaign_id=%d backend=postgres", campaign_id)
+            purged += 1
+
+    # Leads
+    def insert_leads(self, campaign_id, leads):
+        """
+        COPY the batch into a session-local staging table, then upsert contacts (blank fields are
+        filled, unsubscribes are sticky, as the SQLite view trigger does) and add memberships.
+        Leads need an email (/upload validation guarantees one); rows without one are skipped.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS lead_staging (
+                    ord INTEGER, email_key TEXT, email TEXT, first_name TEXT, last_name TEXT, company TEXT,
+                    domain TEXT, label TEXT, description TEXT, unsubscribe_status TEXT, score INTEGER,
+                    source TEXT, unsubscribe_token TEXT
+                ) ON COMMIT DELETE ROWS
+            """)
+            cursor.execute("TRUNCATE lead_staging")
+            with cursor.copy(f"COPY lead_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN") as copy:
+                for ord_, lead in enumerate(leads):
+                    email = lead['email'].strip()
+                    copy.write_row((ord_, email.lower(), email, lead['first_name'], lead['last_name'],
+                                    lead['company'], lead['domain'], lead['label'], lead['description'],
+                                    lead['unsubscribe_status'], lead['score'], lead['source'],
+                                    lead['unsubscribe_token']))
+            cursor.execute("""
+                INSERT INTO contacts AS ct (email_key, email, first_name, last_name, company, domain, label,
+                                            description, unsubscribe_status)
+                SELECT DISTINCT ON (email_key) email_key, email, first_name, last_name, company, domain, label,
+                       description, COALESCE(unsubscribe_status, 'subscribed')
+                FROM lead_staging
+                WHERE email_key <> ''
+                ORDER BY email_key, ord
+                ON CONFLICT (email_key) DO UPDATE SET
+                    first_name = COALESCE(NULLIF(ct.first_name, ''), EXCLUDED.first_name),
+                    last_name = COALESCE(NULLIF(ct.last_name, ''), EXCLUDED.last_name),
+                    company = COALESCE(NULLIF(ct.company, ''), EXCLUDED.company),
+                    domain = COALESCE(NULLIF(ct.domain, ''), EXCLUDED.domain),
+                    label = COALESCE(NULLIF(ct.label, ''), EXCLUDED.label),
+                    description = COALESCE(NULLIF(ct.description, ''), EXCLUDED.description),
+                    unsubscribe_status = CASE WHEN EXCLUDED.unsubscribe_status = 'unsubscribed'
+                                              THEN 'unsubscribed' ELSE ct.unsubscribe_status END
+                WHERE (COALESCE(ct.first_name, '') = '' AND COALESCE(EXCLUDED.first_name, '') <> '')
+                   OR (COALESCE(ct.last_name, '') = '' AND COALESCE(EXCLUDED.last_name, '') <> '')
+                   OR (COALESCE(ct.company, '') = '' AND COALESCE(EXCLUDED.company, '') <> '')
+                   OR (COALESCE(ct.domain, '') = '' AND COALESCE(EXCLUDED.domain, '') <> '')
+                   OR (COALESCE(ct.label, '') = '' AND COALESCE(EXCLUDED.label, '') <> '')
+                   OR (COALESCE(ct.description, '') = '' AND COALESCE(EXCLUDED.description, '') <> '')
+                   OR (EXCLUDED.unsubscribe_status = 'unsubscribed'
+                       AND ct.unsubscribe_status IS DISTINCT FROM 'unsubscribed')
+            """)
+            # One membership per contact: the first row of a key repeated in the batch, and none
+            # for a contact the campaign already has (an earlier batch of the same upload)
+            cursor.execute("""
+                INSERT INTO campaign_leads (campaign_id, contact_id, score, source, is_active, email_status,
+                                            unsubscribe_token, created_at)
+                SELECT %(campaign_id)s, ct.id, s.score, s.source, 1, 'subscribed', s.unsubscribe_token, %(now)s
+                FROM (
+                    SELECT DISTINCT ON (email_key) * FROM lead_staging
+                    WHERE email_key <> ''
+                    ORDER BY email_key, ord
+                ) s
+                JOIN contacts ct ON ct.email_key = s.email_key
+                WHERE NOT EXISTS (SELECT 1 FROM campaign_leads cl
+                                  WHERE cl.campaign_id = %(campaign_id)s AND cl.contact_id = ct.id)
+                ORDER BY s.ord
+            """, {'campaign_id': campaign_id, 'now': datetime.now()})
+
+    def lead_counts(self, campaign_id):
+        return self.conn.execute("""
+            SELECT COUNT(*) FILTER (WHERE is_active = 1), COUNT(*) FILTER (WHERE is_active = 0), COUNT(*)
+            FROM campaign_leads WHERE campaign_id = %s
+        """, (campaign_id,)).fetchone()
+
+    def iter_export_rows(self, campaign_id, fetch_size):
+        # A named cursor keeps the result set on the server; rows arrive fetch_size at a time.
+        # Names are per session, but a pooled connection may serve two exports of one campaign.
+        with self.conn.cursor(name=f"export_campaign_{campaign_id}_{uuid.uuid4().hex}") as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(f"""
+                SELECT {', '.join(EXPORT_COLUMNS)} FROM leads WHERE campaign_id = %s ORDER BY id
+            """, (campaign_id,))
+            yield from cursor
+
+    # Suppression
+    def contact_statuses(self, email_keys):
+        rows = self.conn.execute("""
+            SELECT ct.email_key,
+                   (SELECT email_status FROM campaign_leads cl WHERE cl.contact_id = ct.id
+                    ORDER BY cl.id DESC LIMIT 1),
+                   ct.unsubscribe_status
+            FROM contacts ct
+            WHERE ct.email_key = ANY(%s)
+            AND EXISTS (SELECT 1 FROM campaign_leads cl WHERE cl.contact_id = ct.id)
+        """, (list(email_keys),)).fetchall()
+        return {email_key: (email_status, unsubscribe_status)
+                for email_key, email_status, unsubscribe_status in rows}
+
+    def find_unsubscribed_emails(self, emails):
+        rows = self.conn.execute("""
+            SELECT email, first_name, last_name, unsubscribe_status
+            FROM contacts
+            WHERE email_key = ANY(%s) AND unsubscribe_status = 'unsubscribed'
+        """, ([email.lower().strip() for email in emails],)).fetchall()
+        return [{"email": row[0], "name": f"{row[1]} {row[2]}", "status": row[3]} for row in rows]
+
+    # Dispatch
+    def dispatch_leads(self, campaign_id, included_ids=None, excluded_ids=None):
+        params = [campaign_id] + [int(i) for i in (included_ids or excluded_ids or [])]
+        return self.conn.execute(_dispatch_query('%s', included_ids, excluded_ids), params).fetchall()
+
+    def set_unsubscribe_tokens(self, tokens):
+        with self.conn.cursor() as cursor:
+            cursor.executemany("UPDATE campaign_leads SET unsubscribe_token = %s WHERE id = %s",
+                               [(token, lead_id) for lead_id, token in tokens])
+
+    # Unsubscribe links
+    def lead_unsubscribe_token(self, lead_id):
+        return self.conn.execute("SELECT unsubscribe_token FROM campaign_leads WHERE id = %s", (lead_id,)).fetchone()
+
+    def campaign_unsubscribe_leads(self, campaign_id):
+        return self.conn.execute("""
+            SELECT id, email, first_name, last_name, unsubscribe_token
+            FROM leads
+            WHERE campaign_id = %s
+            AND is_active = 1
+            AND (unsubscribe_status IS NULL OR unsubscribe_status = 'subscribed')
+            ORDER BY id
+        """, (campaign_id,)).fetchall()
+
+    def unsubscribe_link(self, token):
+        row = self.conn.execute("""
+            SELECT id, first_name, last_name, email, unsubscribe_status, contact_id FROM leads WHERE unsubscribe_token = %s
+        """, (token,)).fetchone()
+        return row + (False,) if row else None
+
+    def unsubscribe_lead(self, lead_id):
+        # `leads` is a plain view here: the contact and the membership are updated directly
+        self.conn.execute("""
+            UPDATE contacts SET unsubscribe_status = 'unsubscribed'
+            WHERE id = (SELECT contact_id FROM campaign_leads WHERE id = %s)
+        """, (lead_id,))
+        self.conn.execute("UPDATE campaign_leads SET is_active = 0 WHERE id = %s", (lead_id,))
+
+    def unsubscribe_contact(self, contact_id):
+        self.conn.execute("UPDATE contacts SET unsubscribe_status = 'unsubscribed' WHERE id = %s", (contact_id,))
+
+    # Import profiles
+    def import_profiles(self):
+        with self.conn.cursor() as cursor:
+            return load_import_profiles(cursor)
+
+    def save_import_profile(self, name, profile):
+        with self.conn.cursor() as cursor:
+            store_import_profile(cursor, '%s', name, profile)
+
+    def delete_import_profile(self, name):
+        return self.conn.execute("DELETE FROM import_profiles WHERE name = %s", (name,)).rowcount > 0
+
+    # Upload idempotency
+    def lookup_idempotent_upload(self, key):
+        row = self.conn.execute("SELECT response FROM upload_idempotency WHERE key = %s AND created_at >= %s",
+                                (key, time.time() - app.config['IDEMPOTENCY_TTL_SECONDS'])).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def store_idempotent_upload(self, key, campaign_id, response_data):
+        now = time.time()
+        self.conn.execute("DELETE FROM upload_idempotency WHERE created_at < %s",
+                          (now - app.config['IDEMPOTENCY_TTL_SECONDS'],))
+        cursor = self.conn.execute("""
+            INSERT INTO upload_idempotency (key, campaign_id, response, created_at) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (key) DO NOTHING
+        """, (key, campaign_id, json.dumps(response_data), now))
+        return cursor.rowcount == 1
+
+    # Import error reports
+    def store_import_rejections(self, report_id, rejections):
+        with self.conn.cursor() as cursor:
+            store_import_rejections(cursor, '%s', report_id, rejections)
+
+    def import_rejections(self, report_id):
+        with self.conn.cursor() as cursor:
+            return load_import_rejections(cursor, '%s', report_id)
+
+    # Delivery events
+    def insert_delivery_events(self, rows):
+        # Ingest holds the rollup lock shared until commit, so the rollup never reads past an id
+        # that a still-open ingest transaction could commit below (BIGSERIAL ids commit out of order)
+        self.conn.execute("SELECT pg_advisory_xact_lock_shared(%s)", (DELIVERY_ROLLUP_LOCK_ID,))
+        with self.conn.cursor() as cursor:
+            cursor.executemany(f"""
+                INSERT INTO delivery_events ({', '.join(DELIVERY_EVENT_COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT DO NOTHING
+            """, rows)
+            return cursor.rowcount
+
+    def roll_up_delivery_events(self, batch_size, max_batches=None):
+        with self.conn.transaction():
+            self.conn.execute("SELECT pg_advisory_xact_lock(%s)", (DELIVERY_ROLLUP_LOCK_ID,))
+            upto_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM delivery_events").fetchone()[0]
+        self.conn.commit()
+        total = batches = 0
+        while max_batches is None or batches < max_batches:
+            batches += 1
+            with self.conn.transaction(), self.conn.cursor() as cursor:
+                cursor.execute("SELECT value FROM app_state WHERE key = 'delivery_rollup_id' FOR UPDATE")
+                count = roll_up_delivery_batch(cursor, '%s', batch_size, upto_id)
+            self.conn.commit()
+            total += count
+            if count < batch_size:
+                break
+        return total
+
+    def prune_delivery_events(self, cutoff, batch_size):
+        with self.conn.cursor() as cursor:
+            return prune_delivery_events(cursor, '%s', cutoff, batch_size)
+
+    def delivery_summary(self, campaign_id):
+        with self.conn.cursor() as cursor:
+            return delivery_summary(cursor, '%s', campaign_id)
+
+    def lead_delivery_statuses(self, campaign_id, status=None, after_lead_id=0, limit=100):
+        with self.conn.cursor() as cursor:
+            return lead_delivery_statuses(cursor, '%s', campaign_id, status, after_lead_id, limit)
+
+class PostgresConnectionPool(ConnectionPool):
+    """ConnectionPool for PostgreSQL, keyed by DSN; psycopg is imported on first use"""
+    size_setting = 'POSTGRES_POOL_SIZE'
+
+    def connect(self, dsn):
+        try:
+            import psycopg
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=postgres needs psycopg 3 (pip install 'psycopg[binary]')")
+        return psycopg.connect(dsn)
+
+    def reset(self, conn):
+        if conn.closed:
+            return False
+        try:
+            conn.rollback()
+        except Exception:
+            return False
+        return True
+
+postgres_pool = PostgresConnectionPool()
+
+def get_repository():
+    """The request's repository: PostgreSQL when STORAGE_BACKEND=postgres, else the tenant's SQLite shard"""
+    if 'repository' not in g:
+        if app.config['STORAGE_BACKEND'] == 'postgres':
+            g._pg_connection = postgres_pool.acquire(app.config['POSTGRES_DSN'])
+            g.repository = PostgresRepository(g._pg_connection)
+        else:
+            g.repository = SQLiteRepository(get_db())
+    return g.repository
+
+# What a STORAGE_BACKEND=postgres node serves: these endpoints read and write campaigns only
+# through get_repository(). The rest (review pages, lead edits, merges, search, duplicate
+# checks, archival, audit queries) still use get_db() directly, so a postgres node answers
+# them 501 rather than splitting campaigns across PostgreSQL and a node-local SQLite file.
+# The audit log itself stays node-local (DB_PATH) on such a node.
+POSTGRES_ENDPOINTS = frozenset({
+    'static', 'metrics_endpoint', 'running_operations', 'operation_events',
+    'approve_campaign', 'delete_campaign', 'get_available_campaigns', 'get_campaign_stats', 'export_campaign',
+    'send_to_n8n', 'dispatch_status',
+    'get_lead_unsubscribe_url', 'get_campaign_unsubscribe_urls', 'unsubscribe_confirmation', 'confirm_unsubscribe',
+    'check_unsubscribed_leads',
+    'upload_leads', 'create_chunked_upload', 'chunked_upload_status', 'upload_part', 'complete_chunked_upload',
+    'download_import_report', 'list_import_profiles', 'save_import_profile', 'detect_import_profile_for_upload',
+    'ingest_delivery_events', 'campaign_delivery', 'campaign_delivery_leads',
+})
+
+@app.before_request
+def refuse_sqlite_only_routes():
+    if app.config['STORAGE_BACKEND'] != 'postgres' or request.endpoint in POSTGRES_ENDPOINTS or request.endpoint is None:
+        return None
+    return jsonify({"status": "error", "error": "not_available_on_backend",
+                    "message": f"{request.endpoint} is not available with STORAGE_BACKEND=postgres"}), 501
+
+# --- HTTP CACHING (ETAG / 304) AND RESPONSE COMPRESSION ---
+# Responses smaller than this are sent as-is; compressing them costs more than it saves
+COMPRESS_MIN_SIZE = 1024
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/csv', 'text/plain', 'application/json', 'application/javascript', 'text/css'}
+
+def get_generation(campaign_ids=None):
+    """
+    Return the data generation for the given campaigns, or the global generation.
+    Generations are bumped by triggers when campaigns or contacts change, and by the lead
+    write paths through bump_campaign_generations / bump_lead_generations.
+    """
+    cursor = get_db().cursor()
+    try:
+        if campaign_ids is None:
+            cursor.execute("SELECT value FROM app_state WHERE key = 'generation'")
+            row = cursor.fetchone()
+            return str(row[0]) if row else '0'
+        ids = [int(cid) for cid in campaign_ids]
+        placeholders = ','.join('?' for _ in ids)
+        cursor.execute(f"SELECT id, COALESCE(generation, 0) FROM campaigns WHERE id IN ({placeholders}) ORDER BY id", ids)
+        return ';'.join(f"{row[0]}:{row[1]}" for row in cursor.fetchall())
+    except (sqlite3.OperationalError, ValueError, TypeError):
+        # Schema not migrated yet or bad ids - skip conditional handling
+        return None
+
+def bump_campaign_generations(cursor, campaign_ids, placeholder='?'):
+    """Invalidate the ETags of campaigns whose leads were just written: one UPDATE per write, not per row"""
+    ids = sorted({int(campaign_id) for campaign_id in campaign_ids})
+    if ids:
+        cursor.execute(f"""
+            UPDATE campaigns SET generation = COALESCE(generation, 0) + 1 WHERE id IN ({','.join([placeholder] * len(ids))})
+        """, ids)
+
+def bump_lead_generations(cursor, lead_ids):
+    """bump_campaign_generations for the campaigns of these memberships (call before deleting them)"""
+    lead_ids = list(lead_ids)
+    if lead_ids:
+        cursor.execute(f"""
+            UPDATE campaigns SET generation = COALESCE(generation, 0) + 1
+            WHERE id IN (SELECT campaign_id FROM campaign_leads WHERE id IN ({','.join('?' for _ in lead_ids)}))
+        """, lead_ids)
+
+# endpoint -> function returning the campaign ids the response depends on (None = global generation).
+# Only GET/HEAD responses are conditional: a 304 is not a valid answer to a POST.
+CONDITIONAL_ENDPOINTS = {
+    'campaigns': lambda: None,
+    'campaign_detail': lambda: [request.view_args['campaign_id']],
+    'get_campaign_unsubscribe_urls': lambda: [request.view_args['campaign_id']],
+    'compare_leads': lambda: [request.view_args['current_campaign_id'], request.view_args['processed_campaign_id']],
+}
+
+@app.before_request
+def handle_conditional_request():
+    """Answer 304 Not Modified before doing any work when the client's ETag is still current"""
+    # Generations are only maintained in SQLite
+    if request.method not in ('GET', 'HEAD') or app.config['STORAGE_BACKEND'] != 'sqlite':
+        return None
+    resolve_ids = CONDITIONAL_ENDPOINTS.get(request.endpoint)
+    # Pending flash messages are rendered into the page, so never short-circuit them
+    if resolve_ids is None or session.get('_flashes'):
+        return None
+
+    campaign_ids = resolve_ids()
+    generation = get_generation(campaign_ids)
+    if generation is None:
+        return None
+
+    # Query string and host are part of the rendered output (referrer links, unsubscribe URLs)
+    key = (f"{g.get('tenant', DEFAULT_TENANT)}|{request.endpoint}|{request.host}|{request.full_path}|"
+           f"{sorted(map(str, campaign_ids or []))}|{generation}")
+    g.etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    if request.if_none_match.contains_weak(g.etag):
+        response = app.response_class(status=304)
+        response.set_etag(g.etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return None
+
+def _negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+@app.after_request
+def add_etag_and_compress(response):
+    etag = g.pop('etag', None)
+    if etag and response.status_code == 200:
+        # Weak ETag: the same generation is valid for every content encoding
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    encoding = _negotiate_encoding()
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=5))
+    elif encoding == 'gzip':
+        import gzip
+        response.set_data(gzip.compress(body, compresslevel=6))
+    else:
+        return response
+
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# --- CONTACTS + CAMPAIGN MEMBERSHIP SCHEMA ---
+# Person data lives once per normalized email in `contacts`; `campaign_leads` is the thin
+# per-campaign membership (status, token, score, source). `leads` is a view joining both,
+# with INSTEAD OF triggers, so every route that reads or writes `leads` keeps working.
+# Queries that LEFT JOIN only to count memberships use campaign_leads directly: SQLite
+# can't flatten a view that is itself a join into the right side of a LEFT JOIN.
+CONTACTS_TABLES = [
+    """CREATE TABLE IF NOT EXISTS contacts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email_key TEXT UNIQUE,
+        email TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        company TEXT,
+        domain TEXT,
+        label TEXT,
+        description TEXT,
+        unsubscribe_status TEXT DEFAULT 'subscribed',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""",
+    """CREATE TABLE IF NOT EXISTS campaign_leads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        campaign_id INTEGER,
+        contact_id INTEGER NOT NULL,
+        score INTEGER,
+        source TEXT,
+        is_active INTEGER DEFAULT 1,
+        email_status TEXT DEFAULT 'subscribed',
+        unsubscribe_token TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (campaign_id) REFERENCES campaigns(id) ON DELETE CASCADE,
+        FOREIGN KEY (contact_id) REFERENCES contacts(id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_campaign_leads_campaign ON campaign_leads(campaign_id)",
+    "CREATE INDEX IF NOT EXISTS idx_campaign_leads_contact ON campaign_leads(contact_id)",
+    "CREATE INDEX IF NOT EXISTS idx_campaign_leads_token ON campaign_leads(unsubscribe_token)",
+    # Existing routes look emails up with LOWER(email) through the view
+    "CREATE INDEX IF NOT EXISTS idx_contacts_lower_email ON contacts(LOWER(email))",
+]
+
+CONTACTS_SCHEMA = """
+CREATE VIEW IF NOT EXISTS leads AS
+    SELECT cl.id AS id, ct.first_name AS first_name, ct.last_name AS last_name, ct.email AS email,
+           ct.domain AS domain, cl.score AS score, ct.company AS company, ct.label AS label,
+           ct.description AS description, cl.source AS source, cl.campaign_id AS campaign_id,
+           cl.is_active AS is_active, cl.created_at AS created_at,
+           ct.unsubscribe_status AS unsubscribe_status, cl.unsubscribe_token AS unsubscribe_token,
+           cl.email_status AS email_status, cl.contact_id AS contact_id
+    FROM campaign_leads cl
+    JOIN contacts ct ON ct.id = cl.contact_id;
+
+-- Inserting a lead upserts its contact (blank fields are filled, unsubscribes are sticky)
+-- and adds a membership row
+CREATE TRIGGER IF NOT EXISTS leads_view_insert INSTEAD OF INSERT ON leads BEGIN
+    INSERT INTO contacts (email_key, email, first_name, last_name, company, domain, label, description, unsubscribe_status)
+    VALUES (NULLIF(LOWER(TRIM(NEW.email)), ''), TRIM(NEW.email), NEW.first_name, NEW.last_name, NEW.company,
+            NEW.domain, NEW.label, NEW.description, COALESCE(NEW.unsubscribe_status, 'subscribed'))
+    ON CONFLICT(email_key) DO UPDATE SET
+        first_name = COALESCE(NULLIF(contacts.first_name, ''), excluded.first_name),
+        last_name = COALESCE(NULLIF(contacts.last_name, ''), excluded.last_name),
+        company = COALESCE(NULLIF(contacts.company, ''), excluded.company),
+        domain = COALESCE(NULLIF(contacts.domain, ''), excluded.domain),
+        label = COALESCE(NULLIF(contacts.label, ''), excluded.label),
+        description = COALESCE(NULLIF(contacts.description, ''), excluded.description),
+        unsubscribe_status = CASE WHEN excluded.unsubscribe_status = 'unsubscribed'
+                                  THEN 'unsubscribed' ELSE contacts.unsubscribe_status END
+    WHERE (COALESCE(contacts.first_name, '') = '' AND COALESCE(excluded.first_name, '') <> '')
+       OR (COALESCE(contacts.last_name, '') = '' AND COALESCE(excluded.last_name, '') <> '')
+       OR (COALESCE(contacts.company, '') = '' AND COALESCE(excluded.company, '') <> '')
+       OR (COALESCE(contacts.domain, '') = '' AND COALESCE(excluded.domain, '') <> '')
+       OR (COALESCE(contacts.label, '') = '' AND COALESCE(excluded.label, '') <> '')
+       OR (COALESCE(contacts.description, '') = '' AND COALESCE(excluded.description, '') <> '')
+       OR (excluded.unsubscribe_status = 'unsubscribed' AND contacts.unsubscribe_status IS NOT 'unsubscribed');
+    INSERT INTO campaign_leads (id, campaign_id, contact_id, score, source, is_active, email_status, unsubscribe_token, created_at)
+    VALUES (NEW.id, NEW.campaign_id,
+            CASE WHEN NULLIF(LOWER(TRIM(NEW.email)), '') IS NULL THEN last_insert_rowid()
+                 ELSE (SELECT id FROM contacts WHERE email_key = LOWER(TRIM(NEW.email))) END,
+            NEW.score, NEW.source, COALESCE(NEW.is_active, 1), COALESCE(NEW.email_status, 'subscribed'),
+            NEW.unsubscribe_token, COALESCE(NEW.created_at, CURRENT_TIMESTAMP));
+END;
+
+CREATE TRIGGER IF NOT EXISTS leads_view_update_membership
+INSTEAD OF UPDATE OF campaign_id, score, source, is_active, created_at, unsubscribe_token, email_status ON leads BEGIN
+    UPDATE campaign_leads
+    SET campaign_id = NEW.campaign_id, score = NEW.score, source = NEW.source, is_active = NEW.is_active,
+        created_at = NEW.created_at, unsubscribe_token = NEW.unsubscribe_token, email_status = NEW.email_status
+    WHERE id = OLD.id;
+END;
+
+-- Person fields and unsubscribe status belong to the contact: one update reaches every campaign
+CREATE TRIGGER IF NOT EXISTS leads_view_update_contact
+INSTEAD OF UPDATE OF first_name, last_name, email, domain, company, label, description, unsubscribe_status ON leads BEGIN
+    UPDATE contacts
+    SET first_name = NEW.first_name, last_name = NEW.last_name, email = TRIM(NEW.email),
+        email_key = NULLIF(LOWER(TRIM(NEW.email)), ''), domain = NEW.domain, company = NEW.company,
+        label = NEW.label, description = NEW.description, unsubscribe_status = NEW.unsubscribe_status
+    WHERE id = OLD.contact_id;
+END;
+
+-- Contacts are kept on delete: they carry the unsubscribe history
+CREATE TRIGGER IF NOT EXISTS leads_view_delete INSTEAD OF DELETE ON leads BEGIN
+    DELETE FROM campaign_leads WHERE id = OLD.id;
+END;
+
+-- Generation counters (ETag / 304 handling). Membership writes bump their campaigns once
+-- per statement from the write path (bump_campaign_generations); per-row triggers on
+-- campaign_leads cost two extra UPDATEs for every lead written. Contact updates (unsubscribes,
+-- blanks filled by a later import) are rare and reach every campaign sharing the contact.
+DROP TRIGGER IF EXISTS campaign_leads_generation_insert;
+DROP TRIGGER IF EXISTS campaign_leads_generation_update;
+DROP TRIGGER IF EXISTS campaign_leads_generation_delete;
+CREATE TRIGGER IF NOT EXISTS contacts_generation_update AFTER UPDATE ON contacts BEGIN
+    UPDATE campaigns SET generation = COALESCE(generation, 0) + 1
+    WHERE id IN (SELECT campaign_id FROM campaign_leads WHERE contact_id = NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS campaigns_generation_insert AFTER INSERT ON campaigns BEGIN
+    UPDATE app_state SET value = value + 1 WHERE key = 'generation';
+END;
+CREATE TRIGGER IF NOT EXISTS campaigns_generation_update AFTER UPDATE ON campaigns BEGIN
+    UPDATE app_state SET value = value + 1 WHERE key = 'generation';
+END;
+CREATE TRIGGER IF NOT EXISTS campaigns_generation_delete AFTER DELETE ON campaigns BEGIN
+    UPDATE app_state SET value = value + 1 WHERE key = 'generation';
+END;
+"""
+
+CONTACTS_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5(
+    first_name, last_name, email, company, domain, label, description,
+    content='contacts', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS contacts_fts_insert AFTER INSERT ON contacts BEGIN
+    INSERT INTO contacts_fts (rowid, first_name, last_name, email, company, domain, label, description)
+    VALUES (NEW.id, NEW.first_name, NEW.last_name, NEW.email, NEW.company, NEW.domain, NEW.label, NEW.description);
+END;
+CREATE TRIGGER IF NOT EXISTS contacts_fts_delete AFTER DELETE ON contacts BEGIN
+    INSERT INTO contacts_fts (contacts_fts, rowid, first_name, last_name, email, company, domain, label, description)
+    VALUES ('delete', OLD.id, OLD.first_name, OLD.last_name, OLD.email, OLD.company, OLD.domain, OLD.label, OLD.description);
+END;
+CREATE TRIGGER IF NOT EXISTS contacts_fts_update
+AFTER UPDATE OF first_name, last_name, email, company, domain, label, description ON contacts BEGIN
+    INSERT INTO contacts_fts (contacts_fts, rowid, first_name, last_name, email, company, domain, label, description)
+    VALUES ('delete', OLD.id, OLD.first_name, OLD.last_name, OLD.email, OLD.company, OLD.domain, OLD.label, OLD.description);
+    INSERT INTO contacts_fts (rowid, first_name, last_name, email, company, domain, label, description)
+    VALUES (NEW.id, NEW.first_name, NEW.last_name, NEW.email, NEW.company, NEW.domain, NEW.label, NEW.description);
+END;
+"""
+
+def migrate_leads_to_contacts(conn):
+    """
+    Move rows of the legacy wide leads table into contacts (one per normalized email,
+    newest row's person data, unsubscribed if any copy was) and campaign_leads
+    (same ids as the old lead rows, so existing links and forms stay valid).
+    Runs in a single transaction.
+    """
+    c = conn.cursor()
+    conn.commit()
+    c.execute("BEGIN IMMEDIATE")
+    for statement in CONTACTS_TABLES:
+        c.execute(statement)
+
+    c.execute("""
+        INSERT INTO contacts (email_key, email, first_name, last_name, company, domain, label, description,
+                              unsubscribe_status, created_at)
+        SELECT email_key, email, first_name, last_name, company, domain, label, description,
+               CASE WHEN any_unsubscribed THEN 'unsubscribed' ELSE 'subscribed' END, created_at
+        FROM (
+            SELECT LOWER(TRIM(email)) AS email_key, TRIM(email) AS email, first_name, last_name, company,
+                   domain, label, description, created_at,
+                   ROW_NUMBER() OVER (PARTITION BY LOWER(TRIM(email)) ORDER BY id DESC) AS row_number,
+                   MAX(unsubscribe_status = 'unsubscribed') OVER (PARTITION BY LOWER(TRIM(email))) AS any_unsubscribed
+            FROM leads
+            WHERE TRIM(COALESCE(email, '')) <> ''
+        )
+        WHERE row_number = 1
+    """)
+    c.execute("""
+        INSERT INTO campaign_leads (id, campaign_id, contact_id, score, source, is_active, email_status,
+                                    unsubscribe_token, created_at)
+        SELECT l.id, l.campaign_id, ct.id, l.score, l.source, l.is_active, l.email_status,
+               l.unsubscribe_token, l.created_at
+        FROM leads l
+        JOIN contacts ct ON ct.email_key = LOWER(TRIM(l.email))
+    """)
+
+    # Leads without an email can't be matched to anyone: each gets its own contact
+    c.execute("""
+        SELECT id, campaign_id, first_name, last_name, company, domain, label, description, score, source,
+               is_active, email_status, unsubscribe_status, unsubscribe_token, created_at
+        FROM leads WHERE TRIM(COALESCE(email, '')) = ''
+    """)
+    for row in c.fetchall():
+        c.execute("""
+            INSERT INTO contacts (email_key, email, first_name, last_name, company, domain, label, description,
+                                  unsubscribe_status, created_at)
+            VALUES (NULL, '', ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (row[2], row[3], row[4], row[5], row[6], row[7], row[12], row[14]))
+        c.execute("""
+            INSERT INTO campaign_leads (id, campaign_id, contact_id, score, source, is_active, email_status,
+                                        unsubscribe_token, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (row[0], row[1], c.lastrowid, row[8], row[9], row[10], row[11], row[13], row[14]))
+
+    # Dropping the table also drops its triggers; the old per-lead FTS index goes with it
+    c.execute("DROP TABLE leads")
+    c.execute("DROP TABLE IF EXISTS leads_fts")
+    conn.commit()
+
+def add_membership_cascade(conn):
+    """
+    Rebuild campaign_leads so deleting a campaign cascades to its memberships (SQLite can't
+    alter a foreign key in place). The leads view and the triggers on campaign_leads are
+    dropped with the old table and recreated by the schema scripts that follow. Memberships
+    pointing at campaigns that no longer exist are dropped. Returns False if already done.
+    """
+    c = conn.cursor()
+    on_delete = {row[3]: row[6] for row in c.execute("PRAGMA foreign_key_list(campaign_leads)")}
+    if on_delete.get('campaign_id') == 'CASCADE':
+        return False
+
+    conn.commit()
+    # Keep views/triggers that mention campaign_leads untouched while the table is swapped
+    c.execute("PRAGMA legacy_alter_table = ON")
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'campaign_leads'")
+    row = c.fetchone()
+    next_id = row[0] if row else 0
+    c.execute("DROP VIEW IF EXISTS leads")
+    c.execute(CONTACTS_TABLES[1].replace('campaign_leads', 'campaign_leads_new', 1))
+    c.execute("""
+        INSERT INTO campaign_leads_new (id, campaign_id, contact_id, score, source, is_active, email_status,
+                                        unsubscribe_token, created_at)
+        SELECT id, campaign_id, contact_id, score, source, is_active, email_status, unsubscribe_token, created_at
+        FROM campaign_leads
+        WHERE campaign_id IS NULL OR campaign_id IN (SELECT id FROM campaigns)
+    """)
+    copied = c.rowcount
+    orphaned = c.execute("SELECT COUNT(*) FROM campaign_leads").fetchone()[0] - copied
+    c.execute("DROP TABLE campaign_leads")
+    c.execute("ALTER TABLE campaign_leads_new RENAME TO campaign_leads")
+    # Don't hand out ids of deleted memberships again
+    c.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'campaign_leads'", (next_id,))
+    for statement in CONTACTS_TABLES[2:]:
+        c.execute(statement)
+    conn.commit()
+    c.execute("PRAGMA legacy_alter_table = OFF")
+    if orphaned:
+        logger.info("migration_dropped_orphan_memberships count=%d", orphaned)
+    return True
+
+# --- CARDINALITY SKETCHES FOR MERGE PREVIEWS ---
+# One HyperLogLog sketch of canonical emails per campaign, so merge previews can estimate
+# union / duplicate counts without reading every lead. Upload and merge paths fold new
+# emails in as they insert; anything HLL cannot absorb (deletes, moves, email edits)
+# drops the sketch via triggers and it is rebuilt on the next preview. A lead_count that
+# no longer matches the campaign (rows inserted outside the app) also forces a rebuild.
+HLL_PRECISION = 12                      # 4096 one-byte registers, ~1.6% standard error
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_VALUE_BITS = 64 - HLL_PRECISION
+HLL_INVERSE_POWERS = [2.0 ** -r for r in range(HLL_VALUE_BITS + 2)]
+
+SKETCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaign_sketches (
+    campaign_id INTEGER PRIMARY KEY,
+    lead_count INTEGER NOT NULL,
+    registers BLOB NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS campaign_leads_sketch_delete AFTER DELETE ON campaign_leads BEGIN
+    DELETE FROM campaign_sketches WHERE campaign_id = OLD.campaign_id;
+END;
+CREATE TRIGGER IF NOT EXISTS campaign_leads_sketch_move
+AFTER UPDATE OF campaign_id, contact_id ON campaign_leads BEGIN
+    DELETE FROM campaign_sketches WHERE campaign_id IN (OLD.campaign_id, NEW.campaign_id);
+END;
+CREATE TRIGGER IF NOT EXISTS contacts_sketch_email AFTER UPDATE OF email_key ON contacts
+WHEN OLD.email_key IS NOT NEW.email_key BEGIN
+    DELETE FROM campaign_sketches
+    WHERE campaign_id IN (SELECT campaign_id FROM campaign_leads WHERE contact_id = NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS campaigns_sketch_delete AFTER DELETE ON campaigns BEGIN
+    DELETE FROM campaign_sketches WHERE campaign_id = OLD.id;
+END;
+"""
+
+def hll_add(registers, emails):
+    """Fold emails (by canonical key) into a bytearray of HLL registers"""
+    for email in emails:
+        key = canonical_email_key(email)
+        if not key:
+            continue
+        h = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = h >> HLL_VALUE_BITS
+        rank = HLL_VALUE_BITS - (h & ((1 << HLL_VALUE_BITS) - 1)).bit_length() + 1
+        if rank > registers[index]:
+            registers[index] = rank
+    return registers
+
+def hll_union(register_sets):
+    """Register-wise max: the sketch of the union of the underlying sets"""
+    register_sets = list(register_sets)
+    if not register_sets:
+        return bytes(HLL_REGISTERS)
+    if len(register_sets) == 1:
+        return bytes(register_sets[0])
+    return bytes(map(max, *register_sets))
+
+def hll_estimate(registers):
+    """Distinct-count estimate with the small-range (linear counting) correction"""
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum(map(HLL_INVERSE_POWERS.__getitem__, registers))
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return estimate
+
+def _build_campaign_sketch(cursor, campaign_id):
+    cursor.execute("""
+        SELECT ct.email FROM campaign_leads cl JOIN contacts ct ON ct.id = cl.contact_id
+        WHERE cl.campaign_id = ?
+    """, (campaign_id,))
+    emails = [row[0] for row in cursor.fetchall()]
+    return len(emails), hll_add(bytearray(HLL_REGISTERS), emails)
+
+def load_campaign_sketches(cursor, lead_counts):
+    """
+    Sketches for {campaign_id: current lead count}, rebuilding missing or stale ones.
+    Returns ({campaign_id: registers}, number rebuilt); the caller commits rebuilds.
+    """
+    campaign_ids = list(lead_counts)
+    if not campaign_ids:
+        return {}, 0
+    placeholders = ','.join('?' for _ in campaign_ids)
+    cursor.execute(f"""
+        SELECT campaign_id, lead_count, registers FROM campaign_sketches
+        WHERE campaign_id IN ({placeholders})
+    """, campaign_ids)
+    stored = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    sketches = {}
+    rebuilt = 0
+    for campaign_id, lead_count in lead_counts.items():
+        entry = stored.get(campaign_id)
+        if entry and entry[0] == lead_count:
+            sketches[campaign_id] = entry[1]
+            continue
+        lead_count, registers = _build_campaign_sketch(cursor, campaign_id)
+        cursor.execute("INSERT OR REPLACE INTO campaign_sketches (campaign_id, lead_count, registers) VALUES (?, ?, ?)",
+                       (campaign_id, lead_count, bytes(registers)))
+        sketches[campaign_id] = bytes(registers)
+        rebuilt += 1
+    return sketches, rebuilt
+
+def sketch_add_leads(cursor, campaign_id, emails):
+    """Incrementally fold just-inserted leads into the campaign's sketch (same transaction)"""
+    emails = list(emails)
+    cursor.execute("SELECT COUNT(*) FROM campaign_leads WHERE campaign_id = ?", (campaign_id,))
+    current_count = cursor.fetchone()[0]
+    cursor.execute("SELECT lead_count, registers FROM campaign_sketches WHERE campaign_id = ?", (campaign_id,))
+    row = cursor.fetchone()
+
+    if row and row[0] + len(emails) == current_count:
+        registers = bytearray(row[1])
+    elif current_count == len(emails):
+        registers = bytearray(HLL_REGISTERS)
+    else:
+        # Sketch is out of step with the table; leave it to be rebuilt lazily
+        cursor.execute("DELETE FROM campaign_sketches WHERE campaign_id = ?", (campaign_id,))
+        return
+    cursor.execute("INSERT OR REPLACE INTO campaign_sketches (campaign_id, lead_count, registers) VALUES (?, ?, ?)",
+                   (campaign_id, current_count, bytes(hll_add(registers, emails))))
+
+# --- CAMPAIGN OVERLAP INDEX ---
+# Shared-contact counts for every pair of campaigns (campaign_a < campaign_b), kept current
+# by membership triggers so process_confirmation can rank all prior sends at once.
+# Archived campaigns count through archived_memberships.
+# Contacts are keyed by normalized email, so "shared contacts" = shared normalized emails.
+# Membership moves (UPDATE of campaign_id/contact_id) are not tracked incrementally; they
+# mark the index stale and it is rebuilt on the next read.
+OVERLAP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaign_overlap (
+    campaign_a INTEGER NOT NULL,
+    campaign_b INTEGER NOT NULL,
+    shared INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (campaign_a, campaign_b)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_campaign_overlap_b ON campaign_overlap(campaign_b);
+CREATE INDEX IF NOT EXISTS idx_campaign_leads_contact_campaign ON campaign_leads(contact_id, campaign_id);
+INSERT OR IGNORE INTO app_state (key, value) VALUES ('overlap_stale', 1);
+
+-- Only the first membership of a contact in a campaign changes the pair counts
+CREATE TRIGGER IF NOT EXISTS campaign_leads_overlap_insert AFTER INSERT ON campaign_leads
+WHEN NOT EXISTS (SELECT 1 FROM campaign_leads
+                 WHERE contact_id = NEW.contact_id AND campaign_id = NEW.campaign_id AND id != NEW.id)
+BEGIN
+    INSERT INTO campaign_overlap (campaign_a, campaign_b, shared)
+    SELECT MIN(NEW.campaign_id, other.campaign_id), MAX(NEW.campaign_id, other.campaign_id), 1
+    FROM (SELECT campaign_id FROM campaign_leads
+          WHERE contact_id = NEW.contact_id AND campaign_id != NEW.campaign_id
+          UNION
+          SELECT campaign_id FROM archived_memberships
+          WHERE contact_id = NEW.contact_id AND campaign_id != NEW.campaign_id) AS other
+    WHERE 1
+    ON CONFLICT (campaign_a, campaign_b) DO UPDATE SET shared = shared + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS campaign_leads_overlap_delete AFTER DELETE ON campaign_leads
+WHEN NOT EXISTS (SELECT 1 FROM campaign_leads
+                 WHERE contact_id = OLD.contact_id AND campaign_id = OLD.campaign_id)
+BEGIN
+    UPDATE campaign_overlap SET shared = shared - 1
+    WHERE (campaign_a, campaign_b) IN (
+        SELECT MIN(OLD.campaign_id, campaign_id), MAX(OLD.campaign_id, campaign_id)
+        FROM campaign_leads WHERE contact_id = OLD.contact_id AND campaign_id != OLD.campaign_id
+        UNION
+        SELECT MIN(OLD.campaign_id, campaign_id), MAX(OLD.campaign_id, campaign_id)
+        FROM archived_memberships WHERE contact_id = OLD.contact_id AND campaign_id != OLD.campaign_id
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS campaign_leads_overlap_move AFTER UPDATE OF campaign_id, contact_id ON campaign_leads
+WHEN OLD.campaign_id IS NOT NEW.campaign_id OR OLD.contact_id IS NOT NEW.contact_id
+BEGIN
+    UPDATE app_state SET value = 1 WHERE key = 'overlap_stale';
+END;
+
+CREATE TRIGGER IF NOT EXISTS campaigns_overlap_delete AFTER DELETE ON campaigns BEGIN
+    DELETE FROM campaign_overlap WHERE campaign_a = OLD.id OR campaign_b = OLD.id;
+END;
+"""
+
+def rebuild_campaign_overlap(cursor):
+    """Recompute every pair count from campaign_leads and clear the stale flag"""
+    cursor.execute("DELETE FROM campaign_overlap")
+    cursor.execute("""
+        WITH memberships AS (SELECT contact_id, campaign_id FROM campaign_leads
+                             UNION
+                             SELECT contact_id, campaign_id FROM archived_memberships)
+        INSERT INTO campaign_overlap (campaign_a, campaign_b, shared)
+        SELECT a.campaign_id, b.campaign_id, COUNT(*)
+        FROM memberships a
+        JOIN memberships b ON b.contact_id = a.contact_id AND b.campaign_id > a.campaign_id
+        GROUP BY a.campaign_id, b.campaign_id
+    """)
+    cursor.execute("UPDATE app_state SET value = 0 WHERE key = 'overlap_stale'")
+
+def get_campaign_overlaps(cursor, campaign_id):
+    """{other_campaign_id: shared contact count} for one campaign, rebuilding the index if stale"""
+    cursor.execute("SELECT value FROM app_state WHERE key = 'overlap_stale'")
+    row = cursor.fetchone()
+    if row and row[0]:
+        rebuild_campaign_overlap(cursor)
+        get_db().commit()
+    cursor.execute("""
+        SELECT campaign_b, shared FROM campaign_overlap WHERE campaign_a = ? AND shared > 0
+        UNION ALL
+        SELECT campaign_a, shared FROM campaign_overlap WHERE campaign_b = ? AND shared > 0
+    """, (campaign_id, campaign_id))
+    return dict(cursor.fetchall())
+
+# --- UPLOAD IDEMPOTENCY ---
+# n8n retries /upload after timeouts. Each successful upload stores its response under a key:
+# "key:<Idempotency-Key header>" when the caller sends one, otherwise "content:<hash>" of the
+# campaign name and canonicalized leads. A repeat within IDEMPOTENCY_TTL_SECONDS gets the
+# stored response back instead of a second campaign.
+IDEMPOTENCY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_idempotency (
+    key TEXT PRIMARY KEY,
+    campaign_id INTEGER NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_upload_idempotency_created ON upload_idempotency(created_at);
+CREATE INDEX IF NOT EXISTS idx_upload_idempotency_campaign ON upload_idempotency(campaign_id);
+
+-- Deleting the campaign frees its keys, so the same upload can create it again
+CREATE TRIGGER IF NOT EXISTS campaigns_idempotency_delete AFTER DELETE ON campaigns BEGIN
+    DELETE FROM upload_idempotency WHERE campaign_id = OLD.id;
+END;
+"""
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+_DIGEST_MODULUS = 1 << 128
+
+def lead_fingerprint(lead):
+    """128-bit hash of a normalized lead, insensitive to email aliases and name/company case"""
+    canonical = '\x1f'.join((
+        canonical_email_key(lead['email']),
+        lead['first_name'].lower(),
+        lead['last_name'].lower(),
+        lead['company'].lower(),
+        str(lead['domain'] or '').lower(),
+        str(lead['score']),
+        str(lead['label'] or ''),
+        str(lead['description'] or ''),
+        str(lead['source'] or ''),
+    ))
+    return int.from_bytes(hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).digest(), 'big')
+
+def upload_content_key(campaign_name, leads_digest):
+    """
+    Content key for an upload. leads_digest is the sum of lead fingerprints mod 2**128, which can
+    be accumulated while streaming and does not depend on lead order.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(campaign_name).strip().lower().encode('utf-8'))
+    digest.update(b'\x00')
+    digest.update(leads_digest.to_bytes(16, 'big'))
+    return f"content:{digest.hexdigest()}"
+
+def lookup_idempotent_upload(cursor, key):
+    """Stored response dict for a live key, or None"""
+    cursor.execute("SELECT response FROM upload_idempotency WHERE key = ? AND created_at >= ?",
+                   (key, time.time() - app.config['IDEMPOTENCY_TTL_SECONDS']))
+    row = cursor.fetchone()
+    return json.loads(row[0]) if row else None
+
+def store_idempotent_upload(cursor, key, campaign_id, response_data):
+    """
+    Record the response in the caller's transaction. Returns False if a concurrent request
+    stored the same key first; the caller should roll back and replay that one instead.
+    """
+    now = time.time()
+    cursor.execute("DELETE FROM upload_idempotency WHERE created_at < ?",
+                   (now - app.config['IDEMPOTENCY_TTL_SECONDS'],))
+    cursor.execute("""
+        INSERT INTO upload_idempotency (key, campaign_id, response, created_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (key) DO NOTHING
+    """, (key, campaign_id, json.dumps(response_data), now))
+    return cursor.rowcount == 1
+
+# --- ARCHIVAL TIER: COLD STORE FOR OLD SENT CAMPAIGNS ---
+# Archived campaigns keep their campaigns row (archived_at set, lead counts cached) but their
+# campaign_leads rows move to a separate SQLite file, attached as "archive" on demand:
+#   archived_campaigns: one zlib-compressed JSON payload per campaign, column-major
+#   archived_tokens:    unsubscribe token -> contact, so old unsubscribe links keep working
+# The main database keeps only archived_memberships, a compact (contact, campaign, status)
+# index that duplicate checks, unsubscribe suppression and the overlap index read.
+# Contacts are never archived. Opening an archived campaign rehydrates it.
+ARCHIVE_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived_memberships (
+    contact_id INTEGER NOT NULL,
+    membership_id INTEGER NOT NULL,
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
+    email_status TEXT,
+    PRIMARY KEY (contact_id, membership_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_archived_memberships_campaign ON archived_memberships(campaign_id);
+"""
+
+ARCHIVE_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive.archived_campaigns (
+    campaign_id INTEGER PRIMARY KEY,
+    archived_at TIMESTAMP,
+    lead_count INTEGER NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archive.archived_tokens (
+    unsubscribe_token TEXT PRIMARY KEY,
+    campaign_id INTEGER NOT NULL,
+    membership_id INTEGER NOT NULL,
+    contact_id INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS archive.idx_archived_tokens_campaign ON archived_tokens(campaign_id);
+"""
+
+ARCHIVE_COLUMNS = ('id', 'contact_id', 'score', 'source', 'is_active', 'email_status', 'unsubscribe_token', 'created_at')
+
+def archive_db_path(main_path):
+    """Archive store for a shard: ARCHIVE_DB_PATH for the default database, else <shard stem>_archive.db"""
+    configured = app.config.get('ARCHIVE_DB_PATH')
+    if configured and os.path.abspath(main_path) == os.path.abspath(app.config['DB_PATH']):
+        return configured
+    return os.path.splitext(main_path)[0] + '_archive.db'
+
+def attach_archive(conn, create=True):
+    """ATTACH the archive store as "archive". Returns False if it doesn't exist and create is False."""
+    databases = {row[1]: row[2] for row in conn.execute("PRAGMA database_list")}
+    if 'archive' in databases:
+        return True
+    path = archive_db_path(databases['main'])
+    if not create and not os.path.exists(path):
+        return False
+    conn.commit()  # ATTACH can't run inside a transaction
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    conn.executescript(ARCHIVE_STORE_SCHEMA)
+    return True
+
+def archive_campaign(conn, campaign_id):
+    """Move one campaign's memberships to the archive store in a single transaction"""
+    attach_archive(conn)
+    conn.commit()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM campaign_leads WHERE campaign_id = ? ORDER BY id",
+                       (campaign_id,))
+        rows = cursor.fetchall()
+        columns = {name: [row[i] for row in rows] for i, name in enumerate(ARCHIVE_COLUMNS)}
+        payload = zlib.compress(json.dumps(columns, separators=(',', ':'), default=str).encode('utf-8'), 6)
+        now = datetime.now()
+        cursor.execute("INSERT OR REPLACE INTO archive.archived_campaigns VALUES (?, ?, ?, ?)",
+                       (campaign_id, now, len(rows), payload))
+        cursor.execute("""
+            INSERT OR IGNORE INTO archive.archived_tokens (unsubscribe_token, campaign_id, membership_id, contact_id)
+            SELECT unsubscribe_token, campaign_id, id, contact_id FROM campaign_leads
+            WHERE campaign_id = ? AND unsubscribe_token IS NOT NULL
+        """, (campaign_id,))
+        cursor.execute("""
+            INSERT OR REPLACE INTO archived_memberships (contact_id, membership_id, campaign_id, email_status)
+            SELECT contact_id, id, campaign_id, email_status FROM campaign_leads WHERE campaign_id = ?
+        """, (campaign_id,))
+
+        # The membership delete triggers decrement this campaign's overlap counts, but its
+        # contacts still count through archived_memberships: put the counts back afterwards
+        cursor.execute("SELECT campaign_a, campaign_b, shared FROM campaign_overlap WHERE campaign_a = ? OR campaign_b = ?",
+                       (campaign_id, campaign_id))
+        overlap_rows = cursor.fetchall()
+        cursor.execute("DELETE FROM campaign_leads WHERE campaign_id = ?", (campaign_id,))
+        cursor.execute("DELETE FROM campaign_overlap WHERE campaign_a = ? OR campaign_b = ?", (campaign_id, campaign_id))
+        cursor.executemany("INSERT INTO campaign_overlap (campaign_a, campaign_b, shared) VALUES (?, ?, ?)", overlap_rows)
+
+        cursor.execute("""
+            UPDATE campaigns SET archived_at = ?, archived_lead_count = ?, archived_active_count = ?,
+                                 generation = COALESCE(generation, 0) + 1
+            WHERE id = ?
+        """, (now, len(rows), sum(1 for active in columns['is_active'] if active == 1), campaign_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info("campaign_archived campaign_id=%d leads=%d payload_bytes=%d", campaign_id, len(rows), len(payload))
+    return len(rows)
+
+def rehydrate_campaign(conn, campaign_id):
+    """Move an archived campaign's memberships back into campaign_leads (same ids)"""
+    attach_archive(conn)
+    conn.commit()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute("SELECT payload FROM archive.archived_campaigns WHERE campaign_id = ?", (campaign_id,))
+        row = cursor.fetchone()
+        columns = json.loads(zlib.decompress(row[0])) if row else {name: [] for name in ARCHIVE_COLUMNS}
+        # Drop the frozen overlap counts: the membership insert triggers recount them
+        cursor.execute("DELETE FROM campaign_overlap WHERE campaign_a = ? OR campaign_b = ?", (campaign_id, campaign_id))
+        cursor.execute("DELETE FROM archived_memberships WHERE campaign_id = ?", (campaign_id,))
+        cursor.executemany(f"""
+            INSERT INTO campaign_leads (campaign_id, {', '.join(ARCHIVE_COLUMNS)})
+            VALUES (?, {', '.join('?' for _ in ARCHIVE_COLUMNS)})
+        """, [(campaign_id,) + values for values in zip(*(columns[name] for name in ARCHIVE_COLUMNS))])
+        cursor.execute("DELETE FROM archive.archived_tokens WHERE campaign_id = ?", (campaign_id,))
+        cursor.execute("DELETE FROM archive.archived_campaigns WHERE campaign_id = ?", (campaign_id,))
+        cursor.execute("""
+            UPDATE campaigns SET archived_at = NULL, archived_lead_count = NULL, archived_active_count = NULL,
+                                 rehydrated_at = ?, generation = COALESCE(generation, 0) + 1
+            WHERE id = ?
+        """, (datetime.now(), campaign_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info("campaign_rehydrated campaign_id=%d leads=%d", campaign_id, len(columns['id']))
+    return len(columns['id'])
+
+def ensure_campaigns_hot(campaign_ids):
+    """Rehydrate any archived campaigns among campaign_ids so the caller can read campaign_leads"""
+    ids = [int(cid) for cid in campaign_ids if str(cid).isdigit()]
+    if not ids:
+        return []
+    db = get_db()
+    placeholders = ','.join('?' for _ in ids)
+    archived = [row[0] for row in db.execute(
+        f"SELECT id FROM campaigns WHERE id IN ({placeholders}) AND archived_at IS NOT NULL", ids)]
+    for campaign_id in archived:
+        rehydrate_campaign(db, campaign_id)
+    return archived
+
+def archive_old_campaigns(conn):
+    """Archive sent campaigns last processed (and last rehydrated) more than ARCHIVE_AFTER_DAYS ago"""
+    cutoff = datetime.now() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+    campaign_ids = [row[0] for row in conn.execute("""
+        SELECT id FROM campaigns
+        WHERE processing_status = 'sent' AND archived_at IS NULL AND deleted_at IS NULL
+        AND last_processed_at < ? AND (rehydrated_at IS NULL OR rehydrated_at < ?)
+        ORDER BY last_processed_at
+    """, (cutoff, cutoff))]
+    for campaign_id in campaign_ids:
+        archive_campaign(conn, campaign_id)
+        time.sleep(app.config['PURGE_PAUSE_SECONDS'])
+    return len(campaign_ids)
+
+def find_archived_token(cursor, token):
+    """(membership_id, first_name, last_name, email, unsubscribe_status, contact_id) for an archived link"""
+    if not attach_archive(get_db(), create=False):
+        return None
+    cursor.execute("""
+        SELECT t.membership_id, ct.first_name, ct.last_name, ct.email, ct.unsubscribe_status, ct.id
+        FROM archive.archived_tokens t
+        JOIN contacts ct ON ct.id = t.contact_id
+        WHERE t.unsubscribe_token = ?
+    """, (token,))
+    return cursor.fetchone()
 
 # --- INIT DATABASE ---
-def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
+# Bump whenever run_migrations gains a step; databases already at this version skip it
+SCHEMA_VERSION = 8
+
+def init_db(db_path=None):
+    """Bring the schema up to date. Returns False (after one PRAGMA read) when nothing is pending."""
+    db_path = db_path or app.config['DB_PATH']
+    conn = sqlite3.connect(db_path)
+    try:
+        current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+    if current_version >= SCHEMA_VERSION:
+        return False
+    run_migrations(db_path)
+    return True
+
+def run_migrations(db_path):
+    """Idempotent schema setup and upgrades for every version, ending at SCHEMA_VERSION"""
+    with sqlite3.connect(db_path) as conn:
         c = conn.cursor()
         c.execute("""CREATE TABLE IF NOT EXISTS campaigns (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -94,59 +2374,363 @@ def init_db():
         # Add new column for unsubscribe status
         try:
             c.execute("ALTER TABLE leads ADD COLUMN unsubscribe_status TEXT DEFAULT 'subscribed'")
-            print("✅ Added unsubscribe_status column to leads table")
+            logger.info("migration_added_column table=leads column=unsubscribe_status")
         except sqlite3.OperationalError:
-            print("ℹ️ unsubscribe_status column already exists")
+            logger.debug("migration_column_exists column=unsubscribe_status")
             
         # Add unique token column for unsubscribe links
         try:
             c.execute("ALTER TABLE leads ADD COLUMN unsubscribe_token TEXT")
-            print("✅ Added unsubscribe_token column to leads table")
+            logger.info("migration_added_column table=leads column=unsubscribe_token")
         except sqlite3.OperationalError:
-            print("ℹ️ unsubscribe_token column already exists")
+            logger.debug("migration_column_exists column=unsubscribe_token")
+
+        # Add this inside your init_db() function after the existing ALTER TABLE statements
+        try:
+            c.execute("ALTER TABLE leads ADD COLUMN email_status TEXT DEFAULT 'subscribed'")
+            logger.info("migration_added_column table=leads column=email_status")
+        except sqlite3.OperationalError:
+            logger.debug("migration_column_exists column=email_status")
+            # Add this inside your init_db() function after existing ALTER TABLE statements
+        try:
+            c.execute("ALTER TABLE campaigns ADD COLUMN description TEXT")
+            logger.info("migration_added_column table=campaigns column=description")
+        except sqlite3.OperationalError:
+            logger.debug("migration_column_exists column=description")
+            # Ensure existing distributed lists are marked correctly
+        try:
+            c.execute("UPDATE campaigns SET is_merged = 0 WHERE is_merged IS NULL")
+            logger.debug("migration_backfilled column=is_merged rows=%d", c.rowcount)
+        except sqlite3.OperationalError:
+            pass
+
+            # Add processing tracking columns
+        try:
+            c.execute("ALTER TABLE campaigns ADD COLUMN last_processed_at TIMESTAMP")
+            logger.info("migration_added_column table=campaigns column=last_processed_at")
+        except sqlite3.OperationalError:
+            logger.debug("migration_column_exists column=last_processed_at")
+        try:
+            c.execute("ALTER TABLE campaigns ADD COLUMN process_count INTEGER DEFAULT 0")
+            logger.info("migration_added_column table=campaigns column=process_count")
+        except sqlite3.OperationalError:
+            logger.debug("migration_column_exists column=process_count")
+        try:
+            c.execute("ALTER TABLE campaigns ADD COLUMN processing_status TEXT DEFAULT 'not_sent'")
+            logger.info("migration_added_column table=campaigns column=processing_status")
+        except sqlite3.OperationalError:
+            logger.debug("migration_column_exists column=processing_status")
+
+        # Generation counters for ETag / 304 handling (see get_generation)
+        try:
+            c.execute("ALTER TABLE campaigns ADD COLUMN generation INTEGER DEFAULT 0")
+            logger.info("migration_added_column table=campaigns column=generation")
+        except sqlite3.OperationalError:
+            logger.debug("migration_column_exists column=generation")
+        c.execute("""CREATE TABLE IF NOT EXISTS app_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )""")
+        c.execute("INSERT OR IGNORE INTO app_state (key, value) VALUES ('generation', 0)")
+
+        # Soft delete: set by delete_campaign, the row and its leads are removed by CampaignPurger
+        try:
+            c.execute("ALTER TABLE campaigns ADD COLUMN deleted_at TIMESTAMP")
+            logger.info("migration_added_column table=campaigns column=deleted_at")
+        except sqlite3.OperationalError:
+            logger.debug("migration_column_exists column=deleted_at")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_deleted ON campaigns(deleted_at) WHERE deleted_at IS NOT NULL")
+
+        # Archival tier: stub columns on campaigns (see ARCHIVAL TIER)
+        for column in ('archived_at TIMESTAMP', 'archived_lead_count INTEGER', 'archived_active_count INTEGER',
+                       'rehydrated_at TIMESTAMP'):
+            try:
+                c.execute(f"ALTER TABLE campaigns ADD COLUMN {column}")
+                logger.info("migration_added_column table=campaigns column=%s", column.split()[0])
+            except sqlite3.OperationalError:
+                logger.debug("migration_column_exists column=%s", column.split()[0])
+        conn.commit()
+
+        # Split the wide leads table into contacts + campaign memberships (one-time)
+        c.execute("SELECT type FROM sqlite_master WHERE name = 'leads'")
+        if c.fetchone()[0] == 'table':
+            migrate_leads_to_contacts(conn)
+            logger.info("migration_contacts_split leads_view=1")
+        else:
+            logger.debug("migration_contacts_split already_done=1")
+        if add_membership_cascade(conn):
+            logger.info("migration_membership_cascade rebuilt=1")
+        c.executescript(CONTACTS_SCHEMA)
+        c.executescript(SKETCH_SCHEMA)
+        c.executescript(ARCHIVE_INDEX_SCHEMA)
+        # Overlap triggers from before the archival tier don't see archived memberships
+        c.execute("SELECT sql FROM sqlite_master WHERE name = 'campaign_leads_overlap_insert'")
+        row = c.fetchone()
+        if row and 'archived_memberships' not in row[0]:
+            c.execute("DROP TRIGGER campaign_leads_overlap_insert")
+            c.execute("DROP TRIGGER IF EXISTS campaign_leads_overlap_delete")
+            logger.info("migration_overlap_triggers updated=1")
+        c.executescript(OVERLAP_SCHEMA)
+        c.executescript(IDEMPOTENCY_SCHEMA)
+        c.executescript(DELIVERY_SCHEMA)
+        c.executescript(AUDIT_SCHEMA)
+        c.executescript(IMPORT_REPORT_SCHEMA)
+        c.executescript(IMPORT_PROFILE_SCHEMA)
+
+        # Full-text search index over contacts (external content, kept in sync by triggers)
+        try:
+            c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'contacts_fts'")
+            fts_exists = c.fetchone() is not None
+            c.executescript(CONTACTS_FTS_SCHEMA)
+            if not fts_exists:
+                c.execute("INSERT INTO contacts_fts (contacts_fts) VALUES ('rebuild')")
+                logger.info("migration_fts_index built=1")
+            else:
+                logger.debug("migration_fts_index already_exists=1")
+        except sqlite3.OperationalError as e:
+            logger.warning("fts_unavailable error=%s (SQLite built without FTS5?)", e)
+
+        # Purged campaigns give their pages back to the OS via PRAGMA incremental_vacuum;
+        # switching an existing database over takes one full VACUUM
+        if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.commit()
+            c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            c.execute("VACUUM")
+            logger.info("migration_auto_vacuum mode=incremental")
+
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    logger.info("migrations_applied db=%s schema_version=%d", db_path, SCHEMA_VERSION)
+
+# --- DUPLICATE DETECTION: EMAIL CANONICALIZATION AND FUZZY MATCHING ---
+GMAIL_DOMAINS = {'gmail.com', 'googlemail.com'}
+SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for c in letters}
+
+def canonical_email_key(email, rules=None):
+    """
+    Normalize an email for duplicate detection: lowercase/trim, optionally strip
+    +tags and fold Gmail dots and aliases. With both rules off (the default) this is the
+    same identity as contacts.email_key. Returns '' for empty input.
+    """
+    email = (email or '').strip().lower()
+    if '@' not in email:
+        return email
+    rules = rules or app.config['DEDUP_RULES']
+    local, _, domain = email.rpartition('@')
+    if domain in GMAIL_DOMAINS and rules.get('fold_gmail_dots'):
+        domain = 'gmail.com'
+        local = local.replace('.', '')
+    if rules.get('strip_plus_tags') and '+' in local:
+        local = local.split('+', 1)[0]
+    return f"{local}@{domain}"
+
+def soundex(name):
+    """American Soundex code ('R163' for Robert/Rupert); '' for names without letters"""
+    letters = [ch for ch in (name or '').lower() if 'a' <= ch <= 'z']
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0], '')
+    for ch in letters[1:]:
+        digit = SOUNDEX_CODES.get(ch, '')
+        if digit != '0' and digit != previous:
+            code += digit
+        if ch not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+def _normalize_company(company):
+    company = re.sub(r'[^a-z0-9 ]', '', (company or '').lower())
+    return re.sub(r'\b(inc|llc|ltd|gmbh|corp|co|company|the)\b', '', company).strip()
+
+def _email_domain(lead):
+    email = (lead.get('email') or '').lower()
+    return email.rpartition('@')[2] if '@' in email else (lead.get('domain') or '').lower().strip()
+
+def _name_similarity(a, b):
+    return _cached_name_similarity((a or '').lower().strip(), (b or '').lower().strip())
+
+@functools.lru_cache(maxsize=65536)
+def _cached_name_similarity(a, b):
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    # "J" vs "John"
+    if (len(a) == 1 or len(b) == 1) and a[0] == b[0]:
+        return 0.8
+    import difflib
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+def _local_part_matches_name(local, first, last):
+    """jdoe / johndoe / doejohn / johnd style local parts (letters only) for the given name"""
+    if not local or not first or not last:
+        return False
+    return local in {first + last, last + first, first[0] + last, first + last[0], last + first[0]}
+
+def _match_features(lead):
+    """Per-lead values match scoring needs, computed once instead of per pair"""
+    return {
+        'first': (lead.get('first_name') or '').lower().strip(),
+        'last': (lead.get('last_name') or '').lower().strip(),
+        'company': _normalize_company(lead.get('company')),
+        'domain': _email_domain(lead),
+        'local': re.sub(r'[^a-z]', '', (lead.get('email') or '').lower().partition('@')[0]),
+    }
+
+def _score_features(a, b):
+    last = _name_similarity(a['last'], b['last'])
+    if last < 0.75:
+        return 0.0
+    first = _name_similarity(a['first'], b['first'])
+    same_org = (a['company'] and a['company'] == b['company']) or (a['domain'] and a['domain'] == b['domain'])
+
+    score = 0.4 * last + 0.3 * first + (0.2 if same_org else 0.0)
+    if (_local_part_matches_name(a['local'], b['first'], b['last'])
+            or _local_part_matches_name(b['local'], a['first'], a['last'])):
+        score += 0.1
+    return round(min(score, 1.0), 3)
+
+def match_score(a, b):
+    """
+    Confidence (0..1) that two leads are the same person, from last/first name similarity,
+    shared company or email domain and email local parts that spell the other's name.
+    """
+    return _score_features(_match_features(a), _match_features(b))
+
+def blocking_keys(lead):
+    """Keys that put plausible duplicates in the same bucket; only bucket-mates are compared"""
+    last_code = soundex(lead.get('last_name'))
+    if not last_code:
+        return []
+    keys = []
+    domain = _email_domain(lead)
+    if domain and domain not in GMAIL_DOMAINS:
+        keys.append(('domain', domain, last_code))
+    company = _normalize_company(lead.get('company'))
+    if company:
+        keys.append(('company', company, last_code))
+    first_code = soundex(lead.get('first_name'))
+    if first_code:
+        keys.append(('name', first_code[0], last_code))
+    return keys
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+def find_duplicate_clusters(leads_data, rules=None):
+    """
+    Group leads that are likely the same person.
+    Exact canonical-email matches link with confidence 1.0; with fuzzy matching enabled,
+    leads sharing a blocking key are scored pairwise and linked at report_threshold or above.
+    Returns clusters (largest first) as dicts: members (indexes into leads_data), confidence, reasons.
+    """
+    rules = rules or app.config['DEDUP_RULES']
+    uf = _UnionFind(len(leads_data))
+    link_scores = {}
+    reasons = {}
 
-        # Add this inside your init_db() function after the existing ALTER TABLE statements
-        try:
-            c.execute("ALTER TABLE leads ADD COLUMN email_status TEXT DEFAULT 'subscribed'")
-            print("✅ Added email_status column to leads table")
-        except sqlite3.OperationalError:
-            print("ℹ️ email_status column already exists")
-            # Add this inside your init_db() function after existing ALTER TABLE statements
-        try:
-            c.execute("ALTER TABLE campaigns ADD COLUMN description TEXT")
-            print("✅ Added description column to campaigns table")
-        except sqlite3.OperationalError:
-            print("ℹ️ description column already exists")
-            # Ensure existing distributed lists are marked correctly
-        try:
-            c.execute("UPDATE campaigns SET is_merged = 0 WHERE is_merged IS NULL")
-            print("✅ Updated existing campaigns with is_merged = 0")
-        except sqlite3.OperationalError:
-            pass
+    def link(i, j, score, reason):
+        uf.union(i, j)
+        pair = (min(i, j), max(i, j))
+        if score > link_scores.get(pair, 0):
+            link_scores[pair] = score
+            reasons[pair] = reason
 
-            # Add processing tracking columns
-        try:
-            c.execute("ALTER TABLE campaigns ADD COLUMN last_processed_at TIMESTAMP")
-            print("✅ Added last_processed_at column to campaigns table")
-        except sqlite3.OperationalError:
-            print("ℹ️ last_processed_at column already exists")
-        try:
-            c.execute("ALTER TABLE campaigns ADD COLUMN process_count INTEGER DEFAULT 0")
-            print("✅ Added process_count column to campaigns table")
-        except sqlite3.OperationalError:
-            print("ℹ️ process_count column already exists")
-        try:
-            c.execute("ALTER TABLE campaigns ADD COLUMN processing_status TEXT DEFAULT 'not_sent'")
-            print("✅ Added processing_status column to campaigns table")
-        except sqlite3.OperationalError:
-            print("ℹ️ processing_status column already exists")
+    first_by_email = {}
+    for i, lead in enumerate(leads_data):
+        key = canonical_email_key(lead.get('email'), rules)
+        if not key:
+            continue
+        if key in first_by_email:
+            link(first_by_email[key], i, 1.0, 'email')
+        else:
+            first_by_email[key] = i
 
-        conn.commit()
+    if rules.get('fuzzy_matching'):
+        threshold = rules.get('report_threshold', 0.8)
+        max_block = rules.get('max_block_size', 500)
+        features = [_match_features(lead) for lead in leads_data]
+        blocks = {}
+        for i, lead in enumerate(leads_data):
+            for key in blocking_keys(lead):
+                blocks.setdefault(key, []).append(i)
+        # Uniform data (one company, one surname) can still make every block large;
+        # stop scoring once the budget is spent rather than going quadratic
+        budget = rules.get('max_comparisons', 200000)
+        compared = set()
+        for members in sorted(blocks.values(), key=len):
+            if len(members) < 2 or len(members) > max_block:
+                continue
+            if len(compared) >= budget:
+                break
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pair = (members[x], members[y])
+                    if pair in compared:
+                        continue
+                    compared.add(pair)
+                    score = _score_features(features[pair[0]], features[pair[1]])
+                    if score >= threshold:
+                        link(pair[0], pair[1], score, 'fuzzy')
+
+    grouped = {}
+    for i in range(len(leads_data)):
+        grouped.setdefault(uf.find(i), []).append(i)
+
+    # Cluster confidence is its weakest link
+    weakest = {}
+    cluster_reasons = {}
+    for pair, score in link_scores.items():
+        root = uf.find(pair[0])
+        weakest[root] = min(score, weakest.get(root, 1.0))
+        cluster_reasons.setdefault(root, set()).add(reasons[pair])
+
+    clusters = []
+    for root, members in grouped.items():
+        if len(members) < 2:
+            continue
+        clusters.append({
+            'members': members,
+            'confidence': round(weakest.get(root, 1.0), 3),
+            'reasons': sorted(cluster_reasons.get(root, ())),
+        })
+    clusters.sort(key=lambda c: (-len(c['members']), -c['confidence']))
+    return clusters
+
+def describe_clusters(leads_data, clusters, limit=50):
+    """JSON-friendly cluster summary (emails and names) for API responses"""
+    return [{
+        'confidence': cluster['confidence'],
+        'reasons': cluster['reasons'],
+        'leads': [{
+            'email': leads_data[i].get('email'),
+            'first_name': leads_data[i].get('first_name'),
+            'last_name': leads_data[i].get('last_name'),
+            'company': leads_data[i].get('company'),
+        } for i in cluster['members']]
+    } for cluster in clusters[:limit]]
+
+def fuzzy_only_clusters(clusters):
+    """Clusters that exact/canonical email dedup does not already collapse"""
+    return [c for c in clusters if c['reasons'] != ['email']]
 
 # --- UTILITY FUNCTIONS ---
 def remove_duplicate_leads(leads_data):
     """
-    Remove duplicate leads based on email address
+    Remove duplicate leads based on canonical email address (see canonical_email_key)
     Returns unique leads and duplicate count
     """
     seen_emails = set()
@@ -154,7 +2738,7 @@ def remove_duplicate_leads(leads_data):
     duplicate_count = 0
     
     for lead in leads_data:
-        email = lead.get('email', '').lower().strip()
+        email = canonical_email_key(lead.get('email'))
         if email and email not in seen_emails:
             seen_emails.add(email)
             unique_leads.append(lead)
@@ -165,14 +2749,14 @@ def remove_duplicate_leads(leads_data):
 
 def remove_duplicate_leads_with_status(leads_data):
     """
-    Remove duplicate leads based on email address while preserving the LATEST email status
+    Remove duplicate leads based on canonical email address while preserving the LATEST email status
     Returns unique leads and duplicate count
     """
     email_map = {}
     duplicate_count = 0
     
     for lead in leads_data:
-        email = lead.get('email', '').lower().strip()
+        email = canonical_email_key(lead.get('email'))
         if not email:
             continue
             
@@ -218,6 +2802,375 @@ def get_campaign_profile_count(campaign_id):
     count = cursor.fetchone()
     return count[0] if count else 0
 
+# --- OPERATION PROGRESS: SERVER-SENT EVENTS ---
+# send_to_n8n, merge_campaigns and upload_csv register an operation while they run and
+# publish progress events from the request doing the work; pages pass a client-generated
+# operation_id with the form and watch /api/operations/<id>/events until the post returns.
+# A second submission of the same job (same campaign, same merge set, same CSV list name)
+# while one is in flight is rejected. The registry is per process: with several worker
+# processes the event stream must be served by the worker running the job (sticky sessions).
+OPERATION_ID = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+OPERATION_RETENTION_SECONDS = 300   # finished operations stay readable for late subscribers
+OPERATION_STALE_SECONDS = 1800      # an in-flight operation silent this long no longer blocks resubmits
+SSE_KEEPALIVE_SECONDS = 15
+SSE_START_WAIT_SECONDS = 30         # the stream may open before the form post registers its operation
+PROGRESS_EVERY_ROWS = 1000
+
+class OperationInProgress(Exception):
+    def __init__(self, operation):
+        super().__init__(f"{operation.kind} already in progress")
+        self.operation = operation
+
+class Operation:
+    """One running job and its events: (seq, event, data) with event 'progress', 'done' or 'failed'"""
+
+    def __init__(self, tracker, operation_id, kind, key):
+        self.tracker = tracker
+        self.id = operation_id
+        self.kind = kind
+        self.key = key
+        self.events = []
+        self.finished = False
+        self.updated_at = time.monotonic()
+
+    def progress(self, stage, **data):
+        self.tracker.publish(self, 'progress', dict(data, stage=stage))
+
+    def done(self, message, redirect=None):
+        self.tracker.publish(self, 'done', {'message': message, 'redirect': redirect})
+
+    def fail(self, message):
+        self.tracker.publish(self, 'failed', {'message': message})
+
+    def close(self):
+        """Finish with 'failed' if the job ended without reporting an outcome (e.g. an exception)"""
+        if not self.finished:
+            self.fail('Operation ended unexpectedly')
+
+class OperationTracker:
+    """In-process registry of running operations, keyed by id and by job (for duplicate rejection)"""
+
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.operations = {}
+        self.in_flight = {}
+
+    def start(self, operation_id, kind, key):
+        """Register a job; raises OperationInProgress if the same job (or id) is still running"""
+        if not operation_id or not OPERATION_ID.match(operation_id):
+            operation_id = uuid.uuid4().hex
+        key = (kind,) + tuple(key)
+        with self.changed:
+            self._expire()
+            running = self.in_flight.get(key) or self.operations.get(operation_id)
+            if running is not None and not running.finished:
+                raise OperationInProgress(running)
+            if operation_id in self.operations:
+                operation_id = uuid.uuid4().hex  # a finished job's id is not reused
+            operation = self.operations[operation_id] = Operation(self, operation_id, kind, key)
+            self.in_flight[key] = operation
+            self.changed.notify_all()
+        logger.debug("operation_started id=%s kind=%s", operation_id, kind)
+        return operation
+
+    def publish(self, operation, event, data):
+        with self.changed:
+            if operation.finished:
+                return
+            operation.events.append((len(operation.events) + 1, event, data))
+            operation.updated_at = time.monotonic()
+            if event != 'progress':
+                operation.finished = True
+                if self.in_flight.get(operation.key) is operation:
+                    del self.in_flight[operation.key]
+            self.changed.notify_all()
+
+    def _expire(self):
+        now = time.monotonic()
+        for operation_id, operation in list(self.operations.items()):
+            if operation.finished and now - operation.updated_at > OPERATION_RETENTION_SECONDS:
+                del self.operations[operation_id]
+            elif not operation.finished and now - operation.updated_at > OPERATION_STALE_SECONDS:
+                logger.warning("operation_stale id=%s kind=%s", operation_id, operation.kind)
+                operation.finished = True
+                self.in_flight.pop(operation.key, None)
+                del self.operations[operation_id]
+
+    def snapshot(self, operation_id, after=0):
+        """(events after seq `after`, finished) without blocking; (None, True) for an unknown id"""
+        with self.changed:
+            operation = self.operations.get(operation_id)
+            if operation is None:
+                return None, True
+            return operation.events[after:], operation.finished
+
+    def running(self, tenant):
+        with self.changed:
+            self._expire()
+            return [{'id': op.id, 'kind': op.kind, 'key': list(op.key[2:]),
+                     'last_event': op.events[-1][2] if op.events else None}
+                    for op in self.in_flight.values() if op.key[1] == tenant]
+
+    def stream(self, operation_id, after=0):
+        """Yield (seq, event, data) as published, None as a keepalive tick; ends after the final event"""
+        deadline = time.monotonic() + SSE_START_WAIT_SECONDS
+        while True:
+            with self.changed:
+                operation = self.operations.get(operation_id)
+                if operation is None:
+                    if time.monotonic() >= deadline:
+                        yield 0, 'failed', {'message': 'Unknown or expired operation'}
+                        return
+                elif len(operation.events) <= after and not operation.finished:
+                    self.changed.wait(SSE_KEEPALIVE_SECONDS)
+                if operation is None:
+                    self.changed.wait(1)
+                    continue
+                events, finished = operation.events[after:], operation.finished
+            if not events:
+                if finished:
+                    return
+                yield None
+                continue
+            for item in events:
+                yield item
+            after = events[-1][0]
+            if finished:
+                return
+
+operation_tracker = OperationTracker()
+
+def start_operation(kind, *key):
+    """Register the current request's job under its form's operation_id (scoped to the tenant)"""
+    current_shard_path()
+    return operation_tracker.start(request.form.get('operation_id'), kind, (g.get('tenant', DEFAULT_TENANT),) + key)
+
+def format_sse(seq, event, data):
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/operations')
+def running_operations():
+    """Operations in flight for this tenant (pages use it to resume progress after a reload)"""
+    return jsonify(operation_tracker.running(g.get('tenant', DEFAULT_TENANT)))
+
+@app.route('/api/operations/<operation_id>/events')
+def operation_events(operation_id):
+    """Server-Sent Events: progress/done/failed for one operation; honours Last-Event-ID on reconnect"""
+    if not OPERATION_ID.match(operation_id):
+        return jsonify({"error": "Invalid operation id"}), 400
+    try:
+        after = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        after = 0
+
+    def generate():
+        yield "retry: 2000\n\n"
+        for item in operation_tracker.stream(operation_id, after):
+            yield ": keepalive\n\n" if item is None else format_sse(*item)
+
+    return app.response_class(generate(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- AUDIT LOG: BUFFERED, APPEND-ONLY MUTATION EVENTS ---
+# Every mutation route records who changed what with audit_log.record(). The call only
+# appends a tuple to an in-memory buffer (per shard); a background thread flushes the buffer
+# with one executemany per shard every AUDIT_FLUSH_INTERVAL_SECONDS, or sooner once
+# AUDIT_FLUSH_BATCH_SIZE events are waiting. Events buffered when the process dies are lost,
+# which is the price of keeping the write off the request path; a clean exit flushes.
+# audit_log rows are never updated or deleted (triggers refuse it). Each event's detail holds
+# the values the mutation set, so folding a lead's events in id order replays its state.
+AUDIT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit_log (
+    id INTEGER PRIMARY KEY,
+    occurred_at REAL NOT NULL,
+    actor TEXT NOT NULL,
+    action TEXT NOT NULL,
+    campaign_id INTEGER,
+    lead_id INTEGER,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_audit_log_lead ON audit_log(lead_id, id) WHERE lead_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_audit_log_campaign ON audit_log(campaign_id, id) WHERE campaign_id IS NOT NULL;
+
+CREATE TRIGGER IF NOT EXISTS audit_log_no_update BEFORE UPDATE ON audit_log BEGIN
+    SELECT RAISE(ABORT, 'audit_log is append-only');
+END;
+CREATE TRIGGER IF NOT EXISTS audit_log_no_delete BEFORE DELETE ON audit_log BEGIN
+    SELECT RAISE(ABORT, 'audit_log is append-only');
+END;
+"""
+AUDIT_COLUMNS = ('occurred_at', 'actor', 'action', 'campaign_id', 'lead_id', 'detail')
+
+def current_actor():
+    """Who is making this request: REMOTE_USER from an auth proxy, the AUDIT_ACTOR_HEADER, else the client address"""
+    if request.remote_user:
+        return request.remote_user
+    header = app.config['AUDIT_ACTOR_HEADER']
+    if header and request.headers.get(header):
+        return request.headers[header][:200]
+    return f"anonymous@{request.remote_addr or 'unknown'}"
+
+def _int_ids(values):
+    """Form-submitted ids as ints, skipping anything that isn't one"""
+    return [int(value) for value in values if str(value).strip().isdigit()]
+
+class AuditLog:
+    """In-memory buffer of audit events per shard, flushed in batches by a daemon thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = {}  # db_path -> [row tuple]
+        self.flushing = {}  # db_path -> [row tuple] taken by the running flush, not yet committed
+        self.count = 0
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        with self.lock:
+            if not self.running:
+                self.thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+                self.thread.start()
+
+    def record(self, action, campaign_id=None, lead_ids=None, actor=None, **detail):
+        """Buffer one event per lead (or one campaign-level event when lead_ids is None)"""
+        if not app.config['AUDIT_LOG_ENABLED']:
+            return
+        detail = json.dumps(detail, separators=(',', ':'), default=str) if detail else None
+        base = (time.time(), actor or current_actor(), action, campaign_id)
+        rows = [base + (lead_id, detail) for lead_id in lead_ids] if lead_ids is not None else [base + (None, detail)]
+        db_path = current_shard_path()
+        with self.lock:
+            self.pending.setdefault(db_path, []).extend(rows)
+            self.count += len(rows)
+            full = self.count >= app.config['AUDIT_FLUSH_BATCH_SIZE']
+        metrics.inc('audit_events_total', (('action', action),), len(rows))
+        if not self.running:
+            self.start()
+        if full:
+            self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(app.config['AUDIT_FLUSH_INTERVAL_SECONDS'])
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("audit_flush_failed")
+
+    def flush(self):
+        """Write everything buffered so far; failed shards are kept for the next flush (up to AUDIT_MAX_BUFFERED)"""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending, self.count = self.pending, {}, 0
+                self.flushing = dict(pending)
+            for db_path, rows in pending.items():
+                started = time.perf_counter()
+                conn = connection_pool.acquire(db_path)
+                try:
+                    conn.executemany(f"INSERT INTO audit_log ({', '.join(AUDIT_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                                     rows)
+                    conn.commit()
+                except sqlite3.Error:
+                    logger.exception("audit_flush_failed shard=%s events=%d", db_path, len(rows))
+                    self._requeue(db_path, rows)
+                    continue
+                finally:
+                    connection_pool.release(db_path, conn)
+                with self.lock:
+                    self.flushing.pop(db_path, None)
+                metrics.observe('audit_flush_duration_seconds', (), time.perf_counter() - started)
+
+    def buffered(self, db_path, **filters):
+        """
+        Events for db_path that are not in audit_log yet (buffered or mid-flush), oldest first, as
+        AUDIT_COLUMNS dicts; filters are column=value, None matching anything
+        """
+        with self.lock:
+            rows = self.flushing.get(db_path, []) + self.pending.get(db_path, [])
+        wanted = [(AUDIT_COLUMNS.index(column), value) for column, value in filters.items() if value is not None]
+        return [dict(zip(AUDIT_COLUMNS, row)) for row in rows if all(row[i] == value for i, value in wanted)]
+
+    def _requeue(self, db_path, rows):
+        with self.lock:
+            self.flushing.pop(db_path, None)
+            room = app.config['AUDIT_MAX_BUFFERED'] - self.count
+            kept = rows[:max(room, 0)]
+            self.pending[db_path] = kept + self.pending.get(db_path, [])
+            self.count += len(kept)
+        if len(kept) < len(rows):
+            logger.error("audit_events_dropped shard=%s events=%d", db_path, len(rows) - len(kept))
+            metrics.inc('audit_events_dropped_total', (), len(rows) - len(kept))
+
+audit_log = AuditLog()
+atexit.register(audit_log.flush)
+
+def replay_lead_state(events):
+    """Fold a lead's audit events (oldest first) into the field values they leave behind"""
+    state = {}
+    for event in events:
+        state.update(event['detail'] or {})
+    return state
+
+def _audit_rows(cursor):
+    return [{'id': row[0], 'occurred_at': row[1], 'actor': row[2], 'action': row[3], 'campaign_id': row[4],
+             'lead_id': row[5], 'detail': json.loads(row[6]) if row[6] else None} for row in cursor.fetchall()]
+
+def _audit_event_key(event):
+    return tuple(event[column] for column in AUDIT_COLUMNS[:-1])
+
+def _buffered_audit_events(buffered, stored, limit=None):
+    """
+    Buffered events (taken before the table was read) as API events with no id yet, minus any
+    a flush committed in between, which are already among stored
+    """
+    seen = {_audit_event_key(event) for event in stored}
+    events = [dict(event, id=None, detail=json.loads(event['detail']) if event['detail'] else None)
+              for event in buffered if _audit_event_key(event) not in seen]
+    return events[:limit]
+
+@app.route('/api/audit')
+def query_audit_log():
+    """
+    Audit events oldest first, filtered by ?lead_id=, ?campaign_id=, ?action= and ?actor=.
+    Page with ?after=<last id> (keyset); lead and campaign filters use their indexes. This
+    process's events that are still buffered follow the stored ones on the last page, with
+    "id": null (up to the limit; the rest show up once flushed).
+    """
+    filters, params, values = ['id > ?'], [request.args.get('after', 0, type=int)], {}
+    for column, kind in (('lead_id', int), ('campaign_id', int), ('action', str), ('actor', str)):
+        values[column] = value = request.args.get(column, type=kind)
+        if value is not None:
+            filters.append(f"{column} = ?")
+            params.append(value)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    buffered = audit_log.buffered(current_shard_path(), **values)
+    cursor = get_db().cursor()
+    cursor.execute(f"""
+        SELECT id, {', '.join(AUDIT_COLUMNS)} FROM audit_log
+        WHERE {' AND '.join(filters)} ORDER BY id LIMIT ?
+    """, params + [limit])
+    events = _audit_rows(cursor)
+    if len(events) == limit:
+        return jsonify({"events": events, "next_after": events[-1]['id']})
+    return jsonify({"events": events + _buffered_audit_events(buffered, events, limit - len(events)),
+                    "next_after": None})
+
+@app.route('/api/lead/<int:lead_id>/history')
+def lead_history(lead_id):
+    """Every audit event for one lead in order (still-buffered ones last, without an id), plus the state they replay to"""
+    buffered = audit_log.buffered(current_shard_path(), lead_id=lead_id)
+    cursor = get_db().cursor()
+    cursor.execute(f"SELECT id, {', '.join(AUDIT_COLUMNS)} FROM audit_log WHERE lead_id = ? ORDER BY id", (lead_id,))
+    events = _audit_rows(cursor)
+    events += _buffered_audit_events(buffered, events)
+    return jsonify({"lead_id": lead_id, "events": events, "state": replay_lead_state(events)})
+
 # --- HOME PAGE: REDIRECT TO CAMPAIGNS LIST ---
 @app.route('/')
 def home():
@@ -229,16 +3182,17 @@ def campaigns():
     db = get_db()
     cursor = db.cursor()
     cursor.execute("""
-        SELECT c.id, c.name, c.status, c.description, COUNT(l.id) as profile_count, 
+        SELECT c.id, c.name, c.status, c.description, COUNT(l.id) + COALESCE(c.archived_lead_count, 0) as profile_count, 
                c.processing_status, c.last_processed_at, c.process_count
         FROM campaigns c
-        LEFT JOIN leads l ON c.id = l.campaign_id
-        WHERE (c.is_merged IS NULL OR c.is_merged = 0)
+        LEFT JOIN campaign_leads l ON c.id = l.campaign_id
+        WHERE (c.is_merged IS NULL OR c.is_merged = 0) AND c.deleted_at IS NULL
         GROUP BY c.id, c.name, c.status, c.description, c.processing_status, c.last_processed_at, c.process_count
         ORDER BY c.id DESC
     """)
     campaigns = cursor.fetchall()
-    return render_template("campaigns.html", campaigns=campaigns)
+    import_profiles = [(name, profile.get('label') or name) for name, profile in load_import_profiles(cursor).items()]
+    return render_template("campaigns.html", campaigns=campaigns, import_profiles=import_profiles)
 
 # --- MERGE CAMPAIGNS ---
 # Replace your merge_campaigns function with this updated version
@@ -258,9 +3212,16 @@ def merge_campaigns():
         flash('Please provide a name for the merged campaign', 'error')
         return redirect(url_for('campaigns'))
     
+    try:
+        operation = start_operation('merge', *sorted(set(campaign_ids)))
+    except OperationInProgress:
+        flash('These campaigns are already being merged; wait for the current merge to finish', 'error')
+        return redirect(url_for('campaigns'))
+    
     try:
         db = get_db()
         cursor = db.cursor()
+        ensure_campaigns_hot(campaign_ids)
         
         # Check if campaigns table has required columns
         cursor.execute("PRAGMA table_info(campaigns)")
@@ -270,50 +3231,59 @@ def merge_campaigns():
         
         # Verify all campaigns exist
         placeholders = ','.join('?' for _ in campaign_ids)
-        cursor.execute(f"SELECT id, name FROM campaigns WHERE id IN ({placeholders})", campaign_ids)
+        cursor.execute(f"SELECT id, name FROM campaigns WHERE id IN ({placeholders}) AND deleted_at IS NULL", campaign_ids)
         existing_campaigns = cursor.fetchall()
         
         if len(existing_campaigns) != len(campaign_ids):
+            operation.fail('Some selected campaigns do not exist')
             flash('Some selected campaigns do not exist', 'error')
             return redirect(url_for('campaigns'))
         
-        # Get all leads from selected campaigns INCLUDING email subscription status
+        # Get memberships of the selected campaigns INCLUDING email subscription status.
+        # Person data stays in contacts, so only membership fields are carried over; the
+        # name/company/domain columns are read for the possible-duplicate check only.
         cursor.execute(f"""
-            SELECT first_name, last_name, email, domain, score, company, label, description, 
-                   COALESCE(source, 'Merged Campaign') as source,
-                   email_status, unsubscribe_status, unsubscribe_token
-            FROM leads WHERE campaign_id IN ({placeholders})
+            SELECT ct.email, cl.contact_id, cl.score, COALESCE(cl.source, 'Merged Campaign') as source,
+                   cl.email_status, ct.unsubscribe_status, cl.unsubscribe_token,
+                   ct.first_name, ct.last_name, ct.company, ct.domain
+            FROM campaign_leads cl
+            JOIN contacts ct ON ct.id = cl.contact_id
+            WHERE cl.campaign_id IN ({placeholders})
+            ORDER BY cl.id
         """, campaign_ids)
         all_leads = cursor.fetchall()
         
         if not all_leads:
+            operation.fail('No profiles found in selected campaigns')
             flash('No profiles found in selected campaigns', 'error')
             return redirect(url_for('campaigns'))
+        operation.progress('reading', rows=len(all_leads))
         
         # Convert to list of dictionaries for duplicate removal (PRESERVE EMAIL STATUS)
         leads_data = []
         for lead in all_leads:
             leads_data.append({
-                'first_name': lead[0] or '',
-                'last_name': lead[1] or '',
-                'email': lead[2] or '',
-                'domain': lead[3] or '',
-                'score': lead[4] or 5,
-                'company': lead[5] or '',
-                'label': lead[6] or '',
-                'description': lead[7] or '',
-                'source': lead[8] or 'Merged Campaign',
-                'email_status': lead[9],
-                'unsubscribe_status': lead[10],
-                'unsubscribe_token': lead[11] or generate_unsubscribe_token()
+                'email': lead[0] or '',
+                'contact_id': lead[1],
+                'score': lead[2] or 5,
+                'source': lead[3] or 'Merged Campaign',
+                'email_status': lead[4],
+                'unsubscribe_status': lead[5],
+                'unsubscribe_token': lead[6] or generate_unsubscribe_token(),
+                'first_name': lead[7] or '',
+                'last_name': lead[8] or '',
+                'company': lead[9] or '',
+                'domain': lead[10] or ''
             })
         
         # Remove duplicates based on email (but preserve the LATEST email status)
         unique_leads, duplicate_count = remove_duplicate_leads_with_status(leads_data)
         
         if not unique_leads:
+            operation.fail('No valid profiles found after removing duplicates')
             flash('No valid profiles found after removing duplicates', 'error')
             return redirect(url_for('campaigns'))
+        operation.progress('deduplicated', rows=len(unique_leads), duplicates=duplicate_count)
         
         # Create new merged campaign - ALWAYS set is_merged = 1 for merged campaigns
         if has_created_at and has_is_merged:
@@ -346,84 +3316,47 @@ def merge_campaigns():
                 WHERE id = ?
             """, (merged_campaign_id,))
         
-        # Check if leads table has the required columns
-        cursor.execute("PRAGMA table_info(leads)")
-        leads_columns_info = cursor.fetchall()
-        leads_columns = [col[1] for col in leads_columns_info]
-        
-        has_source = 'source' in leads_columns
-        has_is_active = 'is_active' in leads_columns
-        has_leads_created_at = 'created_at' in leads_columns
-        has_email_status = 'email_status' in leads_columns
-        has_unsubscribe_status = 'unsubscribe_status' in leads_columns
-        has_unsubscribe_token = 'unsubscribe_token' in leads_columns
-        
-        # Insert unique leads into the new merged campaign (PRESERVE EMAIL STATUS)
-        leads_added = 0
-        for lead in unique_leads:
-            columns = ['campaign_id', 'first_name', 'last_name', 'email', 'domain', 'score', 'company', 'label', 'description']
-            values = [
-                merged_campaign_id,
-                lead['first_name'],
-                lead['last_name'],
-                lead['email'],
-                lead['domain'],
-                lead['score'],
-                lead['company'],
-                lead['label'],
-                lead['description']
-            ]
-            
-            if has_source:
-                columns.append('source')
-                values.append(lead['source'])
-            
-            if has_is_active:
-                columns.append('is_active')
-                values.append(1)
-            
-            if has_leads_created_at:
-                columns.append('created_at')
-                values.append(datetime.now())
-            
-            # PRESERVE EMAIL SUBSCRIPTION STATUS
-            if has_email_status:
-                columns.append('email_status')
-                values.append(lead.get('email_status'))
-            
-            if has_unsubscribe_status:
-                columns.append('unsubscribe_status')
-                values.append(lead.get('unsubscribe_status'))
-            
-            if has_unsubscribe_token:
-                columns.append('unsubscribe_token')
-                values.append(lead.get('unsubscribe_token'))
-            
-            # Create the INSERT query
-            columns_str = ', '.join(columns)
-            placeholders_str = ', '.join(['?' for _ in columns])
-            
-            cursor.execute(f"""
-                INSERT INTO leads ({columns_str})
-                VALUES ({placeholders_str})
-            """, values)
-            leads_added += 1
+        # Merging is just new membership rows pointing at the existing contacts
+        now = datetime.now()
+        for i in range(0, len(unique_leads), PROGRESS_EVERY_ROWS):
+            cursor.executemany("""
+                INSERT INTO campaign_leads (campaign_id, contact_id, score, source, is_active, email_status,
+                                            unsubscribe_token, created_at)
+                VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+            """, [
+                (merged_campaign_id, lead['contact_id'], lead['score'], lead['source'],
+                 lead.get('email_status'), lead.get('unsubscribe_token'), now)
+                for lead in unique_leads[i:i + PROGRESS_EVERY_ROWS]
+            ])
+            operation.progress('inserting', rows=min(i + PROGRESS_EVERY_ROWS, len(unique_leads)), total=len(unique_leads))
+        leads_added = len(unique_leads)
+        sketch_add_leads(cursor, merged_campaign_id, [lead['email'] for lead in unique_leads])
+        bump_campaign_generations(cursor, [merged_campaign_id])
         
         # DO NOT DELETE OR MARK ORIGINAL CAMPAIGNS - LEAVE THEM AS DISTRIBUTED LISTS
         # Original campaigns remain in first tab with is_merged = 0 or NULL
         
         db.commit()
+        audit_log.record('merge_campaigns', merged_campaign_id, source_campaign_ids=_int_ids(campaign_ids),
+                         leads_added=leads_added, duplicates_removed=duplicate_count)
         
         campaign_names = [camp[1] for camp in existing_campaigns]
         success_message = f'Successfully merged {len(campaign_ids)} distributed lists into "{merged_campaign_name}"'
         if duplicate_count > 0:
             success_message += f' - Removed {duplicate_count} duplicate profiles'
         success_message += f' - {leads_added} unique profiles added (original lists preserved)'
+        possible_duplicates = fuzzy_only_clusters(find_duplicate_clusters(unique_leads))
+        if possible_duplicates:
+            success_message += f' - {len(possible_duplicates)} possible duplicate groups flagged for review'
         
+        operation.done(success_message, redirect=url_for('campaign_detail', campaign_id=merged_campaign_id))
         flash(success_message, 'success')
         return redirect(url_for('campaign_detail', campaign_id=merged_campaign_id))
         
     except Exception as e:
+        operation.fail(f'Error merging campaigns: {str(e)}')
+        if is_database_locked(e):
+            raise
         flash(f'Error merging campaigns: {str(e)}', 'error')
         return redirect(url_for('campaigns'))
 
@@ -441,57 +3374,50 @@ def upload_csv():
     if file.filename == '':
         flash('No file selected', 'error')
         return redirect(url_for('campaigns'))
-    ff
+    
     if not campaign_name:
         flash('Campaign name is required', 'error')
         return redirect(url_for('campaigns'))
     
     if file and allowed_file(file.filename):
         try:
-            # Read CSV content
-            stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-            csv_input = csv.DictReader(stream)
-            
-            # Process CSV rows
+            operation = start_operation('upload_csv', campaign_name.lower())
+        except OperationInProgress:
+            flash(f'"{campaign_name}" is already being imported; wait for the current upload to finish', 'error')
+            return redirect(url_for('campaigns'))
+        try:
+            # Read CSV content (utf-8-sig: spreadsheet exports often start with a BOM), pick the
+            # mapping profile from the header row and normalize a batch of rows at a time
+            import csv
+            stream = io.StringIO(file.stream.read().decode("utf-8-sig"), newline=None)
+            reader = csv.reader(stream)
+            header = next(reader, [])
+            profile_name, profile = choose_import_profile(load_import_profiles(get_db().cursor()), header,
+                                                          request.form.get('mapping_profile'))
+            extractor = compile_import_profile(profile_name, profile, header)
+            operation.progress('parsing', rows=0, profile=profile_name)
             leads_data = []
-            for row in csv_input:
-                # Map CSV columns to database fields
-                first_name = row.get('first_name', row.get('First Name', '')).strip()
-                last_name = row.get('last_name', row.get('Last Name', '')).strip()
-                email = row.get('email', row.get('Email', '')).strip()
-                company = row.get('company', row.get('Company', '')).strip()
-                domain = row.get('domain', row.get('Domain', '')).strip()
-                label = row.get('label', row.get('Label', row.get('Job Title', ''))).strip()
-                description = row.get('description', row.get('Description', '')).strip()
-                source = row.get('source', row.get('Source', 'CSV Import')).strip()
-                
-                try:
-                    score = int(row.get('score', row.get('Score', 5)))
-                except (ValueError, TypeError):
-                    score = 5
-                
-                # Skip empty rows
-                if not email or not first_name:
-                    continue
-                
-                leads_data.append({
-                    'first_name': first_name,
-                    'last_name': last_name,
-                    'email': email,
-                    'domain': domain,
-                    'score': score,
-                    'company': company,
-                    'label': label,
-                    'description': description,
-                    'source': source
-                })
+            report = ImportReport()
+            for leads, rejections in iter_csv_lead_batches(reader, extractor, PROGRESS_EVERY_ROWS):
+                leads_data.extend(leads)
+                report.add(rejections)
+                operation.progress('parsing', rows=len(leads_data), rejected=report.rejected)
             
             # Remove duplicates
             unique_leads, duplicate_count = remove_duplicate_leads(leads_data)
             
             if not unique_leads:
-                flash('No valid profiles found in CSV file', 'error')
+                message = 'No valid profiles found in CSV file'
+                if extractor.positions.keys() < {'email', 'first_name'}:
+                    message += f' - no email/first name column for the {profile_name!r} mapping'
+                if report.rejected:
+                    report.save(SQLiteRepository(get_db()))
+                    get_db().commit()
+                    message += f' - {report.summary()}; error report: {report.url}'
+                operation.fail(message)
+                flash(message, 'error')
                 return redirect(url_for('campaigns'))
+            operation.progress('deduplicated', rows=len(unique_leads), duplicates=duplicate_count)
             
             db = get_db()
             cursor = db.cursor()
@@ -505,27 +3431,43 @@ def upload_csv():
             
             # Insert unique leads
             leads_added = 0
-            for lead in unique_leads:
-                cursor.execute("""
+            for i in range(0, len(unique_leads), PROGRESS_EVERY_ROWS):
+                chunk = unique_leads[i:i + PROGRESS_EVERY_ROWS]
+                cursor.executemany("""
                     INSERT INTO leads (first_name, last_name, email, domain, score, company, label, description, source, campaign_id, is_active, created_at)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
-                """, (
+                """, [(
                     lead['first_name'], lead['last_name'], lead['email'], lead['domain'],
                     lead['score'], lead['company'], lead['label'], lead['description'],
                     lead['source'], campaign_id, datetime.now()
-                ))
-                leads_added += 1
+                ) for lead in chunk])
+                leads_added += len(chunk)
+                operation.progress('inserting', rows=leads_added, total=len(unique_leads))
+            sketch_add_leads(cursor, campaign_id, [lead['email'] for lead in unique_leads])
+            bump_campaign_generations(cursor, [campaign_id])
+            report.save(SQLiteRepository(db))
             
             db.commit()
             
             success_message = f'Successfully uploaded {leads_added} unique profiles to campaign "{campaign_name}"'
+            if profile_name != 'standard':
+                success_message += f' (columns mapped as {profile.get("label") or profile_name})'
             if duplicate_count > 0:
                 success_message += f' - Removed {duplicate_count} duplicate profiles'
+            if report.rejected:
+                success_message += f' - {report.summary()}; error report: {report.url}'
+            possible_duplicates = fuzzy_only_clusters(find_duplicate_clusters(unique_leads))
+            if possible_duplicates:
+                success_message += f' - {len(possible_duplicates)} possible duplicate groups flagged for review'
                 
+            operation.done(success_message, redirect=url_for('campaign_detail', campaign_id=campaign_id))
             flash(success_message, 'success')
             return redirect(url_for('campaign_detail', campaign_id=campaign_id))
             
         except Exception as e:
+            operation.fail(f'Error processing CSV file: {str(e)}')
+            if is_database_locked(e):
+                raise
             flash(f'Error processing CSV file: {str(e)}', 'error')
             return redirect(url_for('campaigns'))
     else:
@@ -541,8 +3483,12 @@ def campaign_detail(campaign_id):
     cursor = db.cursor()
     
     # Get campaign info
-    cursor.execute("SELECT name FROM campaigns WHERE id = ?", (campaign_id,))
+    cursor.execute("SELECT name, deleted_at FROM campaigns WHERE id = ?", (campaign_id,))
     campaign = cursor.fetchone()
+    if campaign and campaign[1]:
+        flash('Campaign not found', 'error')
+        return redirect(url_for('campaigns'))
+    ensure_campaigns_hot([campaign_id])
     
     # UPDATED: Include email_status in the query (position 11)
     cursor.execute("""
@@ -565,10 +3511,10 @@ def campaign_detail(campaign_id):
 # --- APPROVE CAMPAIGN ---
 @app.route('/approve/<int:campaign_id>', methods=['POST'])
 def approve_campaign(campaign_id):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("UPDATE campaigns SET status = 'approved' WHERE id = ?", (campaign_id,))
-    db.commit()
+    repo = get_repository()
+    repo.set_campaign_status(campaign_id, 'approved')
+    repo.commit()
+    audit_log.record('approve_campaign', campaign_id, status='approved')
     flash('Campaign approved successfully!', 'success')
     return redirect('/campaigns')
 
@@ -577,8 +3523,10 @@ def approve_campaign(campaign_id):
 def delete_lead(lead_id, campaign_id):
     db = get_db()
     cursor = db.cursor()
+    bump_lead_generations(cursor, [lead_id])
     cursor.execute("DELETE FROM leads WHERE id = ?", (lead_id,))
     db.commit()
+    audit_log.record('delete_lead', campaign_id, [lead_id], deleted=True)
     flash('Profile deleted successfully!', 'success')
     return redirect(url_for('campaign_detail', campaign_id=campaign_id))
 
@@ -595,7 +3543,9 @@ def toggle_lead_status(lead_id, campaign_id):
     if current_status:
         new_status = 0 if current_status[0] == 1 else 1
         cursor.execute("UPDATE leads SET is_active = ? WHERE id = ?", (new_status, lead_id))
+        bump_lead_generations(cursor, [lead_id])
         db.commit()
+        audit_log.record('toggle_lead_status', campaign_id, [lead_id], is_active=new_status)
         
         status_text = "activated" if new_status == 1 else "deactivated"
         flash(f'Profile {status_text} successfully!', 'success')
@@ -612,8 +3562,10 @@ def bulk_delete_leads(campaign_id):
         db = get_db()
         cursor = db.cursor()
         placeholders = ','.join('?' for _ in lead_ids)
+        bump_lead_generations(cursor, lead_ids)
         cursor.execute(f"DELETE FROM leads WHERE id IN ({placeholders})", lead_ids)
         db.commit()
+        audit_log.record('bulk_delete_leads', campaign_id, _int_ids(lead_ids), deleted=True)
         flash(f'Successfully deleted {len(lead_ids)} profiles!', 'success')
     return redirect(url_for('campaign_detail', campaign_id=campaign_id))
 
@@ -626,7 +3578,9 @@ def bulk_toggle_leads(campaign_id, status):
         cursor = db.cursor()
         placeholders = ','.join('?' for _ in lead_ids)
         cursor.execute(f"UPDATE leads SET is_active = ? WHERE id IN ({placeholders})", [status] + lead_ids)
+        bump_lead_generations(cursor, lead_ids)
         db.commit()
+        audit_log.record('bulk_toggle_leads', campaign_id, _int_ids(lead_ids), is_active=status)
         
         action = "activated" if status == 1 else "deactivated"
         flash(f'Successfully {action} {len(lead_ids)} profiles!', 'success')
@@ -652,13 +3606,14 @@ def add_lead(campaign_id):
         
         # Validate email format
         email = data['email'].strip()
-        if '@' not in email or '.' not in email.split('@')[1]:
+        if not is_valid_email(email):
             flash('Please enter a valid email address', 'error')
             return render_template("add_lead.html", campaign_id=campaign_id, referrer=referrer)
         
         try:
             db = get_db()
             cursor = db.cursor()
+            ensure_campaigns_hot([campaign_id])
             
             # Check for duplicate email in the same campaign
             cursor.execute("SELECT id FROM leads WHERE email = ? AND campaign_id = ?", (email, campaign_id))
@@ -682,8 +3637,8 @@ def add_lead(campaign_id):
                 data['first_name'].strip(),
                 data['last_name'].strip(),
                 email,
-                data.get('domain', '').strip(),
-                int(data.get('score', 5)),
+                data.get('domain', '').strip() or email.rpartition('@')[2].lower(),
+                coerce_score(data.get('score', DEFAULT_LEAD_SCORE)),
                 data['company'].strip(),
                 data.get('label', '').strip(),
                 data.get('description', '').strip()
@@ -709,12 +3664,15 @@ def add_lead(campaign_id):
                 INSERT INTO leads ({columns_str})
                 VALUES ({placeholders_str})
             """, values)
+            bump_campaign_generations(cursor, [campaign_id])
             
             db.commit()
             flash('Profile added successfully!', 'success')
             return redirect(url_for('campaign_detail', campaign_id=campaign_id, referrer=referrer))
             
         except Exception as e:
+            if is_database_locked(e):
+                raise
             flash(f'Error adding profile: {str(e)}', 'error')
             return render_template("add_lead.html", campaign_id=campaign_id, referrer=referrer)
             
@@ -798,8 +3756,51 @@ def add_lead(campaign_id):
 # Modify your send_to_n8n function to include unsubscribe tokens
 @app.route('/send_to_n8n/<int:campaign_id>', methods=['POST'])
 def send_to_n8n(campaign_id):
-    db = get_db()
-    cursor = db.cursor()
+    # With the dispatch scheduler on, the prepared leads are queued and delivered in the
+    # background. Otherwise, under the async server (asgi.py) leads are prepared and the
+    # webhook is awaited before this view runs; it then only records the outcome
+    dispatch = request.environ.get('campaign_review.dispatch')
+    if dispatch is None:
+        dispatch, error_message = prepare_campaign_dispatch(campaign_id)
+        if dispatch is None:
+            flash(error_message, 'error')
+            return redirect(url_for('campaigns'))
+        if app.config['DISPATCH_SCHEDULER']:
+            try:
+                return schedule_dispatch(campaign_id, dispatch)
+            except Exception:
+                dispatch['operation'].close()
+                raise
+        dispatch['operation'].progress('sending', rows=dispatch['lead_count'])
+        dispatch['error'] = deliver_webhook(dispatch['payload'], dispatch['unsubscribe_url_template'])
+    try:
+        return record_dispatch_result(campaign_id, dispatch)
+    finally:
+        dispatch['operation'].close()
+
+def prepare_campaign_dispatch(campaign_id):
+    """
+    Select, filter and tokenize the leads to send for a campaign (reads the current request's form).
+    Returns (dispatch, None) where dispatch holds the webhook payload and its 'operation' (see
+    OPERATION PROGRESS), or (None, error message), also when this campaign is already being sent.
+    """
+    try:
+        operation = start_operation('send', campaign_id)
+    except OperationInProgress:
+        return None, 'This campaign is already being sent; wait for the current run to finish'
+    try:
+        dispatch, error_message = select_dispatch_leads(campaign_id, operation)
+    except Exception:
+        operation.close()
+        raise
+    if dispatch is None:
+        operation.fail(error_message)
+    else:
+        dispatch['operation'] = operation
+    return dispatch, error_message
+
+def select_dispatch_leads(campaign_id, operation):
+    repo = get_repository()
 
     # Get excluded lead IDs from form if provided
     excluded_lead_ids = request.form.getlist('excluded_leads[]')
@@ -807,148 +3808,562 @@ def send_to_n8n(campaign_id):
     included_lead_ids = request.form.getlist('included_leads[]')
     
     # Check campaign status
-    cursor.execute("SELECT status FROM campaigns WHERE id = ?", (campaign_id,))
-    status = cursor.fetchone()
-    if not status or status[0] != 'approved':
-        flash('Campaign is not approved', 'error')
-        return redirect(url_for('campaigns'))
+    campaign = repo.get_campaign(campaign_id)
+    if not campaign or campaign['status'] != 'approved':
+        return None, 'Campaign is not approved'
+    repo.ensure_hot([campaign_id])
+
+    operation.progress('selecting')
+    # Include mode: only process selected leads; exclude mode (default): all except excluded leads
+    if included_lead_ids:
+        mode_message = f"include only {len(included_lead_ids)} selected leads"
+    elif excluded_lead_ids:
+        mode_message = f"exclude {len(excluded_lead_ids)} selected duplicates"
+    else:
+        mode_message = "process all leads (no exclusions)"
+    leads = repo.dispatch_leads(campaign_id, included_lead_ids, excluded_lead_ids)
+
+    if not leads:
+        return None, 'No active, subscribed profiles found after filtering'
+    operation.progress('selected', rows=len(leads))
+
+    leads_data = []
+    base_url = request.url_root.rstrip('/')
+    new_tokens = []
+    
+    for lead in leads:
+        lead_id = lead[0]
+        unsubscribe_token = lead[10]
+        
+        if not unsubscribe_token:
+            unsubscribe_token = generate_unsubscribe_token()
+            new_tokens.append((lead_id, unsubscribe_token))
+        
+        unsubscribe_url = build_unsubscribe_url(base_url, unsubscribe_token)
+        
+        lead_dict = {
+            "lead_id": lead_id,
+            "first_name": lead[1],
+            "last_name": lead[2], 
+            "email": lead[3],
+            "company": lead[4],
+            "domain": lead[5],
+            "score": lead[6],
+            "label": lead[7],
+            "description": lead[8],
+            "source": lead[9],
+            "unsubscribe_url": unsubscribe_url,
+            "unsubscribe_token": unsubscribe_token
+        }
+        
+        leads_data.append(lead_dict)
+    
+    # Commit any token updates
+    if new_tokens:
+        repo.set_unsubscribe_tokens(new_tokens)
+        repo.commit()
+        operation.progress('tokens', rows=len(new_tokens))
+
+    payload = {
+        "campaign_id": campaign_id,
+        "total_leads": len(leads_data),
+        "processing_mode": mode_message,
+        "leads": leads_data
+    }
+
+    return {
+        "payload": payload,
+        "lead_count": len(leads_data),
+        "mode_message": mode_message,
+        "unsubscribe_url_template": build_unsubscribe_url(base_url, '{token}')
+    }, None
+
+def deliver_webhook(payload, unsubscribe_url_template=None):
+    """POST the payload to the n8n webhook; returns None on success or the error text"""
+    return post_webhook(app.config['N8N_WEBHOOK_URL'], payload, unsubscribe_url_template)[2]
+
+def post_webhook(url, payload, unsubscribe_url_template=None):
+    """
+    POST one payload in the destination's encoding (see WEBHOOK PAYLOAD ENCODINGS). Returns
+    (status, retry_after, error): status is None when no response came back, retry_after is
+    the server's Retry-After in seconds (or None), error is None on success.
+    """
+    # requests is only needed when a campaign is sent; importing it lazily keeps cold start down
+    import requests
+    while True:
+        payload_format, content_encoding = webhook_encoding(url)
+        body, headers = encode_webhook_payload(payload, payload_format, content_encoding, unsubscribe_url_template)
+        metrics.inc('webhook_request_bytes_total', (('format', payload_format), ('encoding', content_encoding)), len(body))
+        webhook_started = time.perf_counter()
+        response = None
+        try:
+            response = requests.post(url, data=body, headers=headers, timeout=app.config['WEBHOOK_TIMEOUT'])
+            if response.status_code == 415 and fall_back_to_plain(url, payload_format, content_encoding):
+                continue
+            response.raise_for_status()
+        except requests.RequestException as e:
+            metrics.observe('webhook_request_duration_seconds', (('outcome', 'error'),),
+                            time.perf_counter() - webhook_started)
+            if response is None:
+                return None, None, str(e)
+            return response.status_code, parse_retry_after(response.headers.get('Retry-After')), str(e)
+        metrics.observe('webhook_request_duration_seconds', (('outcome', 'success'),),
+                        time.perf_counter() - webhook_started)
+        return response.status_code, None, None
+
+def parse_retry_after(value):
+    """Retry-After as seconds (delta-seconds or an HTTP date); None if absent or unreadable"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+def record_dispatch_result(campaign_id, dispatch):
+    """Mark the campaign sent/failed after a delivery attempt and redirect with a flash message"""
+    repo = get_repository()
+    mode_message = dispatch['mode_message']
+
+    if dispatch['error'] is None:
+        repo.record_dispatch(campaign_id, sent=True)
+        repo.commit()
+        
+        message = f'Campaign processed successfully! ({dispatch["lead_count"]} profiles sent to n8n, mode: {mode_message})'
+        dispatch['operation'].done(message, redirect=url_for('campaigns'))
+        flash(message, 'success')
+    else:
+        logger.warning("webhook_failed campaign_id=%d leads=%d error=%s", campaign_id, dispatch['lead_count'], dispatch['error'])
+        repo.record_dispatch(campaign_id, sent=False)
+        repo.commit()
+        dispatch['operation'].fail(f'Failed to process campaign: {dispatch["error"]}')
+        flash(f'Failed to process campaign: {dispatch["error"]}', 'error')
+
+    return redirect(url_for('campaigns'))
+
+# --- WEBHOOK PAYLOAD ENCODINGS ---
+# 'json' is the original body: one object whose "leads" array repeats every field name per
+# lead and carries both the unsubscribe URL and its token. The compact formats keep the
+# same top-level fields (plus "format" and "lead_count") and drop the per-lead URL in favour
+# of one "unsubscribe_url_template" ("{token}" is replaced by each lead's token):
+# - 'ndjson': that header object on the first line, then one lead object per line, so the
+#   receiver can handle records as they are read instead of parsing one large document.
+# - 'columnar': one object with "columns": {field: [value per lead]}.
+# Any of them can be gzip-compressed (Content-Encoding: gzip); X-Payload-Format names the
+# format. A destination that answers 415 is switched to plain json for this process.
+WEBHOOK_CONTENT_TYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson', 'columnar': 'application/json'}
+WEBHOOK_CONTENT_ENCODINGS = ('identity', 'gzip')
+_plain_webhooks = set()
+_plain_webhooks_lock = threading.Lock()
+
+def webhook_encoding(url):
+    """(payload format, content encoding) for a destination"""
+    if url in _plain_webhooks:
+        return 'json', 'identity'
+    override = app.config['WEBHOOK_DESTINATION_ENCODINGS'].get(url, {})
+    payload_format = override.get('format', app.config['WEBHOOK_PAYLOAD_FORMAT'])
+    content_encoding = override.get('content_encoding', app.config['WEBHOOK_CONTENT_ENCODING'])
+    if payload_format not in WEBHOOK_CONTENT_TYPES or content_encoding not in WEBHOOK_CONTENT_ENCODINGS:
+        raise ValueError(f"Unsupported webhook encoding {payload_format!r}/{content_encoding!r}"
+                         f" for {url or 'WEBHOOK_PAYLOAD_FORMAT/WEBHOOK_CONTENT_ENCODING'}")
+    return payload_format, content_encoding
+
+def fall_back_to_plain(url, payload_format, content_encoding):
+    """Remember that url rejected this encoding; False if it was already plain json (nothing to fall back to)"""
+    if (payload_format, content_encoding) == ('json', 'identity'):
+        return False
+    with _plain_webhooks_lock:
+        _plain_webhooks.add(url)
+    logger.warning("webhook_encoding_rejected url=%s format=%s encoding=%s fallback=json",
+                   url, payload_format, content_encoding)
+    return True
+
+def encode_webhook_payload(payload, payload_format='json', content_encoding='identity', unsubscribe_url_template=None):
+    """Body bytes and request headers for a dispatch payload"""
+    if payload_format == 'json':
+        body = json.dumps(payload).encode('utf-8')
+    else:
+        leads = payload['leads']
+        header = {key: value for key, value in payload.items() if key != 'leads'}
+        header.update(format=payload_format, lead_count=len(leads))
+        drop = ()
+        if unsubscribe_url_template:
+            header['unsubscribe_url_template'] = unsubscribe_url_template
+            drop = ('unsubscribe_url',)
+        fields = [field for field in (leads[0] if leads else ()) if field not in drop]
+        if payload_format == 'ndjson':
+            lines = [json.dumps(header, separators=(',', ':'))]
+            lines.extend(json.dumps({field: lead[field] for field in fields}, separators=(',', ':')) for lead in leads)
+            body = ('\n'.join(lines) + '\n').encode('utf-8')
+        else:
+            header['columns'] = {field: [lead[field] for lead in leads] for field in fields}
+            body = json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    headers = {'Content-Type': WEBHOOK_CONTENT_TYPES[payload_format], 'X-Payload-Format': payload_format}
+    if content_encoding == 'gzip':
+        import gzip
+        body = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+# --- DISPATCH SCHEDULER: TOKEN BUCKETS, FAIR QUEUEING, ADAPTIVE BACKOFF ---
+# send_to_n8n queues the prepared leads here and returns. A scheduler thread splits each
+# campaign into DISPATCH_CHUNK_SIZE-lead requests and releases them through per-destination
+# token buckets (requests/s and leads/s), at most DISPATCH_MAX_IN_FLIGHT at a time. Campaigns
+# are ordered by priority, then by start-time fair queueing on leads: each campaign's virtual
+# time advances by the leads it has sent, so a small campaign queued behind a large one waits
+# for at most one of its chunks. A 429/5xx/network error halves the destination's rate and
+# pauses it (Retry-After when given, else exponential backoff with jitter); each success
+# brings the rate back up a step. Chunks carry dispatch_id and chunk_index so the workflow
+# can drop a repeat after a timed-out attempt is retried. The queue lives in this process:
+# a restart leaves queued campaigns 'queued', and they can simply be sent again.
+DISPATCH_RATE_RECOVERY_STEP = 0.1   # rate factor regained per successful request
+
+def is_retryable_status(status):
+    return status is None or status in (408, 429) or status >= 500
+
+class TokenBucket:
+    """`rate` tokens per second, holding up to burst_seconds worth; a rate of 0 means unlimited"""
+
+    def __init__(self, rate, burst_seconds):
+        self.base_rate = self.rate = rate
+        self.capacity = max(rate * burst_seconds, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def scale(self, factor, now):
+        self._refill(now)
+        self.rate = self.base_rate * factor
+
+    def wait_time(self, cost, now):
+        """Seconds until `cost` tokens are available; a cost above capacity only needs a full bucket"""
+        if not self.base_rate:
+            return 0.0
+        self._refill(now)
+        needed = min(cost, self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, cost, now):
+        if self.base_rate:
+            self._refill(now)
+            self.tokens -= cost  # an oversized chunk leaves the bucket in debt, so the average rate holds
+
+class DispatchDestination:
+    """Pacing and backoff state for one webhook URL"""
+
+    def __init__(self, url):
+        limits = {
+            'requests_per_second': app.config['DISPATCH_REQUESTS_PER_SECOND'],
+            'leads_per_second': app.config['DISPATCH_LEADS_PER_SECOND'],
+        }
+        limits.update(app.config['DISPATCH_DESTINATION_LIMITS'].get(url, {}))
+        self.url = url
+        self.requests = TokenBucket(limits['requests_per_second'], app.config['DISPATCH_BURST_SECONDS'])
+        self.leads = TokenBucket(limits['leads_per_second'], app.config['DISPATCH_BURST_SECONDS'])
+        self.rate_factor = 1.0
+        self.paused_until = 0.0
+        self.failures = 0       # consecutive backoffs
+        self.in_flight = 0
+
+    def ready_in(self, lead_count, now):
+        """Seconds until a request with lead_count leads may start; None while at the in-flight limit"""
+        if self.in_flight >= app.config['DISPATCH_MAX_IN_FLIGHT']:
+            return None
+        return max(self.paused_until - now, self.requests.wait_time(1, now),
+                   self.leads.wait_time(lead_count, now), 0.0)
+
+    def take(self, lead_count, now):
+        self.requests.take(1, now)
+        self.leads.take(lead_count, now)
+        self.in_flight += 1
+
+    def _set_rate(self, factor, now):
+        self.rate_factor = factor
+        self.requests.scale(factor, now)
+        self.leads.scale(factor, now)
+
+    def succeeded(self, now):
+        self.failures = 0
+        if self.rate_factor < 1.0:
+            self._set_rate(min(1.0, self.rate_factor + DISPATCH_RATE_RECOVERY_STEP), now)
+
+    def throttled(self, retry_after, now):
+        """Slow down after a 429/5xx; returns the pause in seconds"""
+        if now >= self.paused_until:
+            # Requests already in flight when the first error came back don't halve the rate again
+            self.failures += 1
+            self._set_rate(max(app.config['DISPATCH_MIN_RATE_FACTOR'], self.rate_factor / 2), now)
+        if retry_after is None:
+            backoff = app.config['DISPATCH_BACKOFF_SECONDS'] * 2 ** (self.failures - 1)
+            retry_after = min(app.config['DISPATCH_MAX_BACKOFF_SECONDS'], backoff) * random.uniform(0.5, 1.0)
+        retry_after = min(retry_after, app.config['DISPATCH_MAX_BACKOFF_SECONDS'])
+        self.paused_until = max(self.paused_until, now + retry_after)
+        return self.paused_until - now
+
+    def describe(self, now):
+        return {
+            'url': self.url,
+            'rate_factor': round(self.rate_factor, 3),
+            'requests_per_second': self.requests.rate or None,
+            'leads_per_second': self.leads.rate or None,
+            'paused_for': round(max(self.paused_until - now, 0.0), 1),
+            'in_flight': self.in_flight,
+        }
+
+class DispatchJob:
+    """One queued campaign send: the payload split into chunks, and how far it has got"""
+
+    def __init__(self, campaign_id, dispatch, url, db_path, priority, redirect):
+        payload = dispatch['payload']
+        leads = payload['leads']
+        size = app.config['DISPATCH_CHUNK_SIZE'] or len(leads) or 1
+        self.campaign_id = campaign_id
+        self.base_payload = {key: value for key, value in payload.items() if key != 'leads'}
+        self.chunks = [leads[i:i + size] for i in range(0, len(leads), size)] or [[]]
+        self.lead_count = len(leads)
+        self.mode_message = dispatch['mode_message']
+        self.unsubscribe_url_template = dispatch['unsubscribe_url_template']
+        self.operation = dispatch['operation']
+        self.tenant = self.operation.key[1]
+        self.url = url
+        self.db_path = db_path
+        self.priority = priority
+        self.redirect = redirect
+        self.next_chunk = 0
+        self.sent_leads = 0
+        self.attempts = 0       # failed attempts at the current chunk
+        self.sending = False
+        self.vtime = 0.0
+        self.seq = 0
+
+    def payload_for(self, index):
+        return dict(self.base_payload, dispatch_id=self.operation.id, chunk_index=index,
+                    chunk_count=len(self.chunks), leads=self.chunks[index])
+
+    def describe(self):
+        return {
+            'campaign_id': self.campaign_id,
+            'operation_id': self.operation.id,
+            'priority': self.priority,
+            'leads': self.lead_count,
+            'sent': self.sent_leads,
+            'chunks': len(self.chunks),
+            'next_chunk': self.next_chunk,
+            'attempts': self.attempts,
+            'sending': self.sending,
+        }
+
+class DispatchScheduler:
+    """In-process queue of DispatchJobs, drained by one scheduling thread and a small sender pool"""
+
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.jobs = []
+        self.destinations = {}
+        self.virtual_time = 0.0
+        self.submitted = 0
+        self.thread = None
+        self.executor = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        with self.changed:
+            if self.running:
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=app.config['DISPATCH_WORKERS'],
+                                                   thread_name_prefix='dispatch-sender')
+            self.thread = threading.Thread(target=self._run, name='dispatch-scheduler', daemon=True)
+            self.thread.start()
+
+    def submit(self, campaign_id, dispatch, url, db_path, priority, redirect=None):
+        job = DispatchJob(campaign_id, dispatch, url, db_path, priority, redirect)
+        with self.changed:
+            # A new job starts at the current virtual time: it is neither owed the past nor behind it
+            job.vtime = self.virtual_time
+            job.seq = self.submitted = self.submitted + 1
+            self.jobs.append(job)
+            self.changed.notify_all()
+        self.start()
+        logger.info("dispatch_queued campaign_id=%d leads=%d chunks=%d priority=%d",
+                    campaign_id, job.lead_count, len(job.chunks), priority)
+        return job
+
+    def _destination(self, url):
+        destination = self.destinations.get(url)
+        if destination is None:
+            destination = self.destinations[url] = DispatchDestination(url)
+        return destination
+
+    def _next(self, now):
+        """(job, None) when a job's next chunk may go now, else (None, seconds to wait or None)"""
+        wait = None
+        blocked = set()
+        for job in sorted(self.jobs, key=lambda j: (j.priority, j.vtime, j.seq)):
+            if job.sending or job.url in blocked:
+                continue
+            ready_in = self._destination(job.url).ready_in(len(job.chunks[job.next_chunk]), now)
+            if ready_in == 0.0:
+                return job, None
+            # The head of the line waits for its destination; later jobs don't overtake it there
+            blocked.add(job.url)
+            if ready_in is not None:
+                wait = ready_in if wait is None else min(wait, ready_in)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self.changed:
+                job, wait = self._next(time.monotonic())
+                if job is None:
+                    self.changed.wait(wait)
+                    continue
+                index = job.next_chunk
+                lead_count = len(job.chunks[index])
+                self.destinations[job.url].take(lead_count, time.monotonic())
+                self.virtual_time = max(self.virtual_time, job.vtime)
+                job.vtime += max(lead_count, 1)
+                job.sending = True
+            try:
+                self.executor.submit(self._send, job, index)
+            except RuntimeError:
+                logger.exception("dispatch_sender_unavailable campaign_id=%d", job.campaign_id)
+                self._chunk_finished(job, index, 0, None, 'Dispatch sender pool is shut down')
+
+    def _send(self, job, index):
+        try:
+            status, retry_after, error = post_webhook(job.url, job.payload_for(index), job.unsubscribe_url_template)
+        except Exception as e:
+            logger.exception("dispatch_send_failed campaign_id=%d chunk=%d", job.campaign_id, index)
+            status, retry_after, error = 0, None, str(e) or e.__class__.__name__  # 0: not retried
+        self._chunk_finished(job, index, status, retry_after, error)
+
+    def _chunk_finished(self, job, index, status, retry_after, error):
+        now = time.monotonic()
+        pause = None
+        with self.changed:
+            destination = self.destinations[job.url]
+            destination.in_flight -= 1
+            job.sending = False
+            if error is None:
+                destination.succeeded(now)
+                job.attempts = 0
+                job.sent_leads += len(job.chunks[index])
+                job.next_chunk += 1
+                finished = job.next_chunk == len(job.chunks)
+                outcome = 'sent'
+            elif is_retryable_status(status) and job.attempts + 1 < app.config['DISPATCH_MAX_ATTEMPTS']:
+                job.attempts += 1
+                pause = destination.throttled(retry_after, now)
+                finished = False
+                outcome = 'retried'
+            else:
+                finished = True
+                outcome = 'failed'
+            if finished:
+                self.jobs.remove(job)
+            self.changed.notify_all()
+        metrics.inc('dispatch_chunks_total', (('outcome', outcome),))
+
+        if outcome == 'retried':
+            logger.warning("dispatch_backoff campaign_id=%d chunk=%d status=%s attempt=%d pause_s=%.1f error=%s",
+                           job.campaign_id, index, status, job.attempts, pause, error)
+            job.operation.progress('throttled', rows=job.sent_leads, total=job.lead_count,
+                                   status=status, retry_in=round(pause, 1))
+        elif outcome == 'sent':
+            job.operation.progress('sending', rows=job.sent_leads, total=job.lead_count)
+        if finished:
+            self._complete(job, error)
 
-    # Build the query based on include/exclude mode
-    if included_lead_ids:
-        # Include mode: only process selected leads
-        placeholders = ','.join('?' for _ in included_lead_ids)
-        base_query = f"""
-            SELECT id, first_name, last_name, email, company, domain, score, label, description, source, unsubscribe_token
-            FROM leads 
-            WHERE campaign_id = ? 
-            AND is_active = 1 
-            AND id IN ({placeholders})
-            AND (
-                email_status = 'subscribed'
-                OR 
-                (
-                    (email_status IS NULL OR email_status = 'subscribed') 
-                    AND (unsubscribe_status IS NULL OR unsubscribe_status = 'subscribed')
-                )
-            )
-        """
-        query_params = [campaign_id] + included_lead_ids
-        mode_message = f"include only {len(included_lead_ids)} selected leads"
-        
-    else:
-        # Exclude mode (default): process all except excluded leads
-        base_query = """
-            SELECT id, first_name, last_name, email, company, domain, score, label, description, source, unsubscribe_token
-            FROM leads 
-            WHERE campaign_id = ? 
-            AND is_active = 1 
-            AND (
-                email_status = 'subscribed'
-                OR 
-                (
-                    (email_status IS NULL OR email_status = 'subscribed') 
-                    AND (unsubscribe_status IS NULL OR unsubscribe_status = 'subscribed')
-                )
-            )
-        """
-        query_params = [campaign_id]
-        
-        # Add exclusion condition if there are excluded leads
-        if excluded_lead_ids:
-            placeholders = ','.join('?' for _ in excluded_lead_ids)
-            base_query += f" AND id NOT IN ({placeholders})"
-            query_params.extend(excluded_lead_ids)
-            mode_message = f"exclude {len(excluded_lead_ids)} selected duplicates"
-        else:
-            mode_message = "process all leads (no exclusions)"
-    
-    cursor.execute(base_query, query_params)
-    leads = cursor.fetchall()
+    def _complete(self, job, error):
+        try:
+            record_dispatch_outcome(job.db_path, job.campaign_id, sent=error is None)
+        except Exception:
+            logger.exception("dispatch_record_failed campaign_id=%d", job.campaign_id)
+        if error is None:
+            logger.info("dispatch_done campaign_id=%d leads=%d chunks=%d", job.campaign_id, job.lead_count, len(job.chunks))
+            job.operation.done(f'Campaign processed successfully! ({job.lead_count} profiles sent to n8n '
+                               f'in {len(job.chunks)} requests, mode: {job.mode_message})', redirect=job.redirect)
+            return
+        logger.warning("webhook_failed campaign_id=%d leads=%d sent=%d error=%s",
+                       job.campaign_id, job.lead_count, job.sent_leads, error)
+        message = f'Failed to process campaign: {error}'
+        if job.sent_leads:
+            message += f' ({job.sent_leads} of {job.lead_count} profiles had already been delivered)'
+        job.operation.fail(message)
 
-    if not leads:
-        flash('No active, subscribed profiles found after filtering', 'error')
-        return redirect(url_for('campaigns'))
+    def snapshot(self, tenant=None):
+        now = time.monotonic()
+        with self.changed:
+            jobs = sorted(self.jobs, key=lambda j: (j.priority, j.vtime, j.seq))
+            return {
+                'queue': [job.describe() for job in jobs if tenant is None or job.tenant == tenant],
+                'destinations': [d.describe(now) for d in self.destinations.values()],
+            }
 
-    # Rest of your existing send_to_n8n logic remains the same
-    leads_data = []
-    base_url = request.url_root.rstrip('/')
-    leads_without_tokens = []
-    
-    for lead in leads:
-        lead_id = lead[0]
-        unsubscribe_token = lead[10]
-        
-        if not unsubscribe_token:
-            unsubscribe_token = generate_unsubscribe_token()
-            cursor.execute("UPDATE leads SET unsubscribe_token = ? WHERE id = ?", (unsubscribe_token, lead_id))
-            leads_without_tokens.append(lead_id)
-        
-        unsubscribe_url = f"{base_url}/unsubscribe/{unsubscribe_token}"
-        
-        lead_dict = {
-            "lead_id": lead_id,
-            "first_name": lead[1],
-            "last_name": lead[2], 
-            "email": lead[3],
-            "company": lead[4],
-            "domain": lead[5],
-            "score": lead[6],
-            "label": lead[7],
-            "description": lead[8],
-            "source": lead[9],
-            "unsubscribe_url": unsubscribe_url,
-            "unsubscribe_token": unsubscribe_token
-        }
-        
-        leads_data.append(lead_dict)
-    
-    # Commit any token updates
-    if leads_without_tokens:
-        db.commit()
+dispatch_scheduler = DispatchScheduler()
 
-    # Continue with existing n8n sending logic...
-    payload = {
-        "campaign_id": campaign_id,
-        "total_leads": len(leads_data),
-        "processing_mode": mode_message,
-        "leads": leads_data
-    }
+def record_dispatch_outcome(db_path, campaign_id, sent):
+    """record_dispatch outside a request (the scheduler's threads), on a pooled connection"""
+    if app.config['STORAGE_BACKEND'] == 'postgres':
+        pool, key, repository = postgres_pool, app.config['POSTGRES_DSN'], PostgresRepository
+    else:
+        pool, key, repository = connection_pool, db_path, SQLiteRepository
+    conn = pool.acquire(key)
+    try:
+        repo = repository(conn)
+        repo.record_dispatch(campaign_id, sent)
+        repo.commit()
+    finally:
+        pool.release(key, conn)
 
-    webhook_url = "https://dory-logical-briefly.ngrok-free.app/webhook-test/f7ecb2fe-1f9c-4920-be0d-2cd6bbc93561"
+def dispatch_priority():
+    """The form's priority (0 = first .. 9 = last), else DISPATCH_DEFAULT_PRIORITY"""
     try:
-        response = requests.post(webhook_url, json=payload)
-        response.raise_for_status()
+        priority = int(request.form.get('priority', app.config['DISPATCH_DEFAULT_PRIORITY']))
+    except ValueError:
+        priority = app.config['DISPATCH_DEFAULT_PRIORITY']
+    return min(max(priority, 0), 9)
 
-        cursor.execute("""
-        UPDATE campaigns 
-        SET processing_status = 'sent', 
-            last_processed_at = ?, 
-            process_count = COALESCE(process_count, 0) + 1
-        WHERE id = ?
-        """, (datetime.now(), campaign_id))
-        db.commit()
-        
-        flash(f'Campaign processed successfully! ({len(leads_data)} profiles sent to n8n, mode: {mode_message})', 'success')
+def schedule_dispatch(campaign_id, dispatch):
+    """Queue a prepared dispatch; the scheduler finishes its operation and records the outcome"""
+    repo = get_repository()
+    repo.mark_dispatch_queued(campaign_id)
+    repo.commit()
+    dispatch['operation'].progress('queued', rows=0, total=dispatch['lead_count'])
+    job = dispatch_scheduler.submit(campaign_id, dispatch, app.config['N8N_WEBHOOK_URL'], current_shard_path(),
+                                    dispatch_priority(), redirect=url_for('campaigns'))
+    flash(f'Campaign queued for sending: {dispatch["lead_count"]} profiles in {len(job.chunks)} requests '
+          f'(mode: {dispatch["mode_message"]})', 'success')
+    return redirect(url_for('campaigns'))
 
-    except requests.RequestException as e:
-        cursor.execute("""
-        UPDATE campaigns 
-        SET processing_status = 'failed'
-        WHERE id = ?
-        """, (campaign_id,))
-        db.commit()
-        flash(f'Failed to process campaign: {str(e)}', 'error')
+@app.route('/api/dispatch')
+def dispatch_status():
+    """This tenant's queued sends and the pacing state of each webhook destination"""
+    status = dispatch_scheduler.snapshot(g.get('tenant', DEFAULT_TENANT))
+    status['scheduler'] = app.config['DISPATCH_SCHEDULER']
+    return jsonify(status)
 
-    return redirect(url_for('campaigns'))
 # Optional: Add a route to get just the unsubscribe URL for a specific lead
 @app.route('/api/lead/<int:lead_id>/unsubscribe_url')
 def get_lead_unsubscribe_url(lead_id):
     """Get unsubscribe URL for a specific lead"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("SELECT unsubscribe_token FROM leads WHERE id = ?", (lead_id,))
-    result = cursor.fetchone()
+    repo = get_repository()
+    result = repo.lead_unsubscribe_token(lead_id)
     
     if not result:
         return jsonify({"error": "Lead not found"}), 404
@@ -957,11 +4372,11 @@ def get_lead_unsubscribe_url(lead_id):
     if not token:
         # Generate token if it doesn't exist
         token = generate_unsubscribe_token()
-        cursor.execute("UPDATE leads SET unsubscribe_token = ? WHERE id = ?", (token, lead_id))
-        db.commit()
+        repo.set_unsubscribe_tokens([(lead_id, token)])
+        repo.commit()
     
     base_url = request.url_root.rstrip('/')
-    unsubscribe_url = f"{base_url}/unsubscribe/{token}"
+    unsubscribe_url = build_unsubscribe_url(base_url, token)
     
     return jsonify({
         "lead_id": lead_id,
@@ -973,29 +4388,21 @@ def get_lead_unsubscribe_url(lead_id):
 @app.route('/api/campaign/<int:campaign_id>/unsubscribe_urls')
 def get_campaign_unsubscribe_urls(campaign_id):
     """Get all unsubscribe URLs for leads in a campaign"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("""
-        SELECT id, email, first_name, last_name, unsubscribe_token
-        FROM leads 
-        WHERE campaign_id = ? 
-        AND is_active = 1 
-        AND (unsubscribe_status IS NULL OR unsubscribe_status = 'subscribed')
-    """, (campaign_id,))
-    
-    leads = cursor.fetchall()
+    repo = get_repository()
+    repo.ensure_hot([campaign_id])
+    leads = repo.campaign_unsubscribe_leads(campaign_id)
     base_url = request.url_root.rstrip('/')
     
     urls_data = []
+    new_tokens = []
     for lead in leads:
         lead_id, email, first_name, last_name, token = lead
         
         if not token:
             token = generate_unsubscribe_token()
-            cursor.execute("UPDATE leads SET unsubscribe_token = ? WHERE id = ?", (token, lead_id))
+            new_tokens.append((lead_id, token))
         
-        unsubscribe_url = f"{base_url}/unsubscribe/{token}"
+        unsubscribe_url = build_unsubscribe_url(base_url, token)
         
         urls_data.append({
             "lead_id": lead_id,
@@ -1004,8 +4411,9 @@ def get_campaign_unsubscribe_urls(campaign_id):
             "unsubscribe_url": unsubscribe_url
         })
     
-    if any(not lead[4] for lead in leads):  # If any tokens were missing
-        db.commit()
+    if new_tokens:
+        repo.set_unsubscribe_tokens(new_tokens)
+        repo.commit()
     
     return jsonify({
         "campaign_id": campaign_id,
@@ -1013,196 +4421,1689 @@ def get_campaign_unsubscribe_urls(campaign_id):
         "unsubscribe_urls": urls_data
     })
 
-# --- UPLOAD ENDPOINT (FROM N8N) WITH DUPLICATE DETECTION ---
-# Fix the upload_leads function - replace the problematic section with this:
+# --- STREAMING JSON / NDJSON INGESTION ---
+# /upload bodies are parsed one lead at a time; leads are validated, filtered, deduplicated
+# and inserted in batches so memory is bounded by the batch size plus the set of seen emails.
+_JSON_DECODER = json.JSONDecoder()
+FUZZY_REPORT_MAX_LEADS = 20000   # possible_duplicates is only computed for uploads up to this size
+
+class EmptyPayloadError(ValueError):
+    pass
+
+class MalformedPayloadError(ValueError):
+    """The body is not the expected JSON structure (json.JSONDecodeError covers invalid values)"""
+
+class JSONStreamReader:
+    """Pull reader over a byte stream holding one JSON document; decodes one value at a time"""
+
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def _fill(self, size=None):
+        if self.eof:
+            return False
+        chunk = self.stream.read(size or self.chunk_size)
+        self.bytes_read += len(chunk)
+        self.eof = not chunk
+        # Drop consumed text so the buffer holds at most the value being decoded
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        """Next non-whitespace character ('' at end of input)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise MalformedPayloadError(f"Expected {char!r} at byte ~{self.bytes_read}, found {found or 'end of input'!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, reading more input until it is whole"""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = _JSON_DECODER.raw_decode(self.buffer, self.pos)
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(size)
+            size *= 2
+
+def iter_upload_json(reader):
+    """
+    Walk an upload document: {"campaign_name": ..., "leads": [...]} or that object as the first
+    element of an array. Yields ('lead', element) for each leads entry and ('field', (key, value))
+    for every other top-level key, in document order.
+    """
+    if reader.peek() == '[':
+        reader.expect('[')
+        if reader.peek() == ']':
+            raise EmptyPayloadError("Empty data array")
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'leads' and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield 'lead', reader.value()
+                    if reader.peek() != ',':
+                        break
+                    reader.expect(',')
+                reader.expect(']')
+        else:
+            yield 'field', (key, reader.value())
+        if reader.peek() != ',':
+            break
+        reader.expect(',')
+    reader.expect('}')
+
+def iter_upload_ndjson(stream):
+    """
+    One JSON object per line. A leading line with campaign_name and no email carries the
+    campaign fields; every other line is a lead.
+    """
+    first = True
+    for raw_line in stream:
+        line = raw_line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if first and isinstance(record, dict) and 'campaign_name' in record and 'email' not in record:
+            for key, value in record.items():
+                yield 'field', (key, value)
+        else:
+            yield 'lead', record
+        first = False
+
+# --- IMPORT PIPELINE: COLUMN-ORIENTED LEAD NORMALIZATION ---
+# upload_csv, /upload and add_lead share one normalizer that works on a batch of rows at a
+# time, one column at a time: header aliases are resolved once per file (per distinct key
+# set for JSON), and stripping, email validation, score coercion and domain extraction run
+# as map() over whole columns, which keeps the per-row work in C. Rows that can't be
+# imported are collected with a reason and stored as a downloadable error report.
+LEAD_TEXT_FIELDS = ('first_name', 'last_name', 'email', 'company', 'domain', 'label', 'description', 'source')
+# Accepted headers per field, in order of preference (exact match first, then case/space-insensitive)
+LEAD_HEADER_ALIASES = {
+    'first_name': ('first_name', 'First Name', 'firstname'),
+    'last_name': ('last_name', 'Last Name', 'lastname'),
+    'email': ('email', 'Email', 'email_address'),
+    'company': ('company', 'Company'),
+    'domain': ('domain', 'Domain'),
+    'label': ('label', 'Label', 'Job Title'),
+    'description': ('description', 'Description'),
+    'source': ('source', 'Source'),
+    'score': ('score', 'Score'),
+}
+# Deliberately loose: one @, no whitespace, a dot in the domain. Deliverability is n8n's job.
+EMAIL_PATTERN = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s.]+')
+DEFAULT_LEAD_SCORE = 5
+REJECTION_MESSAGES = {
+    'not_an_object': 'Row is not a JSON object',
+    'missing_email': 'Email is empty',
+    'invalid_email': 'Email is not a valid address',
+    'missing_first_name': 'First name is empty',
+}
+
+def _header_key(header):
+    return re.sub(r'[\s_-]+', '_', str(header).strip().lower())
+
+def resolve_lead_headers(headers, aliases_by_field=None):
+    """{field: [header, ...]} for the headers present, best alias first; fields without one are left out"""
+    present = list(headers)
+    by_key = {}
+    for header in present:
+        by_key.setdefault(_header_key(header), []).append(header)
+    resolved = {}
+    for field, aliases in (aliases_by_field or LEAD_HEADER_ALIASES).items():
+        found = [alias for alias in aliases if alias in present]
+        for alias in aliases:
+            found += [h for h in by_key.get(_header_key(alias), ()) if h not in found]
+        if found:
+            resolved[field] = found
+    return resolved
+
+def is_valid_email(email):
+    return EMAIL_PATTERN.fullmatch(email) is not None
+
+def _text_column(values, size):
+    if values is None:
+        return [''] * size
+    try:
+        return list(map(str.strip, values))
+    except TypeError:  # JSON input: numbers, nulls
+        return ['' if value is None else str(value).strip() for value in values]
+
+def coerce_score(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return DEFAULT_LEAD_SCORE
+
+def _score_column(values, size):
+    if values is None:
+        return [DEFAULT_LEAD_SCORE] * size
+    try:
+        return list(map(int, values))
+    except (ValueError, TypeError):
+        return list(map(coerce_score, values))
+
+def normalize_lead_columns(columns, size, row_numbers, default_source):
+    """
+    Normalize a batch given as {field: list of raw values} (a missing field is None).
+    Returns (leads, rejections): lead dicts for the valid rows, in order, and
+    (row_number, reason, {field: value}) for the others.
+    """
+    text = {field: _text_column(columns.get(field), size) for field in LEAD_TEXT_FIELDS}
+    emails, first_names = text['email'], text['first_name']
+    valid = list(map(EMAIL_PATTERN.fullmatch, emails))
+    if columns.get('domain') is None or '' in text['domain']:
+        text['domain'] = [domain or (email.rpartition('@')[2].lower() if ok else '')
+                          for domain, email, ok in zip(text['domain'], emails, valid)]
+    text['source'] = [source or default_source for source in text['source']]
+    scores = _score_column(columns.get('score'), size)
+
+    keep = [bool(ok and first) for ok, first in zip(valid, first_names)]
+    if all(keep):
+        rows = zip(*(text[field] for field in LEAD_TEXT_FIELDS), scores)
+        return [dict(zip(LEAD_TEXT_FIELDS + ('score',), row)) for row in rows], []
+
+    leads, rejections = [], []
+    for i, ok in enumerate(keep):
+        row = {field: text[field][i] for field in LEAD_TEXT_FIELDS}
+        row['score'] = scores[i]
+        if ok:
+            leads.append(row)
+        else:
+            reason = 'missing_email' if not emails[i] else 'invalid_email' if not valid[i] else 'missing_first_name'
+            rejections.append((row_numbers[i], reason, row))
+    return leads, rejections
+
+def _dict_column(batch, keys):
+    if len(keys) == 1:
+        key = keys[0]
+        return [lead.get(key) for lead in batch]
+    return [next((lead[key] for key in keys if lead.get(key) not in (None, '')), None) for lead in batch]
+
+@functools.lru_cache(maxsize=64)
+def _resolve_key_set(keys):
+    return resolve_lead_headers(keys)
+
+def normalize_lead_dicts(batch, first_row_number, default_source='API Import'):
+    """normalize_lead_columns for JSON leads; aliases are resolved once per distinct set of keys"""
+    objects = [lead for lead in batch if isinstance(lead, dict)]
+    rejections = []
+    if len(objects) != len(batch):
+        rejections = [(first_row_number + i, 'not_an_object', {}) for i, lead in enumerate(batch)
+                      if not isinstance(lead, dict)]
+    row_numbers = [first_row_number + i for i, lead in enumerate(batch) if isinstance(lead, dict)]
+    resolved = _resolve_key_set(frozenset().union(*objects)) if objects else {}
+    columns = {field: _dict_column(objects, keys) for field, keys in resolved.items()}
+    leads, rejected = normalize_lead_columns(columns, len(objects), row_numbers, default_source)
+    return leads, sorted(rejections + rejected, key=lambda item: item[0])
+
+def iter_csv_lead_batches(reader, extractor, batch_size):
+    """
+    Yield (leads, rejections) per batch of records from a csv.reader positioned after the
+    header, using a compiled mapping profile (see compile_import_profile). Blank records are
+    skipped; row numbers count records with the header as row 1 (the line number unless a
+    field spans lines).
+    """
+    from itertools import islice
+    first_row_number = 2
+    while True:
+        records = list(islice(reader, batch_size))
+        if not records:
+            return
+        kept = [i for i, row in enumerate(records) if row and (row[0] or any(row))]
+        batch = records if len(kept) == len(records) else [records[i] for i in kept]
+        yield normalize_lead_columns(extractor.columns(batch), len(batch), [first_row_number + i for i in kept],
+                                     extractor.source)
+        first_row_number += len(records)
+
+# --- IMPORT MAPPING PROFILES: AUTO-DETECTION AND COMPILED EXTRACTORS ---
+# A mapping profile says which CSV headers feed which lead field (best first), an optional
+# per-field transform and the source label for its rows. Built-in profiles cover the
+# standard headers and common tool exports; named profiles can be stored per shard via
+# /api/import_profiles. upload_csv detects the profile from the header row (stored profiles
+# first, then the most specific built-in whose signature headers are all present) unless
+# one is chosen, and compiles it against that header once: each field becomes a column
+# position, and a batch is cut into columns with itemgetter.
+IMPORT_PROFILE_NAME = re.compile(r'[a-z0-9][a-z0-9_-]{0,63}')
+IMPORT_PROFILE_TRANSFORMS = {
+    # "https://www.acme.com/about" -> "acme.com"
+    'url_host': lambda value: value.strip().lower().split('://', 1)[-1].split('/', 1)[0].split('?', 1)[0]
+                                    .removeprefix('www.'),
+    'lower': str.lower,
+}
+BUILTIN_IMPORT_PROFILES = {
+    'standard': {
+        'label': 'Standard headers',
+        'fields': {field: list(aliases) for field, aliases in LEAD_HEADER_ALIASES.items()},
+        'source': 'CSV Import',
+        'signature': [],
+    },
+    'apollo': {
+        'label': 'Apollo export',
+        'fields': {
+            'first_name': ['First Name'], 'last_name': ['Last Name'], 'email': ['Email'],
+            'company': ['Company', 'Company Name for Emails'], 'domain': ['Website'], 'label': ['Title'],
+            'description': ['Seniority', 'Departments'],
+        },
+        'transforms': {'domain': 'url_host'},
+        'source': 'Apollo',
+        'signature': ['Email Status', 'Company Name for Emails', 'Person Linkedin Url'],
+    },
+    'linkedin_sales_navigator': {
+        'label': 'LinkedIn Sales Navigator export',
+        'fields': {
+            'first_name': ['First Name'], 'last_name': ['Last Name'], 'email': ['Email Address', 'Email'],
+            'company': ['Company Name', 'Company'], 'domain': ['Company Website', 'Website'],
+            'label': ['Title', 'Job Title'], 'description': ['Headline', 'Summary'],
+        },
+        'transforms': {'domain': 'url_host'},
+        'source': 'LinkedIn Sales Navigator',
+        'signature': ['Profile URL', 'Company Name', 'Title'],
+    },
+    'hubspot': {
+        'label': 'HubSpot contacts export',
+        'fields': {
+            'first_name': ['First Name'], 'last_name': ['Last Name'], 'email': ['Email'],
+            'company': ['Company Name'], 'domain': ['Website URL', 'Company Domain Name'],
+            'label': ['Job Title'], 'description': ['Lifecycle Stage'],
+        },
+        'transforms': {'domain': 'url_host'},
+        'source': 'HubSpot',
+        'signature': ['Record ID', 'Company Name', 'Lifecycle Stage'],
+    },
+}
+
+IMPORT_PROFILE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS import_profiles (
+    name TEXT PRIMARY KEY,
+    definition TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+-- The campaigns page lists profiles, so changes must invalidate its ETag
+CREATE TRIGGER IF NOT EXISTS import_profiles_generation_insert AFTER INSERT ON import_profiles BEGIN
+    UPDATE app_state SET value = value + 1 WHERE key = 'generation';
+END;
+CREATE TRIGGER IF NOT EXISTS import_profiles_generation_update AFTER UPDATE ON import_profiles BEGIN
+    UPDATE app_state SET value = value + 1 WHERE key = 'generation';
+END;
+CREATE TRIGGER IF NOT EXISTS import_profiles_generation_delete AFTER DELETE ON import_profiles BEGIN
+    UPDATE app_state SET value = value + 1 WHERE key = 'generation';
+END;
+"""
+
+class CompiledImportProfile:
+    """A profile bound to one header row: field -> column positions, ready to slice batches"""
+
+    def __init__(self, name, profile, header):
+        from operator import itemgetter
+        self.name = name
+        self.source = profile.get('source') or 'CSV Import'
+        resolved = resolve_lead_headers(header, profile['fields'])
+        # Repeated headers (e.g. "email" and "Email"): the first non-empty one wins, as for JSON
+        self.positions = {field: tuple(header.index(name) for name in names) for field, names in resolved.items()}
+        self.mapping = {field: [header[i] for i in positions] for field, positions in self.positions.items()}
+        self.getters = {field: itemgetter(positions[0]) for field, positions in self.positions.items()
+                        if len(positions) == 1}
+        self.transforms = {field: IMPORT_PROFILE_TRANSFORMS[name]
+                           for field, name in profile.get('transforms', {}).items() if field in self.positions}
+        self.width = max((max(positions) for positions in self.positions.values()), default=-1) + 1
+        used = {i for positions in self.positions.values() for i in positions}
+        self.unmapped = [h for i, h in enumerate(header) if i not in used and h.strip()]
+
+    def columns(self, batch):
+        """{field: list of raw values} for a batch of csv records"""
+        if batch and min(map(len, batch)) < self.width:
+            batch = [row if len(row) >= self.width else row + [''] * (self.width - len(row)) for row in batch]
+        columns = {}
+        for field, positions in self.positions.items():
+            getter = self.getters.get(field)
+            if getter is not None:
+                values = list(map(getter, batch))
+            else:
+                values = [next((row[i] for i in positions if row[i].strip()), '') for row in batch]
+            transform = self.transforms.get(field)
+            columns[field] = list(map(transform, values)) if transform else values
+        return columns
+
+@functools.lru_cache(maxsize=128)
+def _compile_import_profile(name, definition, header):
+    return CompiledImportProfile(name, json.loads(definition), list(header))
+
+def compile_import_profile(name, profile, header):
+    """Compiled extractor for (profile, header row); cached, since the same export layout recurs"""
+    return _compile_import_profile(name, json.dumps(profile, sort_keys=True), tuple(header))
+
+def load_import_profiles(cursor):
+    """{name: profile} with stored profiles first (they win detection ties), then the built-ins"""
+    cursor.execute("SELECT name, definition FROM import_profiles ORDER BY name")
+    profiles = {name: dict(json.loads(definition), builtin=False) for name, definition in cursor.fetchall()}
+    profiles.update((name, dict(profile, builtin=True)) for name, profile in BUILTIN_IMPORT_PROFILES.items())
+    return profiles
+
+def _profile_signature(profile):
+    return profile.get('signature') or [aliases[0] for aliases in profile['fields'].values()]
+
+def detect_import_profile(header, profiles):
+    """Name of the profile whose signature headers are all present; the longest signature wins"""
+    keys = {_header_key(h) for h in header}
+    best, best_size = 'standard', 0
+    for name, profile in profiles.items():
+        signature = _profile_signature(profile) if name != 'standard' else []
+        if signature and len(signature) > best_size and all(_header_key(h) in keys for h in signature):
+            best, best_size = name, len(signature)
+    return best
+
+def validate_import_profile(data):
+    """Profile definition from request JSON; raises ValueError with a message for the client"""
+    if not isinstance(data, dict) or not isinstance(data.get('fields'), dict):
+        raise ValueError('"fields" must map lead fields to lists of CSV headers')
+    fields = {}
+    for field, headers in data['fields'].items():
+        if field not in LEAD_HEADER_ALIASES:
+            raise ValueError(f"Unknown lead field {field!r}; expected one of {', '.join(LEAD_HEADER_ALIASES)}")
+        headers = [headers] if isinstance(headers, str) else headers
+        if not isinstance(headers, list) or not headers or not all(isinstance(h, str) and h.strip() for h in headers):
+            raise ValueError(f"Headers for {field!r} must be a non-empty list of strings")
+        fields[field] = headers
+    for field in ('email', 'first_name'):
+        if field not in fields:
+            raise ValueError(f"A profile must map {field!r}")
+    transforms = data.get('transforms') or {}
+    for field, name in transforms.items():
+        if field not in fields or name not in IMPORT_PROFILE_TRANSFORMS:
+            raise ValueError(f"Invalid transform {name!r} for {field!r}; transforms: {', '.join(IMPORT_PROFILE_TRANSFORMS)}")
+    signature = data.get('signature') or []
+    if not isinstance(signature, list) or not all(isinstance(h, str) for h in signature):
+        raise ValueError('"signature" must be a list of headers')
+    return {'label': str(data.get('label') or '')[:100], 'fields': fields, 'transforms': transforms,
+            'source': str(data.get('source') or 'CSV Import')[:100], 'signature': signature}
+
+def store_import_profile(cursor, placeholder, name, profile):
+    """Store (or replace) a validated profile definition"""
+    cursor.execute(f"""
+        INSERT INTO import_profiles (name, definition, updated_at) VALUES ({placeholder}, {placeholder}, {placeholder})
+        ON CONFLICT (name) DO UPDATE SET definition = excluded.definition, updated_at = excluded.updated_at
+    """, (name, json.dumps(profile), time.time()))
+
+def choose_import_profile(profiles, header, requested=None):
+    """(name, profile) for an upload: the requested one if it exists, else auto-detected"""
+    name = requested if requested in profiles else detect_import_profile(header, profiles)
+    return name, profiles[name]
+
+def _describe_profile(name, profile):
+    return {'name': name, 'label': profile.get('label') or name, 'builtin': profile.get('builtin', False),
+            'fields': profile['fields'], 'transforms': profile.get('transforms', {}),
+            'source': profile.get('source'), 'signature': _profile_signature(profile)}
+
+@app.route('/api/import_profiles')
+def list_import_profiles():
+    profiles = get_repository().import_profiles()
+    return jsonify({"profiles": [_describe_profile(name, profile) for name, profile in profiles.items()]})
+
+@app.route('/api/import_profiles/<name>', methods=['PUT', 'DELETE'])
+def save_import_profile(name):
+    """PUT stores (or replaces) a named profile: {"fields": {"email": ["E-mail"], ...}, "source", "transforms", "signature"}"""
+    if name in BUILTIN_IMPORT_PROFILES:
+        return jsonify({"status": "error", "message": f"{name!r} is a built-in profile"}), 400
+    repo = get_repository()
+    if request.method == 'DELETE':
+        deleted = repo.delete_import_profile(name)
+        repo.commit()
+        return jsonify({"status": "success", "deleted": deleted})
+    if not IMPORT_PROFILE_NAME.fullmatch(name):
+        return jsonify({"status": "error", "message": "Profile names are lowercase letters, digits, '-' and '_'"}), 400
+    try:
+        profile = validate_import_profile(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    repo.save_import_profile(name, profile)
+    repo.commit()
+    return jsonify({"status": "success", "profile": _describe_profile(name, profile)})
+
+@app.route('/api/import_profiles/detect', methods=['POST'])
+def detect_import_profile_for_upload():
+    """Which profile a CSV would use and how its headers map: csv_file upload or {"headers": [...]}"""
+    import csv
+    if 'csv_file' in request.files:
+        first_line = request.files['csv_file'].stream.readline().decode('utf-8-sig')
+        header = next(csv.reader([first_line]), [])
+    else:
+        header = (request.get_json(silent=True) or {}).get('headers') or []
+    if not header or not all(isinstance(h, str) for h in header):
+        return jsonify({"status": "error", "message": "No header row found"}), 400
+    name, profile = choose_import_profile(get_repository().import_profiles(), header, request.args.get('profile'))
+    extractor = compile_import_profile(name, profile, header)
+    return jsonify({
+        "profile": name,
+        "mapping": extractor.mapping,
+        "transforms": profile.get('transforms', {}),
+        "unmapped_headers": extractor.unmapped,
+        "missing_required": [field for field in ('email', 'first_name') if field not in extractor.positions],
+    })
+
+def normalize_api_lead(lead):
+    """Validate one /upload lead; returns the row dict or None when it would be rejected"""
+    leads, _ = normalize_lead_dicts([lead], 1)
+    if not leads:
+        return None
+    return dict(leads[0], unsubscribe_token=generate_unsubscribe_token(), unsubscribe_status='subscribed')
+
+# Rejected rows of an import, downloadable as CSV from /import_report/<report_id>
+IMPORT_REPORT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS import_rejections (
+    report_id TEXT NOT NULL,
+    row_number INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    row TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_import_rejections_report ON import_rejections(report_id, row_number);
+CREATE INDEX IF NOT EXISTS idx_import_rejections_created ON import_rejections(created_at);
+"""
+
+def store_import_rejections(cursor, placeholder, report_id, rejections):
+    """Keep the first IMPORT_REPORT_MAX_ROWS rejections of an import; expired reports are dropped"""
+    p = placeholder
+    now = time.time()
+    cursor.execute(f"DELETE FROM import_rejections WHERE created_at < {p}",
+                   (now - app.config['IMPORT_REPORT_TTL_DAYS'] * 86400,))
+    cursor.executemany(f"""
+        INSERT INTO import_rejections (report_id, row_number, reason, row, created_at) VALUES ({p}, {p}, {p}, {p}, {p})
+    """, [(report_id, row_number, reason, json.dumps(row, default=str), now)
+          for row_number, reason, row in rejections[:app.config['IMPORT_REPORT_MAX_ROWS']]])
+
+def load_import_rejections(cursor, placeholder, report_id):
+    cursor.execute(f"""
+        SELECT row_number, reason, row FROM import_rejections WHERE report_id = {placeholder} ORDER BY row_number
+    """, (report_id,))
+    return [(row_number, reason, json.loads(row)) for row_number, reason, row in cursor.fetchall()]
+
+class ImportReport:
+    """Rejected rows of one import; counts every rejection, keeps up to IMPORT_REPORT_MAX_ROWS for the report"""
+
+    def __init__(self):
+        self.report_id = uuid.uuid4().hex
+        self.rejections = []
+        self.counts = {}
+
+    def add(self, rejections):
+        for _, reason, _ in rejections:
+            self.counts[reason] = self.counts.get(reason, 0) + 1
+        room = app.config['IMPORT_REPORT_MAX_ROWS'] - len(self.rejections)
+        if room > 0:
+            self.rejections.extend(rejections[:room])
+
+    @property
+    def rejected(self):
+        return sum(self.counts.values())
+
+    @property
+    def url(self):
+        return url_for('download_import_report', report_id=self.report_id) if self.rejections else None
+
+    def summary(self):
+        """Short text for flash messages: '3 rows rejected (2 invalid email, 1 missing first name)'"""
+        reasons = ', '.join(f"{count} {reason.replace('_', ' ')}" for reason, count in sorted(self.counts.items()))
+        return f"{self.rejected} row{'s' if self.rejected != 1 else ''} rejected ({reasons})"
+
+    def save(self, repo):
+        if self.rejections:
+            repo.store_import_rejections(self.report_id, self.rejections)
+
+@app.route('/import_report/<report_id>')
+def download_import_report(report_id):
+    """CSV of an import's rejected rows: line/position, reason, then the row as normalized"""
+    import csv
+    rows = get_repository().import_rejections(report_id)
+    if not rows:
+        abort(404)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(('row', 'reason', 'message') + LEAD_TEXT_FIELDS + ('score',))
+    for row_number, reason, row in rows:
+        writer.writerow((row_number, reason, REJECTION_MESSAGES.get(reason, reason))
+                        + tuple(row.get(field, '') for field in LEAD_TEXT_FIELDS + ('score',)))
+    response = app.response_class(out.getvalue(), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="import_errors_{report_id[:8]}.csv"'
+    return response
+
+class LeadIngestor:
+    """
+    Imports leads in two phases, so no write transaction is open while the body is still
+    arriving. add() / add_normalized() validate and normalize a batch at a time and spool
+    the result to a temporary file (in memory up to UPLOAD_SPOOL_MEMORY_BYTES); the
+    database is only read. finish() then replays the spool through the same steps as
+    before: unsubscribe filter, dedup by canonical email (first occurrence wins, across
+    batches), insert. The caller commits right after, so the write lock is held for the
+    inserts alone, however slowly the client sent the body.
+    """
+
+    def __init__(self, repo, batch_size=500):
+        self.repo = repo
+        self.batch_size = batch_size
+        self.campaign_id = None
+        self.raw = []  # leads as received, normalized a batch at a time
+        self.spool = tempfile.SpooledTemporaryFile(max_size=app.config['UPLOAD_SPOOL_MEMORY_BYTES'],
+                                                   dir=app.config['UPLOAD_FOLDER'])
+        self.report = ImportReport()
+        self.seen_emails = set()
+        self.leads_received = 0
+        self.leads_spooled = 0
+        self.leads_added = 0
+        self.duplicate_count = 0
+        self.unsubscribed_count = 0
+        self.fuzzy_candidates = []
+        self.leads_digest = 0  # order-independent content hash of the valid leads, see upload_content_key
+
+    def add(self, raw_lead):
+        self.leads_received += 1
+        self.raw.append(raw_lead)
+        if len(self.raw) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        raw, self.raw = self.raw, []
+        if raw:
+            self._spool(*normalize_lead_dicts(raw, self.leads_received - len(raw) + 1))
+
+    def add_normalized(self, batch, rejections):
+        """A batch that went through the column normalizer already (CSV files, see iter_csv_lead_batches)"""
+        self.flush()
+        self.leads_received += len(batch) + len(rejections)
+        self._spool(batch, rejections)
+
+    def _spool(self, batch, rejections):
+        self.report.add(rejections)
+        for lead in batch:
+            lead['unsubscribe_token'] = generate_unsubscribe_token()
+            lead['unsubscribe_status'] = 'subscribed'
+            self.leads_digest = (self.leads_digest + lead_fingerprint(lead)) % _DIGEST_MODULUS
+        if batch:
+            pickle.dump(batch, self.spool, pickle.HIGHEST_PROTOCOL)
+            self.leads_spooled += len(batch)
+
+    def spooled_batches(self):
+        self.spool.seek(0)
+        while True:
+            try:
+                yield pickle.load(self.spool)
+            except EOFError:
+                return
+
+    def finish(self, campaign_name, campaign_description, commit_batches=False):
+        """
+        Write phase: insert the spooled leads and save the error report (the caller commits).
+        commit_batches commits after every batch instead, for imports too large for one write
+        transaction; they go into a staging campaign set as campaign_id beforehand.
+        """
+        self.flush()
+        for batch in self.spooled_batches():
+            self._insert(batch, campaign_name, campaign_description)
+            if commit_batches:
+                self.repo.commit()
+        self.report.save(self.repo)
+        self.close()
+
+    def close(self):
+        self.spool.close()
+
+    def _insert(self, batch, campaign_name, campaign_description):
+        filtered, unsubscribed_count, unsubscribed_emails = filter_unsubscribed_leads(batch)
+        if unsubscribed_count:
+            self.unsubscribed_count += unsubscribed_count
+            logger.debug("upload_unsubscribed_filtered emails=%s", unsubscribed_emails)
+
+        unique_leads = []
+        for lead in filtered:
+            key = canonical_email_key(lead['email'])
+            if key in self.seen_emails:
+                self.duplicate_count += 1
+                continue
+            self.seen_emails.add(key)
+            unique_leads.append(lead)
+        if not unique_leads:
+            return
+
+        if self.campaign_id is None:
+            self.campaign_id = self.repo.create_campaign(campaign_name, campaign_description)
+
+        self.repo.insert_leads(self.campaign_id, unique_leads)
+        self.leads_added += len(unique_leads)
+
+        if self.fuzzy_candidates is not None:
+            self.fuzzy_candidates.extend(
+                {key: lead[key] for key in ('email', 'first_name', 'last_name', 'company', 'domain')}
+                for lead in unique_leads
+            )
+            if len(self.fuzzy_candidates) > FUZZY_REPORT_MAX_LEADS:
+                self.fuzzy_candidates = None
+
+# --- UPLOAD ENDPOINT (FROM N8N) WITH DUPLICATE DETECTION ---
+@app.route('/upload', methods=['POST'])
+def upload_leads():
+    """
+    Create a campaign from leads posted by n8n. Accepts {"campaign_name", "campaign_description",
+    "leads": [...]}, the same object wrapped in an array, or NDJSON (application/x-ndjson: one lead
+    per line, campaign fields on a leading line or in the query string). The body is streamed.
+
+    Retries are idempotent: a repeat with the same Idempotency-Key header (or, without one, the
+    same campaign name and leads) returns the original response instead of a new campaign.
+    With the header the replay happens before the body is read. Without it the body has to be
+    parsed to hash its leads, but the digest is checked before anything is filtered, inserted
+    or locked, so a repeat costs one read of the body and no writes.
+    """
+    request.max_content_length = app.config['MAX_UPLOAD_JSON_BYTES']
+    is_ndjson = request.mimetype in ('application/x-ndjson', 'application/jsonl')
+    fields = {
+        'campaign_name': request.args.get('campaign_name'),
+        'campaign_description': request.args.get('campaign_description', ''),
+    }
+
+    repo = get_repository()
+    idempotency_key = request.headers.get('Idempotency-Key', '').strip()
+    if idempotency_key:
+        if len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return jsonify({"status": "error",
+                            "message": f"Idempotency-Key longer than {MAX_IDEMPOTENCY_KEY_LENGTH} characters"}), 400
+        idempotency_key = f"key:{idempotency_key}"
+        # Replay before reading the body at all
+        stored = repo.lookup_idempotent_upload(idempotency_key)
+        if stored is not None:
+            return idempotent_replay(idempotency_key, stored)
+
+    ingestor = LeadIngestor(repo, batch_size=app.config['UPLOAD_BATCH_SIZE'])
+    reader = None
+    try:
+        if is_ndjson:
+            records = iter_upload_ndjson(request.stream)
+        else:
+            reader = JSONStreamReader(request.stream)
+            records = iter_upload_json(reader)
+        for kind, record in records:
+            if kind == 'lead':
+                ingestor.add(record)
+            elif record[0] in ('campaign_name', 'campaign_description'):
+                fields[record[0]] = record[1]
+
+        campaign_name = fields['campaign_name']
+        campaign_description = fields['campaign_description'] or ""
+        if not campaign_name or not ingestor.leads_received:
+            return jsonify({"status": "error", "message": "Missing campaign_name or leads"}), 400
+
+        if not idempotency_key:
+            # Nothing has been written yet (see LeadIngestor): a repeat is answered from the spool's digest
+            ingestor.flush()
+            idempotency_key = upload_content_key(campaign_name, ingestor.leads_digest)
+            stored = repo.lookup_idempotent_upload(idempotency_key)
+            if stored is not None:
+                return idempotent_replay(idempotency_key, stored)
+
+        ingestor.finish(campaign_name, campaign_description)
+        report = ingestor.report
+        if ingestor.campaign_id is None:
+            if report.rejections:
+                repo.commit()  # nothing else was written; keep the error report that explains the 400
+            else:
+                repo.rollback()
+            return jsonify({
+                "status": "error",
+                "message": "No valid unique profiles found after filtering unsubscribed leads"
+                           + (f" and rejecting invalid rows: {report.summary()}" if report.rejected else ""),
+                "rejected": report.rejected,
+                "rejection_reasons": report.counts,
+                "error_report_url": report.url,
+            }), 400
+
+        candidates = ingestor.fuzzy_candidates
+        response_data = {
+            "status": "success",
+            "campaign_id": ingestor.campaign_id,
+            "leads_added": ingestor.leads_added,
+            "duplicates_removed": ingestor.duplicate_count,
+            "unsubscribed_filtered": ingestor.unsubscribed_count,
+            "rejected": report.rejected,
+            "rejection_reasons": report.counts,
+            "error_report_url": report.url,
+            "possible_duplicates": describe_clusters(candidates, fuzzy_only_clusters(find_duplicate_clusters(candidates)))
+                                   if candidates is not None else None
+        }
+        if not repo.store_idempotent_upload(idempotency_key, ingestor.campaign_id, response_data):
+            # A concurrent retry finished first: keep its campaign, drop ours
+            repo.rollback()
+            return idempotent_replay(idempotency_key, repo.lookup_idempotent_upload(idempotency_key))
+        repo.commit()
+    except EmptyPayloadError as e:
+        repo.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except (json.JSONDecodeError, UnicodeDecodeError, MalformedPayloadError) as e:
+        repo.rollback()
+        return jsonify({"status": "error", "message": f"Invalid JSON: {e}"}), 400
+    except HTTPException:
+        repo.rollback()
+        raise  # e.g. 413 once the body passes MAX_UPLOAD_JSON_BYTES
+    except Exception as e:
+        repo.rollback()
+        if is_database_locked(e):
+            raise
+        logger.exception("upload_failed error=%s", e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        ingestor.close()
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("upload_received bytes=%d leads=%d", reader.bytes_read if reader else request.content_length or 0,
+                     ingestor.leads_received)
+    if ingestor.unsubscribed_count > 0:
+        logger.info("upload_unsubscribed_filtered count=%d", ingestor.unsubscribed_count)
+
+    logger.info("campaign_created campaign_id=%d name=%r leads_added=%d duplicates_removed=%d",
+                ingestor.campaign_id, campaign_name, ingestor.leads_added, ingestor.duplicate_count)
+    return jsonify(response_data)
+
+def idempotent_replay(key, stored):
+    logger.info("upload_replayed campaign_id=%s key=%s", stored.get('campaign_id'), key)
+    response = jsonify(dict(stored, idempotent_replay=True))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+# --- CHUNKED UPLOADS: RESUMABLE PARTS, MMAP IMPORT ---
+# CSV files larger than one /upload_csv post (MAX_CONTENT_LENGTH) are sent in parts:
+#   POST   /api/uploads                     {"filename", "campaign_name", "size", ...} -> upload_id, part_size
+#   PUT    /api/uploads/<id>/parts/<n>      bytes [(n-1)*part_size, n*part_size), X-Part-SHA256: hex digest
+#   GET    /api/uploads/<id>                parts received so far; after a failure send only the rest
+#   POST   /api/uploads/<id>/complete       import the file; a retry returns the same result
+#   DELETE /api/uploads/<id>                abandon the upload
+# Each part is written in place at its offset in UPLOAD_FOLDER/<id>/data, so parts may arrive
+# in any order or in parallel and the file is assembled without a copy. A part counts once its
+# checksum matched (a marker file under parts/ holds its size and digest); the declared size
+# fixes how many parts there are and how long each one is. Completion maps the file with mmap
+# and streams it through the mapping profile into LeadIngestor, the same batched
+# filter/dedup/insert path as /upload, so memory does not grow with the file. The leads are
+# committed batch by batch into a staging campaign that stays hidden (and is left alone by
+# the purger) until the last commit publishes it, so no write transaction spans the import.
+UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+SHA256_HEX = re.compile(r'^[0-9a-f]{64}$')
+UPLOAD_COPY_CHUNK = 256 * 1024
+
+def _upload_dir(upload_id):
+    return os.path.join(app.config['UPLOAD_FOLDER'], upload_id)
+
+def load_upload_session(upload_id):
+    """Manifest of an unfinished upload of this tenant, or None"""
+    if not UPLOAD_ID.match(upload_id):
+        return None
+    try:
+        with open(os.path.join(_upload_dir(upload_id), 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest['tenant'] == g.get('tenant', DEFAULT_TENANT) else None
+
+def received_parts(upload_id):
+    """{part_number: (size, sha256)} for the parts whose checksum matched"""
+    parts_dir = os.path.join(_upload_dir(upload_id), 'parts')
+    parts = {}
+    for name in os.listdir(parts_dir):
+        if name.isdigit():
+            with open(os.path.join(parts_dir, name)) as f:
+                size, digest = f.read().split()
+            parts[int(name)] = (int(size), digest)
+    return parts
+
+def expected_part_count(manifest):
+    return -(-manifest['size'] // manifest['part_size'])
+
+def describe_upload(manifest, parts):
+    return {
+        "upload_id": manifest['upload_id'],
+        "filename": manifest['filename'],
+        "campaign_name": manifest['campaign_name'],
+        "part_size": manifest['part_size'],
+        "size": manifest['size'],
+        "parts": [{"part_number": n, "size": size, "sha256": digest} for n, (size, digest) in sorted(parts.items())],
+        "received_bytes": sum(size for size, _ in parts.values()),
+        "missing_parts": [n for n in range(1, expected_part_count(manifest) + 1) if n not in parts],
+    }
+
+def expire_upload_sessions():
+    """Remove uploads whose data was last written more than UPLOAD_SESSION_TTL_HOURS ago"""
+    cutoff = time.time() - app.config['UPLOAD_SESSION_TTL_HOURS'] * 3600
+    folder = app.config['UPLOAD_FOLDER']
+    for name in os.listdir(folder):
+        if not UPLOAD_ID.match(name):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            expired = os.path.getmtime(os.path.join(path, 'data')) < cutoff
+        except OSError:
+            expired = os.path.isdir(path) and os.path.getmtime(path) < cutoff
+        if expired:
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info("chunked_upload_expired upload_id=%s", name)
+
+def iter_mapped_lines(view):
+    """Text lines of a mapped file, decoded incrementally (a leading BOM is dropped)"""
+    return codecs.iterdecode(iter(view.readline, b''), 'utf-8-sig')
+
+@app.route('/api/uploads', methods=['POST'])
+def create_chunked_upload():
+    """
+    Start a resumable CSV upload: {"filename", "campaign_name", "campaign_description",
+    "mapping_profile", "size"}. "size" (total bytes) is required: every part's length is
+    checked against it, and completion needs all the parts it implies.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename') or ''))
+    campaign_name = str(data.get('campaign_name') or '').strip()
+    size = data.get('size')
+    if not allowed_file(filename):
+        return jsonify({"status": "error", "message": "filename must name a .csv file"}), 400
+    if not campaign_name:
+        return jsonify({"status": "error", "message": "campaign_name is required"}), 400
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+        return jsonify({"status": "error", "message": '"size" (total bytes, a positive integer) is required'}), 400
+    if size > app.config['UPLOAD_MAX_BYTES']:
+        return jsonify({"status": "error",
+                        "message": f"Files are limited to {app.config['UPLOAD_MAX_BYTES']} bytes"}), 413
+
+    expire_upload_sessions()
+    manifest = {
+        'upload_id': uuid.uuid4().hex,
+        'tenant': g.get('tenant', DEFAULT_TENANT),
+        'filename': filename,
+        'campaign_name': campaign_name,
+        'campaign_description': str(data.get('campaign_description') or '').strip(),
+        'mapping_profile': data.get('mapping_profile') or None,
+        'part_size': app.config['UPLOAD_PART_SIZE'],
+        'size': size,
+        'created_at': time.time(),
+    }
+    path = _upload_dir(manifest['upload_id'])
+    os.makedirs(os.path.join(path, 'parts'))
+    open(os.path.join(path, 'data'), 'wb').close()
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    logger.info("chunked_upload_started upload_id=%s filename=%s size=%s", manifest['upload_id'], filename, size)
+    return jsonify(describe_upload(manifest, {})), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'DELETE'])
+def chunked_upload_status(upload_id):
+    """Received parts (GET), for resuming after a failure, or abandon the upload (DELETE)"""
+    manifest = load_upload_session(upload_id)
+    if manifest is None:
+        return jsonify({"status": "error", "message": "Unknown or expired upload"}), 404
+    if request.method == 'DELETE':
+        shutil.rmtree(_upload_dir(upload_id), ignore_errors=True)
+        return jsonify({"status": "success", "deleted": True})
+    return jsonify(describe_upload(manifest, received_parts(upload_id)))
+
+@app.route('/api/uploads/<upload_id>/parts/<int:part_number>', methods=['PUT'])
+def upload_part(upload_id, part_number):
+    """Store one part at its offset; the X-Part-SHA256 header (hex) must match the body"""
+    manifest = load_upload_session(upload_id)
+    if manifest is None:
+        return jsonify({"status": "error", "message": "Unknown or expired upload"}), 404
+    part_size = manifest['part_size']
+    last = expected_part_count(manifest)
+    if not 1 <= part_number <= last:
+        return jsonify({"status": "error", "message": f"part_number must be between 1 and {last}"}), 400
+    checksum = request.headers.get('X-Part-SHA256', '').strip().lower()
+    if not SHA256_HEX.match(checksum):
+        return jsonify({"status": "error", "message": "X-Part-SHA256 header (hex SHA-256 of the part) is required"}), 400
+
+    request.max_content_length = part_size
+    marker = os.path.join(_upload_dir(upload_id), 'parts', f"{part_number:06d}")
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(marker)  # its bytes are about to be overwritten; it counts again once verified
+    digest = hashlib.sha256()
+    received = 0
+    with open(os.path.join(_upload_dir(upload_id), 'data'), 'r+b') as f:
+        f.seek((part_number - 1) * part_size)
+        while True:
+            chunk = request.stream.read(UPLOAD_COPY_CHUNK)
+            if not chunk:
+                break
+            received += len(chunk)
+            digest.update(chunk)
+            f.write(chunk)
+
+    actual = digest.hexdigest()
+    if actual != checksum:
+        metrics.inc('chunked_upload_parts_total', (('outcome', 'checksum_mismatch'),))
+        return jsonify({"status": "error", "message": f"Checksum mismatch for part {part_number}; send it again",
+                        "part_number": part_number, "size": received, "sha256": actual}), 400
+    expected_size = min(part_size, manifest['size'] - (part_number - 1) * part_size)
+    if received != expected_size:
+        return jsonify({"status": "error", "message": f"Part {part_number} must be {expected_size} bytes, "
+                                                      f"got {received}"}), 400
+
+    pending = f"{marker}.{uuid.uuid4().hex}"
+    with open(pending, 'w') as f:
+        f.write(f"{received} {actual}")
+    os.replace(pending, marker)
+    metrics.inc('chunked_upload_parts_total', (('outcome', 'stored'),))
+    metrics.inc('chunked_upload_bytes_total', (), received)
+    return jsonify({"status": "success", "part_number": part_number, "size": received, "sha256": actual})
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """
+    Import an upload whose parts are all in: creates the campaign like /upload and answers in
+    the same shape. Optional body: {"sha256": hex digest of the whole file, "mapping_profile"}.
+    The result is kept under the upload id, so retrying after a dropped response is safe.
+    """
+    repo = get_repository()
+    key = f"upload:{upload_id}"
+    stored = repo.lookup_idempotent_upload(key) if UPLOAD_ID.match(upload_id) else None
+    if stored is not None:
+        return idempotent_replay(key, stored)
+    manifest = load_upload_session(upload_id)
+    if manifest is None:
+        return jsonify({"status": "error", "message": "Unknown or expired upload"}), 404
+    data = request.get_json(silent=True) or {}
+
+    status = describe_upload(manifest, received_parts(upload_id))
+    if status['missing_parts']:
+        return jsonify(dict(status, status="error", message="Upload is missing parts")), 409
+    total = manifest['size']  # every part was checked against it when stored
+
+    try:
+        operation = start_operation('chunked_upload', upload_id)
+    except OperationInProgress:
+        return jsonify({"status": "error", "message": "This upload is already being imported"}), 409
+    ingestor = LeadIngestor(repo, batch_size=app.config['UPLOAD_BATCH_SIZE'])
+
+    def discard_staging():
+        repo.rollback()
+        if ingestor.campaign_id is not None:
+            repo.discard_staging_campaign(ingestor.campaign_id)
+            repo.commit()
+            campaign_purger.notify()
+
+    try:
+        import csv
+        with open(os.path.join(_upload_dir(upload_id), 'data'), 'r+b') as f:
+            f.truncate(total)  # a rejected retry of the last part may have written past its end
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                if data.get('sha256') and hashlib.sha256(view).hexdigest() != str(data['sha256']).lower():
+                    operation.fail('File checksum mismatch')
+                    return jsonify({"status": "error", "message": "sha256 of the assembled file does not match"}), 400
+                reader = csv.reader(iter_mapped_lines(view))
+                header = next(reader, [])
+                profile_name, profile = choose_import_profile(
+                    repo.import_profiles(), header, data.get('mapping_profile') or manifest['mapping_profile'])
+                extractor = compile_import_profile(profile_name, profile, header)
+                operation.progress('importing', rows=0, bytes=0, total_bytes=total, profile=profile_name)
+                reported = 0
+                for leads, rejections in iter_csv_lead_batches(reader, extractor, app.config['UPLOAD_BATCH_SIZE']):
+                    ingestor.add_normalized(leads, rejections)
+                    if view.tell() - reported >= total // 100:
+                        reported = view.tell()
+                        operation.progress('importing', rows=ingestor.leads_received, bytes=reported,
+                                           total_bytes=total, rejected=ingestor.report.rejected)
+
+        operation.progress('inserting', rows=ingestor.leads_spooled)
+        if ingestor.leads_spooled:
+            ingestor.campaign_id = repo.create_staging_campaign(manifest['campaign_name'],
+                                                                manifest['campaign_description'])
+            repo.commit()
+        ingestor.finish(manifest['campaign_name'], manifest['campaign_description'], commit_batches=True)
+        report = ingestor.report
+        if not ingestor.leads_added:
+            # Nothing imported: keep the parts so the upload can be completed with another mapping
+            message = "No valid unique profiles found after filtering unsubscribed leads"
+            if extractor.positions.keys() < {'email', 'first_name'}:
+                message += f" (no email/first name column for the {profile_name!r} mapping)"
+            if report.rejected:
+                message += f" and rejecting invalid rows: {report.summary()}"
+            repo.commit()  # the error report
+            discard_staging()
+            operation.fail(message)
+            return jsonify({"status": "error", "message": message, "profile": profile_name,
+                            "rejected": report.rejected, "rejection_reasons": report.counts,
+                            "error_report_url": report.url}), 400
+
+        candidates = ingestor.fuzzy_candidates
+        response_data = {
+            "status": "success",
+            "campaign_id": ingestor.campaign_id,
+            "profile": profile_name,
+            "bytes": total,
+            "leads_received": ingestor.leads_received,
+            "leads_added": ingestor.leads_added,
+            "duplicates_removed": ingestor.duplicate_count,
+            "unsubscribed_filtered": ingestor.unsubscribed_count,
+            "rejected": report.rejected,
+            "rejection_reasons": report.counts,
+            "error_report_url": report.url,
+            "possible_duplicates": describe_clusters(candidates, fuzzy_only_clusters(find_duplicate_clusters(candidates)))
+                                   if candidates is not None else None
+        }
+        repo.publish_staging_campaign(ingestor.campaign_id)
+        if not repo.store_idempotent_upload(key, ingestor.campaign_id, response_data):
+            discard_staging()  # completed by another worker meanwhile
+            operation.fail('Upload was completed by another request')
+            return idempotent_replay(key, repo.lookup_idempotent_upload(key))
+        repo.commit()
+        operation.done(f"Imported {ingestor.leads_added} leads into \"{manifest['campaign_name']}\"",
+                       redirect=url_for('campaign_detail', campaign_id=ingestor.campaign_id))
+    except UnicodeDecodeError as e:
+        discard_staging()
+        operation.fail(f'File is not UTF-8 text: {e}')
+        return jsonify({"status": "error", "message": f"File is not UTF-8 text: {e}"}), 400
+    except Exception as e:
+        discard_staging()
+        if is_database_locked(e):
+            operation.fail('Database is busy, retry the upload')
+            raise
+        logger.exception("chunked_upload_failed upload_id=%s error=%s", upload_id, e)
+        operation.fail(f'Error importing upload: {e}')
+        return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        ingestor.close()
+        operation.close()
+
+    shutil.rmtree(_upload_dir(upload_id), ignore_errors=True)
+    logger.info("campaign_created campaign_id=%d name=%r leads_added=%d duplicates_removed=%d upload_id=%s bytes=%d",
+                ingestor.campaign_id, manifest['campaign_name'], ingestor.leads_added, ingestor.duplicate_count,
+                upload_id, total)
+    return jsonify(response_data)
+
+
+# --- DELIVERY EVENTS: CALLBACK INGESTION AND ROLLUPS ---
+# n8n reports per-lead outcomes (delivered, opened, bounced, ...) to /api/delivery_events in
+# large batches. Events are appended to delivery_events with batched inserts and nothing
+# else on the write path. A background thread folds new events (id above the watermark in
+# app_state) into lead_delivery_status (one row per lead: bit flags of what has happened,
+# the headline status, open/click counts) and campaign_delivery_stats (per campaign, the
+# number of distinct leads that reached each state, plus event totals). Dashboards read
+# only the rollups. Events carrying an event_id are stored once, so retried callbacks don't
+# double count. Events for leads of archived or purged campaigns are skipped at rollup, and
+# raw events are dropped after DELIVERY_EVENT_RETENTION_DAYS.
+DELIVERY_EVENT_TYPES = {'delivered': 1, 'opened': 2, 'clicked': 4, 'bounced': 8, 'failed': 16, 'complained': 32}
+DELIVERY_STATUS_PRECEDENCE = ('complained', 'bounced', 'failed', 'clicked', 'opened', 'delivered')
+DELIVERY_DETAIL_MAX_LENGTH = 1000
+DELIVERY_EVENT_COLUMNS = ('lead_id', 'event', 'occurred_at', 'received_at', 'event_key', 'detail')
+DELIVERY_ROLLUP_LOCK_ID = 0x6465_6c76  # PostgreSQL advisory lock: ingest (shared) vs rollup bound (exclusive)
+
+DELIVERY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS delivery_events (
+    id INTEGER PRIMARY KEY,
+    lead_id INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    occurred_at REAL NOT NULL,
+    received_at REAL NOT NULL,
+    event_key TEXT,
+    detail TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_delivery_events_key ON delivery_events(event_key) WHERE event_key IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS lead_delivery_status (
+    lead_id INTEGER PRIMARY KEY,
+    campaign_id INTEGER NOT NULL,
+    flags INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    open_count INTEGER NOT NULL DEFAULT 0,
+    click_count INTEGER NOT NULL DEFAULT 0,
+    last_event_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_lead_delivery_campaign ON lead_delivery_status(campaign_id, status, lead_id);
+
+CREATE TABLE IF NOT EXISTS campaign_delivery_stats (
+    campaign_id INTEGER PRIMARY KEY,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    opened INTEGER NOT NULL DEFAULT 0,
+    clicked INTEGER NOT NULL DEFAULT 0,
+    bounced INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    complained INTEGER NOT NULL DEFAULT 0,
+    events INTEGER NOT NULL DEFAULT 0,
+    last_event_at REAL,
+    updated_at REAL
+);
+
+CREATE TRIGGER IF NOT EXISTS campaigns_delivery_delete AFTER DELETE ON campaigns BEGIN
+    DELETE FROM lead_delivery_status WHERE campaign_id = OLD.id;
+    DELETE FROM campaign_delivery_stats WHERE campaign_id = OLD.id;
+END;
 
-@app.route('/upload', methods=['POST'])
-def upload_leads():
-    data = request.get_json()
-    print(f"Received data: {data}")
+INSERT OR IGNORE INTO app_state (key, value) VALUES ('delivery_rollup_id', 0);
+"""
+
+def parse_event_time(value, default):
+    """Epoch seconds (or milliseconds) or an ISO 8601 string -> epoch seconds; default if missing/unreadable"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value / 1000.0 if value > 1e11 else float(value)
+    if isinstance(value, str) and value.strip():
+        try:
+            when = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            return default
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return when.timestamp()
+    return default
+
+def normalize_delivery_event(event, received_at):
+    """Row for delivery_events, or None when the event has no usable lead_id / event type"""
+    if not isinstance(event, dict):
+        return None
+    kind = str(event.get('event') or event.get('type') or '').strip().lower()
+    if kind not in DELIVERY_EVENT_TYPES:
+        return None
+    try:
+        lead_id = int(event.get('lead_id'))
+    except (TypeError, ValueError):
+        return None
+    event_key = event.get('event_id')
+    event_key = str(event_key)[:MAX_IDEMPOTENCY_KEY_LENGTH] if event_key not in (None, '') else None
+    detail = event.get('detail', event.get('reason'))
+    if detail is not None and not isinstance(detail, str):
+        detail = json.dumps(detail)
+    return (lead_id, kind, parse_event_time(event.get('occurred_at', event.get('timestamp')), received_at),
+            received_at, event_key, detail[:DELIVERY_DETAIL_MAX_LENGTH] if detail else None)
 
-    # Handle both array and object formats
-    if isinstance(data, list):
-        if len(data) > 0:
-            data = data[0]
+def _iter_json_array(reader):
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.expect(']')
+        return
+    while True:
+        yield reader.value()
+        if reader.peek() != ',':
+            break
+        reader.expect(',')
+    reader.expect(']')
+
+def iter_delivery_events_json(reader):
+    """Events from {"events": [...]} (other keys ignored) or a bare [...] array"""
+    if reader.peek() == '[':
+        yield from _iter_json_array(reader)
+        return
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'events' and reader.peek() == '[':
+            yield from _iter_json_array(reader)
         else:
-            return jsonify({"status": "error", "message": "Empty data array"}), 400
+            reader.value()
+        if reader.peek() != ',':
+            break
+        reader.expect(',')
+    reader.expect('}')
 
-    campaign_name = data.get("campaign_name")
-    campaign_description = data.get("campaign_description", "")
-    leads = data.get("leads")
+def delivery_status_for(flags):
+    return next((name for name in DELIVERY_STATUS_PRECEDENCE if flags & DELIVERY_EVENT_TYPES[name]), 'sent')
 
-    if not campaign_name or not leads:
-        return jsonify({"status": "error", "message": "Missing campaign_name or leads"}), 400
+def _in_clause(placeholder, count):
+    return ','.join([placeholder] * count)
 
-    try:
-        leads_data = []
-        for lead in leads:
-            description = lead.get("description") or lead.get("Description", "")
-            source = lead.get("source") or lead.get("Source", "API Import")
+def roll_up_delivery_batch(cursor, placeholder, batch_size, upto_id=None):
+    """
+    Fold the next batch of events after the watermark (and at most upto_id) into the rollup
+    tables and advance the watermark. Runs inside the caller's write transaction. Returns the
+    number of events consumed.
+    """
+    p = placeholder
+    cursor.execute("SELECT value FROM app_state WHERE key = 'delivery_rollup_id'")
+    after_id = cursor.fetchone()[0]
+    bound = f"AND id <= {p}" if upto_id is not None else ''
+    cursor.execute(f"""
+        SELECT id, lead_id, event, occurred_at FROM delivery_events
+        WHERE id > {p} {bound} ORDER BY id LIMIT {p}
+    """, (after_id, upto_id, batch_size) if upto_id is not None else (after_id, batch_size))
+    events = cursor.fetchall()
+    if not events:
+        return 0
 
-            first_name = lead.get("first_name", "").strip()
-            last_name = lead.get("last_name", "").strip()
-            email = lead.get("email", "").strip()
-            company = lead.get("company", "").strip()
+    per_lead = {}
+    for _, lead_id, kind, occurred_at in events:
+        entry = per_lead.setdefault(lead_id, [0, 0, 0, 0, occurred_at])  # flags, opens, clicks, events, last
+        entry[0] |= DELIVERY_EVENT_TYPES[kind]
+        entry[1] += kind == 'opened'
+        entry[2] += kind == 'clicked'
+        entry[3] += 1
+        entry[4] = max(entry[4], occurred_at)
 
-            if not email or not first_name:
-                continue
+    lead_ids = list(per_lead)
+    campaigns, existing = {}, {}
+    for i in range(0, len(lead_ids), 500):
+        chunk = lead_ids[i:i + 500]
+        cursor.execute(f"SELECT id, campaign_id FROM campaign_leads WHERE id IN ({_in_clause(p, len(chunk))})", chunk)
+        campaigns.update(cursor.fetchall())
+        cursor.execute(f"""
+            SELECT lead_id, flags, open_count, click_count, last_event_at FROM lead_delivery_status
+            WHERE lead_id IN ({_in_clause(p, len(chunk))})
+        """, chunk)
+        existing.update((row[0], row[1:]) for row in cursor.fetchall())
 
-            try:
-                score = int(lead.get("score", 5))
-            except (ValueError, TypeError):
-                score = 5
-
-            # Add unsubscribe token to each lead
-            lead_dict = {
-                'first_name': first_name,
-                'last_name': last_name,
-                'email': email,
-                'domain': lead.get("domain", ""),
-                'score': score,
-                'company': company,
-                'label': lead.get("label", ""),
-                'description': description,
-                'source': source,
-                'unsubscribe_token': generate_unsubscribe_token(),  # NEW
-                'unsubscribe_status': 'subscribed'  # Default
-            }
-            leads_data.append(lead_dict)
+    now = time.time()
+    lead_rows = []
+    campaign_totals = {}
+    for lead_id, (flags, opens, clicks, event_count, last_event_at) in per_lead.items():
+        campaign_id = campaigns.get(lead_id)
+        if campaign_id is None:
+            continue  # lead archived or purged since it was sent
+        old_flags, old_opens, old_clicks, old_last = existing.get(lead_id, (0, 0, 0, None))
+        new_flags = old_flags | flags
+        lead_rows.append((lead_id, campaign_id, new_flags, delivery_status_for(new_flags), old_opens + opens,
+                          old_clicks + clicks, max(last_event_at, old_last or last_event_at)))
+        totals = campaign_totals.setdefault(campaign_id, dict.fromkeys(DELIVERY_EVENT_TYPES, 0))
+        for name, bit in DELIVERY_EVENT_TYPES.items():
+            if bit & new_flags and not bit & old_flags:
+                totals[name] += 1  # distinct leads: counted the first time each state is reached
+        totals['events'] = totals.get('events', 0) + event_count
+        totals['last_event_at'] = max(totals.get('last_event_at', last_event_at), last_event_at)
 
-        # Filter out unsubscribed leads before deduplication
-        filtered_leads, unsubscribed_count, unsubscribed_emails = filter_unsubscribed_leads(leads_data)
-        if unsubscribed_count > 0:
-            print(f"🚫 Filtered out {unsubscribed_count} unsubscribed emails: {unsubscribed_emails}")
+    names = list(DELIVERY_EVENT_TYPES)
+    cursor.executemany(f"""
+        INSERT INTO lead_delivery_status (lead_id, campaign_id, flags, status, open_count, click_count, last_event_at)
+        VALUES ({_in_clause(p, 7)})
+        ON CONFLICT (lead_id) DO UPDATE SET
+            campaign_id = excluded.campaign_id, flags = excluded.flags, status = excluded.status,
+            open_count = excluded.open_count, click_count = excluded.click_count, last_event_at = excluded.last_event_at
+    """, lead_rows)
+    cursor.executemany(f"""
+        INSERT INTO campaign_delivery_stats (campaign_id, {', '.join(names)}, events, last_event_at, updated_at)
+        VALUES ({_in_clause(p, len(names) + 4)})
+        ON CONFLICT (campaign_id) DO UPDATE SET
+            {', '.join(f"{name} = campaign_delivery_stats.{name} + excluded.{name}" for name in names)},
+            events = campaign_delivery_stats.events + excluded.events,
+            last_event_at = CASE WHEN campaign_delivery_stats.last_event_at IS NULL
+                                   OR excluded.last_event_at > campaign_delivery_stats.last_event_at
+                                 THEN excluded.last_event_at ELSE campaign_delivery_stats.last_event_at END,
+            updated_at = excluded.updated_at
+    """, [(campaign_id,) + tuple(totals[name] for name in names) + (totals['events'], totals['last_event_at'], now)
+          for campaign_id, totals in campaign_totals.items()])
+    bump_campaign_generations(cursor, campaign_totals, p)
+    cursor.execute(f"UPDATE app_state SET value = {p} WHERE key = 'delivery_rollup_id'", (events[-1][0],))
+    skipped = sum(1 for lead_id in per_lead if lead_id not in campaigns)
+    if skipped:
+        logger.info("delivery_events_skipped leads=%d reason=unknown_lead", skipped)
+    return len(events)
 
-        # Remove duplicates
-        unique_leads, duplicate_count = remove_duplicate_leads(filtered_leads)
+def prune_delivery_events(cursor, placeholder, cutoff, batch_size):
+    """Delete one batch of rolled-up events received before cutoff, oldest first; returns rows deleted"""
+    p = placeholder
+    cursor.execute(f"""
+        DELETE FROM delivery_events WHERE id IN (
+            SELECT id FROM delivery_events
+            WHERE id <= (SELECT value FROM app_state WHERE key = 'delivery_rollup_id')
+            ORDER BY id LIMIT {p}
+        ) AND received_at < {p}
+    """, (batch_size, cutoff))
+    return cursor.rowcount
 
-        if not unique_leads:
-            return jsonify({
-                "status": "error",
-                "message": "No valid unique profiles found after filtering unsubscribed leads"
-            }), 400
+def delivery_summary(cursor, placeholder, campaign_id):
+    names = list(DELIVERY_EVENT_TYPES)
+    cursor.execute(f"""
+        SELECT {', '.join(names)}, events, last_event_at, updated_at FROM campaign_delivery_stats
+        WHERE campaign_id = {placeholder}
+    """, (campaign_id,))
+    row = cursor.fetchone()
+    summary = dict(zip(names + ['events', 'last_event_at', 'updated_at'], row or [0] * (len(names) + 1) + [None, None]))
+    cursor.execute("""
+        SELECT (SELECT COALESCE(MAX(id), 0) FROM delivery_events)
+               - (SELECT value FROM app_state WHERE key = 'delivery_rollup_id')
+    """)
+    summary['pending_events'] = max(cursor.fetchone()[0], 0)  # not yet rolled up, across all campaigns
+    return summary
 
-        db = get_db()
-        cursor = db.cursor()
+def lead_delivery_statuses(cursor, placeholder, campaign_id, status=None, after_lead_id=0, limit=100):
+    """Per-lead rollups for a campaign in lead id order (keyset pagination with after_lead_id)"""
+    p = placeholder
+    params = [campaign_id] + ([status] if status else []) + [after_lead_id, limit]
+    cursor.execute(f"""
+        SELECT s.lead_id, l.email, s.status, s.flags, s.open_count, s.click_count, s.last_event_at
+        FROM lead_delivery_status s
+        JOIN leads l ON l.id = s.lead_id
+        WHERE s.campaign_id = {p} {f"AND s.status = {p}" if status else ''} AND s.lead_id > {p}
+        ORDER BY s.lead_id LIMIT {p}
+    """, params)
+    return [{'lead_id': row[0], 'email': row[1], 'status': row[2],
+             'events': [name for name, bit in DELIVERY_EVENT_TYPES.items() if row[3] & bit],
+             'opens': row[4], 'clicks': row[5], 'last_event_at': row[6]} for row in cursor.fetchall()]
 
-        # Campaign insert - FIXED THIS SECTION
-        cursor.execute("PRAGMA table_info(campaigns)")
-        campaigns_columns = [col[1] for col in cursor.fetchall()]
-        has_created_at = 'created_at' in campaigns_columns
+class DeliveryRollup:
+    """
+    Background thread: every DELIVERY_ROLLUP_INTERVAL_SECONDS, rolls up new delivery events on
+    every shard (or the PostgreSQL database) DELIVERY_ROLLUP_BATCH_SIZE events per transaction,
+    then prunes events past retention.
+    """
 
-        if has_created_at:
-            cursor.execute("""
-                INSERT INTO campaigns (name, description, status, created_at) 
-                VALUES (?, ?, 'pending', ?)
-            """, (campaign_name, campaign_description, datetime.now()))
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self.thread = threading.Thread(target=self._run, name='delivery-rollup', daemon=True)
+            self.thread.start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("delivery_rollup_failed")
+            self.wakeup.wait(app.config['DELIVERY_ROLLUP_INTERVAL_SECONDS'])
+            self.wakeup.clear()
+
+    def _repositories(self):
+        """(repository, release) per database holding delivery events"""
+        if app.config['STORAGE_BACKEND'] == 'postgres':
+            dsn = app.config['POSTGRES_DSN']
+            conn = postgres_pool.acquire(dsn)
+            try:
+                yield PostgresRepository(conn)
+            finally:
+                postgres_pool.release(dsn, conn)
+            return
+        for db_path in shard_catalog.all_shards().values():
+            conn = connection_pool.acquire(db_path)
+            try:
+                yield SQLiteRepository(conn)
+            finally:
+                connection_pool.release(db_path, conn)
+
+    def run_once(self):
+        """Roll up and prune everywhere. Returns the number of events rolled up."""
+        batch_size = app.config['DELIVERY_ROLLUP_BATCH_SIZE']
+        cutoff = time.time() - app.config['DELIVERY_EVENT_RETENTION_DAYS'] * 86400
+        total = 0
+        for repo in self._repositories():
+            started = time.perf_counter()
+            rolled_up = repo.roll_up_delivery_events(batch_size)
+            metrics.inc('delivery_events_rolled_up_total', (), rolled_up)
+            pruned = 0
+            if app.config['DELIVERY_EVENT_RETENTION_DAYS'] > 0:
+                while True:
+                    deleted = repo.prune_delivery_events(cutoff, batch_size)
+                    repo.commit()
+                    pruned += deleted
+                    if deleted < batch_size:
+                        break
+            if rolled_up or pruned:
+                logger.info("delivery_rollup events=%d pruned=%d duration_ms=%.1f",
+                            rolled_up, pruned, (time.perf_counter() - started) * 1000)
+            total += rolled_up
+        return total
+
+delivery_rollup = DeliveryRollup()
+
+@app.route('/api/delivery_events', methods=['POST'])
+def ingest_delivery_events():
+    """
+    Per-lead delivery callbacks from n8n: {"events": [...]}, a bare array, or NDJSON (one event
+    per line), optionally gzip-compressed. Each event needs "lead_id" (as sent in the dispatch
+    payload) and "event" (delivered, opened, clicked, bounced, failed, complained); "occurred_at"
+    (epoch seconds or ISO 8601), "event_id" (deduplication) and "detail" are optional.
+    Events are stored as received and show up in the rollups after the next rollup pass.
+    """
+    request.max_content_length = app.config['MAX_UPLOAD_JSON_BYTES']
+    # Buffered: line iteration straight off the WSGI input reads in tiny pieces
+    stream = io.BufferedReader(request.stream, 64 * 1024)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        import gzip
+        stream = gzip.GzipFile(fileobj=stream)
+    received_at = time.time()
+    batch_size = app.config['DELIVERY_EVENT_BATCH_SIZE']
+    repo = get_repository()
+    received = accepted = rejected = 0
+    batch = []
+    try:
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            events = (json.loads(line) for line in stream if line.strip())
         else:
-            cursor.execute("""
-                INSERT INTO campaigns (name, description, status) 
-                VALUES (?, ?, 'pending')
-            """, (campaign_name, campaign_description))  # FIXED: Removed /merge_campaigns
-        
-        campaign_id = cursor.lastrowid
-
-        # Leads table column checks
-        cursor.execute("PRAGMA table_info(leads)")
-        leads_columns = [col[1] for col in cursor.fetchall()]
-
-        has_source = 'source' in leads_columns
-        has_is_active = 'is_active' in leads_columns
-        has_leads_created_at = 'created_at' in leads_columns
-
-        leads_added = 0
-        for lead in unique_leads:
-            columns = [
-                'campaign_id', 'first_name', 'last_name', 'email', 'domain', 
-                'score', 'company', 'label', 'description',
-                'unsubscribe_token', 'unsubscribe_status'
-            ]
-            values = [
-                campaign_id,
-                lead['first_name'],
-                lead['last_name'],
-                lead['email'],
-                lead['domain'],
-                lead['score'],
-                lead['company'],
-                lead['label'],
-                lead['description'],
-                lead['unsubscribe_token'],
-                lead['unsubscribe_status']
-            ]
+            events = iter_delivery_events_json(JSONStreamReader(stream))
+        for event in events:
+            received += 1
+            row = normalize_delivery_event(event, received_at)
+            if row is None:
+                rejected += 1
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                accepted += repo.insert_delivery_events(batch)
+                batch = []
+        if batch:
+            accepted += repo.insert_delivery_events(batch)
+        repo.commit()
+    except (ValueError, OSError, EOFError) as e:
+        repo.rollback()
+        return jsonify({"status": "error", "message": f"Invalid delivery events: {e}"}), 400
+    metrics.inc('delivery_events_received_total', (('outcome', 'accepted'),), accepted)
+    metrics.inc('delivery_events_received_total', (('outcome', 'duplicate'),), received - rejected - accepted)
+    metrics.inc('delivery_events_received_total', (('outcome', 'rejected'),), rejected)
+    if not delivery_rollup.running:
+        # No background thread: one bounded batch on this shard only; the rest stays pending
+        # for the next ingest
+        rolled_up = repo.roll_up_delivery_events(app.config['DELIVERY_ROLLUP_BATCH_SIZE'], max_batches=1)
+        metrics.inc('delivery_events_rolled_up_total', (), rolled_up)
+    return jsonify({"status": "success", "received": received, "accepted": accepted,
+                    "duplicates": received - rejected - accepted, "rejected": rejected}), 202
 
-            if has_source:
-                columns.append('source')
-                values.append(lead['source'])
+@app.route('/api/campaign/<int:campaign_id>/delivery')
+def campaign_delivery(campaign_id):
+    """Rolled-up delivery counts for a campaign (distinct leads per state, from the last rollup pass)"""
+    return jsonify(dict(get_repository().delivery_summary(campaign_id), campaign_id=campaign_id))
 
-            if has_is_active:
-                columns.append('is_active')
-                values.append(1)
+@app.route('/api/campaign/<int:campaign_id>/delivery/leads')
+def campaign_delivery_leads(campaign_id):
+    """Per-lead delivery status, ?status=bounced to filter; page with ?after=<last lead_id>"""
+    status = request.args.get('status') or None
+    if status is not None and status not in DELIVERY_STATUS_PRECEDENCE + ('sent',):
+        return jsonify({"status": "error", "message": f"Unknown delivery status: {status}"}), 400
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    leads = get_repository().lead_delivery_statuses(campaign_id, status, after, limit)
+    return jsonify({"campaign_id": campaign_id, "leads": leads,
+                    "next_after": leads[-1]['lead_id'] if len(leads) == limit else None})
 
-            if has_leads_created_at:
-                columns.append('created_at')
-                values.append(datetime.now())
+# --- DELETE CAMPAIGN: SOFT DELETE + BACKGROUND PURGE ---
+class CampaignPurger:
+    """
+    Removes soft-deleted campaigns. Memberships go PURGE_BATCH_SIZE rows per transaction with
+    a pause in between, so the write lock is only ever held briefly; the campaign row goes
+    last (ON DELETE CASCADE catches anything added meanwhile), then freed pages are returned
+    with incremental vacuum. Runs on a daemon thread, woken by delete_campaign and every
+    PURGE_INTERVAL_SECONDS to pick up work left by a restart; each pass also archives old
+    sent campaigns (see ARCHIVAL TIER). With PURGE_IN_BACKGROUND=0, `flask purge-deleted`
+    does the purge instead.
+    """
 
-            placeholders_str = ', '.join(['?' for _ in columns])
-            columns_str = ', '.join(columns)
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self.thread = None
 
-            cursor.execute(f"""
-                INSERT INTO leads ({columns_str})
-                VALUES ({placeholders_str})
-            """, values)
-            leads_added += 1
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
 
-        db.commit()
+    def start(self):
+        if not self.running:
+            self.thread = threading.Thread(target=self._run, name='campaign-purger', daemon=True)
+            self.thread.start()
 
-        response_data = {
-            "status": "success",
-            "campaign_id": campaign_id,
-            "leads_added": leads_added,
-            "duplicates_removed": duplicate_count,
-            "unsubscribed_filtered": unsubscribed_count
-        }
+    def notify(self):
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("campaign_purge_failed")
+            if app.config['ARCHIVE_AFTER_DAYS'] > 0:
+                try:
+                    self.archive_once()
+                except Exception:
+                    logger.exception("campaign_archive_failed")
+            self.wakeup.wait(app.config['PURGE_INTERVAL_SECONDS'])
+            self.wakeup.clear()
 
-        print(f"✅ Campaign created: {campaign_name} with {leads_added} unique leads")
-        return jsonify(response_data)
+    def run_once(self):
+        """Purge soft-deleted campaigns on every shard (or in PostgreSQL). Returns the number of campaigns purged."""
+        if app.config['STORAGE_BACKEND'] == 'postgres':
+            return self.purge_postgres()
+        return sum(self.purge_shard(db_path) for db_path in shard_catalog.all_shards().values())
 
-    except Exception as e:
-        print(f"❌ Error processing upload: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+    def archive_once(self):
+        """Archive campaigns that are due on every shard. Returns the number archived."""
+        if app.config['STORAGE_BACKEND'] == 'postgres':
+            return 0  # no archival tier
+        return sum(self.archive_shard(db_path) for db_path in shard_catalog.all_shards().values())
+
+    def purge_shard(self, db_path):
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute("PRAGMA foreign_keys = ON")
+        try:
+            purged = 0
+            # Staging campaigns of chunked uploads are hidden the same way; they are only left
+            # behind (and purged) once their import has been dead for the upload session TTL
+            abandoned = datetime.now() - timedelta(hours=app.config['UPLOAD_SESSION_TTL_HOURS'])
+            while True:
+                row = conn.execute("""
+                    SELECT id FROM campaigns
+                    WHERE deleted_at IS NOT NULL AND (status != 'importing' OR deleted_at < ?)
+                    ORDER BY deleted_at LIMIT 1
+                """, (abandoned,)).fetchone()
+                if row is None:
+                    break
+                self.purge_campaign(conn, row[0])
+                purged += 1
+            if purged:
+                self.vacuum(conn)
+            return purged
+        finally:
+            conn.close()
+
+    def purge_postgres(self):
+        dsn = app.config['POSTGRES_DSN']
+        conn = postgres_pool.acquire(dsn)
+        try:
+            abandoned = datetime.now() - timedelta(hours=app.config['UPLOAD_SESSION_TTL_HOURS'])
+            return PostgresRepository(conn).purge_deleted_campaigns(abandoned, app.config['PURGE_BATCH_SIZE'],
+                                                                    app.config['PURGE_PAUSE_SECONDS'])
+        finally:
+            postgres_pool.release(dsn, conn)
 
+    def archive_shard(self, db_path):
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute("PRAGMA foreign_keys = ON")
+        try:
+            archived = archive_old_campaigns(conn)
+            if archived:
+                self.vacuum(conn)
+            return archived
+        finally:
+            conn.close()
+
+    def purge_campaign(self, conn, campaign_id):
+        batch_size = app.config['PURGE_BATCH_SIZE']
+        started = time.perf_counter()
+        removed = 0
+        for table, key in (('campaign_leads', 'id'), ('archived_memberships', 'contact_id, membership_id')):
+            while True:
+                with conn:
+                    deleted = conn.execute(f"""
+                        DELETE FROM {table}
+                        WHERE ({key}) IN (SELECT {key} FROM {table} WHERE campaign_id = ? LIMIT ?)
+                    """, (campaign_id, batch_size)).rowcount
+                removed += deleted
+                if deleted < batch_size:
+                    break
+                time.sleep(app.config['PURGE_PAUSE_SECONDS'])
+        if attach_archive(conn, create=False):
+            with conn:
+                conn.execute("DELETE FROM archive.archived_tokens WHERE campaign_id = ?", (campaign_id,))
+                conn.execute("DELETE FROM archive.archived_campaigns WHERE campaign_id = ?", (campaign_id,))
+        with conn:
+            conn.execute("DELETE FROM campaigns WHERE id = ? AND deleted_at IS NOT NULL", (campaign_id,))
+        logger.info("campaign_purged campaign_id=%d memberships=%d duration_ms=%.1f",
+                    campaign_id, removed, (time.perf_counter() - started) * 1000)
+
+    def vacuum(self, conn):
+        """Return free pages to the filesystem a step at a time (needs auto_vacuum = INCREMENTAL)"""
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return
+        pages = app.config['VACUUM_PAGES_PER_STEP']
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free > 0:
+            conn.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free:
+                break
+            free = remaining
+            time.sleep(app.config['PURGE_PAUSE_SECONDS'])
+
+campaign_purger = CampaignPurger()
+
+@app.cli.command('purge-deleted')
+def purge_deleted_command():
+    """Purge soft-deleted campaigns on every shard (for deployments with PURGE_IN_BACKGROUND=0)"""
+    logger.info("campaigns_purged count=%d", campaign_purger.run_once())
 
-# --- DELETE CAMPAIGN ---
 @app.route('/delete_campaign/<int:campaign_id>', methods=['POST'])
 def delete_campaign(campaign_id):
-    db = get_db()
-    cursor = db.cursor()
-    
-    # Delete associated leads first
-    cursor.execute("DELETE FROM leads WHERE campaign_id = ?", (campaign_id,))
-    
-    # Then delete the campaign
-    cursor.execute("DELETE FROM campaigns WHERE id = ?", (campaign_id,))
-    
-    db.commit()
+    # Hide the campaign now; its leads are removed in the background
+    repo = get_repository()
+    repo.delete_campaign(campaign_id)
+    repo.commit()
+    audit_log.record('delete_campaign', campaign_id, deleted=True)
+
+    # Without the purger thread (PURGE_IN_BACKGROUND=0) the campaign stays soft-deleted until
+    # the next `flask purge-deleted` run; purging is never done on the request
+    campaign_purger.notify()
     flash('Campaign deleted successfully!', 'success')
     return redirect(url_for('campaigns'))
 
 # --- GET CAMPAIGN STATS (API ENDPOINT) ---
 @app.route('/api/campaign/<int:campaign_id>/stats')
 def get_campaign_stats(campaign_id):
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM leads WHERE campaign_id = ? AND is_active = 1", (campaign_id,))
-    active_count = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM leads WHERE campaign_id = ? AND is_active = 0", (campaign_id,))
-    inactive_count = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM leads WHERE campaign_id = ?", (campaign_id,))
-    total_count = cursor.fetchone()[0]
+    repo = get_repository()
+    repo.ensure_hot([campaign_id])
+    active_count, inactive_count, total_count = repo.lead_counts(campaign_id)
     
     return jsonify({
         "active": active_count,
@@ -1213,59 +6114,62 @@ def get_campaign_stats(campaign_id):
 # --- EXPORT CAMPAIGN DATA ---
 @app.route('/export_campaign/<int:campaign_id>')
 def export_campaign(campaign_id):
-    db = get_db()
-    cursor = db.cursor()
+    """
+    CSV export, streamed: rows are read EXPORT_FETCH_SIZE at a time (a server-side cursor on
+    PostgreSQL) and written out as they arrive, gzip-compressed on the fly when accepted.
+    """
+    repo = get_repository()
+    repo.ensure_hot([campaign_id])
     
     # Get campaign name
-    cursor.execute("SELECT name FROM campaigns WHERE id = ?", (campaign_id,))
-    campaign = cursor.fetchone()
-    campaign_name = campaign[0] if campaign else f"Campaign_{campaign_id}"
-    
-    # Get all leads
-    cursor.execute("""
-        SELECT first_name, last_name, email, company, domain, score, label, description, source, is_active
-        FROM leads WHERE campaign_id = ? ORDER BY id
-    """, (campaign_id,))
-    leads = cursor.fetchall()
+    campaign = repo.get_campaign(campaign_id)
+    campaign_name = campaign['name'] if campaign else f"Campaign_{campaign_id}"
     
     # Create CSV response
-    from flask import Response
-    import io
+    from flask import Response, stream_with_context
     import csv
     
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['First Name', 'Last Name', 'Email', 'Company', 'Domain', 'Score', 'Label', 'Description', 'Source', 'Status'])
-    
-    # Write data
-    for lead in leads:
-        status = 'Active' if lead[9] == 1 else 'Inactive'
-        writer.writerow([lead[0], lead[1], lead[2], lead[3], lead[4], lead[5], lead[6], lead[7], lead[8], status])
-    
-    output.seek(0)
+    fetch_size = app.config['EXPORT_FETCH_SIZE']
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if request.accept_encodings['gzip'] else None
+    release = detach_request_connections()
+
+    def generate():
+        output = io.StringIO()
+        writer = csv.writer(output)
+
+        def take():
+            chunk = output.getvalue().encode('utf-8')
+            output.seek(0)
+            output.truncate()
+            return compressor.compress(chunk) if compressor else chunk
+
+        # Write header
+        writer.writerow(['First Name', 'Last Name', 'Email', 'Company', 'Domain', 'Score', 'Label', 'Description', 'Source', 'Status'])
+        
+        # Write data
+        for count, lead in enumerate(repo.iter_export_rows(campaign_id, fetch_size), 1):
+            status = 'Active' if lead[9] == 1 else 'Inactive'
+            writer.writerow([lead[0], lead[1], lead[2], lead[3], lead[4], lead[5], lead[6], lead[7], lead[8], status])
+            if count % fetch_size == 0:
+                yield take()
+        yield take()
+        if compressor:
+            yield compressor.flush()
     
-    return Response(
-        output.getvalue(),
+    response = Response(
+        stream_with_context(generate()),
         mimetype='text/csv',
         headers={"Content-disposition": f"attachment; filename={campaign_name}_export.csv"}
     )
+    response.call_on_close(release)
+    response.vary.add('Accept-Encoding')
+    if compressor:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 # --- API ENDPOINT TO CHECK FOR DUPLICATES ---
-@app.route('/api/check_duplicates', methods=['POST'])
-def check_duplicates():
-    """API endpoint to check for duplicate emails across all campaigns or within specific campaigns"""
-    data = request.get_json()
-    emails = data.get('emails', [])
-    campaign_ids = data.get('campaign_ids', [])  # Optional: check within specific campaigns
-    
-    if not emails:
-        return jsonify({"error": "No emails provided"}), 400
-    
-    db = get_db()
-    cursor = db.cursor()
-    
+def find_existing_emails(cursor, emails, campaign_ids=None):
+    """[{"email", "found_in": [...]}] for emails already in (hot or archived) campaigns of one shard"""
     duplicates = []
     
     for email in emails:
@@ -1277,16 +6181,28 @@ def check_duplicates():
                 SELECT l.email, c.name, c.id 
                 FROM leads l 
                 JOIN campaigns c ON l.campaign_id = c.id 
-                WHERE LOWER(l.email) = ? AND l.campaign_id IN ({placeholders})
-            """, [email] + campaign_ids)
+                WHERE LOWER(l.email) = ? AND c.deleted_at IS NULL AND l.campaign_id IN ({placeholders})
+                UNION ALL
+                SELECT ct.email, c.name, c.id
+                FROM contacts ct
+                JOIN archived_memberships am ON am.contact_id = ct.id
+                JOIN campaigns c ON c.id = am.campaign_id
+                WHERE ct.email_key = ? AND c.deleted_at IS NULL AND am.campaign_id IN ({placeholders})
+            """, [email] + campaign_ids + [email] + campaign_ids)
         else:
             # Check across all campaigns
             cursor.execute("""
                 SELECT l.email, c.name, c.id 
                 FROM leads l 
                 JOIN campaigns c ON l.campaign_id = c.id 
-                WHERE LOWER(l.email) = ?
-            """, (email,))
+                WHERE LOWER(l.email) = ? AND c.deleted_at IS NULL
+                UNION ALL
+                SELECT ct.email, c.name, c.id
+                FROM contacts ct
+                JOIN archived_memberships am ON am.contact_id = ct.id
+                JOIN campaigns c ON c.id = am.campaign_id
+                WHERE ct.email_key = ? AND c.deleted_at IS NULL
+            """, (email, email))
         
         existing = cursor.fetchall()
         if existing:
@@ -1294,16 +6210,154 @@ def check_duplicates():
                 "email": email,
                 "found_in": [{"campaign_name": row[1], "campaign_id": row[2]} for row in existing]
             })
+    return duplicates
+
+@app.route('/api/check_duplicates', methods=['POST'])
+def check_duplicates():
+    """
+    API endpoint to check for duplicate emails across all campaigns or within specific campaigns.
+    "all_shards": true checks every tenant's shard in parallel (campaign_ids are per shard, so
+    they are ignored then) and tags each match with its tenant.
+    """
+    data = request.get_json()
+    emails = data.get('emails', [])
+    campaign_ids = data.get('campaign_ids', [])  # Optional: check within specific campaigns
+    
+    if not emails:
+        return jsonify({"error": "No emails provided"}), 400
+    
+    if data.get('all_shards'):
+        merged = {}
+        for tenant, found in fan_out(lambda cursor: find_existing_emails(cursor, emails)).items():
+            for entry in found:
+                merged.setdefault(entry['email'], []).extend(dict(match, tenant=tenant) for match in entry['found_in'])
+        duplicates = [{"email": email, "found_in": found_in} for email, found_in in merged.items()]
+    else:
+        duplicates = find_existing_emails(get_db().cursor(), emails, campaign_ids)
     
     return jsonify({
         "duplicates_found": len(duplicates),
         "duplicates": duplicates
     })
 
+# --- FULL-TEXT SEARCH ACROSS LEADS ---
+SEARCH_MAX_PER_PAGE = 100
+# Above this many matches, bm25-scoring every hit costs more than it's worth:
+# results are returned newest-first instead (FTS5 walks rowids in order, no sort)
+SEARCH_RANK_LIMIT = 1000
+# Column weights for bm25(), in contacts_fts column order:
+# first_name, last_name, email, company, domain, label, description
+SEARCH_COLUMN_WEIGHTS = (8.0, 8.0, 10.0, 5.0, 3.0, 2.0, 1.0)
+
+def build_fts_query(text):
+    """
+    Turn free text into an FTS5 MATCH expression: every term must match, and the
+    last term is a prefix so results narrow as the operator types.
+    Email-like input ("john.doe@acme") is split the same way the tokenizer splits it.
+    Single-character prefixes are matched exactly: they would expand to most of the index.
+    """
+    terms = re.findall(r'\w+', text.lower())
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= 2:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+@app.route('/api/search')
+def search_leads():
+    """Ranked, paginated prefix search over lead name, email, company, domain, label and description"""
+    fts_query = build_fts_query(request.args.get('q', ''))
+    if not fts_query:
+        return jsonify({"error": "Query parameter q is required"}), 400
+
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 25)), 1), SEARCH_MAX_PER_PAGE)
+    except ValueError:
+        return jsonify({"error": "page and per_page must be integers"}), 400
+
+    conditions = ["contacts_fts MATCH ?"]
+    params = [fts_query]
+
+    campaign_ids = request.args.getlist('campaign_id', type=int)
+    if campaign_ids:
+        conditions.append(f"l.campaign_id IN ({','.join('?' for _ in campaign_ids)})")
+        params.extend(campaign_ids)
+
+    status = request.args.get('status')
+    if status:
+        conditions.append("c.status = ?")
+        params.append(status)
+
+    active = request.args.get('active')
+    if active in ('0', '1'):
+        conditions.append("l.is_active = ?")
+        params.append(int(active))
+
+    weights = ', '.join(str(w) for w in SEARCH_COLUMN_WEIGHTS)
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute("""
+            SELECT COUNT(*) FROM (SELECT rowid FROM contacts_fts WHERE contacts_fts MATCH ? LIMIT ?)
+        """, (fts_query, SEARCH_RANK_LIMIT + 1))
+        ranked = cursor.fetchone()[0] <= SEARCH_RANK_LIMIT
+        order_by = "rank" if ranked else "contacts_fts.rowid DESC"
+
+        # Fetch one extra row to know whether another page exists without a COUNT over all matches
+        cursor.execute(f"""
+            SELECT l.id, l.first_name, l.last_name, l.email, l.company, l.domain, l.label,
+                   l.is_active, l.email_status, c.id, c.name, c.status,
+                   bm25(contacts_fts, {weights}) AS rank
+            FROM contacts_fts
+            JOIN leads l ON l.contact_id = contacts_fts.rowid
+            JOIN campaigns c ON c.id = l.campaign_id AND c.deleted_at IS NULL
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {order_by}
+            LIMIT ? OFFSET ?
+        """, params + [per_page + 1, (page - 1) * per_page])
+    except sqlite3.OperationalError as e:
+        if is_database_locked(e):
+            raise
+        logger.warning("search_failed query=%r error=%s", fts_query, e)
+        return jsonify({"error": "Search index unavailable"}), 503
+
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    results = [{
+        'lead_id': row[0],
+        'first_name': row[1],
+        'last_name': row[2],
+        'email': row[3],
+        'company': row[4],
+        'domain': row[5],
+        'label': row[6],
+        'is_active': row[7],
+        'email_status': row[8],
+        'campaign_id': row[9],
+        'campaign_name': row[10],
+        'campaign_status': row[11],
+        'score': round(-row[12], 4),
+    } for row in rows[:per_page]]
+
+    return jsonify({
+        "query": request.args.get('q', ''),
+        "page": page,
+        "per_page": per_page,
+        "has_more": has_more,
+        "ranked": ranked,
+        "results": results
+    })
+
 # --- API ENDPOINT TO GET CAMPAIGN MERGE PREVIEW ---
 @app.route('/api/merge_preview', methods=['POST'])
 def merge_preview():
-    """Get a preview of what would happen when merging campaigns"""
+    """
+    Get a preview of what would happen when merging campaigns.
+    Unique/duplicate counts are estimated from per-campaign sketches; pass ?detail=1
+    for exact counts plus the duplicate list (reads every lead).
+    """
     campaign_ids = request.json.get('campaign_ids', [])
     
     if len(campaign_ids) < 2:
@@ -1311,31 +6365,50 @@ def merge_preview():
     
     db = get_db()
     cursor = db.cursor()
+    ensure_campaigns_hot(campaign_ids)
     
     # Get campaign details
     placeholders = ','.join('?' for _ in campaign_ids)
     cursor.execute(f"""
-        SELECT id, name, COUNT(l.id) as profile_count
+        SELECT c.id, c.name, COUNT(l.id) as profile_count
         FROM campaigns c
-        LEFT JOIN leads l ON c.id = l.campaign_id
-        WHERE c.id IN ({placeholders})
+        LEFT JOIN campaign_leads l ON c.id = l.campaign_id
+        WHERE c.id IN ({placeholders}) AND c.deleted_at IS NULL
         GROUP BY c.id, c.name
     """, campaign_ids)
     
     campaigns_info = cursor.fetchall()
+    campaigns_list = [{"id": c[0], "name": c[1], "profile_count": c[2]} for c in campaigns_info]
+    
+    if not request.args.get('detail'):
+        sketches, rebuilt = load_campaign_sketches(cursor, {c[0]: c[2] for c in campaigns_info})
+        if rebuilt:
+            db.commit()
+        total_count = sum(c[2] for c in campaigns_info)
+        # The union can't have fewer distinct emails than the largest campaign's estimate
+        floor = max((hll_estimate(registers) for registers in sketches.values()), default=0)
+        unique_count = min(total_count, int(round(max(hll_estimate(hll_union(sketches.values())), floor))))
+        return jsonify({
+            "campaigns": campaigns_list,
+            "total_profiles": total_count,
+            "unique_profiles": unique_count,
+            "duplicate_profiles": total_count - unique_count,
+            "estimated": True
+        })
     
     # Get all leads from selected campaigns
     cursor.execute(f"""
-        SELECT email, first_name, last_name, company
+        SELECT email, first_name, last_name, company, domain
         FROM leads WHERE campaign_id IN ({placeholders})
     """, campaign_ids)
     
     all_leads = cursor.fetchall()
+    lead_dicts = [dict(zip(('email', 'first_name', 'last_name', 'company', 'domain'), row)) for row in all_leads]
     
-    # Calculate duplicates
+    # Calculate duplicates (by canonical email, same as the merge itself)
     email_count = {}
     for lead in all_leads:
-        email = lead[0].lower().strip()
+        email = canonical_email_key(lead[0])
         if email in email_count:
             email_count[email] += 1
         else:
@@ -1347,11 +6420,44 @@ def merge_preview():
     duplicate_count = total_count - unique_count
     
     return jsonify({
-        "campaigns": [{"id": c[0], "name": c[1], "profile_count": c[2]} for c in campaigns_info],
+        "campaigns": campaigns_list,
         "total_profiles": total_count,
         "unique_profiles": unique_count,
         "duplicate_profiles": duplicate_count,
-        "duplicates_detail": duplicates
+        "estimated": False,
+        "duplicates_detail": duplicates,
+        "possible_duplicates": describe_clusters(lead_dicts, fuzzy_only_clusters(find_duplicate_clusters(lead_dicts)))
+    })
+
+@app.route('/api/duplicate_clusters', methods=['POST'])
+def duplicate_clusters():
+    """
+    Report likely-duplicate clusters with confidence scores, either for the leads of
+    the given campaigns ({"campaign_ids": [...]}) or for posted leads ({"leads": [...]}).
+    """
+    data = request.get_json(silent=True) or {}
+    campaign_ids = data.get('campaign_ids') or []
+    if campaign_ids:
+        ensure_campaigns_hot(campaign_ids)
+        placeholders = ','.join('?' for _ in campaign_ids)
+        cursor = get_db().cursor()
+        cursor.execute(f"""
+            SELECT email, first_name, last_name, company, domain
+            FROM leads WHERE campaign_id IN ({placeholders})
+        """, campaign_ids)
+        leads_data = [dict(zip(('email', 'first_name', 'last_name', 'company', 'domain'), row)) for row in cursor.fetchall()]
+    elif isinstance(data.get('leads'), list):
+        leads_data = [lead for lead in data['leads'] if isinstance(lead, dict)]
+    else:
+        return jsonify({"error": "Provide campaign_ids or leads"}), 400
+
+    clusters = find_duplicate_clusters(leads_data)
+    if not data.get('include_exact', True):
+        clusters = fuzzy_only_clusters(clusters)
+    return jsonify({
+        "total_leads": len(leads_data),
+        "cluster_count": len(clusters),
+        "clusters": describe_clusters(leads_data, clusters, limit=int(data.get('limit', 200)))
     })
 
 # Add this new route to your Flask app (test_upload.py)
@@ -1372,11 +6478,11 @@ def merge_campaigns_page():
     if has_is_merged:
         # Get only previously merged campaigns for the table
         cursor.execute("""
-            SELECT c.id, c.name, c.status, c.description, COUNT(l.id) as profile_count,
+            SELECT c.id, c.name, c.status, c.description, COUNT(l.id) + COALESCE(c.archived_lead_count, 0) as profile_count,
                    c.processing_status, c.last_processed_at, c.process_count
             FROM campaigns c
-            LEFT JOIN leads l ON c.id = l.campaign_id
-            WHERE c.is_merged = 1 AND c.name NOT LIKE 'Original:%'
+            LEFT JOIN campaign_leads l ON c.id = l.campaign_id
+            WHERE c.is_merged = 1 AND c.name NOT LIKE 'Original:%' AND c.deleted_at IS NULL
             GROUP BY c.id, c.name, c.status, c.description, c.processing_status, c.last_processed_at, c.process_count
             ORDER BY c.id DESC
         """)
@@ -1388,20 +6494,15 @@ def merge_campaigns_page():
 
 # Add this new route to your test_upload.py file
 
-@app.route('/api/available_campaigns')
-def get_available_campaigns():
-    """Get all campaigns available for merging (excluding already merged campaigns if needed)"""
-    db = get_db()
-    cursor = db.cursor()
-    
+def list_available_campaigns(cursor):
     # Get all campaigns with their profile counts
     # You can modify this query to exclude certain campaigns if needed
     cursor.execute("""
-        SELECT c.id, c.name, c.status,c.description, COUNT(l.id) as profile_count
+        SELECT c.id, c.name, c.status,c.description, COUNT(l.id) + COALESCE(c.archived_lead_count, 0) as profile_count
         FROM campaigns c
-        LEFT JOIN leads l ON c.id = l.campaign_id
-        WHERE (c.is_merged IS NULL OR c.is_merged = 0)
-        GROUP BY c.id, c.name, c.status,c.description,
+        LEFT JOIN campaign_leads l ON c.id = l.campaign_id
+        WHERE (c.is_merged IS NULL OR c.is_merged = 0) AND c.deleted_at IS NULL
+        GROUP BY c.id, c.name, c.status,c.description
         ORDER BY c.id DESC
     """)
     
@@ -1417,8 +6518,19 @@ def get_available_campaigns():
             'description': campaign[3] or '',
             'profile_count': campaign[4] if campaign[4] else 0
         })
-    
-    return jsonify(campaigns_list)
+    return campaigns_list
+
+@app.route('/api/available_campaigns')
+def get_available_campaigns():
+    """
+    Get all campaigns available for merging (excluding already merged campaigns if needed).
+    ?all_shards=1 lists every tenant's campaigns, fetched in parallel and tagged with the tenant.
+    """
+    if request.args.get('all_shards'):
+        return jsonify([dict(campaign, tenant=tenant)
+                        for tenant, campaigns in fan_out(list_available_campaigns).items()
+                        for campaign in campaigns])
+    return jsonify(get_repository().list_available_campaigns())
 
 
 def generate_unsubscribe_token():
@@ -1434,12 +6546,17 @@ def update_lead_tokens():
     cursor.execute("SELECT id FROM leads WHERE unsubscribe_token IS NULL")
     leads_without_tokens = cursor.fetchall()
     
+    if leads_without_tokens:
+        cursor.execute("""
+            UPDATE campaigns SET generation = COALESCE(generation, 0) + 1
+            WHERE id IN (SELECT campaign_id FROM campaign_leads WHERE unsubscribe_token IS NULL)
+        """)
     for lead in leads_without_tokens:
         token = generate_unsubscribe_token()
         cursor.execute("UPDATE leads SET unsubscribe_token = ? WHERE id = ?", (token, lead[0]))
     
     db.commit()
-    print(f"✅ Updated {len(leads_without_tokens)} leads with unsubscribe tokens")
+    logger.info("unsubscribe_tokens_backfilled count=%d", len(leads_without_tokens))
 
 # Simplified version - just show confirmation then redirect
 
@@ -1449,21 +6566,11 @@ def unsubscribe_confirmation(token):
     if not token:
         return "Invalid unsubscribe link", 400
     
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("""
-        SELECT id, first_name, last_name, email, unsubscribe_status 
-        FROM leads 
-        WHERE unsubscribe_token = ?
-    """, (token,))
-    
-    lead = cursor.fetchone()
-    
+    lead = get_repository().unsubscribe_link(token)
     if not lead:
         return "Invalid or expired unsubscribe link", 404
     
-    lead_id, first_name, last_name, email, current_status = lead
+    lead_id, first_name, last_name, email, current_status = lead[:5]
     
     if current_status == 'unsubscribed':
         return f"<h2>Already Unsubscribed</h2><p>{first_name} {last_name}, you are already unsubscribed.</p>"
@@ -1476,30 +6583,23 @@ def unsubscribe_confirmation(token):
 @app.route('/confirm_unsubscribe/<token>', methods=['POST'])
 def confirm_unsubscribe(token):
     """Process unsubscribe and show simple message"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("""
-        SELECT id, first_name, last_name, email 
-        FROM leads 
-        WHERE unsubscribe_token = ?
-    """, (token,))
-    
-    lead = cursor.fetchone()
+    repo = get_repository()
+    lead = repo.unsubscribe_link(token)
     
     if not lead:
         return "Invalid link", 404
     
-    lead_id, first_name, last_name, email = lead
-    
-    # Unsubscribe
-    cursor.execute("""
-        UPDATE leads 
-        SET unsubscribe_status = 'unsubscribed', is_active = 0 
-        WHERE id = ?
-    """, (lead_id,))
+    lead_id, first_name, last_name, email, _, contact_id, archived = lead
+    if archived:
+        # The membership is archived; the contact-level status is what suppresses future sends
+        repo.unsubscribe_contact(contact_id)
+        changes = {'unsubscribe_status': 'unsubscribed'}
+    else:
+        repo.unsubscribe_lead(lead_id)
+        changes = {'unsubscribe_status': 'unsubscribed', 'is_active': 0}
     
-    db.commit()
+    repo.commit()
+    audit_log.record('confirm_unsubscribe', None, [lead_id], actor='recipient', **changes)
     
     # Simple success message
     return f"""
@@ -1510,26 +6610,16 @@ def confirm_unsubscribe(token):
     </div>
     """
 
-@app.route('/api/check_unsubscribed', methods=['POST'])
-def check_unsubscribed_leads():
-    """API endpoint to check if leads are unsubscribed before adding to campaigns"""
-    data = request.get_json()
-    emails = data.get('emails', [])
-    
-    if not emails:
-        return jsonify({"error": "No emails provided"}), 400
-    
-    db = get_db()
-    cursor = db.cursor()
-    
+def find_unsubscribed_emails(cursor, emails):
     unsubscribed_leads = []
     
     for email in emails:
         email = email.lower().strip()
+        # Unsubscribe status is per contact, so archived campaigns' contacts are covered too
         cursor.execute("""
             SELECT email, first_name, last_name, unsubscribe_status
-            FROM leads 
-            WHERE LOWER(email) = ? AND unsubscribe_status = 'unsubscribed'
+            FROM contacts 
+            WHERE email_key = ? AND unsubscribe_status = 'unsubscribed'
         """, (email,))
         
         result = cursor.fetchone()
@@ -1539,6 +6629,26 @@ def check_unsubscribed_leads():
                 "name": f"{result[1]} {result[2]}",
                 "status": result[3]
             })
+    return unsubscribed_leads
+
+@app.route('/api/check_unsubscribed', methods=['POST'])
+def check_unsubscribed_leads():
+    """
+    API endpoint to check if leads are unsubscribed before adding to campaigns.
+    "all_shards": true checks every tenant's shard in parallel (PostgreSQL has just the one database).
+    """
+    data = request.get_json()
+    emails = data.get('emails', [])
+    
+    if not emails:
+        return jsonify({"error": "No emails provided"}), 400
+    
+    if data.get('all_shards') and app.config['STORAGE_BACKEND'] == 'sqlite':
+        unsubscribed_leads = [dict(lead, tenant=tenant)
+                              for tenant, leads in fan_out(lambda cursor: find_unsubscribed_emails(cursor, emails)).items()
+                              for lead in leads]
+    else:
+        unsubscribed_leads = get_repository().find_unsubscribed_emails(emails)
     
     return jsonify({
         "unsubscribed_count": len(unsubscribed_leads),
@@ -1552,8 +6662,26 @@ def filter_unsubscribed_leads(leads_data):
     Filter out unsubscribed leads and return both filtered leads and unsubscribed count
     Priority: Manual email_status overrides external unsubscribe_status
     """
-    db = get_db()
-    cursor = db.cursor()
+    # Latest membership's manual status and the contact's external status, in batched lookups
+    # of distinct emails (contacts.email_key is LOWER(TRIM(email)) and uniquely indexed)
+    emails = list({lead.get('email', '').lower().strip() for lead in leads_data} - {''})
+    statuses = get_repository().contact_statuses(emails)
+
+    if app.config.get('SHARD_GLOBAL_SUPPRESSION') and shard_catalog.enabled and emails:
+        # An unsubscribe recorded for any tenant suppresses the email everywhere
+        def unsubscribed_in_shard(shard_cursor):
+            found = set()
+            for i in range(0, len(emails), 500):
+                chunk = emails[i:i + 500]
+                shard_cursor.execute(f"""
+                    SELECT email_key FROM contacts
+                    WHERE email_key IN ({','.join('?' for _ in chunk)}) AND unsubscribe_status = 'unsubscribed'
+                """, chunk)
+                found.update(row[0] for row in shard_cursor.fetchall())
+            return found
+        for found in fan_out(unsubscribed_in_shard).values():
+            for email_key in found:
+                statuses[email_key] = (statuses.get(email_key, (None, None))[0], 'unsubscribed')
     
     filtered_leads = []
     unsubscribed_emails = []
@@ -1563,28 +6691,19 @@ def filter_unsubscribed_leads(leads_data):
         if not email:
             continue
             
-        # Check email subscription status with priority logic
-        cursor.execute("""
-            SELECT email, email_status, unsubscribe_status FROM leads 
-            WHERE LOWER(email) = ?
-            ORDER BY id DESC
-            LIMIT 1
-        """, (email,))
-        
-        result = cursor.fetchone()
+        result = statuses.get(email)
         should_exclude = False
         
         if result:
-            email_status = result[1]  # manual status
-            unsubscribe_status = result[2]  # external status
+            email_status = result[0]  # manual status
+            unsubscribe_status = result[1]  # external status
             
-            # Logic: Exclude only if unsubscribed and NOT manually overridden
+            # Logic: Exclude if manually or externally unsubscribed.
+            # A manual resubscribe (toggle_email_status) clears the contact's external status,
+            # so overrides are already reflected in unsubscribe_status.
             if email_status == 'unsubscribed':
                 # Manually unsubscribed - always exclude
                 should_exclude = True
-            elif email_status == 'subscribed':
-                # Manually subscribed - always include (overrides external unsubscribe)
-                should_exclude = False
             elif unsubscribe_status == 'unsubscribed':
                 # Externally unsubscribed and no manual override - exclude
                 should_exclude = True
@@ -1623,24 +6742,29 @@ def toggle_email_status(lead_id, campaign_id):
         
         # Toggle logic
         new_status = 'unsubscribed' if current_email_status == 'subscribed' else 'subscribed'
+        changes = {'email_status': new_status}
         
         # If manually subscribing someone who was externally unsubscribed, override the external status
         if new_status == 'subscribed' and current_unsubscribe_status == 'unsubscribed':
+            changes['unsubscribe_status'] = 'subscribed'
             cursor.execute("""
                 UPDATE leads 
                 SET email_status = ?, unsubscribe_status = 'subscribed' 
                 WHERE id = ?
             """, (new_status, lead_id))
-            print(f"✅ Manual override: Resubscribed {email} (was externally unsubscribed)")
+            bump_lead_generations(cursor, [lead_id])
+            logger.info("email_status_override lead_id=%d email=%s status=subscribed", lead_id, email)
             flash(f'Profile {name} manually resubscribed (overriding external unsubscribe)!', 'success')
         else:
             # Normal toggle
             cursor.execute("UPDATE leads SET email_status = ? WHERE id = ?", (new_status, lead_id))
+            bump_lead_generations(cursor, [lead_id])
             action = "subscribed" if new_status == 'subscribed' else "unsubscribed"
             flash(f'Profile {name} {action} successfully!', 'success')
-            print(f"📧 Email status changed: {email} -> {action}")
+            logger.info("email_status_changed lead_id=%d email=%s status=%s", lead_id, email, action)
         
         db.commit()
+        audit_log.record('toggle_email_status', campaign_id, [lead_id], **changes)
     else:
         flash('Profile not found!', 'error')
     
@@ -1655,6 +6779,7 @@ def bulk_email_status(campaign_id, status):
         cursor = db.cursor()
         placeholders = ','.join('?' for _ in lead_ids)
         cursor.execute(f"UPDATE leads SET email_status = ? WHERE id IN ({placeholders})", [status] + lead_ids)
+        bump_lead_generations(cursor, lead_ids)
         db.commit()
         
         action = "subscribed" if status == 'subscribed' else "unsubscribed"
@@ -1689,7 +6814,7 @@ def process_confirmation(campaign_id):
     cursor = db.cursor()
     
     # Get current campaign info
-    cursor.execute("SELECT name, status FROM campaigns WHERE id = ?", (campaign_id,))
+    cursor.execute("SELECT name, status FROM campaigns WHERE id = ? AND deleted_at IS NULL", (campaign_id,))
     campaign = cursor.fetchone()
     
     if not campaign or campaign[1] != 'approved':
@@ -1705,11 +6830,12 @@ def process_confirmation(campaign_id):
     if has_is_merged:
         cursor.execute("""
             SELECT c.id, c.name, c.last_processed_at, c.process_count, 
-                   COUNT(l.id) as profile_count
+                   COUNT(l.id) + COALESCE(c.archived_active_count, 0) as profile_count
             FROM campaigns c
-            LEFT JOIN leads l ON c.id = l.campaign_id AND l.is_active = 1
+            LEFT JOIN campaign_leads l ON c.id = l.campaign_id AND l.is_active = 1
             WHERE c.processing_status = 'sent' 
             AND c.id != ?
+            AND c.deleted_at IS NULL
             AND c.is_merged = 1
             GROUP BY c.id, c.name, c.last_processed_at, c.process_count
             ORDER BY c.last_processed_at DESC
@@ -1718,42 +6844,52 @@ def process_confirmation(campaign_id):
         # Fallback if is_merged column doesn't exist - you might want to add other criteria
         cursor.execute("""
             SELECT c.id, c.name, c.last_processed_at, c.process_count, 
-                   COUNT(l.id) as profile_count
+                   COUNT(l.id) + COALESCE(c.archived_active_count, 0) as profile_count
             FROM campaigns c
-            LEFT JOIN leads l ON c.id = l.campaign_id AND l.is_active = 1
+            LEFT JOIN campaign_leads l ON c.id = l.campaign_id AND l.is_active = 1
             WHERE c.processing_status = 'sent' 
             AND c.id != ?
+            AND c.deleted_at IS NULL
             AND c.name NOT LIKE 'Original:%'
             GROUP BY c.id, c.name, c.last_processed_at, c.process_count
             ORDER BY c.last_processed_at DESC
         """, (campaign_id,))
+    processed_rows = cursor.fetchall()
     
-    processed_campaigns = cursor.fetchall()
+    # Shared contacts with each prior send, from the incrementally maintained overlap index
+    overlaps = get_campaign_overlaps(cursor, campaign_id)
+    cursor.execute("SELECT COUNT(DISTINCT contact_id) FROM campaign_leads WHERE campaign_id = ?", (campaign_id,))
+    campaign_size = cursor.fetchone()[0]
+    processed_campaigns = [
+        tuple(pc) + (overlaps.get(pc[0], 0), round(overlaps.get(pc[0], 0) * 100 / campaign_size) if campaign_size else 0)
+        for pc in processed_rows
+    ]
+    sort = request.args.get('sort', 'overlap')
+    if sort == 'overlap':
+        processed_campaigns.sort(key=lambda pc: pc[5], reverse=True)
     
     return render_template("process_confirmation.html", 
                          campaign_id=campaign_id,
                          campaign_name=campaign[0],
-                         processed_campaigns=processed_campaigns)
+                         processed_campaigns=processed_campaigns,
+                         sort=sort)
 
 @app.route('/api/compare_leads/<int:current_campaign_id>/<int:processed_campaign_id>')
 def compare_leads(current_campaign_id, processed_campaign_id):
     """Compare leads between current campaign and processed campaign"""
     db = get_db()
     cursor = db.cursor()
+    ensure_campaigns_hot([current_campaign_id, processed_campaign_id])
     
     # Get current campaign active leads
     cursor.execute("""
         SELECT id, first_name, last_name, email, company
         FROM leads 
         WHERE campaign_id = ? AND is_active = 1
-        AND (
-            email_status = 'subscribed'
-            OR 
-            (
-                (email_status IS NULL OR email_status = 'subscribed') 
-                AND (unsubscribe_status IS NULL OR unsubscribe_status = 'subscribed')
-            )
-        )
+        -- unsubscribe_status is per contact (any campaign's unsubscribe applies);
+        -- a manual resubscribe via toggle_email_status clears it
+        AND (email_status IS NULL OR email_status = 'subscribed')
+        AND (unsubscribe_status IS NULL OR unsubscribe_status = 'subscribed')
     """, (current_campaign_id,))
     current_leads = cursor.fetchall()
     
@@ -1793,5 +6929,4 @@ def compare_leads(current_campaign_id, processed_campaign_id):
     })
 
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=os.environ.get('FLASK_DEBUG', '1') == '1')
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Shared fixtures: a fresh app per test (temporary SQLite database and upload folder) and, for
+the PostgreSQL cases, a scratch database per test. PostgreSQL comes from $TEST_POSTGRES_DSN
+(a server the tests may create databases on) or a throwaway local server started with
+pgserver; without either the postgres cases are skipped.
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import test_upload  # noqa: E402
+
+BACKENDS = ['sqlite', 'postgres']
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """create_app(**overrides) on this test's temporary files, background threads off"""
+    def make(**overrides):
+        config = {
+            'DB_PATH': str(tmp_path / 'leads.db'),
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+            'STORAGE_BACKEND': 'sqlite',
+            'POSTGRES_DSN': '',
+            'PURGE_IN_BACKGROUND': False,
+            'DELIVERY_ROLLUP_INTERVAL_SECONDS': 0,
+            'DISPATCH_SCHEDULER': False,
+            'AUDIT_LOG_ENABLED': False,
+        }
+        config.update(overrides)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return test_upload.create_app(**config)
+
+    yield make
+    test_upload.connection_pool.close_all()
+    test_upload.postgres_pool.close_all()
+
+
+@pytest.fixture(scope='session')
+def postgres_server():
+    """DSN of a server to create scratch databases on"""
+    dsn = os.environ.get('TEST_POSTGRES_DSN')
+    if dsn:
+        yield dsn
+        return
+    pgserver = pytest.importorskip('pgserver', reason="set TEST_POSTGRES_DSN or install pgserver")
+    with tempfile.TemporaryDirectory(prefix='campaign-review-pg-') as data_dir:
+        server = pgserver.get_server(data_dir, cleanup_mode='stop')
+        try:
+            yield server.get_uri()
+        finally:
+            server.cleanup()
+
+
+@pytest.fixture
+def postgres_dsn(postgres_server):
+    """A new, empty database; dropped after the test"""
+    psycopg = pytest.importorskip('psycopg')
+    from psycopg.conninfo import make_conninfo
+    name = f"campaign_review_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(postgres_server, autocommit=True) as conn:
+        conn.execute(f'CREATE DATABASE "{name}"')
+    yield make_conninfo(postgres_server, dbname=name)
+    test_upload.postgres_pool.close_all()
+    with psycopg.connect(postgres_server, autocommit=True) as conn:
+        conn.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+
+
+@pytest.fixture(params=BACKENDS)
+def backend_app(request, make_app):
+    """The app on each storage backend"""
+    if request.param == 'postgres':
+        return make_app(STORAGE_BACKEND='postgres', POSTGRES_DSN=request.getfixturevalue('postgres_dsn'))
+    return make_app()
+
+
+@pytest.fixture
+def client(backend_app):
+    return backend_app.test_client()
+
+
+@pytest.fixture
+def repository(backend_app):
+    """get_repository() inside a request on each backend"""
+    with backend_app.test_request_context():
+        yield test_upload.get_repository()
@@ -0,0 +1,109 @@
+"""Resumable CSV uploads: parts in any order, resume from the status, and a safe retry of complete"""
+import hashlib
+
+import pytest
+
+PART_SIZE = 64
+
+
+@pytest.fixture
+def client(backend_app):
+    backend_app.config['UPLOAD_PART_SIZE'] = PART_SIZE
+    return backend_app.test_client()
+
+
+def csv_file(count=10):
+    rows = ['email,first_name,last_name,company'] + [f"lead{i}@example.com,Lead{i},Person,Example"
+                                                     for i in range(count)]
+    return ('\n'.join(rows) + '\n').encode()
+
+
+def start(client, data, name='Chunked'):
+    response = client.post('/api/uploads', json={'filename': 'leads.csv', 'campaign_name': name, 'size': len(data)})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def put_part(client, upload_id, data, number, checksum=None):
+    part = data[(number - 1) * PART_SIZE:number * PART_SIZE]
+    return client.put(f"/api/uploads/{upload_id}/parts/{number}", data=part,
+                      headers={'X-Part-SHA256': checksum or hashlib.sha256(part).hexdigest()})
+
+
+def campaign_names(client):
+    return sorted(c['name'] for c in client.get('/api/available_campaigns').get_json())
+
+
+def test_parts_resume_and_complete_once(client):
+    data = csv_file()
+    upload = start(client, data)
+    upload_id, parts = upload['upload_id'], upload['missing_parts']
+    assert len(parts) == -(-len(data) // PART_SIZE) > 3
+
+    assert put_part(client, upload_id, data, 1).status_code == 200
+    bad = put_part(client, upload_id, data, 2, checksum='0' * 64)
+    assert bad.status_code == 400 and 'Checksum mismatch' in bad.get_json()['message']
+
+    incomplete = client.post(f"/api/uploads/{upload_id}/complete")
+    assert incomplete.status_code == 409
+    assert incomplete.get_json()['missing_parts'] == parts[1:]
+
+    # Resume: ask what is missing and send only that, in any order
+    status = client.get(f"/api/uploads/{upload_id}").get_json()
+    assert [p['part_number'] for p in status['parts']] == [1]
+    assert status['missing_parts'] == parts[1:]
+    for number in reversed(status['missing_parts']):
+        assert put_part(client, upload_id, data, number).status_code == 200
+    assert client.get(f"/api/uploads/{upload_id}").get_json()['received_bytes'] == len(data)
+
+    done = client.post(f"/api/uploads/{upload_id}/complete", json={'sha256': hashlib.sha256(data).hexdigest()})
+    assert done.status_code == 200
+    result = done.get_json()
+    assert (result['status'], result['leads_added'], result['bytes']) == ('success', 10, len(data))
+    assert campaign_names(client) == ['Chunked']
+
+    # A retry after a lost response gets the same answer and no second campaign
+    retry = client.post(f"/api/uploads/{upload_id}/complete")
+    assert retry.status_code == 200 and retry.headers['Idempotent-Replayed'] == 'true'
+    assert dict(result, idempotent_replay=True) == retry.get_json()
+    assert campaign_names(client) == ['Chunked']
+    assert client.get(f"/api/uploads/{upload_id}").status_code == 404
+
+
+def test_file_checksum_mismatch_is_rejected(client):
+    data = csv_file(3)
+    upload_id = start(client, data)['upload_id']
+    for number in range(1, -(-len(data) // PART_SIZE) + 1):
+        put_part(client, upload_id, data, number)
+    response = client.post(f"/api/uploads/{upload_id}/complete", json={'sha256': hashlib.sha256(b'other').hexdigest()})
+    assert response.status_code == 400
+    assert campaign_names(client) == []
+    # Nothing was imported, so the upload can still be completed
+    assert client.post(f"/api/uploads/{upload_id}/complete").get_json()['leads_added'] == 3
+
+
+def test_no_valid_rows_keeps_the_parts(client):
+    data = b'name,phone\n' + b''.join(b'Someone %d,555-01%02d\n' % (i, i) for i in range(5))
+    upload_id = start(client, data, name='Unmapped')['upload_id']
+    for number in range(1, -(-len(data) // PART_SIZE) + 1):
+        put_part(client, upload_id, data, number)
+    response = client.post(f"/api/uploads/{upload_id}/complete")
+    assert response.status_code == 400
+    assert 'No valid unique profiles' in response.get_json()['message']
+    # The staging campaign is discarded; the upload stays for another attempt
+    assert campaign_names(client) == []
+    assert client.get(f"/api/uploads/{upload_id}").get_json()['missing_parts'] == []
+    assert client.post(f"/api/uploads/{upload_id}/complete").status_code == 400
+
+
+def test_part_outside_the_declared_size_is_refused(client):
+    data = csv_file(2)
+    upload = start(client, data)
+    last = upload['missing_parts'][-1]
+    response = client.put(f"/api/uploads/{upload['upload_id']}/parts/{last + 1}", data=b'x',
+                          headers={'X-Part-SHA256': hashlib.sha256(b'x').hexdigest()})
+    assert response.status_code == 400
+    short = data[:PART_SIZE - 1]
+    response = client.put(f"/api/uploads/{upload['upload_id']}/parts/1", data=short,
+                          headers={'X-Part-SHA256': hashlib.sha256(short).hexdigest()})
+    assert response.status_code == 400 and 'must be' in response.get_json()['message']
@@ -0,0 +1,212 @@
+"""SQLiteRepository and PostgresRepository: the same calls give the same results"""
+import pytest
+
+import test_upload
+
+
+def make_leads(start, count, **overrides):
+    leads = []
+    for i in range(start, start + count):
+        lead = test_upload.normalize_api_lead({
+            'email': f"person{i}@acme{i % 3}.com",
+            'first_name': f"First{i}",
+            'last_name': f"Last{i}",
+            'company': f"Acme {i % 3}",
+        })
+        lead['unsubscribe_token'] = f"token-{i}"
+        lead.update(overrides)
+        leads.append(lead)
+    return leads
+
+
+def exercise(repo):
+    """Drive every repository method once; returns what each returned, ids included"""
+    out = {}
+    leads = make_leads(0, 12)
+    first = repo.create_campaign('First', 'parity')
+    repo.insert_leads(first, leads[:8])
+    repo.rename_campaign(first, 'First (renamed)', 'parity')
+    second = repo.create_campaign('Second', '')
+    overlap = [dict(lead, unsubscribe_token=f"second-{lead['unsubscribe_token']}") for lead in leads[4:12]]
+    overlap[-1]['unsubscribe_status'] = 'unsubscribed'
+    repo.insert_leads(second, overlap)
+    repo.commit()
+    out['campaign'] = repo.get_campaign(first)
+    out['counts'] = [tuple(repo.lead_counts(first)), tuple(repo.lead_counts(second))]
+    out['export'] = [tuple(row) for row in repo.iter_export_rows(first, 3)]
+    out['listing'] = repo.list_available_campaigns()
+
+    keys = [lead['email'] for lead in leads[6:12]] + ['nobody@example.invalid']
+    out['statuses'] = sorted(repo.contact_statuses(keys).items())
+    out['unsubscribed'] = repo.find_unsubscribed_emails([overlap[-1]['email'].upper(), leads[0]['email']])
+
+    dispatch = repo.dispatch_leads(second)
+    ids = [row[0] for row in dispatch]
+    out['dispatch'] = [tuple(row) for row in dispatch]
+    out['dispatch_include'] = [row[0] for row in repo.dispatch_leads(second, [str(i) for i in ids[:2]])]
+    out['dispatch_exclude'] = [row[0] for row in repo.dispatch_leads(second, None, [str(i) for i in ids[:2]])]
+    repo.set_unsubscribe_tokens([(ids[0], 'new-token')])
+    repo.mark_dispatch_queued(second)
+    repo.commit()
+    out['queued'] = repo.get_campaign(second)['processing_status']
+    repo.record_dispatch(second, sent=True)
+    repo.set_campaign_status(second, 'approved')
+    repo.commit()
+    out['sent'] = repo.get_campaign(second)
+
+    out['token'] = tuple(repo.lead_unsubscribe_token(ids[0]))
+    out['missing_token'] = repo.lead_unsubscribe_token(10 ** 6)
+    out['unsubscribe_leads'] = [tuple(row) for row in repo.campaign_unsubscribe_leads(second)]
+    link = repo.unsubscribe_link('new-token')
+    out['link'] = tuple(link)
+    repo.unsubscribe_lead(link[0])
+    repo.commit()
+    out['after_unsubscribe'] = (tuple(repo.lead_counts(second)), tuple(repo.unsubscribe_link('new-token')))
+    repo.unsubscribe_contact(repo.unsubscribe_link(leads[0]['unsubscribe_token'])[5])
+    repo.commit()
+    out['contact_unsubscribed'] = repo.unsubscribe_link(leads[0]['unsubscribe_token'])[4]
+    out['unknown_link'] = repo.unsubscribe_link('no-such-token')
+
+    staging = repo.create_staging_campaign('Staging', '')
+    repo.insert_leads(staging, make_leads(100, 3))
+    repo.commit()
+    out['staging_hidden'] = repo.get_campaign(staging)
+    repo.publish_staging_campaign(staging)
+    repo.commit()
+    out['staging_published'] = repo.get_campaign(staging)
+    discarded = repo.create_staging_campaign('Discarded', '')
+    repo.discard_staging_campaign(discarded)
+    repo.commit()
+    out['discarded'] = repo.get_campaign(discarded)
+
+    out['idempotency'] = [repo.lookup_idempotent_upload('key:a'),
+                          repo.store_idempotent_upload('key:a', first, {'campaign_id': first})]
+    repo.commit()
+    out['idempotency'] += [repo.store_idempotent_upload('key:a', second, {'campaign_id': second})]
+    repo.rollback()
+    out['idempotency'] += [repo.lookup_idempotent_upload('key:a')]
+
+    repo.store_import_rejections('report-1', [(3, 'invalid_email', {'email': 'nope'}), (1, 'missing_name', {})])
+    repo.commit()
+    out['rejections'] = repo.import_rejections('report-1')
+
+    repo.save_import_profile('custom', {'fields': {'email': ['E-mail'], 'first_name': ['Vorname']}})
+    repo.commit()
+    out['profiles'] = sorted(name for name, profile in repo.import_profiles().items() if not profile['builtin'])
+    out['profile_deleted'] = [repo.delete_import_profile('custom'), repo.delete_import_profile('custom')]
+    repo.commit()
+
+    events = [(ids[1], 'delivered', 100.0, 100.0, 'e1', None), (ids[1], 'opened', 101.0, 101.0, 'e2', None),
+              (ids[2], 'bounced', 102.0, 102.0, None, 'mailbox full')]
+    out['events_new'] = [repo.insert_delivery_events(events)]
+    repo.commit()
+    out['events_new'] += [repo.insert_delivery_events(events[:2])]
+    repo.commit()
+    out['rolled_up'] = repo.roll_up_delivery_events(100)
+    summary = repo.delivery_summary(second)
+    summary.pop('updated_at')
+    out['summary'] = summary
+    out['lead_statuses'] = repo.lead_delivery_statuses(second)
+    out['lead_statuses_bounced'] = repo.lead_delivery_statuses(second, status='bounced')
+
+    repo.delete_campaign(first)
+    repo.commit()
+    out['deleted'] = (repo.get_campaign(first), repo.lookup_idempotent_upload('key:a'))
+    return out
+
+
+def test_backends_return_the_same_results(make_app, postgres_dsn):
+    app = make_app()
+    test_upload.init_postgres(postgres_dsn)
+    with app.test_request_context():
+        sqlite_results = exercise(test_upload.get_repository())
+        conn = test_upload.postgres_pool.connect(postgres_dsn)
+        try:
+            postgres_results = exercise(test_upload.PostgresRepository(conn))
+        finally:
+            conn.close()
+    for name in sqlite_results:
+        assert postgres_results[name] == sqlite_results[name], name
+
+
+def test_repository_results(repository):
+    out = exercise(repository)
+    assert out['campaign']['name'] == 'First (renamed)'
+    assert out['counts'] == [(8, 0, 8), (8, 0, 8)]
+    assert [row[2] for row in out['export']] == [lead['email'] for lead in make_leads(0, 8)]
+    assert {c['name']: c['profile_count'] for c in out['listing']} == {'First (renamed)': 8, 'Second': 8}
+    assert [key for key, _ in out['statuses']] == sorted(lead['email'] for lead in make_leads(6, 6))
+    assert [entry['email'] for entry in out['unsubscribed']] == ['person11@acme2.com']
+    assert len(out['dispatch']) == 7  # the unsubscribed contact is not sent
+    assert out['dispatch_include'] == [row[0] for row in out['dispatch'][:2]]
+    assert out['dispatch_exclude'] == [row[0] for row in out['dispatch'][2:]]
+    assert out['queued'] == 'queued'
+    assert (out['sent']['status'], out['sent']['processing_status']) == ('approved', 'sent')
+    assert out['token'] == ('new-token',) and out['missing_token'] is None
+    assert out['link'][3] == 'person4@acme1.com' and out['link'][6] is False
+    assert out['after_unsubscribe'][0] == (7, 1, 8)
+    assert out['after_unsubscribe'][1][4] == 'unsubscribed'
+    assert out['contact_unsubscribed'] == 'unsubscribed'
+    assert out['unknown_link'] is None
+    assert out['staging_hidden'] is None and out['staging_published']['status'] == 'pending'
+    assert out['discarded'] is None
+    assert out['idempotency'] == [None, True, False, {'campaign_id': 1}]
+    assert out['rejections'] == [(1, 'missing_name', {}), (3, 'invalid_email', {'email': 'nope'})]
+    assert out['profiles'] == ['custom'] and out['profile_deleted'] == [True, False]
+    assert out['events_new'] == [3, 0]
+    assert out['rolled_up'] == 3
+    assert (out['summary']['delivered'], out['summary']['opened'], out['summary']['bounced']) == (1, 1, 1)
+    assert [(s['status'], s['events']) for s in out['lead_statuses']] == [('opened', ['delivered', 'opened']),
+                                                                         ('bounced', ['bounced'])]
+    assert len(out['lead_statuses_bounced']) == 1
+    assert out['deleted'] == (None, None)
+
+
+def test_insert_leads_reuses_contacts(repository):
+    campaign_id = repository.create_campaign('Reuse', '')
+    blank = make_leads(0, 1, company='')
+    repository.insert_leads(campaign_id, blank)
+    other = repository.create_campaign('Reuse again', '')
+    repository.insert_leads(other, make_leads(0, 1, first_name='Changed', unsubscribe_status='unsubscribed'))
+    repository.commit()
+    # Blank fields are filled, set ones are kept, and unsubscribes are sticky
+    rows = [tuple(row) for row in repository.iter_export_rows(campaign_id, 10)]
+    assert [(row[0], row[3]) for row in rows] == [('First0', 'Acme 0')]
+    assert repository.find_unsubscribed_emails([blank[0]['email']])[0]['status'] == 'unsubscribed'
+
+
+@pytest.mark.parametrize('backend_app', ['postgres'], indirect=True)
+def test_postgres_insert_leads_adds_one_membership_per_contact(repository):
+    campaign_id = repository.create_campaign('Dedup', '')
+    first, second = make_leads(0, 2)
+    repeated = dict(first, email=first['email'].upper())
+    repository.insert_leads(campaign_id, [first, repeated, dict(second, email='  ')])
+    repository.insert_leads(campaign_id, [first, second])
+    repository.commit()
+    assert [row[2] for row in repository.iter_export_rows(campaign_id, 10)] == [first['email'], second['email']]
+
+
+@pytest.mark.parametrize('backend_app', ['postgres'], indirect=True)
+def test_postgres_concurrent_exports_on_one_connection(repository):
+    campaign_id = repository.create_campaign('Export', '')
+    repository.insert_leads(campaign_id, make_leads(0, 5))
+    repository.commit()
+    first, second = repository.iter_export_rows(campaign_id, 2), repository.iter_export_rows(campaign_id, 2)
+    assert next(first) == next(second)
+    assert len(list(first)) == len(list(second)) == 4
+
+
+@pytest.mark.parametrize('backend_app', ['postgres'], indirect=True)
+def test_postgres_purge_removes_deleted_campaigns(backend_app, repository):
+    campaign_id = repository.create_campaign('Purge me', '')
+    repository.insert_leads(campaign_id, make_leads(0, 5))
+    repository.delete_campaign(campaign_id)
+    kept = repository.create_staging_campaign('Still importing', '')
+    repository.commit()
+    backend_app.config['PURGE_BATCH_SIZE'] = 2
+    assert test_upload.campaign_purger.run_once() == 1
+    assert repository.lead_counts(campaign_id) == (0, 0, 0)
+    repository.publish_staging_campaign(kept)  # a live import is left alone
+    repository.commit()
+    assert repository.get_campaign(kept)['status'] == 'pending'
+
@@ -0,0 +1,77 @@
+"""/upload retries: the same Idempotency-Key, or the same name and leads, replay the first campaign"""
+import json
+
+import pytest
+
+
+def payload(name='Replay', count=3, start=0):
+    return {
+        'campaign_name': name,
+        'campaign_description': 'from n8n',
+        'leads': [{'email': f"lead{i}@example.com", 'first_name': f"Lead{i}", 'company': 'Example'}
+                  for i in range(start, start + count)],
+    }
+
+
+def campaign_names(client):
+    return sorted(c['name'] for c in client.get('/api/available_campaigns').get_json())
+
+
+def test_idempotency_key_replays_the_first_response(client):
+    first = client.post('/upload', json=payload(), headers={'Idempotency-Key': 'n8n-run-1'})
+    assert first.status_code == 200
+    assert first.get_json()['leads_added'] == 3
+    assert 'Idempotent-Replayed' not in first.headers
+
+    # The key decides, not the body
+    replay = client.post('/upload', json=payload(count=5), headers={'Idempotency-Key': 'n8n-run-1'})
+    assert replay.status_code == 200
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    body = replay.get_json()
+    assert body.pop('idempotent_replay') is True
+    assert body == first.get_json()
+    assert campaign_names(client) == ['Replay']
+
+    other = client.post('/upload', json=payload(), headers={'Idempotency-Key': 'n8n-run-2'})
+    assert other.get_json()['campaign_id'] != first.get_json()['campaign_id']
+    assert campaign_names(client) == ['Replay', 'Replay']
+
+
+def test_same_body_without_key_replays(client):
+    first = client.post('/upload', json=payload()).get_json()
+    replay = client.post('/upload', json=payload())
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert replay.get_json()['campaign_id'] == first['campaign_id']
+
+    # NDJSON with the same name and leads is the same upload
+    lines = [{'campaign_name': 'Replay', 'campaign_description': 'from n8n'}] + payload()['leads']
+    ndjson = client.post('/upload', data='\n'.join(map(json.dumps, lines)), content_type='application/x-ndjson')
+    assert ndjson.get_json()['campaign_id'] == first['campaign_id']
+    assert campaign_names(client) == ['Replay']
+
+
+@pytest.mark.parametrize('changed', [payload(name='Replay 2'), payload(start=1)], ids=['name', 'leads'])
+def test_different_body_creates_a_campaign(client, changed):
+    first = client.post('/upload', json=payload()).get_json()
+    second = client.post('/upload', json=changed)
+    assert 'Idempotent-Replayed' not in second.headers
+    assert second.get_json()['campaign_id'] != first['campaign_id']
+    assert len(campaign_names(client)) == 2
+
+
+def test_deleting_the_campaign_forgets_the_upload(client):
+    first = client.post('/upload', json=payload(), headers={'Idempotency-Key': 'n8n-run-1'}).get_json()
+    assert client.post(f"/delete_campaign/{first['campaign_id']}").status_code == 302
+    assert campaign_names(client) == []
+
+    again = client.post('/upload', json=payload(), headers={'Idempotency-Key': 'n8n-run-1'})
+    assert 'Idempotent-Replayed' not in again.headers
+    assert again.get_json()['campaign_id'] != first['campaign_id']
+    assert campaign_names(client) == ['Replay']
+
+
+def test_rejected_upload_is_not_remembered(client):
+    assert client.post('/upload', json={'campaign_name': 'Empty', 'leads': [{'email': 'not-an-email'}]}).status_code == 400
+    fixed = client.post('/upload', json={'campaign_name': 'Empty', 'leads': payload()['leads']})
+    assert fixed.status_code == 200 and 'Idempotent-Replayed' not in fixed.headers
+